@@ -0,0 +1,231 @@
+# backend/batch.py
+# Modo masivo (headless): genera un informe por cada feature de un
+# FeatureCollection GeoJSON usando un pool acotado de workers y un manifiesto
+# de checkpoint para poder reanudar una corrida interrumpida.
+#
+# Uso:
+#   python -m backend.batch parcelas.geojson --start 2025-01-01 --end 2025-03-31 --workers 4
+#   python -m backend.batch parcelas.geojson --start 2025-01-01 --end 2025-03-31 --workers 8 --pdf-workers 4
+#   python -m backend.batch parcelas.geojson --start 2025-01-01 --end 2025-03-31 --export cog   # + rásters de índices
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backend import gee_processor
+from reports import pdf_generator
+from reports.render_pool import PdfRenderPool
+from utils import ingest
+from utils import raster_export
+from utils import storage
+from utils import tile_cache
+from utils import tracing
+from utils.geometry import AOIGeometry
+
+DEFAULT_OUTPUT_DIR = 'batch_output'
+DEFAULT_WORKERS = 4
+MANIFEST_NAME = 'manifest.json'
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class BatchManifest:
+    """
+    Manifiesto de checkpoint de una corrida masiva. Registra el estado de cada
+    feature y se reescribe de forma atómica después de cada informe, así una
+    corrida interrumpida se reanuda saltando los features ya terminados.
+    `run` describe la corrida (huella de las geometrías del archivo, período,
+    nubes y opciones): el progreso previo solo se reutiliza si coincide
+    entero, así otro archivo u otras opciones en el mismo output_dir nunca
+    heredan features "terminados".
+    """
+
+    def __init__(self, path, source, run):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {'source': source, 'run': run, 'features': {}}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            if previous.get('run') == run:
+                self.data['features'] = previous.get('features', {})
+            else:
+                print(f"WARNING: El manifiesto {path} es de otra corrida (archivo, período u opciones); se ignora su progreso.")
+
+    def is_done(self, feature_id):
+        return self.data['features'].get(feature_id, {}).get('status') == STATUS_DONE
+
+    def record(self, feature_id, status, **details):
+        with self._lock:
+            self.data['features'][feature_id] = dict(details, status=status, updated_at=time.time())
+            storage.atomic_write_json(self.path, self.data, indent=2)
+
+
+def _safe_name(feature_id):
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(feature_id))
+
+
+def check_feature_ids(ids):
+    """
+    Lanza ValueError si hay ids repetidos, vacíos o que _safe_name lleva a la
+    misma carpeta: sus informes y su estado en el manifiesto se pisarían.
+    """
+    folders = {}
+    for feature_id in ids:
+        folders.setdefault(_safe_name(feature_id), []).append(feature_id)
+    clashes = [group for name, group in folders.items() if len(group) > 1 or not name]
+    if clashes:
+        shown = '; '.join(', '.join(repr(fid) for fid in group) for group in clashes[:5])
+        raise ValueError(f"Ids de feature repetidos o que comparten carpeta de salida: {shown}")
+
+
+def process_feature(feature_id, geometry, start_date, end_date, output_dir, cloud_cover_max=20, baseline_start=None,
+                    baseline_end=None, pdf_pool=None, export_format=None):
+    """
+    Procesa un feature: process_aoi + generate_pdf_report, y mueve los
+    artefactos a <output_dir>/<feature_id>/. Devuelve la ruta del PDF.
+    Con baseline_start/baseline_end agrega detección de cambios (el composite
+    de referencia de cada feature se cachea entre corridas).
+    Con pdf_pool (reports.render_pool.PdfRenderPool) el PDF se construye en un
+    proceso aparte y no compite por el GIL con los demás features.
+    Con export_format ('cog' o 'npy') también escribe los valores crudos de
+    los índices en la carpeta del feature (utils.raster_export); si el export
+    falla, el feature cuenta como fallido y se reintenta al reanudar.
+    Lanza RuntimeError si el procesamiento o el PDF fallan.
+    """
+    name = _safe_name(feature_id)
+    feature_dir = os.path.join(output_dir, name)
+    os.makedirs(feature_dir, exist_ok=True)
+
+    # Bounds, área y simplificación del polígono en el cliente
+    aoi = AOIGeometry(geometry)
+    with tracing.trace_run('batch_feature'):
+        # Los mapas se escriben directamente en la carpeta del feature (sumidero a disco)
+        results = gee_processor.process_aoi(aoi, start_date, end_date, cloud_cover_max=cloud_cover_max,
+                                            file_tag=name, save_dir=feature_dir,
+                                            baseline_start=baseline_start, baseline_end=baseline_end,
+                                            export_format=export_format)
+        if not results or 'error' in results:
+            raise RuntimeError((results or {}).get('error', 'Unknown processing error'))
+        if (results.get('export') or {}).get('error'):
+            raise RuntimeError(f"Export de rásters falló: {results['export']['error']}")
+
+        pdf_path = pdf_generator.generate_pdf_report(results, filename_prefix=f"GeoInformeExpress_{name}", output_dir=feature_dir,
+                                                     renderer=pdf_pool.render if pdf_pool else None)
+        if not pdf_path:
+            raise RuntimeError('PDF generation failed')
+    return pdf_path
+
+
+def _process_upload_feature(upload, index, feature_id, *args):
+    # La geometría GeoJSON se materializa en el worker, solo mientras se procesa el feature
+    return process_feature(feature_id, upload.geometry(index), *args)
+
+
+def run_batch(geojson_path, start_date, end_date, output_dir=DEFAULT_OUTPUT_DIR, workers=DEFAULT_WORKERS, cloud_cover_max=20,
+              baseline_start=None, baseline_end=None, pdf_workers=0, export_format=None):
+    """
+    Genera un informe por feature del archivo GeoJSON. Los features marcados
+    como terminados en el manifiesto de la misma corrida se saltan
+    (reanudación); si dos features comparten id o carpeta lanza ValueError
+    antes de procesar nada. Se encolan a lo sumo 2*workers features a la vez,
+    así la memoria no crece con el archivo.
+    pdf_workers > 0 construye los PDFs en un pool de procesos de ese tamaño.
+    export_format ('cog' o 'npy') agrega el export de rásters de cada feature.
+    Devuelve un resumen con conteos y throughput en informes/minuto.
+    """
+    # Lectura en streaming (GeoJSON, KML o KMZ): coordenadas en arrays compactos
+    upload = ingest.load_path(geojson_path)
+    check_feature_ids(upload.ids)
+    os.makedirs(output_dir, exist_ok=True)
+    ids_digest = hashlib.sha256('\n'.join(str(fid) for fid in upload.ids).encode('utf-8')).hexdigest()
+    run = {'fingerprint': upload.fingerprint, 'ids': ids_digest, 'start_date': start_date, 'end_date': end_date,
+           'cloud_cover_max': cloud_cover_max, 'baseline_start': baseline_start, 'baseline_end': baseline_end,
+           'export_format': export_format}
+    manifest = BatchManifest(os.path.join(output_dir, MANIFEST_NAME), geojson_path, run)
+    pending = [(i, fid) for i, fid in enumerate(upload.ids) if not manifest.is_done(fid)]
+    skipped = len(upload) - len(pending)
+    print(f"Batch: {len(upload)} features, {skipped} ya terminados, {len(pending)} pendientes, {workers} workers.")
+
+    start_time = time.time()
+    done = failed = 0
+    pdf_pool = PdfRenderPool(pdf_workers) if pdf_workers and pending else None
+    try:
+        workers = max(1, workers)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+            in_flight = {}
+            next_job = 0
+            while next_job < len(pending) or in_flight:
+                # Mantiene la ventana llena: a lo sumo 2*workers features encolados
+                while next_job < len(pending) and len(in_flight) < 2 * workers:
+                    i, fid = pending[next_job]
+                    future = executor.submit(_process_upload_feature, upload, i, fid, start_date, end_date, output_dir,
+                                             cloud_cover_max, baseline_start, baseline_end, pdf_pool, export_format)
+                    in_flight[future] = fid
+                    next_job += 1
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    fid = in_flight.pop(future)
+                    try:
+                        pdf_path = future.result()
+                        manifest.record(fid, STATUS_DONE, pdf=pdf_path)
+                        done += 1
+                    except Exception as e:
+                        print(f"ERROR: [batch] Feature {fid} falló: {e}")
+                        manifest.record(fid, STATUS_FAILED, error=str(e))
+                        failed += 1
+                    elapsed_min = (time.time() - start_time) / 60
+                    rate = done / elapsed_min if elapsed_min > 0 else 0.0
+                    print(f"Batch: {done + failed}/{len(pending)} ({failed} fallidos) - {rate:.2f} informes/minuto")
+    finally:
+        if pdf_pool is not None:
+            pdf_pool.close()
+
+    elapsed = time.time() - start_time
+    summary = {
+        'total': len(upload),
+        'skipped': skipped,
+        'done': done,
+        'failed': failed,
+        'elapsed_seconds': elapsed,
+        'reports_per_minute': done / (elapsed / 60) if elapsed > 0 else 0.0,
+        # Features vecinos sobre la misma escena comparten tiles (utils.tile_cache)
+        'tile_cache_hit_rate': tile_cache.get_tile_cache().stats()['hit_rate'] if tile_cache.TILE_CACHE_ENABLED else None,
+    }
+    print(f"Batch terminado: {summary}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GeoInforme Express - generación masiva de informes desde un FeatureCollection.")
+    parser.add_argument('geojson_path', help="Archivo GeoJSON (FeatureCollection), KML o KMZ con los AOIs")
+    parser.add_argument('--start', required=True, help="Fecha inicial YYYY-MM-DD")
+    parser.add_argument('--end', required=True, help="Fecha final YYYY-MM-DD")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--pdf-workers', type=int, default=0,
+                        help="Procesos para construir los PDFs (0: en los mismos hilos del batch)")
+    parser.add_argument('--cloud-cover-max', type=float, default=20)
+    parser.add_argument('--baseline-start', help="Inicio del período previo al evento (detección de cambios dNBR/dNDVI)")
+    parser.add_argument('--baseline-end', help="Fin del período previo al evento")
+    parser.add_argument('--export', choices=raster_export.EXPORT_FORMATS,
+                        help="Exporta los valores crudos de los índices (COG requiere rasterio; npy solo NumPy)")
+    args = parser.parse_args(argv)
+    if bool(args.baseline_start) != bool(args.baseline_end):
+        parser.error("--baseline-start y --baseline-end van juntos")
+    if args.export and args.export not in raster_export.available_formats():
+        parser.error(f"--export {args.export} requiere rasterio (pip install rasterio)")
+    try:
+        summary = run_batch(args.geojson_path, args.start, args.end, args.output_dir, args.workers, args.cloud_cover_max,
+                            args.baseline_start, args.baseline_end, args.pdf_workers, args.export)
+    except ValueError as e:
+        parser.error(str(e))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,257 @@
+# backend/change_detection.py
+# Detección de cambios pre/post evento (dNBR, dNDVI): un composite de
+# referencia (mediana sin nubes de la ventana previa al evento) contra la
+# escena post-evento. La primera corrida resuelve pre, post y las diferencias
+# en UN grafo del servidor y una sola descarga (computePixels); los índices
+# del composite se guardan como .npz en disco, así las corridas siguientes
+# sobre el mismo AOI y ventana previa solo descargan la escena post-evento.
+import io
+import os
+import threading
+import time
+
+import ee
+import numpy as np
+
+from backend.timeseries import S2_COLLECTION, SCL_MASK_CLASSES
+from backend import zonal_stats
+from utils import ee_client
+from utils import geometry as geometry_utils
+from utils import index_registry
+from utils import local_engine
+from utils import result_cache
+from utils import storage
+
+BASELINE_DIR = os.environ.get('GEOINFORME_BASELINE_DIR', os.path.join('cache', 'baselines'))
+BASELINE_TTL_SECONDS = int(os.environ.get('GEOINFORME_BASELINE_TTL_SECONDS', 90 * 24 * 3600))
+GRID_PX = 512  # lado del grid de descarga (el mismo que las miniaturas del informe)
+
+# Índices diferenciados por defecto: d<ÍNDICE> = pre - post (positivo = pérdida)
+DEFAULT_CHANGE_INDICES = ['nbr', 'ndvi']
+
+# Visualización y umbral de cada índice diferenciado; el resto usa DEFAULT_DELTA
+DEFAULT_DELTA = {
+    'vis': {'min': -0.5, 'max': 0.5, 'palette': ['#1A9850', '#91CF60', '#FFFFBF', '#FC8D59', '#D73027']},
+    'threshold': 0.2,
+    'description': 'Diferencia pre - post: valores positivos (rojo) indican pérdida respecto del período de referencia.',
+}
+DELTA_OVERRIDES = {
+    'nbr': {
+        'vis': {'min': -0.25, 'max': 0.9, 'palette': ['#1A9850', '#FFFFBF', '#FDAE61', '#F46D43', '#D73027', '#7A0177']},
+        'threshold': 0.1,
+        'description': 'NBR pre-evento menos NBR post-evento. Sobre 0.1 indica área afectada; la severidad crece con el valor (clases USGS).',
+    },
+    'ndvi': {
+        'threshold': 0.2,
+        'description': 'NDVI pre-evento menos NDVI post-evento. Valores positivos indican pérdida de vegetación.',
+    },
+}
+
+# Clases de severidad de quemado para dNBR (USGS / Key & Benson)
+DNBR_SEVERITY_CLASSES = [
+    ('Regeneración', -np.inf, -0.1),
+    ('No quemado', -0.1, 0.1),
+    ('Severidad baja', 0.1, 0.27),
+    ('Severidad moderada-baja', 0.27, 0.44),
+    ('Severidad moderada-alta', 0.44, 0.66),
+    ('Severidad alta', 0.66, np.inf),
+]
+
+
+def delta_definition(key):
+    """Título, vis, umbral, rango del histograma y descripción del índice diferenciado d<key>."""
+    index = index_registry.get_index(key)
+    definition = dict(DEFAULT_DELTA, **DELTA_OVERRIDES.get(key, {}))
+    definition['name'] = f'D{index.name}'
+    definition['title'] = f'Cambio de {index.name} (d{index.name})'
+    low, high = index.value_range
+    definition['value_range'] = (low - high, high - low)  # pre - post con ambos en value_range
+    return definition
+
+
+def baseline_composite(aoi, start_date, end_date, cloud_cover_max=20, bands=None):
+    """Mediana de las escenas S2 de la ventana previa, con nubes enmascaradas por SCL."""
+    def mask_clouds(image):
+        clear = image.select('SCL').remap(SCL_MASK_CLASSES, [0] * len(SCL_MASK_CLASSES), 1)
+        return image.updateMask(clear)
+
+    collection = ee.ImageCollection(S2_COLLECTION) \
+        .filterBounds(aoi) \
+        .filterDate(start_date, end_date) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_cover_max)) \
+        .map(mask_clouds)
+    if bands:
+        collection = collection.select(bands)
+    return collection.median()
+
+
+def baseline_key(region, start_date, end_date, cloud_cover_max, index_keys, width, height):
+    """Clave del composite: región (grid), ventana previa, nubes, índices y tamaño del grid."""
+    return result_cache.make_cache_key({'type': 'baseline', 'region': region}, start_date, end_date, cloud_cover_max,
+                                       None, {'indices': sorted(index_keys), 'grid': [width, height]})
+
+
+class BaselineStore:
+    """
+    Composites de referencia en disco: <directory>/<clave>.npz con un array por
+    índice (PRE_<ÍNDICE>) y la metadata de la ventana. Escritura atómica; las
+    entradas vencen a los ttl_seconds de creadas.
+    """
+
+    def __init__(self, directory=BASELINE_DIR, ttl_seconds=BASELINE_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, key):
+        """Devuelve ({clave índice: array}, metadata) o None."""
+        path = self._path(key)
+        with self._lock:
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    os.unlink(path)
+                    raise FileNotFoundError(path)
+                with np.load(path, allow_pickle=False) as data:
+                    arrays = {name[len('PRE_'):].lower(): data[name] for name in data.files if name.startswith('PRE_')}
+                    metadata = {'start_date': str(data['start_date']), 'end_date': str(data['end_date']),
+                                'created_at': float(data['created_at'])}
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return arrays, metadata
+
+    def put(self, key, arrays, start_date, end_date):
+        """Guarda los índices del composite ({clave índice: array})."""
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, start_date=start_date, end_date=end_date, created_at=time.time(),
+                            **{f'PRE_{k.upper()}': v.astype(np.float32) for k, v in arrays.items()})
+        with self._lock:
+            return storage.atomic_write(self._path(key), buffer.getvalue())
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_baseline_store():
+    """Devuelve el BaselineStore compartido por el proceso."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = BaselineStore()
+        return _default_store
+
+
+def severity_breakdown(dnbr, pixel_area, mask=None):
+    """
+    Área (ha) y fracción de los píxeles válidos en cada clase de severidad
+    dNBR; con `mask` (zonal_stats.aoi_mask) solo cuentan los del polígono.
+    """
+    inside = np.isfinite(dnbr) if mask is None else mask & np.isfinite(dnbr)
+    valid = dnbr[inside]
+    breakdown = []
+    for label, low, high in DNBR_SEVERITY_CLASSES:
+        count = int(np.count_nonzero((valid >= low) & (valid < high)))
+        breakdown.append({'class': label, 'min': None if np.isinf(low) else low, 'max': None if np.isinf(high) else high,
+                          'area_ha': count * pixel_area / zonal_stats.M2_PER_HA,
+                          'fraction': count / valid.size if valid.size else 0.0})
+    return breakdown
+
+
+def compute_change(aoi, region, post_image, pre_start, pre_end, cloud_cover_max=20, index_keys=None,
+                   width=GRID_PX, height=GRID_PX, counter=None, store=None):
+    """
+    Índices diferenciados (pre - post) sobre el grid de los bounds del AOI.
+    Sin composite en el store: un único grafo con pre, post y d<ÍNDICE>
+    calculados en GEE y una sola descarga; el composite queda guardado.
+    Con composite: solo se descarga la escena post-evento y la diferencia se
+    hace en el cliente.
+    Devuelve {'pre': {...}, 'post': {...}, 'delta': {clave: array},
+    'baseline_cached': bool, 'baseline_key': ...}.
+    """
+    ee_client.ensure_initialized()
+    index_keys = index_registry.resolve_keys(index_keys or DEFAULT_CHANGE_INDICES)
+    store = store or get_baseline_store()
+    key = baseline_key(region, pre_start, pre_end, cloud_cover_max, index_keys, width, height)
+    names = {k: index_registry.get_index(k).name for k in index_keys}
+
+    post_indices = index_registry.build_ee_indices(post_image, index_keys)
+    cached = store.get(key)
+    if cached is not None and all(k in cached[0] for k in index_keys):
+        print(f"Composite de referencia {pre_start}..{pre_end} recuperado del caché ({key[:12]}).")
+        pre = {k: cached[0][k] for k in index_keys}
+        stacked = ee.Image.cat([post_indices[k].rename(f'POST_{names[k]}') for k in index_keys]).toFloat()
+        arrays = local_engine.fetch_band_arrays(stacked, region, width, height, counter=counter, stage='change_detection',
+                                                bands=[f'POST_{names[k]}' for k in index_keys])
+        post = {k: arrays[f'POST_{names[k]}'] for k in index_keys}
+        with np.errstate(invalid='ignore'):
+            delta = {k: pre[k] - post[k] for k in index_keys}
+        return {'pre': pre, 'post': post, 'delta': delta, 'baseline_cached': True, 'baseline_key': key}
+
+    print(f"Calculando composite de referencia {pre_start}..{pre_end} en GEE...")
+    composite = baseline_composite(aoi, pre_start, pre_end, cloud_cover_max, index_registry.required_bands(index_keys))
+    pre_indices = index_registry.build_ee_indices(composite, index_keys)
+    layers = []
+    for k in index_keys:
+        layers.append(pre_indices[k].rename(f'PRE_{names[k]}'))
+        layers.append(post_indices[k].rename(f'POST_{names[k]}'))
+        layers.append(pre_indices[k].subtract(post_indices[k]).rename(f'D{names[k]}'))
+    bands = [f'{prefix}{names[k]}' for k in index_keys for prefix in ('PRE_', 'POST_', 'D')]
+    arrays = local_engine.fetch_band_arrays(ee.Image.cat(layers).toFloat(), region, width, height, counter=counter,
+                                            stage='change_detection', bands=bands)
+    pre = {k: arrays[f'PRE_{names[k]}'] for k in index_keys}
+    post = {k: arrays[f'POST_{names[k]}'] for k in index_keys}
+    delta = {k: arrays[f'D{names[k]}'] for k in index_keys}
+    if all(np.isfinite(values).any() for values in pre.values()):
+        store.put(key, pre, pre_start, pre_end)
+    else:
+        print("WARNING: Composite de referencia sin píxeles válidos; no se guarda en caché.")
+    return {'pre': pre, 'post': post, 'delta': delta, 'baseline_cached': False, 'baseline_key': key}
+
+
+def change_report(change, region, pre_start, pre_end, post_date, aoi_geometry=None):
+    """
+    Resumen de cambios para results['change']: estadísticas zonales de cada
+    d<ÍNDICE>, clases de severidad dNBR y PNG de cada mapa de cambio.
+    Con `aoi_geometry` (GeoJSON) las estadísticas y la severidad solo cuentan
+    los píxeles dentro del polígono, no todo el grid de los bounds.
+    Devuelve (resumen, {clave de mapa: bytes PNG}).
+    """
+    delta = change['delta']
+    height, width = next(iter(delta.values())).shape
+    pixel_area = zonal_stats.pixel_area_m2(region, width, height)
+    mask = aoi_area_m2 = None
+    if aoi_geometry is not None:
+        mask = zonal_stats.aoi_mask(aoi_geometry, region, width, height)
+        aoi_area_m2 = geometry_utils.area_m2(aoi_geometry)
+    definitions = {k: delta_definition(k) for k in delta}
+    stats = zonal_stats.compute_zonal_stats_local(
+        {definitions[k]['name']: values for k, values in delta.items()}, pixel_area,
+        thresholds={d['name']: d['threshold'] for d in definitions.values()}, mask=mask, aoi_area_m2=aoi_area_m2,
+        value_ranges={d['name']: d['value_range'] for d in definitions.values()})
+
+    images = {}
+    for k, values in delta.items():
+        try:
+            images[f'd{k}'] = local_engine.encode_png(local_engine.render_index(values, definitions[k]['vis']))
+        except Exception as e:
+            print(f"ERROR renderizando mapa de cambio d{k}: {e}")
+    summary = {
+        'pre_window': [pre_start, pre_end],
+        'post_date': post_date,
+        'baseline_cached': change['baseline_cached'],
+        'indices': list(delta),
+        'stats': stats,
+        'maps': {f'd{k}': {'title': definitions[k]['title'], 'description': definitions[k]['description']}
+                 for k in delta},
+    }
+    if 'nbr' in delta:
+        summary['severity'] = severity_breakdown(delta['nbr'], pixel_area, mask)
+    return summary, images
@@ -0,0 +1,46 @@
+# backend/ee_batch.py
+import threading
+import ee
+
+from utils import gee_calls
+
+
+class RemoteCallCounter:
+    """
+    Cuenta las llamadas remotas a GEE (getInfo, getThumbURL, ...) hechas durante
+    una ejecución de process_aoi, agrupadas por etapa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.by_stage = {}
+
+    def record(self, stage, calls=1):
+        with self._lock:
+            self.total += calls
+            self.by_stage[stage] = self.by_stage.get(stage, 0) + calls
+
+    def as_dict(self):
+        with self._lock:
+            return {'total': self.total, 'by_stage': dict(self.by_stage)}
+
+    def __repr__(self):
+        return f"RemoteCallCounter(total={self.total}, by_stage={self.by_stage})"
+
+
+def evaluate_batch(values, stage, counter=None):
+    """
+    Evalúa un diccionario {clave: objeto ee} en un único getInfo().
+    En lugar de hacer un round trip por valor, construye un ee.Dictionary con
+    todos los valores de la etapa y lo resuelve de una sola vez.
+    Devuelve un dict de Python con los valores ya evaluados.
+    """
+    batch = ee.Dictionary(values)
+    try:
+        # Reintentos, rate limiting y circuit breaker compartidos (utils.gee_calls)
+        return gee_calls.get_info(batch, description=f"getInfo [{stage}]")
+    finally:
+        # La llamada cuenta aunque falle: el round trip se pagó igual
+        if counter is not None:
+            counter.record(stage)
@@ -1,51 +1,113 @@
 # backend/gee_processor.py
 import ee
-ee.Initialize(project='geoinforme')  # Reemplaza con tu ID real ()from utils import index_calculator
-print(ee.data.getAssetRoots())  # Debe mostrar tus proyectos y assets accesibles.
-from utils.map_generator import generate_map_image, ndvi_vis, nbr_vis, ndwi_vis, rgb_vis
+from utils.map_generator import generate_map_images, generate_map_previews, save_map_png, rgb_vis, THUMBNAIL_SIZE_PX
 from utils import index_calculator
+from utils import index_registry
+from utils import local_engine
+from utils import raster_export
+from utils import tiled_renderer
+from utils import storage
+from utils import tracing
+from utils import ee_client
+from utils import geometry as geometry_utils
+from utils.geometry import AOIGeometry
+from backend.ee_batch import RemoteCallCounter, evaluate_batch
+from backend import change_detection
+from backend import scene_catalog
+from backend import timeseries as index_timeseries
+from backend import zonal_stats
+from datetime import datetime, timezone
 import time
 import os
+import sqlite3
 
-# Define data directory
-DATA_DIR = 'data'
+DATA_DIR = storage.DATA_DIR
 
-# Initialize Earth Engine (redundant if already done in index_calculator, but safe)
-try:
-    if not ee.data._credentials:
-        ee.Initialize(project='geoinforme')
-except Exception as e:
-    print(f"WARNING: Could not initialize EE in gee_processor: {e}")
-    # The app might fail if EE wasn't initialized elsewhere
+# Motor de render de mapas:
+#  'stacked': índices calculados en GEE y apilados en una imagen multibanda que
+#             se descarga en UNA petición; el render con paletas es local
+#  'server':  visualize + getThumbURL por mapa en GEE (una petición por índice)
+#  'local':   una descarga de bandas y cálculo/render en NumPy
+DEFAULT_ENGINE = os.environ.get('GEOINFORME_ENGINE', 'stacked')
 
-def get_sentinel2_image(aoi, start_date, end_date, cloud_cover_max=20):
+# Earth Engine se inicializa de forma perezosa (utils.ee_client), no al importar
+
+def find_best_scene(aoi, start_date, end_date, cloud_cover_max=20, counter=None, region=None):
     """
-    Gets the least cloudy Sentinel-2 L2A image for the AOI and date range.
+    Busca la imagen Sentinel-2 L2A menos nubosa para el AOI y rango de fechas.
+    Toda la metadata de la escena (conteo, id, nubosidad, fecha y bounds del AOI)
+    se resuelve en un único getInfo() batched. Si se pasa `region` (bounds ya
+    calculados en el cliente) no se piden los bounds al servidor.
+    Con `region` y el catálogo local habilitado (backend.scene_catalog) la
+    escena se elige con una consulta SQLite; GEE solo se consulta para
+    sincronizar los tramos de fechas que el catálogo aún no tiene.
+    Devuelve (ee.Image, scene_info) o (None, scene_info) si no hay imágenes.
     """
-    try:
-        print(f"Fetching Sentinel-2 image for AOI between {start_date} and {end_date}...")
-        s2_collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
-            .filterBounds(aoi) \
-            .filterDate(start_date, end_date) \
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_cover_max))
+    ee_client.ensure_initialized()
+    print(f"Fetching Sentinel-2 image for AOI between {start_date} and {end_date}...")
+    if region is not None and scene_catalog.CATALOG_ENABLED:
+        try:
+            scene, count = scene_catalog.get_scene_catalog().best_scene(region, start_date, end_date, cloud_cover_max, counter)
+        except sqlite3.Error as e:
+            print(f"WARNING: Catálogo de escenas no disponible ({e}); se busca la escena en GEE.")
+        else:
+            print(f"Found {count} images matching criteria (catálogo local).")
+            scene_info = {'count': count, 'aoi_bounds': region, 'source': 'catalog'}
+            if scene is None:
+                print("WARNING: No suitable Sentinel-2 images found for the specified criteria.")
+                return None, scene_info
+            scene_info['image_id'] = scene['image_id']
+            scene_info['cloud_cover'] = scene['cloud_cover']
+            scene_info['image_date'] = datetime.fromtimestamp(scene['time_start'] / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+            print(f"Selected image ID: {scene_info['image_id']} with {scene_info['cloud_cover']}% cloud cover.")
+            return ee.Image(scene_info['image_id']), scene_info
+
+    s2_collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
+        .filterBounds(aoi) \
+        .filterDate(start_date, end_date) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_cover_max))
 
-        # Check if any images are found
-        count = s2_collection.size().getInfo()
-        print(f"Found {count} images matching criteria.")
+    # limit(1) + aggregate_array funciona también con colecciones vacías,
+    # así evitamos evaluar first().id() sobre una imagen nula.
+    best = s2_collection.sort('CLOUDY_PIXEL_PERCENTAGE').limit(1)
+    values = {
+        'count': s2_collection.size(),
+        'image_ids': best.aggregate_array('system:id'),
+        'cloud_covers': best.aggregate_array('CLOUDY_PIXEL_PERCENTAGE'),
+        'times': best.aggregate_array('system:time_start'),
+    }
+    if region is None:
+        values['aoi_bounds'] = aoi.bounds(maxError=1).coordinates()
+    info = evaluate_batch(values, 'scene_search', counter)
+
+    count = info['count']
+    print(f"Found {count} images matching criteria.")
+    scene_info = {'count': count, 'aoi_bounds': region if region is not None else info['aoi_bounds'], 'source': 'gee'}
+    if count == 0 or not info['image_ids']:
+        print("WARNING: No suitable Sentinel-2 images found for the specified criteria.")
+        return None, scene_info
 
-        if count == 0:
-            print("WARNING: No suitable Sentinel-2 images found for the specified criteria.")
-            return None # Indicate no image found
+    scene_info['image_id'] = info['image_ids'][0]
+    scene_info['cloud_cover'] = info['cloud_covers'][0]
+    scene_info['image_date'] = datetime.fromtimestamp(info['times'][0] / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+    print(f"Selected image ID: {scene_info['image_id']} with {scene_info['cloud_cover']}% cloud cover.")
 
-        # Select the least cloudy image
-        image = s2_collection.sort('CLOUDY_PIXEL_PERCENTAGE').first()
+    # Referenciamos la escena por id: el grafo de las etapas siguientes no
+    # tiene que volver a filtrar y ordenar la colección.
+    return ee.Image(scene_info['image_id']), scene_info
 
-        # Ensure the image is not null (can happen even if count > 0 in rare cases)
-        if image is None:
-             print("WARNING: Sorted collection resulted in a null image.")
-             return None
 
-        print(f"Selected image ID: {image.id().getInfo()} with {image.get('CLOUDY_PIXEL_PERCENTAGE').getInfo()}% cloud cover.")
+def get_sentinel2_image(aoi, start_date, end_date, cloud_cover_max=20, counter=None):
+    """
+    Gets the least cloudy Sentinel-2 L2A image for the AOI and date range.
+    With a utils.geometry.AOIGeometry the scene is resolved from the local
+    scene catalog (client-side bounds); an ee.Geometry queries GEE directly.
+    """
+    try:
+        region = None
+        if isinstance(aoi, AOIGeometry):
+            region, aoi = aoi.region, aoi.to_ee()
+        image, _ = find_best_scene(aoi, start_date, end_date, cloud_cover_max, counter, region=region)
         return image # Return the ee.Image object
 
     except ee.EEException as e:
@@ -56,54 +118,150 @@ def get_sentinel2_image(aoi, start_date, end_date, cloud_cover_max=20):
         return None
 
 
-def process_aoi(aoi, start_date, end_date):
+def _local_stats(indices, aoi, region, counter, aoi_geometry=None, aoi_area_m2=None):
+    # Los arrays cubren los bounds del AOI: se enmascaran al polígono antes de reducir
+    if aoi_geometry is None:
+        aoi_geometry = evaluate_batch({'aoi': aoi}, 'aoi_geometry', counter)['aoi']
+    if aoi_area_m2 is None:
+        aoi_area_m2 = geometry_utils.area_m2(aoi_geometry)
+    height, width = next(iter(indices.values())).shape
+    return zonal_stats.compute_zonal_stats_local(indices, zonal_stats.pixel_area_m2(region, width, height),
+                                                 mask=zonal_stats.aoi_mask(aoi_geometry, region, width, height),
+                                                 aoi_area_m2=aoi_area_m2)
+
+
+def compute_stats(base_image, aoi, region, counter, local_indices=None, aoi_area_m2=None, index_keys=None,
+                  aoi_geometry=None):
+    """
+    Zonal statistics for the report: reuses the local-engine arrays when
+    available, otherwise one combined-reducer call in GEE, falling back to a
+    small local band download if the server reduction fails.
+    Local statistics only count pixels inside the AOI polygon (`aoi_geometry`,
+    GeoJSON; fetched from `aoi` in one call if not given).
+    Returns the stats dict or None.
+    """
+    try:
+        if local_indices is not None:
+            return _local_stats(local_indices, aoi, region, counter, aoi_geometry, aoi_area_m2)
+        return zonal_stats.compute_zonal_stats(base_image, aoi, counter=counter, aoi_area_m2=aoi_area_m2,
+                                               index_keys=index_keys)
+    except Exception as e:
+        print(f"WARNING: Server-side zonal stats failed ({e}); falling back to local computation.")
+    try:
+        width = height = 256
+        bands = local_engine.fetch_band_arrays(base_image, region, width, height, counter=counter,
+                                               bands=index_registry.required_bands(index_keys))
+        return _local_stats(local_engine.compute_indices(bands, index_keys), aoi, region, counter, aoi_geometry,
+                            aoi_area_m2)
+    except Exception as e:
+        print(f"WARNING: Local zonal stats fallback failed: {e}")
+        return None
+
+
+def process_aoi(aoi, start_date, end_date, cloud_cover_max=20, max_concurrent_maps=None, engine=None, file_tag=None, progress_callback=None, save_dir=None, timeseries=False, stats=True, target_resolution_m=None, preview_size=None, indices=None,
+                baseline_start=None, baseline_end=None, change_indices=None, export_format=None):
     """
     Main processing function: gets image, calculates indices, generates maps.
-    Returns a dictionary with results (image paths, metadata) or None on failure.
+    `indices` lists the utils.index_registry keys to report (default
+    index_registry.DEFAULT_INDICES); one map, stats row and series per index.
+    `aoi` is an ee.Geometry or a utils.geometry.AOIGeometry; with the latter the
+    bounds and area computed client-side are reused instead of asked to GEE.
+    Maps are rendered concurrently (max_concurrent_maps, default MAX_CONCURRENT_MAPS).
+    engine='stacked' (default) computes every index in GEE, downloads them as one
+    multi-band image in a single request and renders/splits the maps locally, so
+    the request count does not grow with the number of indices.
+    engine='server' renders each map with getThumbURL; engine='local' downloads
+    the bands once and computes and renders every index with NumPy.
+    file_tag (default: a unique run id, see utils.storage.new_job_id) names the
+    map files, so concurrent runs never overwrite each other.
+    progress_callback(fraction, message), if given, is called between stages.
+    preview_size (px) renders small previews of every map right after the scene
+    is selected and passes them as progress_callback(..., preview={...}) before
+    the full-resolution maps.
+    timeseries=True adds per-date index statistics for every scene in the
+    window (results['timeseries']), computed in one server-side reduction.
+    stats=True adds zonal statistics of every index (results['stats']).
+    baseline_start/baseline_end (pre-event window) enable change detection:
+    the selected scene is compared against a cloud-free median composite of the
+    pre window (d<INDEX> = pre - post for change_indices, default dNBR/dNDVI;
+    results['change'] plus maps 'dnbr', 'dndvi'). The composite is cached on
+    disk (backend.change_detection), so later runs only fetch the new scene.
+    target_resolution_m renders each map as a tiled high-resolution mosaic
+    (utils.tiled_renderer) instead of a single 512x512 thumbnail.
+    Map PNGs are kept in memory (results['images'], key -> bytes); pass save_dir
+    to also write them to disk (results['image_paths']).
+    export_format ('cog' or 'npy', utils.raster_export) also writes the raw
+    float32 index values, georeferenced, at target_resolution_m (default
+    raster_export.DEFAULT_RESOLUTION_M) to save_dir or the job workspace;
+    results['export'] describes the file.
+    Returns a dictionary with results (images, metadata) or None on failure.
+    The number of remote GEE calls made is reported in metadata['remote_calls'].
+    Every stage is recorded as a span of the active trace (utils.tracing).
     """
+    try:
+        index_keys = index_registry.resolve_keys(indices)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return {'error': str(e)}
+    local_aoi = None
+    if isinstance(aoi, AOIGeometry):
+        local_aoi = aoi
+        aoi = local_aoi.to_ee()
     if not isinstance(aoi, ee.geometry.Geometry):
-        print("ERROR: Invalid AOI provided to process_aoi. Expected ee.Geometry.")
+        print("ERROR: Invalid AOI provided to process_aoi. Expected ee.Geometry or AOIGeometry.")
         return None
 
+    counter = RemoteCallCounter()
+    with tracing.trace_run('process_aoi') as trace:
+        if trace.counter is None:
+            trace.counter = counter
+        return _process_aoi(aoi, local_aoi, start_date, end_date, counter, cloud_cover_max, max_concurrent_maps, engine,
+                            file_tag, progress_callback, save_dir, timeseries, stats, target_resolution_m, preview_size,
+                            index_keys, (baseline_start, baseline_end, change_indices), export_format)
+
+
+def _process_aoi(aoi, local_aoi, start_date, end_date, counter, cloud_cover_max, max_concurrent_maps, engine,
+                 file_tag, progress_callback, save_dir, timeseries, stats, target_resolution_m, preview_size, index_keys,
+                 change_options, export_format):
+    """Body of process_aoi, run inside its trace."""
     print("Starting AOI processing...")
+    progress = progress_callback or (lambda fraction, message, **details: None)
     start_time = time.time()
 
-    # 1. Get Sentinel-2 Image
-    base_image = get_sentinel2_image(aoi, start_date, end_date)
+    progress(0.1, "Buscando escena Sentinel-2")
+    # 1. Get Sentinel-2 Image (+ toda la metadata de la escena en un solo round trip)
+    with tracing.span('scene_search') as scene_span:
+        try:
+            base_image, scene_info = find_best_scene(aoi, start_date, end_date, cloud_cover_max, counter,
+                                                     region=local_aoi.region if local_aoi else None)
+        except ee.EEException as e:
+            print(f"ERROR during GEE operation in find_best_scene: {e}")
+            base_image, scene_info = None, {}
+        except Exception as e:
+            print(f"ERROR in find_best_scene: {e}")
+            base_image, scene_info = None, {}
+        scene_span.set(scenes_found=scene_info.get('count'), image_id=scene_info.get('image_id'),
+                       source=scene_info.get('source'))
     if base_image is None:
         print("Processing failed: Could not retrieve a suitable base image.")
         return {'error': "No suitable satellite image found for the period and AOI. Try adjusting dates or AOI."}
 
-    # Add timeout or retry logic here in a production system
+    # Timeouts, reintentos y rate limiting de cada llamada remota: utils.gee_calls
 
     # 2. Calculate Indices
+    progress(0.3, f"Escena seleccionada: {scene_info['image_id']}")
     print("Calculating indices...")
-    ndvi = None  # Inicializar a None
-    ndwi = None
-    nbr = None
+    index_images = {}
     calculation_step_error = None # Variable para guardar error específico
 
     # Check if index calculation failed
     try:
-        print("DEBUG: [process_aoi] Attempting NDVI calculation...")
-        ndvi = index_calculator.calculate_ndvi(base_image)
-        print(f"DEBUG: [process_aoi] NDVI result type: {type(ndvi)}")
-        if ndvi is None:
-            raise ValueError("NDVI calculation returned None") # Forzar error si falla
-
-        print("DEBUG: [process_aoi] Attempting NDWI calculation...")
-        ndwi = index_calculator.calculate_ndwi(base_image)
-        print(f"DEBUG: [process_aoi] NDWI result type: {type(ndwi)}")
-        if ndwi is None:
-            raise ValueError("NDWI calculation returned None") # Forzar error si falla
-
-        print("DEBUG: [process_aoi] Attempting NBR calculation...")
-        nbr = index_calculator.calculate_nbr(base_image)
-        print(f"DEBUG: [process_aoi] NBR result type: {type(nbr)}")
-        if nbr is None:
-            raise ValueError("NBR calculation returned None") # Forzar error si falla
-
-        print("DEBUG: [process_aoi] All indices calculated successfully.")
+        with tracing.span('index_build', indices=len(index_keys)):
+            # Todos los índices del registro se construyen como grafos perezosos (sin llamadas remotas)
+            index_images = index_calculator.calculate_indices(base_image, index_keys)
+            failed_indices = [key.upper() for key, index in index_images.items() if index is None]
+            if failed_indices:
+                raise ValueError(", ".join(failed_indices)) # Forzar error si falla
 
     # Captura errores específicos del cálculo aquí mismo
     except ee.EEException as e:
@@ -120,46 +278,185 @@ def process_aoi(aoi, start_date, end_date):
 
     # Si hubo un error en el bloque try-except anterior, retorna el error
     if calculation_step_error:
-        print(f"DEBUG: [process_aoi] Returning error due to calculation failure: {calculation_step_error}")
         return {'error': calculation_step_error}
 
 
     # 3. Generate Map Images (Solo si no hubo errores antes)
-    print("DEBUG: [process_aoi] Proceeding to map generation...")
-    timestamp = time.strftime("%Y%m%d-%H%M%S") # Unique identifier for this run
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    run_id = storage.new_job_id() # Único aunque dos corridas empiecen en el mismo segundo
+    tag = file_tag or run_id
+    # La metadata ya viene resuelta desde find_best_scene, sin getInfo() extra
+    region = scene_info['aoi_bounds']
     results = {'metadata': {
-        'aoi_bounds': aoi.bounds().getInfo()['coordinates'],
-        'image_id': base_image.id().getInfo(),
-        'image_date': ee.Date(base_image.get('system:time_start')).format('YYYY-MM-dd').getInfo(),
-        'cloud_cover': base_image.get('CLOUDY_PIXEL_PERCENTAGE').getInfo(),
-        'processing_timestamp': timestamp
+        'aoi_bounds': region,
+        'image_id': scene_info['image_id'],
+        'image_date': scene_info['image_date'],
+        'cloud_cover': scene_info['cloud_cover'],
+        'processing_timestamp': timestamp,
+        'run_id': run_id,
+        'indices': index_keys,
     }}
 
-    map_tasks = {
-        'rgb': (base_image, rgb_vis, f'rgb_{timestamp}.png', 'True Color (RGB)'),
-        'ndvi': (ndvi, ndvi_vis, f'ndvi_{timestamp}.png', 'NDVI'),
-        'ndwi': (ndwi, ndwi_vis, f'ndwi_{timestamp}.png', 'NDWI'),
-        'nbr': (nbr, nbr_vis, f'nbr_{timestamp}.png', 'NBR')
-    }
+    map_tasks = {'rgb': (base_image, rgb_vis, f'rgb_{tag}.png', 'True Color (RGB)')}
+    for key in index_keys:
+        map_tasks[key] = (index_images[key], index_registry.get_index(key).vis, f'{key}_{tag}.png', key.upper())
+    engine = engine or DEFAULT_ENGINE
+
+    if preview_size:
+        # Fase 1 del render progresivo: vistas previas chicas apenas hay escena,
+        # antes de los renders caros (el usuario puede cancelar si la escena no sirve)
+        with tracing.span('previews', size=preview_size):
+            if engine == 'server':
+                previews = generate_map_previews(map_tasks, aoi, region=region, counter=counter,
+                                                 max_workers=max_concurrent_maps, size=preview_size)
+            else:
+                # Una sola descarga apilada chica para todas las vistas previas
+                previews = local_engine.generate_stacked_map_images(base_image, region, index_keys, rgb_vis,
+                                                                    preview_size, preview_size, counter, 'previews')
+                previews = {key: png for key, png in previews.items() if png}
+        progress(0.32, "Vista previa lista", preview={
+            'images': previews,
+            'titles': {key: map_tasks[key][3] for key in previews},
+            'image_id': scene_info['image_id'],
+            'image_date': scene_info['image_date'],
+            'cloud_cover': scene_info['cloud_cover'],
+        })
 
+    if timeseries:
+        progress(0.35, "Calculando serie temporal de índices")
+        try:
+            with tracing.span('timeseries'):
+                results['timeseries'] = index_timeseries.compute_index_timeseries(
+                    aoi, start_date, end_date, cloud_cover_max, counter=counter, index_keys=index_keys)
+        except ee.EEException as e:
+            # La serie es complementaria: si falla, el informe sigue sin ella
+            print(f"WARNING: GEE Error computing index time series: {e}")
+        except Exception as e:
+            print(f"WARNING: Unexpected error computing index time series: {e}")
+
+    images = {}
     image_paths = {}
-    for key, (img, vis, filename, title) in map_tasks.items():
-        filepath = generate_map_image(img, vis, filename, aoi, title)
-        if filepath:
-            image_paths[key] = filepath
+    failed_maps = []
+    progress(0.4, "Generando mapas")
+    results['metadata']['engine'] = engine
+    results['metadata']['target_resolution_m'] = target_resolution_m
+    local_indices = None
+    with tracing.span('maps', engine=engine, tiled=bool(target_resolution_m)) as maps_span:
+        if engine == 'local':
+            generated, local_indices = local_engine.generate_map_images_locally(
+                base_image, region,
+                {key: filename for key, (_, _, filename, _) in map_tasks.items()},
+                index_registry.vis_params(index_keys), rgb_vis,
+                None, counter=counter, in_memory=True, return_indices=True)
+        elif target_resolution_m and engine == 'stacked':
+            # Una petición por tile con todos los índices apilados; todos los mosaicos a la vez
+            # (el progreso por franja es también punto de cancelación)
+            generated = tiled_renderer.render_tiled_stacked_maps_png(
+                base_image, index_keys, rgb_vis, region, target_resolution_m, max_concurrent_maps, counter,
+                row_callback=lambda done, rows: progress(0.4 + 0.45 * done / rows, f"Generando mapas en alta resolución ({done}/{rows} franjas)"))
+        elif target_resolution_m:
+            # Cada mapa ya descarga sus tiles en paralelo; los mapas van uno tras otro
+            # (el progreso entre mapas es también punto de cancelación)
+            generated = {}
+            for position, (key, (img, vis, _, title)) in enumerate(map_tasks.items()):
+                progress(0.4 + 0.45 * position / len(map_tasks), f"Generando mapa en alta resolución: {title}")
+                generated[key] = tiled_renderer.render_tiled_map_png(img, vis, region, target_resolution_m,
+                                                                     max_concurrent_maps, counter, title)
+        elif engine == 'stacked':
+            # Con el id de la escena los píxeles salen del caché de tiles (AOIs vecinos los comparten)
+            generated = local_engine.generate_stacked_map_images(base_image, region, index_keys, rgb_vis,
+                                                                 THUMBNAIL_SIZE_PX, THUMBNAIL_SIZE_PX, counter,
+                                                                 scene_id=scene_info['image_id'])
+        else:
+            generated = generate_map_images(map_tasks, aoi, region=region, counter=counter, max_workers=max_concurrent_maps, in_memory=True)
+        maps_span.set(bytes=sum(len(b) for b in generated.values() if b))
+    map_filenames = {key: filename for key, (_, _, filename, _) in map_tasks.items()}
+
+    baseline_start, baseline_end, change_indices = change_options
+    if baseline_start and baseline_end:
+        progress(0.8, f"Detección de cambios frente a {baseline_start} - {baseline_end}")
+        try:
+            with tracing.span('change_detection') as change_span:
+                change = change_detection.compute_change(aoi, region, base_image, baseline_start, baseline_end,
+                                                         cloud_cover_max, change_indices, counter=counter)
+                # Estadísticas y severidad solo dentro del polígono del AOI, como las del informe
+                aoi_geometry = local_aoi.geometry if local_aoi else evaluate_batch({'aoi': aoi}, 'aoi_geometry', counter)['aoi']
+                results['change'], change_maps = change_detection.change_report(
+                    change, region, baseline_start, baseline_end, scene_info['image_date'], aoi_geometry)
+                change_span.set(baseline_cached=change['baseline_cached'])
+            for key, png_bytes in change_maps.items():
+                generated[key] = png_bytes
+                map_filenames[key] = f'{key}_{tag}.png'
+        except ee.EEException as e:
+            # Sin composite de referencia el informe sigue sin la sección de cambios
+            print(f"WARNING: GEE Error computing change detection: {e}")
+            results['change'] = {'error': str(e), 'pre_window': [baseline_start, baseline_end]}
+        except Exception as e:
+            print(f"WARNING: Unexpected error computing change detection: {e}")
+            results['change'] = {'error': str(e), 'pre_window': [baseline_start, baseline_end]}
+
+    for key, png_bytes in generated.items():
+        if png_bytes:
+            images[key] = png_bytes
+            # Persistencia a disco solo si se pide explícitamente
+            if save_dir:
+                image_paths[key] = save_map_png(png_bytes, map_filenames[key], save_dir)
         else:
             print(f"WARNING: Failed to generate map for {key}")
+            failed_maps.append(key)
             # Decide if failure to generate one map should halt everything
             # For MVP, we can continue and report missing maps
 
+    results['images'] = images
+    results['image_filenames'] = {key: map_filenames[key] for key in images}
     results['image_paths'] = image_paths
+    results['failed_maps'] = failed_maps
 
     # Check if any maps were generated
-    if not image_paths:
+    if not images:
         print("Processing failed: Could not generate any map images.")
         return {'error': "Failed to generate map visualizations."}
 
 
+    if export_format:
+        progress(0.82, f"Exportando rásters de índices ({export_format})")
+        callback_errors = []
+
+        def on_export_row(done, rows):
+            try:
+                progress(0.82, f"Exportando rásters de índices ({done}/{rows} franjas)")
+            except Exception as e:
+                callback_errors.append(e) # Cancelación del job: no es un error del export
+                raise
+
+        try:
+            with tracing.span('export', format=export_format) as export_span:
+                export_path = os.path.join(save_dir or storage.current_workspace().path,
+                                           raster_export.export_filename(tag, export_format))
+                results['export'] = raster_export.export_index_rasters(
+                    base_image, index_keys, region, export_path, export_format,
+                    target_resolution_m or raster_export.DEFAULT_RESOLUTION_M, max_concurrent_maps, counter,
+                    tags={'image_id': scene_info['image_id'], 'image_date': scene_info['image_date']},
+                    row_callback=on_export_row)
+                export_span.set(bytes=results['export']['bytes'])
+        except Exception as e:
+            if callback_errors:
+                raise
+            # El informe no depende del export: se informa el error y se sigue
+            print(f"WARNING: Raster export failed: {e}")
+            results['export'] = {'format': export_format, 'error': str(e)}
+
+    # 4. Zonal statistics (todas las estadísticas de todos los índices en una llamada)
+    if stats:
+        progress(0.85, "Calculando estadísticas zonales")
+        with tracing.span('zonal_stats'):
+            results['stats'] = compute_stats(base_image, aoi, region, counter, local_indices,
+                                             aoi_area_m2=local_aoi.area_m2 if local_aoi else None,
+                                             index_keys=index_keys,
+                                             aoi_geometry=local_aoi.geometry if local_aoi else None)
+
+    results['metadata']['remote_calls'] = counter.as_dict()
+
     end_time = time.time()
-    print(f"AOI processing finished in {end_time - start_time:.2f} seconds.")
+    print(f"AOI processing finished in {end_time - start_time:.2f} seconds ({counter.total} remote GEE calls: {counter.by_stage}).")
     return results
\ No newline at end of file
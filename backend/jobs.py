@@ -0,0 +1,211 @@
+# backend/jobs.py
+# Runner de jobs en segundo plano: ejecuta los informes en un pool de workers
+# compartido por todas las sesiones, con ids de job, progreso consultable y
+# deduplicación de envíos idénticos en curso. Cada job corre dentro de su
+# propio workspace en disco (utils.storage), así los jobs concurrentes nunca
+# comparten archivos.
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import storage
+
+MAX_WORKERS = int(os.environ.get('GEOINFORME_JOB_WORKERS', 4))
+JOB_RETENTION_SECONDS = int(os.environ.get('GEOINFORME_JOB_RETENTION_SECONDS', 3600))
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Lanzada dentro de un job cuando se pidió su cancelación."""
+
+
+class Job:
+    """Estado de un job. Los campos se actualizan desde el worker bajo lock."""
+
+    def __init__(self, job_id, dedup_key=None):
+        self.id = job_id
+        self.dedup_key = dedup_key
+        self.status = STATUS_QUEUED
+        self.progress = 0.0
+        self.message = "En cola"
+        self.preview = None  # Resultado parcial publicado por el trabajo (p. ej. vistas previas de mapas)
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.subscribers = 1  # Sesiones/clientes que esperan este job (los envíos deduplicados se suman)
+        self.future = None
+        self.workspace = None  # utils.storage.JobWorkspace mientras el job corre
+        self._lock = threading.Lock()
+
+    def update_progress(self, fraction, message=None, preview=None):
+        """
+        Callback de progreso para el trabajo; también es el punto de cancelación
+        cooperativa. `preview` publica un resultado parcial consultable mientras
+        el job sigue corriendo.
+        """
+        if self.cancel_requested:
+            raise JobCancelled(self.id)
+        with self._lock:
+            self.progress = max(self.progress, min(float(fraction), 1.0))
+            if message:
+                self.message = message
+            if preview is not None:
+                self.preview = preview
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'progress': self.progress,
+                'message': self.message,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'subscribers': self.subscribers,
+            }
+
+
+class JobManager:
+    """
+    Pool de workers con registro de jobs. submit() con el mismo dedup_key que
+    un job aún en curso devuelve el id del job existente en vez de encolar otro
+    y lo anota como un suscriptor más; cancel() solo cancela cuando lo pide
+    el último suscriptor.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, retention_seconds=JOB_RETENTION_SECONDS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._in_flight = {}  # dedup_key -> job_id
+        self._lock = threading.Lock()
+        self.retention_seconds = retention_seconds
+
+    def submit(self, fn, *args, dedup_key=None, **kwargs):
+        """
+        Encola fn(*args, progress=job.update_progress, **kwargs); fn corre con
+        el workspace del job como storage.current_workspace().
+        Devuelve el id del job (nuevo o el ya en curso con igual dedup_key).
+        """
+        with self._lock:
+            self._prune()
+            if dedup_key is not None and dedup_key in self._in_flight:
+                job = self._jobs[self._in_flight[dedup_key]]
+                with job._lock:
+                    job.subscribers += 1
+                return job.id
+            job = Job(storage.new_job_id(), dedup_key)
+            self._jobs[job.id] = job
+            if dedup_key is not None:
+                self._in_flight[dedup_key] = job.id
+            job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+            return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested:
+            self._finish(job, STATUS_CANCELLED, message="Cancelado")
+            return
+        with job._lock:
+            job.status = STATUS_RUNNING
+            job.started_at = time.time()
+            job.message = "Procesando"
+        try:
+            with storage.JobWorkspace(job.id) as workspace:
+                job.workspace = workspace
+                result = fn(*args, progress=job.update_progress, **kwargs)
+            job.result = result
+            self._finish(job, STATUS_DONE, progress=1.0, message="Terminado")
+        except JobCancelled:
+            self._finish(job, STATUS_CANCELLED, message="Cancelado")
+        except Exception as e:
+            print(f"ERROR: [jobs] Job {job.id} falló: {e}")
+            traceback.print_exc()
+            self._finish(job, STATUS_FAILED, message="Error", error=str(e))
+
+    def _finish(self, job, status, progress=None, message=None, error=None):
+        with job._lock:
+            job.status = status
+            job.finished_at = time.time()
+            if progress is not None:
+                job.progress = progress
+            if message:
+                job.message = message
+            job.error = error
+        with self._lock:
+            if job.dedup_key is not None and self._in_flight.get(job.dedup_key) == job.id:
+                del self._in_flight[job.dedup_key]
+
+    def _prune(self):
+        """Olvida los jobs terminados hace más de retention_seconds (llamar con el lock tomado)."""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return job.to_dict() if job else None
+
+    def active_count(self):
+        """Jobs en cola o corriendo (para aplicar contrapresión antes de encolar)."""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def cancel(self, job_id):
+        """
+        Da de baja a un suscriptor del job. Si era el último pide la
+        cancelación (inmediata si está en cola, cooperativa si ya corre) y
+        devuelve True; si otros envíos deduplicados siguen esperando el job,
+        este sigue corriendo y devuelve False.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            with job._lock:
+                job.subscribers = max(0, job.subscribers - 1)
+                if job.subscribers:
+                    return False
+            # Un envío idéntico posterior no debe unirse a un job que se está cancelando
+            if job.dedup_key is not None and self._in_flight.get(job.dedup_key) == job.id:
+                del self._in_flight[job.dedup_key]
+        job.cancel_requested = True
+        if job.future is not None and job.future.cancel():
+            self._finish(job, STATUS_CANCELLED, message="Cancelado")
+        return True
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Devuelve el JobManager compartido por todas las sesiones del proceso."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = JobManager()
+        return _default_manager
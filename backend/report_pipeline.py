@@ -0,0 +1,112 @@
+# backend/report_pipeline.py
+# Pipeline completo de un informe (AOI -> caché -> process_aoi -> PDF), sin
+# dependencias de Streamlit. Lo usan el runner de jobs y la UI.
+import os
+
+import geojson
+
+from backend import gee_processor
+from reports import pdf_generator
+from utils import helpers
+from utils import index_registry
+from utils import result_cache
+from utils import tracing
+from utils.map_generator import PREVIEW_SIZE_PX, rgb_vis
+
+DEFAULT_CLOUD_COVER_MAX = 20
+
+
+class ReportError(Exception):
+    """Error de negocio del pipeline (sin imágenes, AOI inválido, PDF fallido...)."""
+
+
+def build_aoi_geometry(aoi_type, aoi_params):
+    """
+    Recrea el AOI (utils.geometry.AOIGeometry, con bounds y área ya calculados
+    en el cliente) a partir de los parámetros guardados en sesión.
+    """
+    if aoi_type == 'coords':
+        aoi = helpers.get_aoi_from_coords(aoi_params['lat'], aoi_params['lon'], aoi_params['radius_km'])
+    elif aoi_type == 'upload':
+        # Handle ya parseado (utils.ingest.ParsedUpload); se usa el primer feature
+        upload = aoi_params.get('upload')
+        if upload is None:
+            raise ReportError("No se encontró el archivo cargado en el estado.")
+        aoi = upload.to_aoi()
+    elif aoi_type == 'geojson':
+        geojson_string = aoi_params.get('geojson_string')
+        if not geojson_string:
+            raise ReportError("No se encontró el string GeoJSON en el estado.")
+        # Extraer geometría del primer feature (para varios features usar backend.batch)
+        try:
+            aoi = helpers.get_aoi_from_geojson(geojson.loads(geojson_string))
+        except ValueError:
+            raise ReportError("No se encontró geometría válida en el GeoJSON guardado.")
+    else:
+        raise ReportError("Tipo de AOI desconocido en el estado.")
+    if aoi is None:
+        raise ReportError("No se pudo recrear la geometría AOI.")
+    return aoi
+
+
+def report_cache_key(aoi_type, aoi_params, start_date, end_date, cloud_cover_max=DEFAULT_CLOUD_COVER_MAX, options=None):
+    """Clave de caché (y de deduplicación de jobs) de un informe."""
+    return result_cache.make_cache_key(
+        result_cache.normalize_aoi_params(aoi_type, aoi_params),
+        start_date, end_date, cloud_cover_max,
+        dict(index_registry.vis_params((options or {}).get('indices')), rgb=rgb_vis),
+        options)
+
+
+def generate_report(aoi_type, aoi_params, start_date, end_date, cloud_cover_max=DEFAULT_CLOUD_COVER_MAX, progress=None, options=None,
+                    previews=False):
+    """
+    Genera (o recupera del caché) el informe de un AOI.
+    `options` son opciones del informe pasadas a process_aoi (p. ej. {'timeseries': True}).
+    `progress(fraction, message)` es opcional y recibe el avance por etapa; con
+    previews=True además recibe progress(..., preview={...}) con miniaturas
+    chicas de cada mapa apenas se elige la escena (no cambia la clave de caché).
+    Devuelve {'pdf_bytes', 'pdf_filename', 'results', 'from_cache'}; lanza
+    ReportError si falla. Toda la ejecución (incluido el PDF) queda en una
+    sola traza (utils.tracing).
+    """
+    with tracing.trace_run('report'):
+        return _generate_report(aoi_type, aoi_params, start_date, end_date, cloud_cover_max, progress, options, previews)
+
+
+def _generate_report(aoi_type, aoi_params, start_date, end_date, cloud_cover_max, progress, options, previews):
+    progress = progress or (lambda fraction, message, **details: None)
+    cache = result_cache.get_default_cache()
+    options = options or {}
+    cache_key = report_cache_key(aoi_type, aoi_params, start_date, end_date, cloud_cover_max, options)
+
+    with tracing.span('cache_lookup') as cache_span:
+        cached_entry = cache.get(cache_key)
+        cache_span.set(hit=bool(cached_entry and cached_entry.get('pdf_path')), key=cache_key[:12])
+    if cached_entry and cached_entry.get('pdf_path'):
+        with open(cached_entry['pdf_path'], 'rb') as f:
+            pdf_bytes = f.read()
+        progress(1.0, "Informe recuperado del caché")
+        return {'pdf_bytes': pdf_bytes, 'pdf_filename': os.path.basename(cached_entry['pdf_path']),
+                'results': cached_entry['results'], 'from_cache': True}
+
+    progress(0.05, "Recreando geometría del AOI")
+    aoi = build_aoi_geometry(aoi_type, aoi_params)
+
+    processing_results = gee_processor.process_aoi(aoi, start_date, end_date, cloud_cover_max=cloud_cover_max, progress_callback=progress,
+                                                   preview_size=PREVIEW_SIZE_PX if previews else None, **options)
+    if not processing_results:
+        raise ReportError("Error desconocido durante el procesamiento GEE.")
+    if 'error' in processing_results:
+        raise ReportError(processing_results['error'])
+
+    progress(0.9, "Generando PDF")
+    pdf_bytes = pdf_generator.build_pdf_report(processing_results)
+    if not pdf_bytes:
+        raise ReportError("Error al generar el archivo PDF del informe.")
+    pdf_filename = pdf_generator.report_filename(processing_results)
+
+    # El caché es el único sumidero a disco: la UI sirve los bytes directamente
+    cache.put(cache_key, processing_results, pdf_bytes, pdf_filename)
+    progress(1.0, "Informe listo")
+    return {'pdf_bytes': pdf_bytes, 'pdf_filename': pdf_filename, 'results': processing_results, 'from_cache': False}
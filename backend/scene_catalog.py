@@ -0,0 +1,325 @@
+# backend/scene_catalog.py
+# Catálogo local (SQLite) de escenas Sentinel-2 L2A: id, fecha, nubosidad y
+# footprint de cada escena, con un índice espacial R-tree sobre el bbox del
+# footprint. find_best_scene elige la escena con una sola consulta local en vez
+# de filtrar y ordenar la colección en GEE en cada informe.
+#
+# El catálogo se llena de forma incremental por celdas de CELL_DEG grados y
+# por fecha: cada celda recuerda los intervalos de fechas ya sincronizados y
+# solo se le piden a GEE los tramos que faltan, partidos en ventanas de a lo
+# sumo SYNC_WINDOW_DAYS días y pedidos de a SYNC_WINDOWS_PER_CALL ventanas por
+# getInfo: la respuesta (ids y footprints de cada escena) queda acotada aunque
+# se pida un año entero, y cada página confirmada queda cubierta aunque una
+# posterior falle.
+# Los últimos INGEST_LAG_DAYS días solo se dan por cubiertos durante
+# TAIL_REFRESH_SECONDS, porque GEE sigue ingiriendo escenas recientes: pasado
+# ese tiempo el informe siguiente re-consulta únicamente esa cola.
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import ee
+
+from backend.ee_batch import evaluate_batch
+from backend.timeseries import S2_COLLECTION
+from utils import ee_client
+
+CATALOG_PATH = os.environ.get('GEOINFORME_SCENE_CATALOG', os.path.join('cache', 'scene_catalog.sqlite'))
+CATALOG_ENABLED = os.environ.get('GEOINFORME_SCENE_CATALOG_ENABLED', '1') == '1'
+CELL_DEG = float(os.environ.get('GEOINFORME_SCENE_CATALOG_CELL_DEG', 1.0))
+INGEST_LAG_DAYS = float(os.environ.get('GEOINFORME_SCENE_CATALOG_INGEST_LAG_DAYS', 5))
+TAIL_REFRESH_SECONDS = int(os.environ.get('GEOINFORME_SCENE_CATALOG_TAIL_REFRESH_SECONDS', 3600))
+SYNC_WINDOW_DAYS = float(os.environ.get('GEOINFORME_SCENE_CATALOG_SYNC_WINDOW_DAYS', 31))
+SYNC_WINDOWS_PER_CALL = int(os.environ.get('GEOINFORME_SCENE_CATALOG_SYNC_WINDOWS_PER_CALL', 8))
+DAY_MS = 24 * 3600 * 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    image_id TEXT NOT NULL UNIQUE,
+    time_start INTEGER NOT NULL,
+    cloud REAL,
+    footprint TEXT
+);
+CREATE INDEX IF NOT EXISTS scenes_time ON scenes (time_start);
+CREATE VIRTUAL TABLE IF NOT EXISTS scenes_rtree USING rtree (id, min_x, max_x, min_y, max_y);
+CREATE TABLE IF NOT EXISTS coverage (
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    synced_at REAL NOT NULL,
+    expires_at REAL -- NULL: tramo definitivo; si no, cola reciente cubierta hasta esa hora
+);
+CREATE INDEX IF NOT EXISTS coverage_cell ON coverage (cell_x, cell_y);
+"""
+
+
+def date_to_millis(date):
+    """'YYYY-MM-DD' (medianoche UTC, como filterDate de GEE) a milisegundos."""
+    return int(datetime.strptime(str(date)[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def region_box(region):
+    """(xmin, ymin, xmax, ymax) de una región en formato aoi.bounds().coordinates()."""
+    points = [point for ring in region for point in ring]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def _subtract_intervals(start, end, covered):
+    """Tramos de [start, end) no incluidos en los intervalos `covered` (ya fusionados)."""
+    missing, cursor = [], start
+    for covered_start, covered_end in covered:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            missing.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+def _split_interval(start, end, step):
+    """[start, end) en tramos consecutivos de a lo sumo `step`."""
+    return [(s, min(s + step, end)) for s in range(start, end, step)]
+
+
+def _point_in_ring(x, y, ring):
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _segments_cross(p1, p2, q1, q2):
+    def orientation(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    d1, d2 = orientation(q1, q2, p1), orientation(q1, q2, p2)
+    d3, d4 = orientation(p1, p2, q1), orientation(p1, p2, q2)
+    return d1 * d2 < 0 and d3 * d4 < 0 # Cruce propio; los contactos los cubren los chequeos de vértices
+
+
+def ring_intersects_box(ring, box):
+    """
+    ¿El footprint (anillo [[x, y], ...]) toca el bbox? Filtro fino después del
+    R-tree: las escenas de borde de pasada cubren solo parte de su bbox.
+    """
+    xmin, ymin, xmax, ymax = box
+    if any(xmin <= x <= xmax and ymin <= y <= ymax for x, y in ring):
+        return True
+    corners = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+    if any(_point_in_ring(x, y, ring) for x, y in corners):
+        return True
+    edges = list(zip(corners, corners[1:] + corners[:1]))
+    return any(_segments_cross(a, b, c, d) for a, b in zip(ring, ring[1:]) for c, d in edges)
+
+
+class SceneCatalog:
+    """
+    Catálogo de escenas en un archivo SQLite (seguro entre hilos y procesos:
+    una conexión por operación, WAL). best_scene() sincroniza lo que falte y
+    resuelve la escena con una consulta local.
+    """
+
+    def __init__(self, path=CATALOG_PATH, cell_deg=CELL_DEG, ingest_lag_days=INGEST_LAG_DAYS,
+                 tail_refresh_seconds=TAIL_REFRESH_SECONDS, sync_window_days=SYNC_WINDOW_DAYS,
+                 sync_windows_per_call=SYNC_WINDOWS_PER_CALL):
+        self.path = path
+        self.cell_deg = cell_deg
+        self.ingest_lag_ms = int(ingest_lag_days * DAY_MS)
+        self.tail_refresh_seconds = tail_refresh_seconds
+        self.sync_window_ms = max(1, int(sync_window_days * DAY_MS))
+        self.sync_windows_per_call = max(1, sync_windows_per_call)
+        self.lookups = 0
+        self.syncs = 0
+        self._sync_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn: # commit / rollback
+                yield conn
+        finally:
+            conn.close()
+
+    def cells(self, box):
+        """Celdas (cx, cy) de la grilla de sincronización que toca el bbox."""
+        xmin, ymin, xmax, ymax = box
+        return [(cx, cy)
+                for cx in range(int(xmin // self.cell_deg), int(xmax // self.cell_deg) + 1)
+                for cy in range(int(ymin // self.cell_deg), int(ymax // self.cell_deg) + 1)]
+
+    def cell_box(self, cell):
+        cx, cy = cell
+        return cx * self.cell_deg, cy * self.cell_deg, (cx + 1) * self.cell_deg, (cy + 1) * self.cell_deg
+
+    def missing(self, box, start_ms, end_ms):
+        """[(celda, inicio, fin)] de los tramos de fechas aún no sincronizados."""
+        missing = []
+        with self._connect() as conn:
+            for cell in self.cells(box):
+                covered = conn.execute('SELECT start_ms, end_ms FROM coverage WHERE cell_x = ? AND cell_y = ? '
+                                       'AND (expires_at IS NULL OR expires_at > ?)', cell + (time.time(),)).fetchall()
+                missing.extend((cell, s, e) for s, e in _subtract_intervals(start_ms, end_ms, _merge_intervals(covered)))
+        return missing
+
+    def sync(self, box, start_ms, end_ms, counter=None):
+        """
+        Trae de GEE las escenas de los tramos que faltan, en ventanas de fechas
+        de a lo sumo sync_window_ms y de a sync_windows_per_call ventanas por
+        getInfo, y marca cada página como cubierta apenas se guarda. Devuelve
+        la cantidad de escenas nuevas.
+        """
+        with self._sync_lock:
+            missing = self.missing(box, start_ms, end_ms)
+            if not missing:
+                return 0
+            windows = [(cell, ws, we) for cell, s, e in missing for ws, we in _split_interval(s, e, self.sync_window_ms)]
+            added = 0
+            for first in range(0, len(windows), self.sync_windows_per_call):
+                page = windows[first:first + self.sync_windows_per_call]
+                chunks = self._fetch_windows(page, counter)
+                self.syncs += 1
+                added += self._store_page(page, chunks)
+            print(f"Catálogo de escenas: {len(windows)} ventanas sincronizadas en "
+                  f"{-(-len(windows) // self.sync_windows_per_call)} llamadas, {added} escenas nuevas.")
+            return added
+
+    def _fetch_windows(self, windows, counter=None):
+        """Un getInfo con ids, fechas, nubosidad y footprints de cada ventana (celda, inicio, fin)."""
+        ee_client.ensure_initialized()
+        values = {}
+        for i, (cell, s, e) in enumerate(windows):
+            collection = ee.ImageCollection(S2_COLLECTION) \
+                .filterBounds(ee.Geometry.Rectangle(list(self.cell_box(cell)))) \
+                .filterDate(s, e)
+            values[f'tramo_{i}'] = ee.Dictionary({
+                'ids': collection.aggregate_array('system:id'),
+                'times': collection.aggregate_array('system:time_start'),
+                'clouds': collection.aggregate_array('CLOUDY_PIXEL_PERCENTAGE'),
+                'footprints': collection.aggregate_array('system:footprint'),
+            })
+        info = evaluate_batch(values, 'scene_catalog_sync', counter)
+        return [info[f'tramo_{i}'] for i in range(len(windows))]
+
+    def _store_page(self, windows, chunks):
+        """Guarda las escenas de una página y marca sus ventanas como cubiertas."""
+        now_ms = int(time.time() * 1000)
+        added = 0
+        with self._connect() as conn:
+            for (cell, s, e), chunk in zip(windows, chunks):
+                for image_id, time_start, cloud, footprint in zip(chunk['ids'], chunk['times'], chunk['clouds'],
+                                                                  chunk['footprints']):
+                    added += self._insert_scene(conn, image_id, time_start, cloud, footprint)
+                # La cola reciente solo se cubre por un rato: GEE todavía puede agregar escenas
+                settled_end = max(s, min(e, now_ms - self.ingest_lag_ms))
+                if settled_end > s:
+                    self._add_coverage(conn, cell, s, settled_end)
+                if e > settled_end:
+                    self._add_coverage(conn, cell, settled_end, e, expires_at=time.time() + self.tail_refresh_seconds)
+        return added
+
+    @staticmethod
+    def _insert_scene(conn, image_id, time_start, cloud, footprint):
+        ring = (footprint or {}).get('coordinates') or []
+        if footprint and footprint.get('type') == 'Polygon':
+            ring = ring[0]
+        if not ring:
+            return 0
+        cursor = conn.execute('INSERT OR IGNORE INTO scenes (image_id, time_start, cloud, footprint) VALUES (?, ?, ?, ?)',
+                              (image_id, int(time_start), cloud, json.dumps(ring)))
+        if not cursor.rowcount:
+            return 0
+        xs, ys = [p[0] for p in ring], [p[1] for p in ring]
+        conn.execute('INSERT INTO scenes_rtree VALUES (?, ?, ?, ?, ?)',
+                     (cursor.lastrowid, min(xs), max(xs), min(ys), max(ys)))
+        return 1
+
+    @staticmethod
+    def _add_coverage(conn, cell, start_ms, end_ms, expires_at=None):
+        """Marca [start_ms, end_ms) como sincronizado; los tramos definitivos de la celda se fusionan."""
+        now = time.time()
+        conn.execute('DELETE FROM coverage WHERE cell_x = ? AND cell_y = ? AND expires_at <= ?', cell + (now,))
+        if expires_at is not None:
+            conn.execute('INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?)', cell + (start_ms, end_ms, now, expires_at))
+            return
+        covered = conn.execute('SELECT start_ms, end_ms FROM coverage WHERE cell_x = ? AND cell_y = ? '
+                               'AND expires_at IS NULL', cell).fetchall()
+        conn.execute('DELETE FROM coverage WHERE cell_x = ? AND cell_y = ? AND expires_at IS NULL', cell)
+        conn.executemany('INSERT INTO coverage VALUES (?, ?, ?, ?, ?, NULL)',
+                         [cell + (s, e, now) for s, e in _merge_intervals(covered + [(start_ms, end_ms)])])
+
+    def query(self, box, start_ms, end_ms, cloud_cover_max):
+        """
+        Escenas cuyo footprint toca el bbox, en [start_ms, end_ms) y con nubosidad
+        < cloud_cover_max (los mismos filtros que find_best_scene pedía a GEE),
+        de menor a mayor nubosidad.
+        """
+        xmin, ymin, xmax, ymax = box
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT s.image_id, s.time_start, s.cloud, s.footprint FROM scenes_rtree r JOIN scenes s ON s.id = r.id '
+                'WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ? '
+                'AND s.time_start >= ? AND s.time_start < ? AND s.cloud < ? '
+                'ORDER BY s.cloud, s.time_start',
+                (xmin, xmax, ymin, ymax, start_ms, end_ms, cloud_cover_max)).fetchall()
+        return [{'image_id': image_id, 'time_start': time_start, 'cloud_cover': cloud}
+                for image_id, time_start, cloud, footprint in rows
+                if ring_intersects_box(json.loads(footprint), box)]
+
+    def best_scene(self, region, start_date, end_date, cloud_cover_max=20, counter=None):
+        """
+        Escena menos nubosa para la región (bounds del AOI) y el período, o None.
+        Devuelve (escena, cantidad de escenas candidatas). Solo llama a GEE si
+        faltan tramos del catálogo.
+        """
+        box = region_box(region)
+        start_ms, end_ms = date_to_millis(start_date), date_to_millis(end_date)
+        self.sync(box, start_ms, end_ms, counter)
+        scenes = self.query(box, start_ms, end_ms, cloud_cover_max)
+        self.lookups += 1
+        return (scenes[0] if scenes else None), len(scenes)
+
+    def stats(self):
+        with self._connect() as conn:
+            scenes = conn.execute('SELECT COUNT(*) FROM scenes').fetchone()[0]
+            cells = conn.execute('SELECT COUNT(DISTINCT cell_x || \',\' || cell_y) FROM coverage').fetchone()[0]
+        return {'scenes': scenes, 'cells': cells, 'lookups': self.lookups, 'syncs': self.syncs}
+
+
+_default_catalog = None
+_default_catalog_lock = threading.Lock()
+
+
+def get_scene_catalog():
+    """Devuelve el SceneCatalog compartido por el proceso."""
+    global _default_catalog
+    with _default_catalog_lock:
+        if _default_catalog is None:
+            _default_catalog = SceneCatalog()
+        return _default_catalog
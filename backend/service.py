@@ -0,0 +1,416 @@
+# backend/service.py
+# Servicio HTTP asíncrono (ASGI, Starlette + uvicorn) sin UI para integraciones
+# (ERP, scripts): recibe un AOI GeoJSON (o centro + radio) y un período,
+# encola el informe en un JobManager propio y devuelve el id del job; el PDF y
+# los PNG de los mapas se sirven en streaming cuando el job termina, igual que
+# el export opcional de los rásters de índices (COG o .npy).
+#
+# Límites configurables: tamaño del cuerpo, área del AOI, jobs simultáneos
+# (workers del pool) y jobs pendientes: con la cola llena se responde 429 con
+# Retry-After en vez de encolar sin límite (contrapresión).
+#
+# Uso:
+#   python -m backend.service --port 8080 --workers 4 --max-pending 32
+#   curl -X POST localhost:8080/v1/reports -d '{"aoi": {...}, "start_date": "2025-01-01", "end_date": "2025-03-31"}'
+#   curl localhost:8080/v1/reports/<job_id>
+#   curl -o informe.pdf localhost:8080/v1/reports/<job_id>/pdf
+#   curl -o indices.tif localhost:8080/v1/reports/<job_id>/export   # con "export": "cog" en el envío
+#
+# Para probarlo sin GEE: benchmarks/load_test.py lo levanta en proceso contra
+# el backend simulado de benchmarks.fake_ee.
+import argparse
+import contextlib
+import json
+import os
+import re
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from backend import jobs
+from backend import report_pipeline
+from utils import ee_client
+from utils import index_registry
+from utils import raster_export
+from utils import storage
+from utils import tracing
+
+SERVICE_HOST = os.environ.get('GEOINFORME_SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.environ.get('GEOINFORME_SERVICE_PORT', 8080))
+SERVICE_WORKERS = int(os.environ.get('GEOINFORME_SERVICE_WORKERS', jobs.MAX_WORKERS))  # informes en paralelo
+MAX_PENDING_JOBS = int(os.environ.get('GEOINFORME_SERVICE_MAX_PENDING', 32))  # en cola + corriendo
+MAX_BODY_BYTES = int(os.environ.get('GEOINFORME_SERVICE_MAX_BODY_BYTES', 2 * 1024 * 1024))
+MAX_AOI_KM2 = float(os.environ.get('GEOINFORME_SERVICE_MAX_AOI_KM2', 5000))
+RETRY_AFTER_SECONDS = int(os.environ.get('GEOINFORME_SERVICE_RETRY_AFTER_SECONDS', 5))
+STREAM_CHUNK_BYTES = 64 * 1024
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+TARGET_RESOLUTIONS_M = (10, 20)
+
+
+class RequestError(Exception):
+    """Envío inválido o rechazado; se responde con `status` y el mensaje como JSON."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+def _json(data, status=200, headers=None):
+    # default=str: la metadata de los resultados puede traer fechas o numpy
+    body = json.dumps(data, default=str, ensure_ascii=False).encode('utf-8')
+    return Response(body, status_code=status, media_type='application/json', headers=headers)
+
+
+def _error(status, message, headers=None):
+    return _json({'error': message}, status, headers)
+
+
+def _parse_date(payload, field, required=True):
+    value = payload.get(field)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not DATE_PATTERN.match(value):
+        raise RequestError(400, f"'{field}' debe ser una fecha YYYY-MM-DD")
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise RequestError(400, f"'{field}' no es una fecha válida: {value}")
+    return value
+
+
+def parse_submission(payload):
+    """
+    Valida el cuerpo de POST /v1/reports y lo traduce a los argumentos de
+    report_pipeline.generate_report: (aoi_type, aoi_params, start_date,
+    end_date, cloud_cover_max, options). Lanza RequestError(400) si no es válido.
+
+    {"aoi": <GeoJSON Feature/FeatureCollection/Geometry> | {"lat", "lon", "radius_km"},
+     "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD", "cloud_cover_max": 20,
+     "indices": ["ndvi", ...], "timeseries": false, "target_resolution_m": 10 | 20,
+     "baseline_start": "YYYY-MM-DD", "baseline_end": "YYYY-MM-DD", "export": "cog" | "npy"}
+    """
+    if not isinstance(payload, dict):
+        raise RequestError(400, "El cuerpo debe ser un objeto JSON")
+    aoi = payload.get('aoi')
+    if not isinstance(aoi, dict):
+        raise RequestError(400, "'aoi' es obligatorio (GeoJSON o {lat, lon, radius_km})")
+    if 'type' in aoi:
+        aoi_type, aoi_params = 'geojson', {'geojson_string': json.dumps(aoi)}
+    elif all(k in aoi for k in ('lat', 'lon', 'radius_km')):
+        try:
+            aoi_type, aoi_params = 'coords', {k: float(aoi[k]) for k in ('lat', 'lon', 'radius_km')}
+        except (TypeError, ValueError):
+            raise RequestError(400, "'lat', 'lon' y 'radius_km' deben ser números")
+    else:
+        raise RequestError(400, "'aoi' debe ser GeoJSON (con 'type') o {lat, lon, radius_km}")
+
+    start_date, end_date = _parse_date(payload, 'start_date'), _parse_date(payload, 'end_date')
+    if start_date > end_date:
+        raise RequestError(400, "'start_date' debe ser anterior a 'end_date'")
+    cloud_cover_max = payload.get('cloud_cover_max', report_pipeline.DEFAULT_CLOUD_COVER_MAX)
+    if isinstance(cloud_cover_max, bool) or not isinstance(cloud_cover_max, (int, float)) or not 0 <= cloud_cover_max <= 100:
+        raise RequestError(400, "'cloud_cover_max' debe ser un número entre 0 y 100")
+
+    # Mismas opciones (y misma forma) que arma la UI, así comparten clave de caché
+    options = {}
+    if payload.get('timeseries'):
+        options['timeseries'] = True
+    indices = payload.get('indices')
+    if indices is not None:
+        if not isinstance(indices, list) or not indices or not all(isinstance(k, str) for k in indices):
+            raise RequestError(400, "'indices' debe ser una lista no vacía de claves de índice")
+        try:
+            indices = index_registry.resolve_keys(indices)
+        except ValueError as e:
+            raise RequestError(400, str(e))
+        if indices != index_registry.DEFAULT_INDICES:
+            options['indices'] = indices
+    baseline_start = _parse_date(payload, 'baseline_start', required=False)
+    baseline_end = _parse_date(payload, 'baseline_end', required=False)
+    if bool(baseline_start) != bool(baseline_end):
+        raise RequestError(400, "'baseline_start' y 'baseline_end' van juntos")
+    if baseline_start:
+        if baseline_start >= baseline_end:
+            raise RequestError(400, "El período previo debe terminar después de empezar")
+        options['baseline_start'], options['baseline_end'] = baseline_start, baseline_end
+    target_resolution_m = payload.get('target_resolution_m')
+    if target_resolution_m is not None:
+        if target_resolution_m not in TARGET_RESOLUTIONS_M:
+            raise RequestError(400, f"'target_resolution_m' debe ser uno de {list(TARGET_RESOLUTIONS_M)}")
+        options['target_resolution_m'] = target_resolution_m
+    export_format = payload.get('export')
+    if export_format is not None:
+        if export_format not in raster_export.EXPORT_FORMATS:
+            raise RequestError(400, f"'export' debe ser uno de {list(raster_export.EXPORT_FORMATS)}")
+        if export_format not in raster_export.available_formats():
+            raise RequestError(400, f"El export '{export_format}' no está disponible en este servidor (falta rasterio)")
+        options['export_format'] = export_format
+    return aoi_type, aoi_params, start_date, end_date, cloud_cover_max, options
+
+
+def check_aoi(aoi_type, aoi_params, max_aoi_km2=MAX_AOI_KM2):
+    """Recrea el AOI en el cliente (sin GEE) para rechazar geometrías inválidas o demasiado grandes antes de encolar."""
+    try:
+        aoi = report_pipeline.build_aoi_geometry(aoi_type, aoi_params)
+    except report_pipeline.ReportError as e:
+        raise RequestError(400, str(e))
+    except (KeyError, TypeError, ValueError) as e:
+        raise RequestError(400, f"AOI inválido: {e}")
+    area_km2 = aoi.area_m2 / 1e6
+    if area_km2 > max_aoi_km2:
+        raise RequestError(413, f"AOI de {area_km2:.0f} km² supera el máximo de {max_aoi_km2:.0f} km²")
+    return aoi
+
+
+async def _read_body(request, max_bytes):
+    """Lee el cuerpo cortando apenas supera max_bytes (no confía solo en Content-Length)."""
+    declared = request.headers.get('content-length')
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise RequestError(413, f"El cuerpo supera el máximo de {max_bytes} bytes")
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise RequestError(413, f"El cuerpo supera el máximo de {max_bytes} bytes")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def _iter_bytes(data, chunk_size=STREAM_CHUNK_BYTES):
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
+
+
+def _links(job_id):
+    base = f'/v1/reports/{job_id}'
+    return {'status': base, 'pdf': f'{base}/pdf', 'map': f'{base}/maps/{{key}}.png', 'export': f'{base}/export'}
+
+
+def _public_export(export):
+    """Descripción del export para el cliente, sin rutas locales del servidor."""
+    if not export:
+        return None
+    return {k: v for k, v in export.items() if k not in ('path', 'metadata_path')}
+
+
+def _finished_job(request):
+    """Job terminado con éxito de la ruta, o RequestError (404 si no existe, 409 si no está listo)."""
+    job = request.app.state.manager.get(request.path_params['job_id'])
+    if job is None:
+        raise RequestError(404, "Job inexistente o vencido")
+    if job.status != jobs.STATUS_DONE:
+        raise RequestError(409, f"El job está '{job.status}'" + (f": {job.error}" if job.error else ''))
+    return job
+
+
+async def submit_report(request):
+    """POST /v1/reports: valida, aplica contrapresión y encola. 202 con el id del job."""
+    state = request.app.state
+    try:
+        body = await _read_body(request, state.max_body_bytes)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise RequestError(400, "El cuerpo no es JSON válido")
+        aoi_type, aoi_params, start_date, end_date, cloud_cover_max, options = parse_submission(payload)
+        await run_in_threadpool(check_aoi, aoi_type, aoi_params, state.max_aoi_km2)
+    except RequestError as e:
+        return _error(e.status, str(e), e.headers)
+    except ClientDisconnect:
+        return Response(status_code=400)
+
+    manager = state.manager
+    dedup_key = report_pipeline.report_cache_key(aoi_type, aoi_params, start_date, end_date, cloud_cover_max, options)
+    # Sin await entre el chequeo y el submit: en el event loop no hay carrera entre envíos
+    active = manager.active_count()
+    if active >= state.max_pending:
+        state.rejected += 1
+        return _error(429, f"Cola llena ({active} jobs pendientes); reintenta más tarde",
+                      headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+    job_id = manager.submit(report_pipeline.generate_report, aoi_type, aoi_params, start_date, end_date, cloud_cover_max,
+                            options=options, dedup_key=dedup_key)
+    state.submitted += 1
+    return _json({'job_id': job_id, 'status': manager.status(job_id)['status'], 'links': _links(job_id)}, 202,
+                 headers={'Location': _links(job_id)['status']})
+
+
+async def report_status(request):
+    """GET /v1/reports/{job_id}: progreso; al terminar incluye metadata, estadísticas y mapas disponibles."""
+    job = request.app.state.manager.get(request.path_params['job_id'])
+    if job is None:
+        return _error(404, "Job inexistente o vencido")
+    status = job.to_dict()
+    if job.status == jobs.STATUS_DONE:
+        result = job.result
+        results = result['results']
+        status.update({
+            'from_cache': result['from_cache'],
+            'pdf_filename': result['pdf_filename'],
+            'metadata': results.get('metadata'),
+            'stats': results.get('stats'),
+            'change': results.get('change'),
+            'export': _public_export(results.get('export')),
+            'maps': sorted(set(results.get('images') or {}) | set(results.get('image_paths') or {})),
+            'links': _links(job.id),
+        })
+    return _json(status)
+
+
+async def report_pdf(request):
+    """GET /v1/reports/{job_id}/pdf: el PDF en streaming por bloques."""
+    try:
+        job = _finished_job(request)
+    except RequestError as e:
+        return _error(e.status, str(e))
+    pdf_bytes = job.result['pdf_bytes']
+    return StreamingResponse(_iter_bytes(pdf_bytes), media_type='application/pdf', headers={
+        'Content-Length': str(len(pdf_bytes)),
+        'Content-Disposition': f'attachment; filename="{job.result["pdf_filename"]}"',
+    })
+
+
+async def report_map(request):
+    """GET /v1/reports/{job_id}/maps/{key}: PNG de un mapa (en memoria o del caché en disco)."""
+    try:
+        job = _finished_job(request)
+    except RequestError as e:
+        return _error(e.status, str(e))
+    key = request.path_params['key']
+    if key.endswith('.png'):
+        key = key[:-len('.png')]
+    results = job.result['results']
+    png_bytes = (results.get('images') or {}).get(key)
+    if png_bytes is not None:
+        return StreamingResponse(_iter_bytes(png_bytes), media_type='image/png',
+                                 headers={'Content-Length': str(len(png_bytes))})
+    path = (results.get('image_paths') or {}).get(key)
+    if path and os.path.exists(path):
+        return FileResponse(path, media_type='image/png')
+    return _error(404, f"El informe no tiene el mapa '{key}'")
+
+
+async def report_export(request):
+    """GET /v1/reports/{job_id}/export: el ráster de índices exportado (COG o .npy), leído del disco por bloques."""
+    try:
+        job = _finished_job(request)
+    except RequestError as e:
+        return _error(e.status, str(e))
+    export = job.result['results'].get('export') or {}
+    if export.get('error'):
+        return _error(409, f"El export falló: {export['error']}")
+    path = export.get('path')
+    if not path or not os.path.exists(path):
+        return _error(404, "El informe no tiene export (se pide con \"export\" en el envío) o ya venció")
+    media_type = 'image/tiff; application=geotiff; profile=cloud-optimized' if export['format'] == 'cog' else 'application/octet-stream'
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+
+async def cancel_report(request):
+    """
+    DELETE /v1/reports/{job_id}: da de baja a este cliente. El job se cancela
+    (inmediato en cola, cooperativo si ya corre) solo si nadie más lo espera:
+    los envíos idénticos deduplicados comparten el mismo job.
+    """
+    manager = request.app.state.manager
+    job_id = request.path_params['job_id']
+    job = manager.get(job_id)
+    if job is None:
+        return _error(404, "Job inexistente o vencido")
+    if job.finished:
+        return _error(409, f"El job ya terminó ('{job.status}')")
+    cancelled = manager.cancel(job_id)
+    status = manager.status(job_id)
+    return _json({'job_id': job_id, 'cancel_requested': cancelled, 'status': status['status'],
+                  'subscribers': status['subscribers']}, 202)
+
+
+async def health(request):
+    state = request.app.state
+    return _json({
+        'status': 'ok',
+        'ee': ee_client.health_status()['state'],
+        'active_jobs': state.manager.active_count(),
+        'max_pending': state.max_pending,
+        'workers': state.manager.max_workers,
+    })
+
+
+async def metrics(request):
+    """Métricas de spans del pipeline (utils.tracing) más el estado de la cola del servicio."""
+    state = request.app.state
+    lines = [
+        '# HELP geoinforme_service_active_jobs Jobs en cola o corriendo.',
+        '# TYPE geoinforme_service_active_jobs gauge',
+        f'geoinforme_service_active_jobs {state.manager.active_count()}',
+        '# HELP geoinforme_service_submitted_total Informes encolados.',
+        '# TYPE geoinforme_service_submitted_total counter',
+        f'geoinforme_service_submitted_total {state.submitted}',
+        '# HELP geoinforme_service_rejected_total Envíos rechazados por cola llena (429).',
+        '# TYPE geoinforme_service_rejected_total counter',
+        f'geoinforme_service_rejected_total {state.rejected}',
+    ]
+    body = tracing.metrics.render_prometheus() + '\n'.join(lines) + '\n'
+    return Response(body, media_type='text/plain; version=0.0.4')
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    ee_client.start_health_check() # ee.Initialize() en segundo plano; /healthz muestra su estado
+    storage.start_gc() # Borra los workspaces de jobs vencidos (nunca los activos)
+    yield
+    app.state.manager.shutdown(wait=False)
+
+
+def create_app(manager=None, max_pending=MAX_PENDING_JOBS, max_body_bytes=MAX_BODY_BYTES, max_aoi_km2=MAX_AOI_KM2,
+               workers=SERVICE_WORKERS):
+    """
+    Arma la aplicación ASGI. Usa un JobManager propio (su pool de `workers`
+    es el tope de informes en paralelo), separado del de la UI.
+    """
+    app = Starlette(routes=[
+        Route('/v1/reports', submit_report, methods=['POST']),
+        Route('/v1/reports/{job_id}', report_status, methods=['GET']),
+        Route('/v1/reports/{job_id}', cancel_report, methods=['DELETE']),
+        Route('/v1/reports/{job_id}/pdf', report_pdf, methods=['GET']),
+        Route('/v1/reports/{job_id}/maps/{key}', report_map, methods=['GET']),
+        Route('/v1/reports/{job_id}/export', report_export, methods=['GET']),
+        Route('/healthz', health, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ], lifespan=lifespan)
+    app.state.manager = manager or jobs.JobManager(max_workers=workers)
+    app.state.max_pending = max_pending
+    app.state.max_body_bytes = max_body_bytes
+    app.state.max_aoi_km2 = max_aoi_km2
+    app.state.submitted = 0
+    app.state.rejected = 0
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GeoInforme Express - servicio HTTP de informes.")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="Informes procesados en paralelo")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING_JOBS,
+                        help="Jobs en cola + corriendo antes de responder 429")
+    parser.add_argument('--max-body-bytes', type=int, default=MAX_BODY_BYTES)
+    parser.add_argument('--max-aoi-km2', type=float, default=MAX_AOI_KM2)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    app = create_app(max_pending=args.max_pending, max_body_bytes=args.max_body_bytes, max_aoi_km2=args.max_aoi_km2,
+                     workers=args.workers)
+    tracing.start_metrics_server() # Solo si GEOINFORME_METRICS_PORT está definido (además de /metrics del servicio)
+    print(f"Servicio de informes en http://{args.host}:{args.port} ({args.workers} workers, cola máx. {args.max_pending})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+# backend/timeseries.py
+# Serie temporal de índices: calcula los índices del informe + reduceRegion para TODAS
+# las escenas Sentinel-2 filtradas, en el servidor, y trae las estadísticas
+# por fecha en un único getInfo().
+import ee
+
+from backend.ee_batch import evaluate_batch
+from utils import ee_client
+from utils import index_registry
+
+S2_COLLECTION = 'COPERNICUS/S2_SR_HARMONIZED'
+DEFAULT_SCALE = 30        # m/píxel para la reducción; 10 m es innecesario para una media
+DEFAULT_MAX_PIXELS = 1e9
+MAX_SCENES = 500          # tope de seguridad para la lista devuelta
+
+# Clases SCL que se enmascaran: sombra de nube, nube media/alta, cirros
+SCL_MASK_CLASSES = [3, 8, 9, 10]
+
+
+def _scene_statistics(aoi, scale, max_pixels, index_keys=None):
+    """Devuelve la función (ee.Image -> ee.Feature) mapeada sobre la colección."""
+    def per_scene(image):
+        scl = image.select('SCL')
+        clear = scl.remap(SCL_MASK_CLASSES, [0] * len(SCL_MASK_CLASSES), 1)
+        indices = index_registry.build_ee_stack(image, index_keys).updateMask(clear)
+        stats = indices.reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=aoi,
+            scale=scale,
+            maxPixels=max_pixels,
+            bestEffort=True,
+        )
+        return ee.Feature(None, stats).set({
+            'date': image.date().format('YYYY-MM-dd'),
+            'cloud_cover': image.get('CLOUDY_PIXEL_PERCENTAGE'),
+        })
+    return per_scene
+
+
+def compute_index_timeseries(aoi, start_date, end_date, cloud_cover_max=20, scale=DEFAULT_SCALE,
+                             max_pixels=DEFAULT_MAX_PIXELS, counter=None, index_keys=None):
+    """
+    Estadísticas (media en el AOI) de cada índice (`index_keys`, por defecto
+    los de utils.index_registry.DEFAULT_INDICES) para cada fecha con escenas.
+    Todo el cálculo corre en GEE y se resuelve en un solo round trip.
+    Devuelve una lista ordenada por fecha de
+    {'date', 'NDVI', 'NDWI', 'NBR', 'cloud_cover', 'scenes'}; las escenas del
+    mismo día (varios tiles MGRS) se promedian.
+    """
+    ee_client.ensure_initialized()
+    collection = ee.ImageCollection(S2_COLLECTION) \
+        .filterBounds(aoi) \
+        .filterDate(start_date, end_date) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_cover_max)) \
+        .sort('system:time_start') \
+        .limit(MAX_SCENES)
+
+    index_names = [index_registry.get_index(key).name for key in index_registry.resolve_keys(index_keys)]
+    per_scene = collection.map(_scene_statistics(aoi, scale, max_pixels, index_keys))
+    # toDictionary por escena: un índice sin píxeles válidos (todo nube) queda
+    # ausente o nulo en vez de descartar la fila completa
+    info = evaluate_batch({
+        'rows': per_scene.toList(MAX_SCENES).map(lambda f: ee.Feature(f).toDictionary()),
+    }, 'timeseries', counter)
+
+    by_date = {}
+    for record in info['rows'] or []:
+        by_date.setdefault(record['date'], []).append(record)
+
+    series = []
+    for date in sorted(by_date):
+        records = by_date[date]
+        entry = {'date': date, 'scenes': len(records),
+                 'cloud_cover': sum(r.get('cloud_cover', 0) for r in records) / len(records)}
+        for name in index_names:
+            values = [r[name] for r in records if r.get(name) is not None]
+            entry[name] = sum(values) / len(values) if values else None
+        series.append(entry)
+    print(f"Serie temporal: {len(series)} fechas con datos entre {start_date} y {end_date}.")
+    return series
@@ -0,0 +1,174 @@
+# backend/zonal_stats.py
+# Estadísticas zonales de todos los índices en una sola llamada: los índices
+# (y sus máscaras de umbral) se apilan en una imagen y se reducen con un único
+# reductor combinado (media, desviación, percentiles); los histogramas (cada
+# índice en su value_range, reescalado a [0, 1]) van en el mismo round trip.
+# Incluye un equivalente local en NumPy para cuando ya se tienen los arrays
+# (motor local) o la reducción en el servidor falla.
+import os
+
+import ee
+import numpy as np
+
+from backend.ee_batch import evaluate_batch
+from utils import geometry as geometry_utils
+from utils import index_registry
+from utils.local_engine import region_extent
+
+DEFAULT_SCALE = int(os.environ.get('GEOINFORME_STATS_SCALE', 20))  # m/píxel
+DEFAULT_MAX_PIXELS = float(os.environ.get('GEOINFORME_STATS_MAX_PIXELS', 1e9))
+PERCENTILES = [10, 25, 50, 75, 90]
+HISTOGRAM_BINS = 20
+# Umbrales y rangos del histograma por índice se leen de utils.index_registry en cada llamada:
+# un índice registrado después de importar este módulo funciona igual que los de fábrica
+HISTOGRAM_UNIT_MAX = 1 - 1e-6  # fixedHistogram excluye el máximo: el valor tope cae en el último bin
+
+M2_PER_HA = 10000.0
+
+
+def combined_reducer():
+    """Un solo reductor: media + desviación + percentiles."""
+    return ee.Reducer.mean() \
+        .combine(ee.Reducer.stdDev(), sharedInputs=True) \
+        .combine(ee.Reducer.percentile(PERCENTILES), sharedInputs=True)
+
+
+def stacked_index_image(image, thresholds=None, index_keys=None):
+    """Imagen multibanda con cada índice y su indicador (0/1) <ÍNDICE>_above."""
+    thresholds = thresholds or index_registry.thresholds(index_keys)
+    bands = []
+    for key, index in index_registry.build_ee_indices(image, index_keys).items():
+        name = index_registry.get_index(key).name
+        bands.append(index)
+        bands.append(index.gt(thresholds[name]).rename(f'{name}_above'))
+    return ee.Image.cat(bands)
+
+
+def unit_histogram_image(image, index_keys=None):
+    """
+    Cada índice llevado de su value_range a [0, 1] (recortado a los extremos),
+    para un solo fixedHistogram(0, 1) sobre todos aunque sus rangos difieran.
+    """
+    ranges = index_registry.value_ranges(index_keys)
+    bands = []
+    for key, index in index_registry.build_ee_indices(image, index_keys).items():
+        name = index_registry.get_index(key).name
+        low, high = ranges[name]
+        bands.append(index.unitScale(low, high).clamp(0, HISTOGRAM_UNIT_MAX).rename(name))
+    return ee.Image.cat(bands)
+
+
+def local_histogram(values, value_range):
+    """Histograma de `values` en value_range; los valores fuera del rango caen en los bins de los extremos."""
+    counts, edges = np.histogram(np.clip(values, *value_range), bins=HISTOGRAM_BINS, range=value_range)
+    return {'bins': edges[:-1].tolist(), 'counts': counts.tolist()}
+
+
+def _parse_server_stats(raw, histograms, aoi_area_m2, thresholds, index_keys=None):
+    ranges = index_registry.value_ranges(index_keys)
+    stats = {}
+    for name in (index_registry.get_index(key).name for key in index_registry.resolve_keys(index_keys)):
+        if raw.get(f'{name}_mean') is None:
+            stats[name] = None # Sin píxeles válidos en el AOI
+            continue
+        histogram = histograms.get(name) or []
+        low, high = ranges[name]
+        fraction_above = raw.get(f'{name}_above_mean') or 0.0
+        stats[name] = {
+            'mean': raw[f'{name}_mean'],
+            'std': raw.get(f'{name}_stdDev'),
+            'percentiles': {f'p{p}': raw.get(f'{name}_p{p}') for p in PERCENTILES},
+            # Los bins vienen en [0, 1] (unit_histogram_image): se devuelven en la escala del índice
+            'histogram': {'bins': [low + row[0] * (high - low) for row in histogram],
+                          'counts': [row[1] for row in histogram]},
+            'threshold': thresholds[name],
+            'fraction_above': fraction_above,
+            'area_above_ha': fraction_above * aoi_area_m2 / M2_PER_HA,
+        }
+    return stats
+
+
+def compute_zonal_stats(image, aoi, scale=DEFAULT_SCALE, max_pixels=DEFAULT_MAX_PIXELS, thresholds=None, counter=None,
+                        aoi_area_m2=None, index_keys=None):
+    """
+    Estadísticas de los índices `index_keys` (por defecto NDVI/NDWI/NBR) sobre
+    el AOI en UN round trip: una reduceRegion con el reductor combinado más el
+    área del AOI, batched; el costo no crece con la cantidad de índices.
+    Si se pasa `aoi_area_m2` (calculada en el cliente) el área no se pide a GEE.
+    Devuelve {'NDVI': {...}, 'NDWI': {...}, 'NBR': {...}, 'aoi_area_ha': ...}.
+    """
+    thresholds = thresholds or index_registry.thresholds(index_keys)
+    reduced = stacked_index_image(image, thresholds, index_keys).reduceRegion(
+        reducer=combined_reducer(),
+        geometry=aoi,
+        scale=scale,
+        maxPixels=max_pixels,
+        bestEffort=True,
+    )
+    histograms = unit_histogram_image(image, index_keys).reduceRegion(
+        reducer=ee.Reducer.fixedHistogram(0, 1, HISTOGRAM_BINS),
+        geometry=aoi,
+        scale=scale,
+        maxPixels=max_pixels,
+        bestEffort=True,
+    )
+    values = {'stats': reduced, 'histograms': histograms}
+    if aoi_area_m2 is None:
+        values['aoi_area'] = aoi.area(maxError=1)
+    info = evaluate_batch(values, 'zonal_stats', counter)
+    aoi_area = aoi_area_m2 if aoi_area_m2 is not None else info['aoi_area']
+    stats = _parse_server_stats(info['stats'], info['histograms'], aoi_area, thresholds, index_keys)
+    stats['aoi_area_ha'] = aoi_area / M2_PER_HA
+    stats['source'] = 'server'
+    return stats
+
+
+def pixel_area_m2(region, width, height):
+    """Área aproximada (m²) de un píxel del grid EPSG:4326 usado por el motor local."""
+    xmin, ymin, xmax, ymax = region_extent(region)
+    lat_center = np.radians((ymin + ymax) / 2)
+    dx_m = (xmax - xmin) / width * 111320.0 * np.cos(lat_center)
+    dy_m = (ymax - ymin) / height * 110540.0
+    return float(dx_m * dy_m)
+
+
+def aoi_mask(geometry, region, width, height):
+    """Máscara (height, width) del polígono del AOI sobre el grid de bounds del motor local."""
+    return geometry_utils.rasterize(geometry, region_extent(region), width, height)
+
+
+def compute_zonal_stats_local(indices, pixel_area, thresholds=None, mask=None, aoi_area_m2=None, value_ranges=None):
+    """
+    Equivalente NumPy de compute_zonal_stats sobre arrays ya descargados.
+    `indices` es {clave: array float con NaN como sin datos}, sobre el grid
+    de los bounds del AOI; `mask` (ver aoi_mask) deja solo los píxeles dentro
+    del polígono, como el clip de reduceRegion. El área del AOI es
+    `aoi_area_m2` si se pasa, si no la de los píxeles de la máscara.
+    Umbrales y rangos del histograma ({NOMBRE: ...}) salen del registro si no
+    se pasan (las claves de `indices` son entonces claves del registro).
+    """
+    thresholds = thresholds or index_registry.thresholds(list(indices))
+    value_ranges = value_ranges or index_registry.value_ranges(list(indices))
+    if mask is None:
+        mask = np.ones(next(iter(indices.values())).shape, dtype=bool)
+    aoi_area = aoi_area_m2 if aoi_area_m2 is not None else int(mask.sum()) * pixel_area
+    stats = {}
+    for key, values in indices.items():
+        name = key.upper()
+        valid = values[mask & np.isfinite(values)]
+        if valid.size == 0:
+            stats[name] = None
+            continue
+        fraction_above = float(np.mean(valid > thresholds[name]))
+        stats[name] = {
+            'mean': float(valid.mean()),
+            'std': float(valid.std()),
+            'percentiles': {f'p{p}': float(v) for p, v in zip(PERCENTILES, np.percentile(valid, PERCENTILES))},
+            'histogram': local_histogram(valid, value_ranges[name]),
+            'threshold': thresholds[name],
+            'fraction_above': fraction_above,
+            'area_above_ha': fraction_above * aoi_area / M2_PER_HA, # Igual que en el servidor
+        }
+    stats['aoi_area_ha'] = aoi_area / M2_PER_HA
+    stats['source'] = 'local'
+    return stats
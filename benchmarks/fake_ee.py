@@ -0,0 +1,671 @@
+# benchmarks/fake_ee.py
+# Doble en proceso de la API de Earth Engine que usa el proyecto
+# (ImageCollection con filtros/orden, normalizedDifference, expression, visualize,
+# reduceRegion, getThumbURL, getInfo, bounds/área de geometrías y
+# ee.data.computePixels). Cada llamada remota duerme una latencia configurable
+# y queda contada; las miniaturas se sirven como PNG sintéticos a través de un
+# adaptador HTTP montado en la sesión compartida, sin red.
+#
+# Uso (antes de importar cualquier módulo de la app):
+#   from benchmarks import fake_ee
+#   fake_ee.install(call_latency=0.2, download_latency=0.1)
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import types
+import zlib
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from urllib.parse import parse_qs, urlparse
+
+FAKE_URL_PREFIX = 'https://fake-ee.invalid/'
+S2_BANDS = ['B2', 'B3', 'B4', 'B5', 'B8', 'B11', 'B12', 'SCL']
+REFLECTANCE_BANDS = set(S2_BANDS) - {'SCL'}
+
+# Valor medio sintético por banda reducida (el resto de bandas usa DEFAULT_BAND_MEAN)
+BAND_MEANS = {'NDVI': 0.45, 'NDWI': -0.15, 'NBR': 0.3, 'SAVI': 0.3, 'EVI': 0.35, 'NDMI': 0.1,
+              'GNDVI': 0.4, 'NDRE': 0.25, 'NBR2': 0.05, 'NDBI': -0.1, 'nd': 0.3}
+ABOVE_FRACTION = 0.35
+# Footprint de todas las escenas sintéticas (filterBounds acepta cualquier AOI)
+WORLD_FOOTPRINT = {'type': 'LinearRing', 'coordinates': [[-180, -90], [180, -90], [180, 90], [-180, 90], [-180, -90]]}
+DEFAULT_BAND_MEAN = 0.2
+# Bandas de máscara (1 = dato válido) pedidas por computePixels, p. ej. la de utils.local_engine.MASK_BAND
+MASK_BANDS = {'valid'}
+# Nube sintética de cada grilla de computePixels: círculo (centro y radio en fracción del lado) enmascarado
+CLOUD_CENTER, CLOUD_RADIUS = (0.25, 0.25), 0.1
+
+
+class EEException(Exception):
+    """Equivalente de ee.EEException."""
+
+
+class FakeBackend:
+    """
+    Estado del servidor simulado: catálogo de escenas, latencias y conteo de
+    llamadas remotas por tipo (getInfo, getThumbURL, computePixels, download).
+    """
+
+    def __init__(self, call_latency=0.2, download_latency=0.1, jitter=0.0, scene_interval_days=5, seed=0):
+        self.call_latency = call_latency
+        self.download_latency = download_latency
+        self.jitter = jitter
+        self.initialized = False
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.scenes = self._build_catalog(scene_interval_days, seed)
+
+    @staticmethod
+    def _build_catalog(interval_days, seed):
+        """Escenas S2 sintéticas cada `interval_days` días entre 2023 y 2027."""
+        rng = random.Random(seed)
+        scenes = []
+        day = datetime(2023, 1, 1, 14, 30, tzinfo=timezone.utc)
+        while day.year < 2027:
+            scenes.append({
+                'system:id': f"COPERNICUS/S2_SR_HARMONIZED/{day:%Y%m%dT%H%M%S}_{day:%Y%m%dT%H%M%S}_T19HCC",
+                'system:time_start': int(day.timestamp() * 1000),
+                'CLOUDY_PIXEL_PERCENTAGE': round(rng.uniform(0, 60), 2),
+                'system:footprint': WORLD_FOOTPRINT,
+            })
+            day += timedelta(days=interval_days)
+        return scenes
+
+    def scene(self, image_id):
+        for scene in self.scenes:
+            if scene['system:id'] == image_id:
+                return scene
+        raise EEException(f"Image.load: Image asset '{image_id}' not found.")
+
+    def remote_call(self, kind, latency=None):
+        """Simula un round trip: duerme la latencia (con jitter) y lo cuenta."""
+        latency = self.call_latency if latency is None else latency
+        if self.jitter:
+            with self._lock:
+                latency += self._random.uniform(0, self.jitter)
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+        if latency > 0:
+            time.sleep(latency)
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls = {}
+
+    def counts(self):
+        with self._lock:
+            return dict(self.calls)
+
+
+backend = FakeBackend()
+
+
+def _resolve(value):
+    """Evalúa recursivamente objetos perezosos dentro de dicts/listas."""
+    if isinstance(value, ComputedObject):
+        return value._evaluate()
+    if isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(item) for item in value]
+    return value
+
+
+class ComputedObject:
+    """Nodo perezoso: su valor se calcula recién en getInfo() (un round trip)."""
+
+    def __init__(self, evaluate=None):
+        self._evaluate_fn = evaluate
+
+    def _evaluate(self):
+        return _resolve(self._evaluate_fn())
+
+    def getInfo(self):
+        backend.remote_call('getInfo')
+        return self._evaluate()
+
+
+class Number(ComputedObject):
+    def __init__(self, value):
+        super().__init__(lambda: value)
+
+
+class String(ComputedObject):
+    def __init__(self, value):
+        super().__init__(lambda: value)
+
+
+class Dictionary(ComputedObject):
+    def __init__(self, values=None):
+        super().__init__(lambda: values or {})
+
+
+class List(ComputedObject):
+    def __init__(self, items):
+        super().__init__(lambda: items() if callable(items) else items)
+
+    def map(self, fn):
+        # En GEE la función corre en el servidor; aquí se aplica al evaluar
+        return List(lambda: [fn(item) for item in self._evaluate_fn()])
+
+    def size(self):
+        return Number(len(self._evaluate_fn()))
+
+
+class Date(ComputedObject):
+    def __init__(self, millis):
+        super().__init__(lambda: millis)
+        self._millis = millis
+
+    def format(self, fmt=None):
+        return String(datetime.fromtimestamp(self._millis / 1000, tz=timezone.utc).strftime('%Y-%m-%d'))
+
+    def millis(self):
+        return Number(self._millis)
+
+
+# --- Geometrías ---------------------------------------------------------------
+
+def _ring_area_m2(ring):
+    """Área aproximada de un anillo lon/lat (shoelace en metros locales)."""
+    if len(ring) < 3:
+        return 0.0
+    lat0 = math.radians(sum(p[1] for p in ring) / len(ring))
+    xs = [p[0] * 111320.0 * math.cos(lat0) for p in ring]
+    ys = [p[1] * 110540.0 for p in ring]
+    return abs(sum(xs[i] * ys[i + 1] - xs[i + 1] * ys[i] for i in range(len(ring) - 1))) / 2
+
+
+class Geometry(ComputedObject):
+    """Geometría en lon/lat guardada como lista de anillos (o un punto)."""
+
+    def __init__(self, geo_json=None, opt_proj=None, opt_geodesic=None, _rings=None, _type=None):
+        if _rings is None:
+            _type, _rings = self._parse(geo_json)
+        self._type = _type
+        self._rings = _rings
+        super().__init__(lambda: self.toGeoJSON())
+
+    @staticmethod
+    def _parse(geo_json):
+        if isinstance(geo_json, Geometry):
+            return geo_json._type, geo_json._rings
+        if not isinstance(geo_json, dict) or 'type' not in geo_json:
+            raise EEException(f"Invalid GeoJSON geometry: {geo_json!r}")
+        kind, coords = geo_json['type'], geo_json.get('coordinates')
+        if kind == 'Point':
+            return kind, [[list(coords)]]
+        if kind == 'Polygon':
+            return kind, [list(map(list, ring)) for ring in coords[:1]]
+        if kind == 'MultiPolygon':
+            return kind, [list(map(list, polygon[0])) for polygon in coords]
+        if kind == 'GeometryCollection':
+            rings = []
+            for item in geo_json.get('geometries', []):
+                rings.extend(Geometry._parse(item)[1])
+            return kind, rings
+        raise EEException(f"Unsupported geometry type: {kind}")
+
+    @staticmethod
+    def Point(coords, proj=None):
+        return Geometry(_rings=[[list(coords)]], _type='Point')
+
+    @staticmethod
+    def Polygon(coords, proj=None, geodesic=None, maxError=None, evenOdd=None):
+        return Geometry({'type': 'Polygon', 'coordinates': coords})
+
+    @staticmethod
+    def Rectangle(coords, proj=None, geodesic=None, evenOdd=None):
+        xmin, ymin, xmax, ymax = coords
+        return Geometry._box(xmin, ymin, xmax, ymax)
+
+    @staticmethod
+    def _box(xmin, ymin, xmax, ymax):
+        ring = [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]
+        return Geometry(_rings=[ring], _type='Polygon')
+
+    def _points(self):
+        return [p for ring in self._rings for p in ring]
+
+    def buffer(self, distance, maxError=None, proj=None):
+        lon, lat = self._points()[0] if self._type == 'Point' else self.centroid()._rings[0][0]
+        dlat = distance / 110540.0
+        dlon = distance / (111320.0 * math.cos(math.radians(lat)))
+        ring = [[lon + dlon * math.cos(2 * math.pi * i / 64), lat + dlat * math.sin(2 * math.pi * i / 64)]
+                for i in range(64)]
+        ring.append(ring[0])
+        return Geometry(_rings=[ring], _type='Polygon')
+
+    def centroid(self, maxError=None, proj=None):
+        points = self._points()
+        return Geometry.Point([sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)])
+
+    def bounds(self, maxError=None, proj=None):
+        points = self._points()
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        return Geometry._box(min(xs), min(ys), max(xs), max(ys))
+
+    def coordinates(self):
+        if self._type == 'Point':
+            return List(self._rings[0][0])
+        return List([ring for ring in self._rings])
+
+    def area(self, maxError=None, proj=None):
+        return Number(sum(_ring_area_m2(ring) for ring in self._rings))
+
+    def type(self):
+        return String(self._type)
+
+    def toGeoJSON(self):
+        if self._type == 'Point':
+            return {'type': 'Point', 'coordinates': self._rings[0][0]}
+        if len(self._rings) == 1:
+            return {'type': 'Polygon', 'coordinates': self._rings}
+        return {'type': 'MultiPolygon', 'coordinates': [[ring] for ring in self._rings]}
+
+
+geometry = types.SimpleNamespace(Geometry=Geometry)
+
+
+# --- Filtros y reductores -----------------------------------------------------
+
+class Filter:
+    def __init__(self, predicate):
+        self._predicate = predicate
+
+    @staticmethod
+    def lt(name, value):
+        return Filter(lambda props: props.get(name) is not None and props[name] < value)
+
+    @staticmethod
+    def gt(name, value):
+        return Filter(lambda props: props.get(name) is not None and props[name] > value)
+
+    @staticmethod
+    def eq(name, value):
+        return Filter(lambda props: props.get(name) == value)
+
+
+class Reducer:
+    """Reductor como lista de salidas ('mean', 'stdDev', 'p10', 'histogram'...)."""
+
+    def __init__(self, outputs, histogram=None):
+        self._outputs = outputs
+        self._histogram = histogram
+
+    @staticmethod
+    def mean():
+        return Reducer(['mean'])
+
+    @staticmethod
+    def stdDev():
+        return Reducer(['stdDev'])
+
+    @staticmethod
+    def min():
+        return Reducer(['min'])
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None, maxBuckets=None, minBucketWidth=None, maxRaw=None):
+        return Reducer(outputNames or [f'p{p}' for p in percentiles])
+
+    @staticmethod
+    def fixedHistogram(min, max, steps, cumulative=False):
+        return Reducer(['histogram'], histogram=(min, max, steps))
+
+    def combine(self, reducer2, outputPrefix=None, sharedInputs=False):
+        return Reducer(self._outputs + reducer2._outputs, self._histogram or reducer2._histogram)
+
+
+def _synthetic_output(band, output, seed, histogram):
+    """Valor sintético (determinista por escena) de un reductor sobre una banda."""
+    if band.endswith('_above'):
+        base = ABOVE_FRACTION
+    else:
+        base = BAND_MEANS.get(band, DEFAULT_BAND_MEAN)
+    base += ((seed % 97) / 97.0 - 0.5) * 0.1
+    if output == 'mean':
+        return base
+    if output == 'stdDev':
+        return 0.12
+    if output.startswith('p') and output[1:].isdigit():
+        return base + (int(output[1:]) - 50) / 100.0 * 0.4
+    if output == 'histogram':
+        low, high, steps = histogram
+        width = (high - low) / steps
+        return [[low + i * width, round(1000 * math.exp(-((low + (i + 0.5) * width - base) / 0.25) ** 2), 1)]
+                for i in range(steps)]
+    return base
+
+
+# --- Imágenes y colecciones ---------------------------------------------------
+
+class Image(ComputedObject):
+    """Imagen perezosa: conserva las bandas y propiedades de la escena de origen."""
+
+    def __init__(self, source=None, _bands=None, _props=None):
+        if isinstance(source, str):
+            _props = dict(backend.scene(source))
+            _bands = list(S2_BANDS)
+        elif isinstance(source, Image):
+            _props, _bands = source._props, source._bands
+        elif isinstance(source, (int, float)):
+            _props, _bands = {}, ['constant']
+        self._props = _props or {}
+        self._bands = _bands or list(S2_BANDS)
+        super().__init__(lambda: {'type': 'Image', 'bands': [{'id': b} for b in self._bands],
+                                  'properties': self._props})
+
+    def _derive(self, bands):
+        return Image(_bands=bands, _props=self._props)
+
+    @property
+    def _seed(self):
+        return zlib.crc32(str(self._props.get('system:id', '')).encode())
+
+    @staticmethod
+    def cat(*images):
+        if len(images) == 1 and isinstance(images[0], (list, tuple)):
+            images = images[0]
+        bands = [band for image in images for band in image._bands]
+        return Image(_bands=bands, _props=images[0]._props if images else {})
+
+    def select(self, selectors, opt_names=None):
+        bands = [selectors] if isinstance(selectors, str) else list(selectors)
+        return self._derive(opt_names or bands)
+
+    def normalizedDifference(self, bandNames=None):
+        missing = [b for b in bandNames or [] if b not in self._bands]
+        if missing:
+            raise EEException(f"Image.select: Pattern '{missing[0]}' did not match any bands.")
+        return self._derive(['nd'])
+
+    def expression(self, expression, opt_map=None):
+        return self._derive(['constant'])
+
+    def divide(self, value):
+        return self._derive(list(self._bands))
+
+    def subtract(self, image2):
+        return self._derive(list(self._bands))
+
+    def toFloat(self):
+        return self._derive(list(self._bands))
+
+    def rename(self, *names):
+        if len(names) == 1 and isinstance(names[0], (list, tuple)):
+            names = names[0]
+        return self._derive(list(names))
+
+    def gt(self, value):
+        return self._derive(list(self._bands))
+
+    def unitScale(self, low, high):
+        return self._derive(list(self._bands))
+
+    def clamp(self, low, high):
+        return self._derive(list(self._bands))
+
+    def remap(self, from_values, to_values, defaultValue=None, bandName=None):
+        return self._derive(['remapped'])
+
+    def updateMask(self, mask):
+        return self._derive(list(self._bands))
+
+    def mask(self):
+        return self._derive(list(self._bands))
+
+    def reduce(self, reducer):
+        return self._derive(list(reducer._outputs))
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        return self._derive(list(self._bands) + [band for band in srcImg._bands if band not in self._bands])
+
+    def clip(self, geometry):
+        return self._derive(list(self._bands))
+
+    def visualize(self, bands=None, gain=None, bias=None, min=None, max=None, gamma=None, opacity=None,
+                  palette=None, forceRgbOutput=None):
+        return self._derive(['vis-red', 'vis-green', 'vis-blue'])
+
+    def get(self, prop):
+        return ComputedObject(lambda: self._props.get(prop))
+
+    def date(self):
+        return Date(self._props.get('system:time_start', 0))
+
+    def id(self):
+        return String(self._props.get('system:id'))
+
+    def reduceRegion(self, reducer, geometry=None, scale=None, crs=None, crsTransform=None, bestEffort=False,
+                     maxPixels=None, tileScale=None):
+        def evaluate():
+            values = {}
+            for band in self._bands:
+                for output in reducer._outputs:
+                    key = band if len(reducer._outputs) == 1 else f'{band}_{output}'
+                    values[key] = _synthetic_output(band, output, self._seed, reducer._histogram)
+            return values
+        return Dictionary(ComputedObject(evaluate))
+
+    def getThumbURL(self, params=None):
+        backend.remote_call('getThumbURL')
+        width, height = str((params or {}).get('dimensions', '256x256')).split('x')
+        return f"{FAKE_URL_PREFIX}thumbnails?width={width}&height={height}"
+
+
+class Feature(ComputedObject):
+    def __init__(self, geom, opt_properties=None):
+        if isinstance(geom, Feature):
+            self._geometry, self._properties = geom._geometry, list(geom._properties)
+        else:
+            self._geometry = geom
+            self._properties = [opt_properties] if opt_properties is not None else []
+        super().__init__(lambda: {'type': 'Feature', 'geometry': self._geometry, 'properties': self._merged()})
+
+    def _merged(self):
+        merged = {}
+        for props in self._properties:
+            merged.update(_resolve(props))
+        return merged
+
+    def set(self, *args):
+        props = args[0] if len(args) == 1 else {args[0]: args[1]}
+        feature = Feature(self)
+        feature._properties.append(props)
+        return feature
+
+    def get(self, prop):
+        return ComputedObject(lambda: self._merged().get(prop))
+
+    def toDictionary(self, properties=None):
+        return Dictionary(ComputedObject(self._merged))
+
+
+class ImageCollection(ComputedObject):
+    """Colección de escenas del catálogo sintético; filtros y orden se aplican al evaluar."""
+
+    def __init__(self, source=None, _scenes=None):
+        if _scenes is None:
+            _scenes = list(backend.scenes)
+        self._scenes = _scenes
+        super().__init__(lambda: {'type': 'ImageCollection', 'features': [{'properties': s} for s in self._scenes]})
+
+    def filterBounds(self, geometry):
+        return ImageCollection(_scenes=self._scenes) # Todo el catálogo cubre cualquier AOI
+
+    def filterDate(self, start, end=None):
+        start_ms, end_ms = _to_millis(start), _to_millis(end) if end else float('inf')
+        return ImageCollection(_scenes=[s for s in self._scenes if start_ms <= s['system:time_start'] < end_ms])
+
+    def filter(self, ee_filter):
+        return ImageCollection(_scenes=[s for s in self._scenes if ee_filter._predicate(s)])
+
+    def sort(self, prop, ascending=True):
+        return ImageCollection(_scenes=sorted(self._scenes, key=lambda s: s.get(prop), reverse=not ascending))
+
+    def limit(self, maximum, opt_property=None, opt_ascending=None):
+        return ImageCollection(_scenes=self._scenes[:int(maximum)])
+
+    def first(self):
+        return Image(_props=dict(self._scenes[0]), _bands=list(S2_BANDS)) if self._scenes else Image(_props={})
+
+    def size(self):
+        return ComputedObject(lambda: len(self._scenes))
+
+    def aggregate_array(self, prop):
+        return List(lambda: [s.get(prop) for s in self._scenes])
+
+    def map(self, algorithm):
+        return FeatureCollection(lambda: [algorithm(Image(_props=dict(s), _bands=list(S2_BANDS)))
+                                          for s in self._scenes])
+
+    def toList(self, count, offset=0):
+        return List(lambda: [Image(_props=dict(s), _bands=list(S2_BANDS))
+                             for s in self._scenes[offset:offset + int(count)]])
+
+
+class FeatureCollection(ComputedObject):
+    def __init__(self, features):
+        self._features = features
+        super().__init__(lambda: {'type': 'FeatureCollection', 'features': self._features()})
+
+    def toList(self, count, offset=0):
+        return List(lambda: self._features()[offset:offset + int(count)])
+
+    def size(self):
+        return ComputedObject(lambda: len(self._features()))
+
+    # Colección de imágenes mapeada (p. ej. con máscara de nubes): composites
+    def select(self, selectors, opt_names=None):
+        return FeatureCollection(lambda: [item.select(selectors, opt_names) for item in self._features()])
+
+    def median(self):
+        items = self._features()
+        return items[0] if items else Image(_props={})
+
+
+def _to_millis(value):
+    if isinstance(value, (int, float)):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000
+
+
+# --- ee.data y arranque -------------------------------------------------------
+
+def _compute_pixels(params):
+    """
+    ee.data.computePixels: array estructurado NUMPY_NDARRAY con reflectancias
+    sintéticas para las bandas S2 y valores alrededor de BAND_MEANS para el resto
+    (índices calculados en el servidor). Como en EE, los píxeles enmascarados
+    (una nube circular, ver CLOUD_CENTER) vuelven en 0 en todas las bandas y
+    las de MASK_BANDS valen 1 fuera de ella.
+    """
+    import numpy as np
+    backend.remote_call('computePixels')
+    image = params['expression']
+    dims = params['grid']['dimensions']
+    width, height = dims['width'], dims['height']
+    rng = np.random.default_rng(image._seed)
+    raw = np.zeros((height, width), dtype=[(band, np.float32) for band in image._bands])
+    for i, band in enumerate(image._bands):
+        if band in REFLECTANCE_BANDS:
+            level = 2500.0 if band == 'B8' else 600.0 + 150.0 * i
+            raw[band] = level + rng.normal(0, 200.0, size=(height, width))
+        else:
+            raw[band] = np.clip(BAND_MEANS.get(band, DEFAULT_BAND_MEAN) + rng.normal(0, 0.15, size=(height, width)), -1, 1)
+    rows, columns = np.ogrid[:height, :width]
+    cloud = ((columns / width - CLOUD_CENTER[0]) ** 2 + (rows / height - CLOUD_CENTER[1]) ** 2) < CLOUD_RADIUS ** 2
+    for band in image._bands:
+        if band in MASK_BANDS:
+            raw[band] = 1.0
+        raw[band][cloud] = 0
+    return raw
+
+
+data = types.SimpleNamespace(computePixels=_compute_pixels, setDeadline=lambda milliseconds: None)
+
+
+def Initialize(credentials=None, project=None, **kwargs):
+    backend.initialized = True
+
+
+def Authenticate(**kwargs):
+    return True
+
+
+# --- HTTP: miniaturas sintéticas ----------------------------------------------
+
+@lru_cache(maxsize=32)
+def synthetic_png(width, height):
+    """
+    PNG RGBA determinista de width x height, cacheado por tamaño. Mitad de
+    cada fila es un degradado y la otra mitad ruido de 4 bits, para que el
+    tamaño comprimido se parezca al de una miniatura real.
+    """
+    rng = random.Random(width * 100003 + height)
+    row_bytes = width * 4
+    half = row_bytes // 2
+    base = bytes(((x * 7) ^ (x >> 3) * 13) & 0xFF for x in range(row_bytes))
+    noise_pool = bytes(b & 0x0F for b in rng.randbytes(half * 64)) # 64 filas distintas: más que la ventana de zlib
+    raw = bytearray()
+    for y in range(height):
+        shift = (y * 4) % half
+        noise = (y % 64) * half
+        raw.append(0) # Filtro None
+        raw += base[shift:half] + base[:shift]
+        raw += noise_pool[noise:noise + row_bytes - half]
+
+    def chunk(kind, payload):
+        return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(bytes(raw), 6))
+            + chunk(b'IEND', b''))
+
+
+def mount_http(session):
+    """Monta en `session` un adaptador que responde las URLs de miniaturas con PNG sintéticos."""
+    import requests
+    from requests.adapters import BaseAdapter
+
+    class FakeThumbnailAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            backend.remote_call('download', backend.download_latency)
+            query = parse_qs(urlparse(request.url).query)
+            width, height = int(query.get('width', ['256'])[0]), int(query.get('height', ['256'])[0])
+            response = requests.Response()
+            response.status_code = 200
+            response._content = synthetic_png(width, height)
+            response.headers['Content-Type'] = 'image/png'
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self):
+            pass
+
+    session.mount(FAKE_URL_PREFIX, FakeThumbnailAdapter())
+    return session
+
+
+def install(call_latency=None, download_latency=None, jitter=None):
+    """
+    Registra este módulo como `ee` en sys.modules (debe llamarse antes de
+    importar la app) y ajusta las latencias del backend simulado.
+    """
+    if call_latency is not None:
+        backend.call_latency = call_latency
+    if download_latency is not None:
+        backend.download_latency = download_latency
+    if jitter is not None:
+        backend.jitter = jitter
+    existing = sys.modules.get('ee')
+    if existing is not None and existing is not sys.modules[__name__]:
+        raise RuntimeError("El módulo ee real ya fue importado; instala fake_ee antes de importar la app.")
+    sys.modules['ee'] = sys.modules[__name__]
+    return backend
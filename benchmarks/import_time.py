@@ -0,0 +1,50 @@
+# benchmarks/import_time.py
+# Mide el tiempo de import en frío de los módulos de la app, cada uno en un
+# proceso nuevo. Desde que Earth Engine se inicializa de forma perezosa
+# (utils.ee_client), ningún import debería pagar round trips de red.
+#
+# Uso:
+#   python -m benchmarks.import_time --repeat 5
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = [
+    'utils.ee_client',
+    'utils.index_calculator',
+    'utils.map_generator',
+    'utils.helpers',
+    'backend.gee_processor',
+    'backend.report_pipeline',
+    'reports.pdf_generator',
+]
+
+
+def time_import(module, repeat=5):
+    """Devuelve los tiempos (s) de `python -c 'import module'` en `repeat` procesos nuevos."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de tiempo de import en frío.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args(argv)
+
+    baseline = statistics.median(time_import('sys', args.repeat)) # Costo de arrancar el intérprete
+    print(f"{'módulo':<28} {'mediana':>9} {'neto':>9} {'máx':>9}")
+    for module in args.modules:
+        timings = time_import(module, args.repeat)
+        median = statistics.median(timings)
+        print(f"{module:<28} {median:>8.3f}s {median - baseline:>8.3f}s {max(timings):>8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
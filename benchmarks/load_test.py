@@ -0,0 +1,191 @@
+# benchmarks/load_test.py
+# Prueba de carga del servicio HTTP (backend.service): N clientes concurrentes
+# envían informes, consultan el estado hasta que terminan y descargan el PDF.
+# Reporta latencia de punta a punta (p50/p95/máx), throughput y rechazos por
+# contrapresión (429). Sin --url levanta el servicio en proceso contra el
+# backend ee simulado de benchmarks.fake_ee (sin red ni credenciales).
+#
+# Uso:
+#   python -m benchmarks.load_test --requests 40 --concurrency 8 --workers 4
+#   python -m benchmarks.load_test --url http://127.0.0.1:8080 --requests 100 --concurrency 16
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import fake_ee
+
+# AOIs base y ventana fija; cada AOI distinto se desplaza un poco para no pegarle al caché
+AOI_LAT, AOI_LON, AOI_RADIUS_KM = -33.45, -70.66, 2.0
+AOI_STEP_DEG = 0.01
+START_DATE, END_DATE = '2025-01-01', '2025-03-31'
+REQUEST_TIMEOUT_SECONDS = 30
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_local_service(workers, max_pending, call_latency, download_latency, jitter):
+    """Levanta backend.service en un hilo (uvicorn) con el ee simulado; devuelve (url, server)."""
+    # Directorios temporales: las corridas no comparten caché ni artefactos con la app
+    scratch = tempfile.mkdtemp(prefix='geoinforme-load-')
+    for name, sub in (('GEOINFORME_CACHE_DIR', 'cache'), ('GEOINFORME_DATA_DIR', 'data'),
+                      ('GEOINFORME_BASELINE_DIR', 'baselines'), ('GEOINFORME_SCENE_CATALOG', 'scene_catalog.sqlite'),
+                      ('GEOINFORME_TILE_CACHE', 'tiles.sqlite')):
+        os.environ.setdefault(name, os.path.join(scratch, sub))
+    os.environ.setdefault('GEOINFORME_WRITE_TRACES', '0')
+    fake_ee.install(call_latency, download_latency, jitter)
+
+    import uvicorn
+    from backend import service
+    from utils.map_generator import get_http_session
+    fake_ee.mount_http(get_http_session())
+
+    port = _free_port()
+    app = service.create_app(max_pending=max_pending, workers=workers)
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, name='load-test-service', daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("El servicio no arrancó")
+        time.sleep(0.05)
+    return f'http://127.0.0.1:{port}', server
+
+
+def _request(method, url, payload=None):
+    """(status, headers, cuerpo en bytes); los errores HTTP se devuelven, no se lanzan."""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SECONDS) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def run_client(base_url, index, distinct, poll_interval, counters, lock):
+    """Un informe completo: envío (reintentando 429), polling y descarga del PDF."""
+    offset = (index % distinct) * AOI_STEP_DEG
+    payload = {'aoi': {'lat': AOI_LAT + offset, 'lon': AOI_LON, 'radius_km': AOI_RADIUS_KM},
+               'start_date': START_DATE, 'end_date': END_DATE}
+    start = time.perf_counter()
+    while True:
+        status, headers, body = _request('POST', f'{base_url}/v1/reports', payload)
+        if status != 429:
+            break
+        with lock:
+            counters['rejected'] += 1
+        time.sleep(float(headers.get('Retry-After') or 1))
+    if status != 202:
+        raise RuntimeError(f"Envío rechazado ({status}): {body[:200]!r}")
+    submitted = time.perf_counter()
+    links = json.loads(body)['links']
+
+    while True:
+        status, _, body = _request('GET', base_url + links['status'])
+        job = json.loads(body)
+        if job.get('status') in ('done', 'failed', 'cancelled'):
+            break
+        time.sleep(poll_interval)
+    if job['status'] != 'done':
+        raise RuntimeError(f"Job {job.get('id')} terminó '{job['status']}': {job.get('error')}")
+
+    status, _, pdf_bytes = _request('GET', base_url + links['pdf'])
+    if status != 200 or not pdf_bytes.startswith(b'%PDF'):
+        raise RuntimeError(f"Descarga del PDF falló ({status})")
+    return {'latency_s': time.perf_counter() - start, 'submit_s': submitted - start,
+            'from_cache': job.get('from_cache'), 'pdf_bytes': len(pdf_bytes)}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))]
+
+
+def run_load(base_url, requests, concurrency, distinct, poll_interval):
+    """Corre `requests` informes con `concurrency` clientes; devuelve el resumen."""
+    counters, lock = {'rejected': 0}, threading.Lock()
+    results, failures = [], []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='client') as pool:
+        futures = [pool.submit(run_client, base_url, i, distinct, poll_interval, counters, lock) for i in range(requests)]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures.append(str(e))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r['latency_s'] for r in results]
+    submits = [r['submit_s'] for r in results]
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'ok': len(results),
+        'failed': len(failures),
+        'rejected_429': counters['rejected'],
+        'from_cache': sum(1 for r in results if r['from_cache']),
+        'elapsed_s': elapsed,
+        'throughput_rps': len(results) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_s': statistics.median(latencies) if latencies else None,
+        'latency_p95_s': _percentile(latencies, 0.95) if latencies else None,
+        'latency_max_s': max(latencies) if latencies else None,
+        'submit_p95_s': _percentile(submits, 0.95) if submits else None,
+        'errors': failures[:5],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio HTTP de informes.")
+    parser.add_argument('--url', help="Servicio ya levantado; sin --url se levanta uno en proceso con el ee simulado")
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8, help="Clientes concurrentes")
+    parser.add_argument('--distinct', type=int, help="AOIs distintos (por defecto uno por request: sin caché ni deduplicación)")
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--workers', type=int, default=4, help="Workers del servicio en proceso")
+    parser.add_argument('--max-pending', type=int, default=16, help="Cola máxima del servicio en proceso")
+    parser.add_argument('--call-latency', type=float, default=0.05, help="Latencia (s) simulada de cada llamada a GEE")
+    parser.add_argument('--download-latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--json', action='store_true', help="Imprime el resumen como JSON")
+    args = parser.parse_args(argv)
+
+    base_url, server = args.url, None
+    if not base_url:
+        base_url, server = start_local_service(args.workers, args.max_pending, args.call_latency,
+                                               args.download_latency, args.jitter)
+        print(f"Servicio en proceso en {base_url} ({args.workers} workers, cola máx. {args.max_pending}, ee simulado)")
+
+    summary = run_load(base_url.rstrip('/'), args.requests, args.concurrency, args.distinct or args.requests,
+                       args.poll_interval)
+    if server is not None:
+        server.should_exit = True
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"\n{summary['ok']}/{summary['requests']} informes OK ({summary['failed']} fallidos, "
+              f"{summary['rejected_429']} rechazos 429, {summary['from_cache']} del caché) en {summary['elapsed_s']:.2f}s")
+        if summary['ok']:
+            print(f"Latencia p50 {summary['latency_p50_s']:.3f}s | p95 {summary['latency_p95_s']:.3f}s | "
+                  f"máx {summary['latency_max_s']:.3f}s | envío p95 {summary['submit_p95_s']:.3f}s")
+            print(f"Throughput: {summary['throughput_rps']:.2f} informes/s")
+        for error in summary['errors']:
+            print(f"  - {error}")
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# benchmarks/pdf_throughput.py
+# Throughput del build de PDFs (páginas/segundo e informes/segundo) con los
+# resultados de GEE ya resueltos, el caso de un batch con caché caliente:
+# genera un resultado con process_aoi contra benchmarks.fake_ee y luego
+# construye N informes en serie (plantilla en frío y en caliente) y con el
+# pool de procesos de reports.render_pool.
+#
+# Uso:
+#   python -m benchmarks.pdf_throughput --reports 24 --workers 4
+#   python -m benchmarks.pdf_throughput --reports 12 --resolution 10   # mapas teselados de alta resolución
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_ee
+
+AOI_LAT, AOI_LON, AOI_RADIUS_KM = -33.45, -70.66, 5.0
+START_DATE, END_DATE = '2025-01-01', '2025-03-31'
+BASELINE_START, BASELINE_END = '2024-10-01', '2024-12-31'
+
+
+def build_results(resolution_m=None):
+    """Un resultado completo de process_aoi (mapas, estadísticas, serie y cambios) sin red."""
+    os.environ.setdefault('GEOINFORME_WRITE_TRACES', '0')
+    scratch = tempfile.mkdtemp(prefix='geoinforme-pdf-')
+    os.environ.setdefault('GEOINFORME_SCENE_CATALOG', os.path.join(scratch, 'scene_catalog.sqlite'))
+    os.environ.setdefault('GEOINFORME_TILE_CACHE', os.path.join(scratch, 'tiles.sqlite'))
+    fake_ee.install(0.0, 0.0)
+    from backend import gee_processor
+    from utils import helpers
+    from utils.map_generator import get_http_session
+    fake_ee.mount_http(get_http_session())
+
+    aoi = helpers.get_aoi_from_coords(AOI_LAT, AOI_LON, AOI_RADIUS_KM)
+    results = gee_processor.process_aoi(aoi, START_DATE, END_DATE, timeseries=True, target_resolution_m=resolution_m,
+                                        baseline_start=BASELINE_START, baseline_end=BASELINE_END)
+    if not results or 'error' in results:
+        raise RuntimeError(f"process_aoi falló: {(results or {}).get('error')}")
+    return results
+
+
+def _measure(label, build, count_pages, reports):
+    start = time.perf_counter()
+    pdfs = build()
+    seconds = time.perf_counter() - start
+    if any(pdf is None for pdf in pdfs):
+        raise RuntimeError(f"{label}: falló el build de algún PDF")
+    pages = sum(count_pages(pdf) for pdf in pdfs)
+    return {'mode': label, 'reports': reports, 'pages': pages, 'seconds': seconds,
+            'pages_per_second': pages / seconds, 'reports_per_second': reports / seconds,
+            'pdf_bytes': len(pdfs[0])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de throughput del build de PDFs.")
+    parser.add_argument('--reports', type=int, default=24, help="Informes a construir por modo")
+    parser.add_argument('--workers', type=int, default=4, help="Procesos del pool")
+    parser.add_argument('--resolution', type=int, choices=(10, 20), help="Mapas teselados de alta resolución (m/píxel)")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = build_results(args.resolution)
+    from reports import pdf_generator
+    from reports import templates
+    from reports.render_pool import PdfRenderPool, count_pages
+
+    sizes = {key: len(png) for key, png in results['images'].items()}
+    print(f"Resultado de prueba: {len(sizes)} mapas ({sum(sizes.values()) / 1e6:.1f} MB PNG)")
+
+    rows = []
+    # Primer informe del proceso: arma la plantilla y prepara (reduce/codifica) cada mapa
+    rows.append(_measure('serie (frío)', lambda: [pdf_generator.build_pdf_report(results)], count_pages, 1))
+    rows.append(_measure('serie', lambda: [pdf_generator.build_pdf_report(results) for _ in range(args.reports)],
+                         count_pages, args.reports))
+    with PdfRenderPool(args.workers) as pool:
+        pool.map([results] * args.workers) # Arranque de los procesos y sus cachés fuera de la medición
+        rows.append(_measure(f'pool x{args.workers}', lambda: pool.map([results] * args.reports), count_pages,
+                             args.reports))
+
+    if args.json:
+        print(json.dumps({'rows': rows, 'image_cache': templates.get_report_template().image_cache.stats()}, indent=2))
+        return 0
+    print(f"\n{'modo':<14} {'informes':>8} {'páginas':>8} {'segundos':>9} {'págs/s':>8} {'inf/s':>7} {'KB PDF':>8}")
+    for row in rows:
+        print(f"{row['mode']:<14} {row['reports']:>8} {row['pages']:>8} {row['seconds']:>9.3f} "
+              f"{row['pages_per_second']:>8.1f} {row['reports_per_second']:>7.2f} {row['pdf_bytes'] / 1024:>8.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# benchmarks/run_benchmarks.py
+# Benchmark de extremo a extremo sin red: process_aoi + generate_pdf_report
+# contra el backend simulado de benchmarks.fake_ee (latencia configurable y
+# PNG sintéticos). Mide tiempo, llamadas remotas y memoria pico por escenario
+# y lo compara con un baseline guardado para detectar regresiones.
+#
+# Uso:
+#   python -m benchmarks.run_benchmarks --repeat 3
+#   python -m benchmarks.run_benchmarks --update-baseline   # guarda benchmarks/baseline.json (mismo --repeat que al comparar)
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import fake_ee
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Opciones de process_aoi por escenario
+SCENARIOS = {
+    'stacked': {'engine': 'stacked'},
+    'stacked_all_indices': {'engine': 'stacked', 'indices': ['ndvi', 'ndwi', 'nbr', 'savi', 'evi', 'ndmi',
+                                                             'gndvi', 'ndre', 'nbr2', 'ndbi']},
+    'server': {'engine': 'server'},
+    'server_timeseries': {'engine': 'server', 'timeseries': True},
+    'local': {'engine': 'local'},
+}
+
+# AOI y ventana de fechas fijos para que las corridas sean comparables
+AOI_LAT, AOI_LON, AOI_RADIUS_KM = -33.45, -70.66, 5.0
+START_DATE, END_DATE = '2025-01-01', '2025-03-31'
+
+TIME_TOLERANCE = 0.20    # +20 % sobre el baseline es regresión...
+TIME_SLACK_SECONDS = 0.05  # ...y además más de 50 ms (las etapas de pocos ms son puro ruido)
+MEMORY_TOLERANCE = 0.25
+
+
+def _load_app():
+    """Importa la app con el ee simulado ya instalado (nunca el ee real)."""
+    os.environ.setdefault('GEOINFORME_WRITE_TRACES', '0')
+    # Catálogo de escenas y caché de tiles propios de la corrida: la primera corrida de cada
+    # escenario descarga, las repeticiones leen localmente
+    scratch = tempfile.mkdtemp(prefix='geoinforme-bench-')
+    os.environ.setdefault('GEOINFORME_SCENE_CATALOG', os.path.join(scratch, 'scene_catalog.sqlite'))
+    os.environ.setdefault('GEOINFORME_TILE_CACHE', os.path.join(scratch, 'tiles.sqlite'))
+    from backend import gee_processor
+    from reports import pdf_generator
+    from utils import helpers
+    from utils.map_generator import get_http_session
+    fake_ee.mount_http(get_http_session())
+    return gee_processor, pdf_generator, helpers
+
+
+def run_once(app, options, output_dir, tag):
+    """Una corrida completa; devuelve tiempos (s) y llamadas remotas."""
+    gee_processor, pdf_generator, helpers = app
+    fake_ee.backend.reset_counts()
+    aoi = helpers.get_aoi_from_coords(AOI_LAT, AOI_LON, AOI_RADIUS_KM)
+
+    start = time.perf_counter()
+    results = gee_processor.process_aoi(aoi, START_DATE, END_DATE, file_tag=tag, **options)
+    process_seconds = time.perf_counter() - start
+    if not results or 'error' in results:
+        raise RuntimeError(f"process_aoi falló: {(results or {}).get('error')}")
+
+    start = time.perf_counter()
+    pdf_path = pdf_generator.generate_pdf_report(results, filename_prefix=f"bench_{tag}", output_dir=output_dir)
+    pdf_seconds = time.perf_counter() - start
+    if not pdf_path:
+        raise RuntimeError("generate_pdf_report falló")
+
+    return {
+        'process_seconds': process_seconds,
+        'pdf_seconds': pdf_seconds,
+        'remote_calls': results['metadata']['remote_calls']['total'],
+        'backend_calls': fake_ee.backend.counts(),
+    }
+
+
+def run_scenario(app, name, options, repeat, output_dir):
+    """`repeat` corridas medidas + una corrida bajo tracemalloc para la memoria pico."""
+    runs = [run_once(app, options, output_dir, f"{name}_{i}") for i in range(repeat)]
+
+    tracemalloc.start()
+    try:
+        run_once(app, options, output_dir, f"{name}_mem")
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    process = [r['process_seconds'] for r in runs]
+    pdf = [r['pdf_seconds'] for r in runs]
+    total = [r['process_seconds'] + r['pdf_seconds'] for r in runs]
+    return {
+        'process_median_s': statistics.median(process),
+        'pdf_median_s': statistics.median(pdf),
+        'total_median_s': statistics.median(total),
+        'total_max_s': max(total),
+        'remote_calls': runs[-1]['remote_calls'],
+        'backend_calls': runs[-1]['backend_calls'],
+        'peak_memory_mb': peak_bytes / 1e6,
+    }
+
+
+def compare(current, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE,
+            time_slack=TIME_SLACK_SECONDS):
+    """Devuelve la lista de regresiones (texto) de `current` frente a `baseline`."""
+    regressions = []
+    for name, metrics in current.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in ('process_median_s', 'pdf_median_s', 'total_median_s'):
+            if metrics[key] > reference[key] * (1 + time_tolerance) + time_slack:
+                regressions.append(f"{name}.{key}: {metrics[key]:.3f}s vs {reference[key]:.3f}s")
+        if metrics['remote_calls'] > reference['remote_calls']:
+            regressions.append(f"{name}.remote_calls: {metrics['remote_calls']} vs {reference['remote_calls']}")
+        if metrics['peak_memory_mb'] > reference['peak_memory_mb'] * (1 + memory_tolerance):
+            regressions.append(f"{name}.peak_memory_mb: {metrics['peak_memory_mb']:.1f} vs {reference['peak_memory_mb']:.1f}")
+    return regressions
+
+
+def _print_table(current, baseline):
+    print(f"\n{'escenario':<20} {'process':>9} {'pdf':>8} {'total':>8} {'Δ total':>8} {'llamadas':>9} {'pico MB':>8}")
+    for name, m in current.items():
+        reference = baseline.get(name)
+        delta = f"{(m['total_median_s'] / reference['total_median_s'] - 1) * 100:+.0f}%" if reference else '-'
+        print(f"{name:<20} {m['process_median_s']:>8.3f}s {m['pdf_median_s']:>7.3f}s {m['total_median_s']:>7.3f}s "
+              f"{delta:>8} {m['remote_calls']:>9} {m['peak_memory_mb']:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con un backend ee simulado.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--call-latency', type=float, default=0.2, help="Latencia (s) de cada llamada a GEE")
+    parser.add_argument('--download-latency', type=float, default=0.1, help="Latencia (s) de cada descarga de miniatura")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Jitter uniforme (s) sumado a cada latencia")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="Escenarios a correr (por defecto todos)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help="Guarda los resultados como nuevo baseline")
+    args = parser.parse_args(argv)
+
+    fake_ee.install(args.call_latency, args.download_latency, args.jitter)
+    app = _load_app()
+    config = {'call_latency': args.call_latency, 'download_latency': args.download_latency, 'jitter': args.jitter}
+
+    current = {}
+    with tempfile.TemporaryDirectory(prefix='geoinforme-bench-') as output_dir:
+        for name in args.scenario or SCENARIOS:
+            print(f"== Escenario {name} ({args.repeat} corridas)")
+            current[name] = run_scenario(app, name, SCENARIOS[name], args.repeat, output_dir)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        if stored.get('config') != config:
+            print(f"WARNING: El baseline se midió con otra configuración ({stored.get('config')}); la comparación es orientativa.")
+        baseline = stored.get('scenarios', {})
+    _print_table(current, baseline)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'scenarios': current}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline actualizado: {args.baseline}")
+        return 0
+    if not baseline:
+        print("\nSin baseline para comparar; corre con --update-baseline para guardarlo.")
+        return 0
+
+    regressions = compare(current, baseline)
+    if regressions:
+        print("\nREGRESIONES:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\nSin regresiones frente al baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
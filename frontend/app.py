@@ -1,13 +1,21 @@
 # frontend/app.py
-import streamlit as st
-import ee
-ee.Initialize(project='geoinforme')  # Reemplaza con tu ID real ()from utils import index_calculator
-print(ee.data.getAssetRoots())  # Debe mostrar tus proyectos y assets accesibles.
 import os
+import streamlit as st
 import time
-from backend import gee_processor
-from reports import pdf_generator
+from datetime import datetime, timedelta
+from backend import jobs
+from backend import report_pipeline
+from utils import ee_client
 from utils import helpers
+from utils import index_registry
+from utils import ingest
+from utils import raster_export
+from utils import result_cache
+from utils import storage
+from utils import tile_cache
+from utils import tracing
+
+JOB_POLL_SECONDS = 1.0 # Intervalo de refresco mientras hay un job en curso
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -17,32 +25,34 @@ st.set_page_config(
 )
 # --- Initialize Session State ---
 if 'aoi_params' not in st.session_state:
-    st.session_state.aoi_params = None # Guardará {'lat':..., 'lon':..., 'radius_km':...} o {'geojson_string': "..."}
+    st.session_state.aoi_params = None # Guardará {'lat':..., 'lon':..., 'radius_km':...} o {'upload': ParsedUpload}
 if 'aoi_type' not in st.session_state:
-    st.session_state.aoi_type = None # Será 'coords' o 'geojson'
-if 'pdf_report_path' not in st.session_state:
-    st.session_state.pdf_report_path = None
-if 'gee_initialized' not in st.session_state:
-    st.session_state.gee_initialized = False # Nueva bandera para verificar la inicialización de GEE
-    
-# --- GEE Initialization Check ---
-# Although initialized elsewhere, good to have a check/reminder here
-if not st.session_state.gee_initialized:
-    st.sidebar.info("Intentando conectar a Google Earth Engine...")
-    try:
-        # Intenta una operación simple para verificar la conexión
-        _ = ee.Geometry.Point([0, 0]).getInfo()
-        st.session_state.gee_initialized = True # Marcar como inicializado para esta sesión
-        st.sidebar.success("Google Earth Engine Conectado")
-        # Recargar la página una vez conectado puede ayudar a limpiar el estado inicial
-        # st.experimental_rerun() # Descomentar con precaución si es necesario
-    except Exception as e:
-         st.sidebar.error(f"Error conectando a GEE: {e}. Revisa la autenticación ('earthengine authenticate').")
-         st.warning("La aplicación podría no funcionar correctamente sin conexión a GEE.")
-         st.session_state.gee_initialized = False # Asegurarse de que sigue falso si falla
-else:
-    # Si ya está inicializado, solo muestra el éxito (opcional)
+    st.session_state.aoi_type = None # Será 'coords' o 'upload'
+if 'pdf_report' not in st.session_state:
+    st.session_state.pdf_report = None # {'bytes': ..., 'filename': ...} del último informe, en memoria
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None # Job de informe en curso para esta sesión
+if 'report_maps' not in st.session_state:
+    st.session_state.report_maps = None # {título: PNG (bytes o ruta)} del último informe terminado
+if 'report_export' not in st.session_state:
+    st.session_state.report_export = None # Descripción del export de rásters del último informe (utils.raster_export)
+if 'export_download_ready' not in st.session_state:
+    st.session_state.export_download_ready = False # El export se lee del disco solo después de "Preparar descarga"
+
+# --- GEE Connection Status ---
+# ee.Initialize() corre una sola vez por proceso y de forma perezosa; el chequeo
+# de conectividad corre en segundo plano y aquí solo se muestra su último estado.
+ee_client.start_health_check()
+tracing.start_metrics_server() # Solo si GEOINFORME_METRICS_PORT está definido
+storage.start_gc() # Borra en segundo plano los workspaces de jobs vencidos (nunca los activos)
+_ee_health = ee_client.health_status()
+if _ee_health['state'] == ee_client.HEALTH_OK:
     st.sidebar.success("Google Earth Engine Conectado")
+elif _ee_health['state'] == ee_client.HEALTH_ERROR:
+    st.sidebar.error(f"Error conectando a GEE: {_ee_health['error']}. Revisa la autenticación ('earthengine authenticate').")
+    st.warning("La aplicación podría no funcionar correctamente sin conexión a GEE.")
+else:
+    st.sidebar.info("Verificando conexión con Google Earth Engine en segundo plano...")
 
 # --- Application Title ---
 st.title("🛰️ GeoInforme Express MVP")
@@ -81,34 +91,28 @@ with tab1:
 
 with tab2:
     st.subheader("Opción B: Subir Archivo Geoespacial")
-    uploaded_file = st.file_uploader("Carga tu archivo .geojson o .kml", type=['geojson', 'kml'])
+    uploaded_file = st.file_uploader("Carga tu archivo .geojson, .kml o .kmz", type=list(ingest.SUPPORTED_EXTENSIONS))
     if uploaded_file is not None:
-        file_type = uploaded_file.name.split('.')[-1].lower()
-        if file_type == 'geojson':
+        # Streamlit re-ejecuta el script en cada clic: solo se parsea un archivo nuevo
+        upload_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+        if st.session_state.get('upload_id') != upload_id:
             try:
-                # Lee el contenido del archivo UNA VEZ
-                geojson_content = uploaded_file.read().decode("utf-8")
-                # Intenta cargarlo para validación rápida (opcional pero bueno)
-                _ = geojson.loads(geojson_content)
-                # Guarda el string
-                st.session_state.aoi_params = {'geojson_string': geojson_content}
-                st.session_state.aoi_type = 'geojson'
-                st.success("Contenido GeoJSON guardado en sesión.")
-                # Limpia el otro tipo por si acaso
-                # st.session_state.aoi = None # Ya no usamos st.session_state.aoi
+                # Lectura en streaming (GeoJSON incremental / KML con iterparse);
+                # en sesión queda el handle parseado, no el texto del archivo
+                upload = ingest.load_upload(uploaded_file, uploaded_file.name)
+                st.session_state.aoi_params = {'upload': upload}
+                st.session_state.aoi_type = 'upload'
+                st.session_state.upload_id = upload_id
             except Exception as e:
-                st.error(f"Error al leer/validar o guardar GeoJSON: {e}")
+                st.error(f"Error al leer el archivo {uploaded_file.name}: {e}")
                 st.session_state.aoi_params = None
                 st.session_state.aoi_type = None
-        elif file_type == 'kml':
-            # aoi = helpers.parse_kml(uploaded_file) # KML Parsing TBD
-            st.warning("La carga de KML aún no está completamente implementada en el MVP. Intenta con GeoJSON.")
-            # if aoi:
-            #     st.success("Archivo KML procesado (básico).")
-            # else:
-            #     st.error("Error al procesar el archivo KML.")
-        else:
-            st.error("Tipo de archivo no soportado.")
+                st.session_state.upload_id = None
+        if st.session_state.aoi_type == 'upload' and st.session_state.upload_id == upload_id:
+            upload = st.session_state.aoi_params['upload']
+            st.success(f"Archivo cargado: {upload.summary()}")
+            if len(upload) > 1:
+                st.info("El informe usa el primer feature; para procesar todos usa el modo masivo (backend.batch).")
 
 # --- Date Range Selection ---
 st.header("2. Selecciona el Período de Tiempo")
@@ -119,136 +123,186 @@ time_period = st.selectbox(
     index=0 # Default to 'Último mes'
 )
 start_date, end_date = helpers.get_date_range(time_period)
-st.caption(f"Se buscarán imágenes entre {start_date} y {end_date} con <20% de nubes.")
+CLOUD_COVER_MAX = report_pipeline.DEFAULT_CLOUD_COVER_MAX
+st.caption(f"Se buscarán imágenes entre {start_date} y {end_date} con <{CLOUD_COVER_MAX}% de nubes.")
+include_timeseries = st.checkbox("Incluir serie temporal de índices (todas las escenas del período)", value=False)
+map_resolution = st.selectbox(
+    "Resolución de los mapas:",
+    ("Estándar (miniatura 512 px)", "Alta (20 m/píxel)", "Máxima (10 m/píxel)"),
+    index=0,
+    help="La alta resolución divide el AOI en tiles descargados en paralelo; tarda más en AOIs grandes."
+)
+selected_indices = st.multiselect(
+    "Índices a incluir:",
+    list(index_registry.INDEXES),
+    default=index_registry.DEFAULT_INDICES,
+    format_func=lambda key: index_registry.get_index(key).title,
+    help="Todos los índices se calculan y descargan juntos: agregar índices no suma llamadas a GEE."
+)
+report_options = {'timeseries': True} if include_timeseries else {}
+if selected_indices and selected_indices != index_registry.DEFAULT_INDICES:
+    report_options['indices'] = selected_indices
+include_change = st.checkbox("Detección de cambios pre/post evento (dNBR, dNDVI)", value=False,
+                             help="Compara la escena elegida con un composite sin nubes de un período previo al evento. "
+                                  "El composite queda en caché: informes diarios del mismo AOI y período previo no lo recalculan.")
+if include_change:
+    col_pre_start, col_pre_end = st.columns(2)
+    default_pre_end = datetime.strptime(start_date, '%Y-%m-%d').date() - timedelta(days=1)
+    with col_pre_start:
+        baseline_start = st.date_input("Inicio período previo", value=default_pre_end - timedelta(days=60))
+    with col_pre_end:
+        baseline_end = st.date_input("Fin período previo", value=default_pre_end)
+    if baseline_start >= baseline_end:
+        st.error("El período previo debe terminar después de empezar.")
+    else:
+        report_options['baseline_start'] = baseline_start.strftime('%Y-%m-%d')
+        report_options['baseline_end'] = baseline_end.strftime('%Y-%m-%d')
+MAP_RESOLUTIONS_M = {"Alta (20 m/píxel)": 20, "Máxima (10 m/píxel)": 10}
+if map_resolution in MAP_RESOLUTIONS_M:
+    report_options['target_resolution_m'] = MAP_RESOLUTIONS_M[map_resolution]
+EXPORT_LABELS = {'cog': "GeoTIFF optimizado para la nube (COG)", 'npy': "Array NumPy (.npy + georreferencia JSON)"}
+export_format = st.selectbox(
+    "Exportar valores crudos de los índices:",
+    [None] + raster_export.available_formats(),
+    format_func=lambda key: EXPORT_LABELS.get(key, "No exportar"),
+    help="Rásters float32 georreferenciados para abrir en un GIS, a la resolución de los mapas "
+         f"({raster_export.DEFAULT_RESOLUTION_M:.0f} m/píxel con miniaturas)."
+)
+if export_format:
+    report_options['export_format'] = export_format
 
 # --- Report Generation Trigger ---
 st.header("3. Generar Informe")
 
-# Placeholders for results
-pdf_path = None
-report_data = None
-
 if st.session_state.aoi_params is None: # NEW - Verifica si hay parámetros guardados
     st.warning("Por favor, define un Área de Interés (AOI) usando una de las opciones anteriores.")
-    # print("DEBUG: Botón no activo porque AOI Params es None.") # Actualiza debug msg
 else:
-    print(f"DEBUG: Parámetros AOI definidos ({st.session_state.aoi_type}). Botón activo.") # Actualiza debug msg
-    # print("DEBUG: Justo antes de evaluar st.button") # Puedes quitar/mantener
-
     # --- Botón Principal ---
     if st.button("🚀 Generar Informe Ahora"):
-        print("DEBUG: Botón 'Generar Informe Ahora' PRESIONADO.")
-        if not st.session_state.gee_initialized:
+        if ee_client.health_status()['state'] == ee_client.HEALTH_ERROR:
+            ee_client.start_health_check(force=True) # Reintenta para el próximo clic
             st.error("Error: Google Earth Engine no está inicializado correctamente. No se puede continuar.")
         else:
-            # --- RECREAR ee.Geometry AHORA ---
-            current_aoi = None # Variable local para la geometría
-            recreation_error = None
             try:
-                if st.session_state.aoi_type == 'coords':
-                    params = st.session_state.aoi_params
-                    current_aoi = helpers.get_ee_geometry_from_coords(params['lat'], params['lon'], params['radius_km'])
-                    print("DEBUG: Recreado AOI desde Coords guardados")
-                elif st.session_state.aoi_type == 'geojson':
-                    params = st.session_state.aoi_params
-                    geojson_string = params.get('geojson_string')
-                    if geojson_string:
-                        gj = geojson.loads(geojson_string)
-                        # Extraer geometría (mismo código que en helpers.parse_geojson)
-                        geometry_data = None
-                        if gj['type'] == 'FeatureCollection':
-                            if gj['features']:
-                                geometry_data = gj['features'][0]['geometry']
-                        elif gj['type'] == 'Feature':
-                            geometry_data = gj['geometry']
-                        elif gj['type'] in ['Polygon', 'MultiPolygon', 'Point', 'LineString', 'MultiPoint', 'MultiLineString']:
-                            geometry_data = gj
-
-                        if geometry_data:
-                            current_aoi = ee.Geometry(geometry_data)
-                            print("DEBUG: Recreado AOI desde GeoJSON String guardado")
-                        else:
-                            recreation_error = "No se encontró geometría válida en el GeoJSON guardado."
-                    else:
-                        recreation_error = "No se encontró el string GeoJSON en el estado."
-                else:
-                    recreation_error = "Tipo de AOI desconocido en el estado."
-
-                # Verificar si la recreación fue exitosa
-                if current_aoi is None:
-                    st.error(f"Error crítico: No se pudo recrear la geometría AOI. {recreation_error or ''}")
-                else:
-                    print(f"DEBUG: AOI Recreado Exitosamente (tipo: {type(current_aoi)})")
-                    # --- PROCEDER CON EL PROCESAMIENTO ---
-                    with st.spinner(f"Procesando AOI y generando informe para el período {start_date} a {end_date}... Esto puede tardar unos minutos."):
-                        print("DEBUG: Entrando al bloque spinner...")
-                        try:
-                            print("DEBUG: Ejecutando limpieza de archivos...")
-                            helpers.cleanup_temp_files()
-
-                            print(f"DEBUG: Llamando a process_aoi con AOI recreado y fechas {start_date}-{end_date}...")
-                            # Usa la geometría recién creada
-                            processing_results = gee_processor.process_aoi(current_aoi, start_date, end_date)
-                            print(f"DEBUG: Resultado de process_aoi: {processing_results}")
-
-                            # ... (resto del código de procesamiento y generación de PDF como estaba antes) ...
-                            # ... (asegúrate de actualizar st.session_state.pdf_report_path si la generación es exitosa) ...
-                            if processing_results and 'error' not in processing_results:
-                                st.info("✅ Procesamiento GEE completado. Generando PDF...")
-                                pdf_report_path = pdf_generator.generate_pdf_report(processing_results)
-                                if pdf_report_path and os.path.exists(pdf_report_path):
-                                    st.success("🎉 ¡Informe PDF generado con éxito!")
-                                    st.session_state.pdf_report_path = pdf_report_path # Guarda para descarga
-                                else:
-                                    st.error("❌ Error al generar el archivo PDF del informe.")
-                                    st.session_state.pdf_report_path = None
-                            elif processing_results and 'error' in processing_results:
-                                st.error(f"❌ Error durante el procesamiento: {processing_results['error']}")
-                                st.session_state.pdf_report_path = None
-                            else:
-                                st.error("❌ Error desconocido durante el procesamiento GEE.")
-                                st.session_state.pdf_report_path = None
-
-                        except ee.EEException as e:
-                            # ... (manejo de excepciones como estaba) ...
-                            st.session_state.pdf_report_path = None
-                        except Exception as e:
-                            # ... (manejo de excepciones como estaba) ...
-                            st.session_state.pdf_report_path = None
-                    print("DEBUG: Saliendo del bloque spinner.")
-
-            except Exception as geo_rec_error:
-                st.error(f"Error inesperado durante la recreación de la geometría AOI: {geo_rec_error}")
-                print(f"DEBUG: EXCEPCIÓN en recreación AOI: {geo_rec_error}")
+                # El informe corre en el pool de jobs compartido; envíos idénticos
+                # en curso (mismo AOI, período y parámetros) se unen al mismo job.
+                dedup_key = report_pipeline.report_cache_key(
+                    st.session_state.aoi_type, st.session_state.aoi_params, start_date, end_date, CLOUD_COVER_MAX, report_options)
+                st.session_state.job_id = jobs.get_job_manager().submit(
+                    report_pipeline.generate_report,
+                    st.session_state.aoi_type, dict(st.session_state.aoi_params), start_date, end_date, CLOUD_COVER_MAX,
+                    options=report_options, previews=True, dedup_key=dedup_key)
+                st.session_state.pdf_report = None
+                st.session_state.report_maps = None
+                st.session_state.report_export = None
+                st.session_state.export_download_ready = False
+            except Exception as submit_error:
+                st.error(f"Error inesperado al encolar el informe: {submit_error}")
+
+def show_maps(images, titles, caption=None):
+    """Muestra los mapas (PNG en bytes o rutas) en una fila de columnas."""
+    columns = st.columns(len(images) or 1)
+    for column, (key, image) in zip(columns, images.items()):
+        column.image(image, caption=titles.get(key, key.upper()))
+    if caption:
+        st.caption(caption)
 
-# --- Download Button ---
-# This part should appear *after* the button is pressed and report_data is populated
-# We use session state to keep track of the generated PDF path across reruns
-if 'pdf_report_path' not in st.session_state:
-    st.session_state.pdf_report_path = None
 
-if report_data: # If generation was successful in the latest run
-    st.session_state.pdf_report_path = report_data
+# --- Job Status Polling ---
+if st.session_state.job_id:
+    job = jobs.get_job_manager().get(st.session_state.job_id)
+    if job is None:
+        st.warning("El job del informe ya no existe en el servidor. Genera el informe de nuevo.")
+        st.session_state.job_id = None
+    elif not job.finished:
+        status = job.to_dict()
+        st.progress(status['progress'], text=f"{status['message']} ({start_date} a {end_date})")
+        # Fase 1: vistas previas de baja resolución mientras se generan los mapas completos y el PDF
+        if job.preview:
+            show_maps(job.preview['images'], job.preview['titles'],
+                      f"Vista previa de la escena {job.preview['image_id']} ({job.preview['image_date']}, "
+                      f"{job.preview['cloud_cover']:.1f}% nubes). Si no sirve, cancela antes de los renders completos.")
+        # Otras sesiones pueden estar esperando el mismo job (envío deduplicado):
+        # solo se cancela si esta era la última; si no, esta sesión deja de seguirlo
+        if st.button("✖️ Cancelar informe") and not jobs.get_job_manager().cancel(job.id) and not job.finished:
+            st.session_state.job_id = None
+            st.info("Dejaste de seguir el informe; sigue en curso para otras sesiones.")
+        else:
+            time.sleep(JOB_POLL_SECONDS)
+            st.rerun()
+    else:
+        if job.status == jobs.STATUS_DONE:
+            if job.result.get('from_cache'):
+                st.success("🎉 ¡Informe recuperado del caché!")
+            else:
+                st.success("🎉 ¡Informe PDF generado con éxito!")
+            # Guarda los bytes en sesión: el download_button los sirve sin releer el disco
+            st.session_state.pdf_report = {'bytes': job.result['pdf_bytes'], 'filename': job.result['pdf_filename']}
+            # Los mapas a resolución completa reemplazan a las vistas previas
+            final_results = job.result['results']
+            st.session_state.report_maps = {
+                'images': final_results.get('images') or final_results.get('image_paths') or {},
+                'titles': {key: key.upper() for key in final_results.get('image_filenames', {})},
+            }
+            st.session_state.report_export = final_results.get('export')
+            st.session_state.export_download_ready = False
+        elif job.status == jobs.STATUS_CANCELLED:
+            st.info("Informe cancelado.")
+        else:
+            st.error(f"❌ Error durante el procesamiento: {job.error}")
+        st.session_state.job_id = None
 
-if st.session_state.pdf_report_path and os.path.exists(st.session_state.pdf_report_path):
+# --- Download Button ---
+# El PDF vive en memoria (session_state) desde que terminó el job; cada rerun
+# lo sirve directamente sin volver a leerlo del disco.
+if st.session_state.report_maps and st.session_state.report_maps['images']:
+    show_maps(st.session_state.report_maps['images'], st.session_state.report_maps['titles'])
+
+if st.session_state.pdf_report:
     st.markdown("---")
     st.subheader("Descargar Informe")
-    with open(st.session_state.pdf_report_path, "rb") as pdf_file:
-        pdf_bytes = pdf_file.read()
-
     st.download_button(
         label="⬇️ Descargar PDF",
-        data=pdf_bytes,
-        file_name=os.path.basename(st.session_state.pdf_report_path),
+        data=st.session_state.pdf_report['bytes'],
+        file_name=st.session_state.pdf_report['filename'],
         mime="application/pdf",
-        on_click=lambda: setattr(st.session_state, 'pdf_report_path', None) # Clear path after download attempt
+        on_click=lambda: setattr(st.session_state, 'pdf_report', None) # Clear report after download attempt
     )
-    st.caption("El archivo se eliminará del servidor después de la descarga o al generar un nuevo informe.")
-else:
-    # Optional: Clear the state if the file doesn't exist anymore
-     if st.session_state.pdf_report_path:
-          st.session_state.pdf_report_path = None
+    st.caption("El informe queda en caché: regenerar el mismo AOI y período lo devuelve al instante.")
+
+_export = st.session_state.report_export
+if _export and _export.get('error'):
+    st.warning(f"No se pudo exportar los rásters de índices: {_export['error']}")
+elif _export and _export.get('path'):
+    # El export puede pesar cientos de MB: st.download_button lee el archivo entero en cada rerun en que
+    # se dibuja, así que solo se arma después de pedirlo y se desarma al descargar
+    if not os.path.exists(_export['path']):
+        st.warning("El export de índices ya no está en el servidor; genera el informe de nuevo.")
+    elif not st.session_state.export_download_ready:
+        st.button(f"📦 Preparar descarga de índices ({', '.join(_export['bands']).upper()}, {_export['bytes'] / 1e6:.1f} MB)",
+                  on_click=lambda: setattr(st.session_state, 'export_download_ready', True))
+    else:
+        with open(_export['path'], 'rb') as export_file:
+            st.download_button(
+                label=f"⬇️ Descargar índices ({', '.join(_export['bands']).upper()}, {_export['bytes'] / 1e6:.1f} MB)",
+                data=export_file,
+                file_name=os.path.basename(_export['path']),
+                mime='image/tiff' if _export['format'] == 'cog' else 'application/octet-stream',
+                on_click=lambda: setattr(st.session_state, 'export_download_ready', False),
+            )
+    # La georreferencia es un JSON chico: se sirve siempre
+    if _export.get('metadata_path') and os.path.exists(_export['metadata_path']):
+        with open(_export['metadata_path'], 'rb') as metadata_file:
+            st.download_button(label="⬇️ Georreferencia (JSON)", data=metadata_file,
+                               file_name=os.path.basename(_export['metadata_path']), mime='application/json')
+
 
+# --- Estadísticas del caché de resultados ---
+_cache_stats = result_cache.get_default_cache().stats()
+st.sidebar.caption(f"Caché: {_cache_stats['hits']} aciertos / {_cache_stats['misses']} fallos ({_cache_stats['hit_rate']:.0%})")
+if tile_cache.TILE_CACHE_ENABLED:
+    _tile_stats = tile_cache.get_tile_cache().stats()
+    st.sidebar.caption(f"Tiles: {_tile_stats['hit_rate']:.0%} reutilizados, {_tile_stats['bytes'] / 1e6:.0f} MB en caché")
 
 # --- Optional: Display logs or more detailed feedback ---
 # st.expander("Ver Logs (Avanzado)")...
\ No newline at end of file
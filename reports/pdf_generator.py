@@ -1,97 +1,258 @@
 # reports/pdf_generator.py
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from reportlab.lib.units import inch, cm
+from reportlab.platypus import SimpleDocTemplate, Spacer, Table
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.charts.legends import Legend
+from datetime import date
+import io
 import os
 import time
 
-# Ensure data directory exists (where PDF will be saved)
-DATA_DIR = 'data'
-os.makedirs(DATA_DIR, exist_ok=True)
+from reports import templates
+from utils import index_registry
+from utils import storage
+from utils import tracing
 
-def generate_pdf_report(results, filename_prefix="GeoInformeExpress"):
+DATA_DIR = storage.DATA_DIR
+
+def report_filename(results, filename_prefix="GeoInformeExpress"):
+    """Nombre del archivo PDF del informe: <prefijo>_<timestamp de procesamiento>.pdf"""
+    timestamp = results.get('metadata', {}).get('processing_timestamp', time.strftime("%Y%m%d-%H%M%S"))
+    return f"{filename_prefix}_{timestamp}.pdf"
+
+
+def _map_image_source(results, key):
     """
-    Generates a PDF report from the processing results.
-    Saves the PDF to the data/ directory.
-    Returns the path to the generated PDF.
+    Fuente de la imagen de un mapa: bytes PNG en memoria (results['images'])
+    si existen, si no la ruta en disco (results['image_paths']).
+    """
+    png_bytes = results.get('images', {}).get(key)
+    if png_bytes:
+        return png_bytes
+    path = results.get('image_paths', {}).get(key)
+    if path and os.path.exists(path):
+        return path
+    return None
+
+
+def timeseries_chart(series, width=6 * inch, height=3 * inch):
+    """
+    Gráfico de líneas (reportlab.graphics) con la media de cada índice por fecha.
+    El eje X son días desde la primera fecha de la serie; el eje Y cubre el
+    value_range de los índices graficados. Colores y rangos se leen del
+    registro en cada llamada (utils.index_registry).
     """
+    first_day = date.fromisoformat(series[0]['date'])
+    lines = []
+    names = []
+    ranges = []
+    for index in index_registry.INDEXES.values():
+        points = [((date.fromisoformat(row['date']) - first_day).days, row[index.name])
+                  for row in series if row.get(index.name) is not None]
+        if points:
+            lines.append((points, colors.HexColor(index.color)))
+            names.append(index.name)
+            ranges.append(index.value_range)
+
+    drawing = Drawing(width, height)
+    if not lines:
+        return drawing
+    plot = LinePlot()
+    plot.x, plot.y = 40, 40
+    plot.width, plot.height = width - 120, height - 60
+    plot.data = [points for points, _ in lines]
+    for i, (_, color) in enumerate(lines):
+        plot.lines[i].strokeColor = color
+        plot.lines[i].strokeWidth = 1.5
+    plot.yValueAxis.valueMin = min(low for low, _ in ranges)
+    plot.yValueAxis.valueMax = max(high for _, high in ranges)
+    plot.xValueAxis.valueMin = 0
+    plot.xValueAxis.valueMax = max(1, (date.fromisoformat(series[-1]['date']) - first_day).days)
+    plot.xValueAxis.labelTextFormat = '%d'
+    drawing.add(plot)
+    drawing.add(String(plot.x + plot.width / 2, 10, f"Días desde {first_day.isoformat()}", fontSize=8, textAnchor='middle'))
+
+    legend = Legend()
+    legend.x, legend.y = width - 70, height - 30
+    legend.fontSize = 8
+    legend.colorNamePairs = [(color, name) for (_, color), name in zip(lines, names)]
+    drawing.add(legend)
+    return drawing
+
+
+def stats_table(stats, names=None):
+    """Tabla con las estadísticas zonales de cada índice (backend.zonal_stats); `names` fija las filas."""
+    header = ['Índice', 'Media', 'Desv.', 'P10', 'P50', 'P90', 'Umbral', 'Área > umbral']
+    rows = [header]
+    if names is None:
+        names = [index.name for index in index_registry.INDEXES.values() if index.name in stats] or ('NDVI', 'NDWI', 'NBR')
+    for name in names:
+        index_stats = stats.get(name)
+        if not index_stats:
+            rows.append([name] + ['N/A'] * (len(header) - 1))
+            continue
+        percentiles = index_stats['percentiles']
+        rows.append([
+            name,
+            f"{index_stats['mean']:.3f}",
+            f"{index_stats['std']:.3f}" if index_stats.get('std') is not None else 'N/A',
+            f"{percentiles['p10']:.3f}" if percentiles.get('p10') is not None else 'N/A',
+            f"{percentiles['p50']:.3f}" if percentiles.get('p50') is not None else 'N/A',
+            f"{percentiles['p90']:.3f}" if percentiles.get('p90') is not None else 'N/A',
+            f"{index_stats['threshold']:.2f}",
+            f"{index_stats['area_above_ha']:.1f} ha ({index_stats['fraction_above']:.0%})",
+        ])
+    return _styled_table(rows)
+
+
+def _styled_table(rows):
+    table = Table(rows, hAlign='CENTER')
+    table.setStyle(templates.get_report_template().table_style)
+    return table
+
+
+def severity_table(severity):
+    """Área por clase de severidad de quemado (dNBR) de backend.change_detection."""
+    rows = [['Clase', 'dNBR', 'Área', '% del AOI']]
+    for row in severity:
+        low = f"{row['min']:.2f}" if row['min'] is not None else '-inf'
+        high = f"{row['max']:.2f}" if row['max'] is not None else '+inf'
+        rows.append([row['class'], f"[{low}, {high})", f"{row['area_ha']:.1f} ha", f"{row['fraction']:.1%}"])
+    return _styled_table(rows)
+
+
+def build_pdf_report(results):
+    """
+    Construye el PDF del informe completamente en memoria.
+    Returns the PDF as bytes, or None on failure.
+    """
+    with tracing.span('pdf_build') as pdf_span:
+        pdf_bytes = _build_pdf_bytes(results)
+        pdf_span.set(bytes=len(pdf_bytes) if pdf_bytes else 0)
+    return pdf_bytes
+
+
+def _build_pdf_bytes(results):
     timestamp = results.get('metadata', {}).get('processing_timestamp', time.strftime("%Y%m%d-%H%M%S"))
-    pdf_filename = f"{filename_prefix}_{timestamp}.pdf"
-    pdf_filepath = os.path.join(DATA_DIR, pdf_filename)
-    print(f"Generating PDF report: {pdf_filepath}")
+    print("Building PDF report in memory...")
 
     try:
-        doc = SimpleDocTemplate(pdf_filepath)
-        styles = getSampleStyleSheet()
-        story = []
-
-        # --- Title Page ---
-        title_style = styles['h1']
-        title_style.alignment = TA_CENTER
-        story.append(Paragraph("GeoInforme Express - Reporte Satelital", title_style))
-        story.append(Spacer(1, 0.5*inch))
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer)
+        # Estilos y flowables estáticos prearmados (reports.templates); nada compartido se modifica
+        template = templates.get_report_template()
+        story = template.static('title')
 
         # --- Metadata Section ---
         meta = results.get('metadata', {})
-        meta_style = styles['Normal']
-        meta_style.alignment = TA_LEFT
-        story.append(Paragraph(f"<b>Fecha de Procesamiento:</b> {timestamp}", meta_style))
-        story.append(Paragraph(f"<b>Imagen Base:</b> {meta.get('image_id', 'N/A')}", meta_style))
-        story.append(Paragraph(f"<b>Fecha Imagen:</b> {meta.get('image_date', 'N/A')}", meta_style))
-        story.append(Paragraph(f"<b>Cobertura Nubosa Estimada:</b> {meta.get('cloud_cover', 'N/A'):.2f}%", meta_style))
+        story.append(template.paragraph(f"<b>Fecha de Procesamiento:</b> {timestamp}"))
+        story.append(template.paragraph(f"<b>Imagen Base:</b> {meta.get('image_id', 'N/A')}"))
+        story.append(template.paragraph(f"<b>Fecha Imagen:</b> {meta.get('image_date', 'N/A')}"))
+        story.append(template.paragraph(f"<b>Cobertura Nubosa Estimada:</b> {meta.get('cloud_cover', 'N/A'):.2f}%"))
         # Add AOI info - maybe a small map or coordinates? For MVP, just text.
-        # story.append(Paragraph(f"<b>Área de Interés (Bounds):</b> {meta.get('aoi_bounds', 'N/A')}", meta_style))
         story.append(Spacer(1, 0.3*inch))
 
-        # --- Map Sections ---
-        image_paths = results.get('image_paths', {})
-        available_maps = {
-            'rgb': ('Imagen Color Verdadero (RGB)', 'Referencia visual del área.'),
-            'ndvi': ('Índice de Vegetación (NDVI)', 'Valores altos (verde) indican vegetación vigorosa. Valores bajos (marrón/blanco) indican suelo desnudo, agua o vegetación estresada.'),
-            'ndwi': ('Índice de Agua (NDWI)', 'Valores altos (azul) indican presencia de agua o alta humedad. Valores bajos (rojo/amarillo) indican áreas secas.'),
-            'nbr': ('Ratio de Quemado Normalizado (NBR)', 'Valores bajos indican áreas quemadas recientemente (pre-incendio vs post-incendio para dNBR). Este NBR simple puede correlacionarse con estrés hídrico o áreas quemadas.')
-        }
+        # --- Zonal Statistics Section ---
+        stats = results.get('stats')
+        if stats:
+            story.extend(template.static('section_stats'))
+            story.append(template.paragraph(f"Estadísticas sobre los píxeles del AOI ({stats.get('aoi_area_ha', 0):.1f} ha)."))
+            story.append(Spacer(1, 0.2*inch))
+            story.append(stats_table(stats))
+            story.append(Spacer(1, 0.3*inch))
 
-        img_width = 6 * inch # Adjust as needed
+        # --- Time Series Section ---
+        series = results.get('timeseries')
+        if series:
+            story.extend(template.static('section_timeseries'))
+            story.append(template.paragraph(f"Media de cada índice en el AOI para las {len(series)} fechas con escenas disponibles en el período (nubes enmascaradas con SCL)."))
+            story.append(Spacer(1, 0.2*inch))
+            story.append(timeseries_chart(series))
+            story.append(Spacer(1, 0.3*inch))
 
-        for key, (title, description) in available_maps.items():
-            if key in image_paths and os.path.exists(image_paths[key]):
-                story.append(Paragraph(f"<b>{title}</b>", styles['h2']))
-                story.append(Spacer(1, 0.1*inch))
-                story.append(Paragraph(description, styles['Normal']))
+        # --- Change Detection Section ---
+        change = results.get('change')
+        if change:
+            story.extend(template.static('section_change'))
+            pre_start, pre_end = change.get('pre_window', ['N/A', 'N/A'])
+            if change.get('error'):
+                story.append(template.paragraph(f"No se pudo calcular el composite de referencia {pre_start} a {pre_end}: {change['error']}"))
+            else:
+                baseline_note = "recuperado del caché" if change.get('baseline_cached') else "calculado en esta corrida"
+                story.append(template.paragraph(
+                    f"Composite de referencia (mediana sin nubes) de {pre_start} a {pre_end}, {baseline_note}, "
+                    f"comparado con la escena post-evento del {change.get('post_date', 'N/A')}. "
+                    f"Diferencias calculadas como pre - post."))
                 story.append(Spacer(1, 0.2*inch))
+                change_stats = change.get('stats') or {}
+                story.append(stats_table(change_stats, [f"D{key.upper()}" for key in change.get('indices', [])]))
+                if change.get('severity'):
+                    story.append(Spacer(1, 0.2*inch))
+                    story.append(template.paragraph("Severidad de quemado (clases dNBR USGS):"))
+                    story.append(Spacer(1, 0.1*inch))
+                    story.append(severity_table(change['severity']))
+            story.append(Spacer(1, 0.3*inch))
 
-                # Add image, handling potential size issues
+        # --- Map Sections ---
+        # Títulos y descripciones de cada índice: utils.index_registry
+        available_maps = {'rgb': templates.RGB_MAP}
+        for key in meta.get('indices') or index_registry.DEFAULT_INDICES:
+            index = index_registry.get_index(key)
+            available_maps[key] = (index.title, index.description)
+        for key, info in ((change or {}).get('maps') or {}).items():
+            available_maps[key] = (info['title'], info['description'])
+
+        for key, (title, description) in available_maps.items():
+            image_source = _map_image_source(results, key)
+            if image_source is not None:
+                story.extend(template.map_header(key, title, description))
+                # Reducido a la resolución de impresión, con su relación de aspecto real
                 try:
-                    img = Image(image_paths[key], width=img_width, height=img_width * 0.75) # Assume aspect ratio
-                    img.hAlign = 'CENTER'
-                    story.append(img)
+                    story.append(template.map_image(image_source))
                 except Exception as img_err:
-                    print(f"Error adding image {image_paths[key]} to PDF: {img_err}")
-                    story.append(Paragraph(f"[Error al cargar imagen: {key}]", styles['Italic']))
+                    print(f"Error adding image {key} to PDF: {img_err}")
+                    story.append(template.paragraph(f"[Error al cargar imagen: {key}]", 'Italic'))
 
                 story.append(Spacer(1, 0.3*inch))
-                # story.append(PageBreak()) # Add page break between maps if desired
 
             else:
                  print(f"Map image for {key} not found or path missing. Skipping in PDF.")
 
 
         # --- Footer/Disclaimer ---
-        story.append(Spacer(1, 0.5*inch))
-        disclaimer_style = styles['Italic']
-        disclaimer_style.fontSize = 8
-        story.append(Paragraph("Este es un informe generado automáticamente por GeoInforme Express MVP.", disclaimer_style))
-        story.append(Paragraph("Los resultados son preliminares y dependen de la calidad y disponibilidad de las imágenes satelitales.", disclaimer_style))
+        story.extend(template.static('disclaimer'))
 
-        # Build the PDF
-        doc.build(story)
-        print(f"Successfully generated PDF: {pdf_filepath}")
-        return pdf_filepath
+        # Build the PDF (streams binarios solo durante este build: reports.templates.stream_encoding)
+        with templates.stream_encoding():
+            doc.build(story)
+        pdf_bytes = buffer.getvalue()
+        print(f"Successfully built PDF in memory ({len(pdf_bytes)} bytes)")
+        return pdf_bytes
 
     except Exception as e:
         print(f"ERROR generating PDF report: {e}")
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None
+
+
+def generate_pdf_report(results, filename_prefix="GeoInformeExpress", output_dir=None, renderer=None):
+    """
+    Generates a PDF report from the processing results.
+    Saves the PDF to output_dir (by default the current job workspace, see
+    utils.storage) - disk sink over build_pdf_report. The write is atomic.
+    `renderer(results) -> bytes` replaces build_pdf_report, e.g. the
+    multi-process reports.render_pool.PdfRenderPool.render used by batch jobs.
+    Returns the path to the generated PDF.
+    """
+    output_dir = output_dir or storage.current_workspace().path
+    pdf_filepath = os.path.join(output_dir, report_filename(results, filename_prefix))
+    print(f"Generating PDF report: {pdf_filepath}")
+    pdf_bytes = (renderer or build_pdf_report)(results)
+    if pdf_bytes is None:
+        return None
+    storage.atomic_write(pdf_filepath, pdf_bytes)
+    print(f"Successfully generated PDF: {pdf_filepath}")
+    return pdf_filepath
@@ -0,0 +1,76 @@
+# reports/render_pool.py
+# Render de PDFs en un pool de procesos para jobs masivos. Con los resultados
+# de GEE en caché el build del PDF (reportlab, Python puro) pasa a ser el
+# cuello de botella y no escala con hilos por el GIL: cada worker es un proceso
+# con su propia plantilla (reports.templates) y su caché de imágenes, armados
+# una sola vez al arrancar.
+#
+# Uso:
+#   with PdfRenderPool(workers=4) as pool:
+#       pdf_bytes = pool.render(results)          # desde cualquier hilo
+#       pdf_generator.generate_pdf_report(results, output_dir=..., renderer=pool.render)
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from reports import pdf_generator
+from reports import templates
+from utils import tracing
+
+PDF_WORKERS = int(os.environ.get('GEOINFORME_PDF_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+# 'spawn': los workers no heredan locks tomados por hilos del proceso padre (el batch usa hilos)
+START_METHOD = os.environ.get('GEOINFORME_PDF_START_METHOD', 'spawn')
+
+_PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+
+def count_pages(pdf_bytes):
+    """Cantidad de páginas de un PDF generado por reportlab (cuenta los objetos /Page)."""
+    return len(_PAGE_PATTERN.findall(pdf_bytes or b''))
+
+
+def _init_worker():
+    templates.get_report_template() # Estilos y flowables estáticos listos antes del primer informe
+
+
+def _render(results):
+    return pdf_generator.build_pdf_report(results)
+
+
+class PdfRenderPool:
+    """
+    Pool de procesos que construye PDFs (bytes) a partir de resultados de
+    process_aoi. render() es seguro desde varios hilos: el batch lo usa como
+    `renderer` de generate_pdf_report.
+    """
+
+    def __init__(self, workers=PDF_WORKERS, start_method=START_METHOD):
+        self.workers = max(1, workers)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context(start_method),
+                                             initializer=_init_worker)
+
+    def submit(self, results):
+        """Encola el build; devuelve un Future con los bytes del PDF (o None si falló)."""
+        return self._executor.submit(_render, results)
+
+    def render(self, results):
+        with tracing.span('pdf_build_pool', workers=self.workers) as pdf_span:
+            pdf_bytes = self.submit(results).result()
+            pdf_span.set(bytes=len(pdf_bytes) if pdf_bytes else 0)
+        return pdf_bytes
+
+    def map(self, results_list):
+        """Construye varios PDFs en paralelo; devuelve los bytes en el mismo orden."""
+        return list(self._executor.map(_render, results_list))
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
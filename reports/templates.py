@@ -0,0 +1,231 @@
+# reports/templates.py
+# Capa de plantillas del informe PDF. Los estilos, el estilo de las tablas y
+# los flowables estáticos (título, encabezados de sección, título y descripción
+# de cada mapa, pie) se construyen UNA vez por proceso (get_report_template());
+# cada informe recibe copias, así ningún build modifica estado compartido.
+#
+# Los mapas se preparan para imprimir: se reducen a PRINT_DPI sobre el ancho
+# en que se dibujan y se vuelven a codificar como PNG (sin pérdida, con la
+# transparencia de los píxeles sin datos). GEOINFORME_PDF_IMAGE_FORMAT=jpeg
+# los aplana sobre blanco y los codifica como JPEG, que reportlab embebe tal
+# cual (un PNG lo decodifica y recomprime en cada build): más rápido, pero
+# con pérdida en las paletas de los índices.
+# El resultado queda en un caché LRU por contenido: informes que reutilizan
+# los mismos mapas (resultados del caché, reintentos) no vuelven a procesarlos.
+# Los streams van en binario (sin ASCII85): sin la extensión C de reportlab
+# ese encoding se hace en Python puro y era la mayor parte del build. La
+# opción global de reportlab se cambia solo durante los builds de este
+# renderer (stream_encoding) y se restaura al terminar.
+import contextlib
+import copy
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image as PILImage
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.styles import ParagraphStyle, StyleSheet1, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Image, Paragraph, Spacer, TableStyle
+
+from utils import index_registry
+
+PRINT_DPI = int(os.environ.get('GEOINFORME_PDF_DPI', 150))
+IMAGE_FORMAT = os.environ.get('GEOINFORME_PDF_IMAGE_FORMAT', 'png').lower()  # 'png' o 'jpeg' (con pérdida, más rápido)
+JPEG_QUALITY = int(os.environ.get('GEOINFORME_PDF_JPEG_QUALITY', 90))
+IMAGE_CACHE_BYTES = int(os.environ.get('GEOINFORME_PDF_IMAGE_CACHE_BYTES', 64 * 1024 * 1024))
+ASCII85 = os.environ.get('GEOINFORME_PDF_ASCII85', '0') == '1'
+
+MAP_WIDTH = 6 * inch
+MAP_MAX_HEIGHT = 7.5 * inch  # AOIs altos: se achica el ancho para que el mapa entre en la página
+
+SECTION_TITLES = {
+    'stats': "Estadísticas por Índice",
+    'timeseries': "Evolución Temporal de Índices",
+    'change': "Detección de Cambios (pre/post evento)",
+}
+DISCLAIMER = (
+    "Este es un informe generado automáticamente por GeoInforme Express MVP.",
+    "Los resultados son preliminares y dependen de la calidad y disponibilidad de las imágenes satelitales.",
+)
+RGB_MAP = ('Imagen Color Verdadero (RGB)', 'Referencia visual del área.')
+
+
+# reportlab lee rl_config.useA85 (global) en cada build: los builds que lo cambian se serializan
+_stream_encoding_lock = threading.RLock()
+
+
+@contextlib.contextmanager
+def stream_encoding(ascii85=ASCII85):
+    """
+    Fija la codificación de los streams del PDF (ASCII85 o binario) mientras
+    dura el bloque y restaura la configuración de reportlab al salir.
+    """
+    with _stream_encoding_lock:
+        previous = rl_config.useA85
+        rl_config.useA85 = 1 if ascii85 else 0
+        try:
+            yield
+        finally:
+            rl_config.useA85 = previous
+
+
+class ImageCache:
+    """LRU en memoria de mapas ya preparados para el PDF, acotado en bytes."""
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # clave -> (bytes, ancho px, alto px)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._bytes += len(entry[0])
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (data, _, _) = self._entries.popitem(last=False)
+                self._bytes -= len(data)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def prepare_image(data, max_width_px, max_height_px, image_format=IMAGE_FORMAT, quality=JPEG_QUALITY):
+    """
+    Reduce una imagen (bytes PNG) para que no supere max_width_px x
+    max_height_px y la codifica para embeber. Devuelve (bytes, ancho, alto).
+    """
+    with PILImage.open(io.BytesIO(data)) as image:
+        image.load()
+        scale = min(1.0, max_width_px / image.width, max_height_px / image.height)
+        if scale < 1.0:
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                 PILImage.LANCZOS)
+        if image_format == 'jpeg':
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                flat = PILImage.new('RGB', image.size, (255, 255, 255))
+                flat.paste(image, mask=image.getchannel('A'))  # Sin datos (transparente) queda blanco
+                image = flat
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+        buffer = io.BytesIO()
+        if image_format == 'jpeg':
+            image.save(buffer, format='JPEG', quality=quality)
+        else:
+            image.save(buffer, format='PNG')
+        return buffer.getvalue(), image.width, image.height
+
+
+class ReportTemplate:
+    """
+    Estilos y flowables estáticos del informe, construidos una vez. Los
+    métodos devuelven flowables nuevos (o copias) en cada llamada: una misma
+    plantilla sirve a builds sucesivos o concurrentes.
+    """
+
+    def __init__(self, dpi=PRINT_DPI, image_format=IMAGE_FORMAT, image_cache=None):
+        self.dpi = dpi
+        self.image_format = image_format
+        self.image_cache = image_cache or ImageCache()
+
+        base = getSampleStyleSheet()
+        self.styles = StyleSheet1()
+        for name, alias in (('Normal', None), ('Italic', None), ('Heading2', 'h2')):
+            self.styles.add(base[name], alias=alias)
+        # Estilos derivados: los de getSampleStyleSheet() no se modifican
+        self.styles.add(ParagraphStyle('ReportTitle', parent=base['h1'], alignment=TA_CENTER))
+        self.styles.add(ParagraphStyle('Disclaimer', parent=base['Italic'], fontSize=8))
+
+        self.table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ])
+
+        # Prototipos: el parseo del markup de cada Paragraph se hace una sola vez
+        self._static = {
+            'title': [Paragraph("GeoInforme Express - Reporte Satelital", self.styles['ReportTitle']),
+                      Spacer(1, 0.5 * inch)],
+            'disclaimer': [Spacer(1, 0.5 * inch)] + [Paragraph(text, self.styles['Disclaimer']) for text in DISCLAIMER],
+        }
+        for key, title in SECTION_TITLES.items():
+            self._static[f'section_{key}'] = [Paragraph(f"<b>{title}</b>", self.styles['h2']), Spacer(1, 0.1 * inch)]
+        self._map_headers = {}
+        self._map_headers_lock = threading.Lock()
+        self.map_header('rgb', *RGB_MAP)
+        for key, index in index_registry.INDEXES.items():
+            self.map_header(key, index.title, index.description)
+
+    def static(self, name):
+        """Copias de los flowables estáticos `name` ('title', 'disclaimer', 'section_stats', ...)."""
+        return [copy.copy(flowable) for flowable in self._static[name]]
+
+    def map_header(self, key, title, description):
+        """Título y descripción de un mapa; se construyen la primera vez y luego se copian."""
+        cache_key = (key, title, description)
+        with self._map_headers_lock:
+            header = self._map_headers.get(cache_key)
+            if header is None:
+                header = [Paragraph(f"<b>{title}</b>", self.styles['h2']), Spacer(1, 0.1 * inch),
+                          Paragraph(description, self.styles['Normal']), Spacer(1, 0.2 * inch)]
+                self._map_headers[cache_key] = header
+        return [copy.copy(flowable) for flowable in header]
+
+    def paragraph(self, text, style='Normal'):
+        return Paragraph(text, self.styles[style])
+
+    def map_image(self, source, width=MAP_WIDTH, max_height=MAP_MAX_HEIGHT):
+        """
+        Flowable de un mapa (bytes PNG o ruta), reducido a self.dpi y con la
+        relación de aspecto real de la imagen.
+        """
+        if not isinstance(source, (bytes, bytearray)):
+            with open(source, 'rb') as f:
+                source = f.read()
+        max_px = (round(width / inch * self.dpi), round(max_height / inch * self.dpi))
+        key = (hashlib.sha1(source).hexdigest(), max_px, self.image_format)
+        entry = self.image_cache.get(key)
+        if entry is None:
+            entry = prepare_image(source, *max_px, image_format=self.image_format)
+            self.image_cache.put(key, entry)
+        data, width_px, height_px = entry
+        draw_width = min(width, max_height * width_px / height_px)
+        image = Image(io.BytesIO(data), width=draw_width, height=draw_width * height_px / width_px)
+        image.hAlign = 'CENTER'
+        return image
+
+
+_default_template = None
+_default_template_lock = threading.Lock()
+
+
+def get_report_template():
+    """Devuelve la ReportTemplate compartida por el proceso."""
+    global _default_template
+    with _default_template_lock:
+        if _default_template is None:
+            _default_template = ReportTemplate()
+        return _default_template
@@ -0,0 +1,60 @@
+# tests/test_batch.py
+# Manifiesto de reanudación e ids de feature del modo masivo (sin GEE: process_feature simulado).
+import json
+
+import pytest
+
+from backend import batch
+
+
+def square(x, y, size=0.01):
+    return {'type': 'Polygon', 'coordinates': [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+def write_collection(path, features):
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': [
+        dict({'type': 'Feature', 'geometry': geometry}, **({'id': fid} if fid is not None else {}))
+        for fid, geometry in features]}))
+    return str(path)
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    """Registra (id, geometría) de cada feature procesado."""
+    calls = []
+
+    def fake_process_feature(feature_id, geometry, *args):
+        calls.append((feature_id, geometry['coordinates'][0][0]))
+        return f'{feature_id}.pdf'
+
+    monkeypatch.setattr(batch, 'process_feature', fake_process_feature)
+    return calls
+
+
+def test_rerun_skips_features_already_done(tmp_path, processed):
+    source = write_collection(tmp_path / 'a.geojson', [(None, square(0, 0)), (None, square(1, 1))])
+    output = str(tmp_path / 'out')
+    assert batch.run_batch(source, '2025-01-01', '2025-01-31', output, workers=1)['done'] == 2
+    summary = batch.run_batch(source, '2025-01-01', '2025-01-31', output, workers=1)
+    assert summary['skipped'] == 2 and summary['done'] == 0
+    assert len(processed) == 2
+
+
+def test_other_file_or_options_do_not_inherit_progress(tmp_path, processed):
+    output = str(tmp_path / 'out')
+    first = write_collection(tmp_path / 'a.geojson', [(None, square(0, 0)), (None, square(1, 1))])
+    batch.run_batch(first, '2025-01-01', '2025-01-31', output, workers=1)
+    # Mismos ids posicionales ("0", "1") y mismo período, pero otras geometrías
+    second = write_collection(tmp_path / 'b.geojson', [(None, square(5, 5)), (None, square(6, 6))])
+    assert batch.run_batch(second, '2025-01-01', '2025-01-31', output, workers=1)['done'] == 2
+    # Mismo archivo con otro umbral de nubes
+    assert batch.run_batch(second, '2025-01-01', '2025-01-31', output, workers=1, cloud_cover_max=50)['done'] == 2
+    assert [coords for _, coords in processed] == [[0, 0], [1, 1], [5, 5], [6, 6], [5, 5], [6, 6]]
+
+
+@pytest.mark.parametrize('ids', [['a', 'a'], ['lote/1', 'lote_1'], ['']])
+def test_clashing_feature_ids_are_rejected(tmp_path, processed, ids):
+    source = write_collection(tmp_path / 'c.geojson', [(fid, square(i, i)) for i, fid in enumerate(ids)])
+    with pytest.raises(ValueError):
+        batch.run_batch(source, '2025-01-01', '2025-01-31', str(tmp_path / 'out'), workers=1)
+    assert processed == []
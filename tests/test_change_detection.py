@@ -0,0 +1,32 @@
+# tests/test_change_detection.py
+# Resumen de cambios: estadísticas y severidad dNBR solo dentro del polígono del AOI.
+import numpy as np
+import pytest
+
+from backend import change_detection
+from backend import zonal_stats
+from utils import geometry
+
+
+def test_change_report_ignores_pixels_outside_the_aoi():
+    aoi = geometry.AOIGeometry.circle(-36.82, -73.05, 3000)
+    mask = zonal_stats.aoi_mask(aoi.geometry, aoi.region, 64, 64)
+    # Dentro del círculo: severidad moderada-alta; en las esquinas del bbox: regeneración
+    dnbr = np.where(mask, 0.5, -0.5).astype(np.float32)
+    change = {'delta': {'nbr': dnbr}, 'baseline_cached': True}
+
+    summary, images = change_detection.change_report(change, aoi.region, '2025-01-01', '2025-01-31', '2025-02-15',
+                                                     aoi.geometry)
+    assert summary['stats']['DNBR']['mean'] == pytest.approx(0.5)
+    assert summary['stats']['DNBR']['fraction_above'] == 1.0
+    assert summary['stats']['aoi_area_ha'] == pytest.approx(aoi.area_m2 / zonal_stats.M2_PER_HA)
+    severity = {row['class']: row['fraction'] for row in summary['severity']}
+    assert severity['Severidad moderada-alta'] == 1.0 and severity['Regeneración'] == 0.0
+    assert set(images) == {'dnbr'}
+
+
+def test_severity_breakdown_without_mask_counts_the_whole_grid():
+    dnbr = np.array([[0.0, 0.7], [np.nan, 0.2]], dtype=np.float32)
+    severity = {row['class']: row for row in change_detection.severity_breakdown(dnbr, 100.0)}
+    assert severity['No quemado']['fraction'] == pytest.approx(1 / 3)
+    assert severity['Severidad alta']['area_ha'] == pytest.approx(100.0 / zonal_stats.M2_PER_HA)
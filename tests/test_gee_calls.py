@@ -0,0 +1,121 @@
+# tests/test_gee_calls.py
+# Token bucket, backoff con jitter y circuit breaker de las llamadas a GEE (reloj falso).
+import random
+
+import ee
+import pytest
+
+from utils import gee_calls
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_burst_then_waits_for_refill():
+    clock = FakeClock()
+    bucket = gee_calls.TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+    # Tras una pausa larga el bucket se llena hasta la capacidad, no más
+    clock.now += 100
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.sleeps) == 1
+
+
+def test_backoff_delay_stays_within_jittered_cap():
+    random.seed(0)
+    for attempt in range(10):
+        ceiling = min(gee_calls.MAX_BACKOFF_SECONDS, gee_calls.BASE_BACKOFF_SECONDS * 2 ** attempt)
+        delays = [gee_calls.backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= d <= ceiling for d in delays)
+        assert max(delays) > ceiling / 2  # Jitter completo: no colapsa en un valor fijo
+    assert gee_calls.backoff_delay(50, base=1, cap=5) <= 5
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = gee_calls.CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=clock)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(gee_calls.CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 10
+    breaker.before_call()  # Llamada de prueba
+    assert breaker.state == breaker.HALF_OPEN
+    with pytest.raises(gee_calls.CircuitOpenError):
+        breaker.before_call()  # Solo una prueba a la vez
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_breaker():
+    clock = FakeClock()
+    breaker = gee_calls.CircuitBreaker(failure_threshold=1, reset_seconds=10, clock=clock)
+    breaker.record_failure()
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    clock.now += 5
+    with pytest.raises(gee_calls.CircuitOpenError):
+        breaker.before_call()
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    clock = FakeClock()
+    breaker = gee_calls.CircuitBreaker(failure_threshold=3, reset_seconds=10, clock=clock)
+    monkeypatch.setattr(gee_calls, 'circuit_breaker', breaker)
+    monkeypatch.setattr(gee_calls, 'rate_limiter', gee_calls.TokenBucket(1000, 1000, clock=clock, sleep=clock.sleep))
+    monkeypatch.setattr(gee_calls.time, 'sleep', clock.sleep)
+    return breaker, clock
+
+
+def fail_with(message):
+    def fn():
+        raise ee.EEException(message)
+    return fn
+
+
+def test_non_retryable_error_leaves_breaker_unchanged(breaker):
+    breaker, _ = breaker
+    for _ in range(2):
+        with pytest.raises(ee.EEException):
+            gee_calls.call_with_retry(fail_with('503 Service Unavailable'), max_attempts=1)
+    with pytest.raises(ee.EEException):
+        gee_calls.call_with_retry(fail_with('Image.select: Band not found'), max_attempts=3)
+    # El error de parámetros no reinició el conteo: un fallo transitorio más abre el breaker
+    with pytest.raises(ee.EEException):
+        gee_calls.call_with_retry(fail_with('503 Service Unavailable'), max_attempts=1)
+    assert breaker.state == breaker.OPEN
+
+
+def test_non_retryable_probe_keeps_breaker_half_open(breaker):
+    breaker, clock = breaker
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 10
+    with pytest.raises(ee.EEException):
+        gee_calls.call_with_retry(fail_with('Invalid argument'), max_attempts=1)
+    assert breaker.state == breaker.HALF_OPEN
+    assert gee_calls.call_with_retry(lambda: 'ok') == 'ok'  # La prueba quedó libre
+    assert breaker.state == breaker.CLOSED
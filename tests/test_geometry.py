@@ -0,0 +1,114 @@
+# tests/test_geometry.py
+# Área geodésica, círculo, simplificación y rasterizado del motor de geometría en el cliente.
+import math
+
+import numpy as np
+import pytest
+
+from utils import geometry
+
+R = geometry.EARTH_RADIUS_M
+
+
+def rectangle(xmin, ymin, xmax, ymax):
+    return [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * R * math.asin(math.sqrt(h))
+
+
+@pytest.mark.parametrize('ymin, ymax', [(0, 1), (-35, -34), (60, 61)])
+def test_area_of_lat_lon_cell(ymin, ymax):
+    # Celda de 1° en la esfera: R² Δλ (sin φ2 - sin φ1)
+    expected = R ** 2 * math.radians(1) * (math.sin(math.radians(ymax)) - math.sin(math.radians(ymin)))
+    ring = rectangle(-58, ymin, -57, ymax)
+    assert geometry.ring_area_m2(ring) == pytest.approx(expected, rel=1e-9)
+    assert geometry.ring_area_m2(ring[::-1]) == pytest.approx(expected, rel=1e-9)  # Sin signo
+
+
+def test_area_discounts_holes_and_sums_multipolygons():
+    outer, hole = rectangle(0, 0, 1, 1), rectangle(0.25, 0.25, 0.75, 0.75)
+    cell = geometry.ring_area_m2(outer)
+    with_hole = geometry.area_m2({'type': 'Polygon', 'coordinates': [outer, hole]})
+    assert with_hole == pytest.approx(cell - geometry.ring_area_m2(hole))
+    assert with_hole == pytest.approx(0.75 * cell, rel=1e-3)
+    multi = {'type': 'MultiPolygon', 'coordinates': [[outer, hole], [rectangle(2, 0, 3, 1)]]}
+    assert geometry.area_m2(multi) == pytest.approx(with_hole + cell, rel=1e-4)
+
+
+@pytest.mark.parametrize('lat, lon, radius_m', [(-34.6, -58.4, 1000), (0, 0, 5000), (70, 20, 250)])
+def test_geodesic_circle_radius_and_area(lat, lon, radius_m):
+    ring = geometry.geodesic_circle(lat, lon, radius_m, segments=64)
+    assert len(ring) == 65 and ring[0] == ring[-1]
+    for x, y in ring:
+        assert haversine_m(lon, lat, x, y) == pytest.approx(radius_m, rel=1e-9)
+    # Polígono inscrito de 64 lados: ~0.16 % menos que el casquete esférico
+    cap = 2 * math.pi * R ** 2 * (1 - math.cos(radius_m / R))
+    assert geometry.ring_area_m2(ring) == pytest.approx(cap, rel=3e-3)
+    assert geometry.ring_area_m2(ring) < cap
+
+
+def noisy_ring(n=2000, seed=0):
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    radius = 0.01 + np.random.default_rng(seed).normal(0, 1e-6, n)
+    ring = np.column_stack([-58.4 + radius * np.cos(angles), -34.6 + radius * np.sin(angles)])
+    return np.vstack([ring, ring[:1]])
+
+
+def test_douglas_peucker_keeps_endpoints_and_tolerance():
+    ring = noisy_ring()
+    simplified = geometry.douglas_peucker(ring, 1e-4)
+    assert len(simplified) < len(ring) / 10
+    np.testing.assert_array_equal(simplified[0], ring[0])
+    np.testing.assert_array_equal(simplified[-1], ring[-1])  # El anillo sigue cerrado
+    # Todo vértice descartado queda a menos de la tolerancia del tramo que lo reemplaza
+    kept = [i for i, p in enumerate(ring) if any((p == q).all() for q in simplified)]
+    kept = sorted(set(kept) - {len(ring) - 1}) + [len(ring) - 1]
+    for start, end in zip(kept, kept[1:]):
+        a, b = ring[start], ring[end]
+        d = b - a
+        for p in ring[start + 1:end]:
+            assert abs(d[0] * (p[1] - a[1]) - d[1] * (p[0] - a[0])) / np.hypot(*d) <= 1e-4
+    line = np.array([[0, 0], [1, 0.00001], [2, 0], [3, 5], [4, 0]])
+    np.testing.assert_array_equal(geometry.douglas_peucker(line, 0.001), line[[0, 2, 3, 4]])
+
+
+def test_simplify_ring_never_collapses():
+    triangle = rectangle(0, 0, 1e-6, 1e-6)
+    np.testing.assert_array_equal(geometry.simplify_ring(triangle, 1.0), np.asarray(triangle))
+
+
+def test_simplify_geometry_respects_vertex_budget():
+    polygon = {'type': 'Polygon', 'coordinates': [noisy_ring().tolist(), rectangle(-58.401, -34.601, -58.399, -34.599)]}
+    simplified, tolerance = geometry.simplify_geometry(polygon, max_vertices=200)
+    assert tolerance > 0
+    assert geometry.vertex_count(simplified) <= 200
+    for ring in simplified['coordinates']:
+        assert ring[0] == ring[-1] and len(ring) >= 4
+    light, zero = geometry.simplify_geometry(polygon, max_vertices=10_000)
+    assert light is polygon and zero == 0.0
+
+
+def test_aoi_area_uses_original_geometry():
+    polygon = {'type': 'Polygon', 'coordinates': [noisy_ring().tolist()]}
+    aoi = geometry.AOIGeometry(polygon, max_vertices=100)
+    assert aoi.simplify_tolerance > 0
+    assert aoi.area_m2 == geometry.area_m2(polygon)
+
+
+def test_rasterize_polygon_with_hole():
+    polygon = {'type': 'Polygon', 'coordinates': [rectangle(0, 0, 10, 10), rectangle(3, 3, 7, 7)]}
+    mask = geometry.rasterize(polygon, (0, 0, 10, 10), 10, 10)
+    expected = np.ones((10, 10), dtype=bool)
+    expected[3:7, 3:7] = False
+    np.testing.assert_array_equal(mask, expected)
+
+
+def test_rasterize_is_top_down():
+    top_half = {'type': 'Polygon', 'coordinates': [rectangle(0, 5, 10, 10)]}
+    mask = geometry.rasterize(top_half, (0, 0, 10, 10), 4, 8)
+    assert mask[:4].all() and not mask[4:].any()
+    assert not geometry.rasterize({'type': 'Point', 'coordinates': [1, 1]}, (0, 0, 10, 10), 4, 4).any()
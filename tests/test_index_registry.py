@@ -0,0 +1,40 @@
+# tests/test_index_registry.py
+# Las fórmulas de los índices se compilan como aritmética pura, sin eval.
+import numpy as np
+import pytest
+
+from utils import index_registry
+
+
+def test_compile_expression_arithmetic_and_functions():
+    compute = index_registry.compile_expression('-A + 2 * B ** 2 / sqrt(abs(C))', {'A': 'B8', 'B': 'B4', 'C': 'B2'})
+    values = {'A': np.float32(1.0), 'B': np.float32(3.0), 'C': np.float32(-4.0)}
+    assert compute(values) == pytest.approx(-1.0 + 2 * 9 / 2)
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os').system('true')",
+    'A.__class__',
+    'open',
+    'A if B else 1',
+    '[A, B]',
+    'A < B',
+    'sqrt(A, B)',
+    'Z + 1',
+    "'texto'",
+])
+def test_compile_expression_rejects_anything_but_arithmetic(expression):
+    with pytest.raises(ValueError):
+        index_registry.compile_expression(expression, {'A': 'B8', 'B': 'B4'})
+
+
+def test_register_index_validates_formula():
+    with pytest.raises(ValueError):
+        index_registry.SpectralIndex('bad', 'Bad', {'A': 'B8'}, "A + __import__('os').getpid()", {})
+
+
+def test_registered_formulas_match_numpy():
+    bands = {'B2': np.array([500.0]), 'B4': np.array([2000.0]), 'B8': np.array([6000.0])}
+    evi = index_registry.get_index('evi').compute_local(bands)
+    nir, red, blue = 0.6, 0.2, 0.05
+    np.testing.assert_allclose(evi, 2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1), rtol=1e-6)
@@ -0,0 +1,137 @@
+# tests/test_ingest.py
+# Lectura en streaming de GeoJSON (bloques chicos), KML y KMZ.
+import io
+import json
+import zipfile
+
+import pytest
+
+from utils import ingest
+
+SQUARE = [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]
+HOLE = [[0.25, 0.25], [0.75, 0.25], [0.75, 0.75], [0.25, 0.75], [0.25, 0.25]]
+MULTIPOLYGON = {'type': 'MultiPolygon', 'coordinates': [
+    [SQUARE, HOLE],
+    [[[x + 2, y] for x, y in SQUARE]],
+]}
+
+
+def collection(*geometries):
+    return {'type': 'FeatureCollection', 'name': 'lotes', 'features': [
+        {'type': 'Feature', 'id': f'f{i}', 'properties': {'note': 'x' * 50}, 'geometry': g}
+        for i, g in enumerate(geometries)]}
+
+
+def load_json(obj, chunk_size=ingest.CHUNK_SIZE, name='a.geojson'):
+    return ingest.load_geojson(io.BytesIO(json.dumps(obj, indent=2).encode('utf-8')), name, chunk_size)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1 << 20])
+def test_features_split_across_chunks(chunk_size):
+    source = collection({'type': 'Polygon', 'coordinates': [SQUARE]}, MULTIPOLYGON,
+                        {'type': 'Point', 'coordinates': [-58.123456789, -34.5]})
+    upload = load_json(source, chunk_size)
+    assert upload.ids == ['f0', 'f1', 'f2']
+    assert [geometry for _, geometry in upload.iter_features()] == [f['geometry'] for f in source['features']]
+
+
+def test_chunk_boundary_inside_a_number():
+    # El bloque termina en medio de "1.5": raw_decode vería "1" como valor completo
+    text = b'{"type": "Point", "coordinates": [1.5, 2.25]}'
+    cut = text.index(b'1.5') + 1
+    upload = ingest.load_geojson(io.BytesIO(text), chunk_size=cut)
+    assert upload.geometry() == {'type': 'Point', 'coordinates': [1.5, 2.25]}
+
+
+def test_bare_geometry_and_feature_collection_agree():
+    polygon = {'type': 'Polygon', 'coordinates': [SQUARE, HOLE]}
+    bare = load_json(polygon)
+    feature = load_json({'type': 'Feature', 'geometry': polygon, 'properties': {}})
+    wrapped = load_json(collection(polygon))
+    assert bare.ids == ['0'] and feature.ids == ['0'] and wrapped.ids == ['f0']
+    assert bare.geometry() == feature.geometry() == wrapped.geometry() == polygon
+    assert bare.fingerprint == wrapped.fingerprint  # La huella no depende del envoltorio
+
+
+def test_multipolygon_holes_round_trip():
+    upload = load_json(collection(MULTIPOLYGON))
+    compact = upload.geometries[0]
+    assert list(compact.polygon_offsets) == [0, 2, 3]
+    assert upload.geometry() == MULTIPOLYGON
+
+
+def test_features_without_geometry_are_skipped_but_keep_positions():
+    source = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': None},
+        {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [SQUARE]}},
+    ]}
+    assert load_json(source).ids == ['1']
+
+
+@pytest.mark.parametrize('text', [
+    b'{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1',
+    b'[1, 2, 3]',
+    b'{"type": "FeatureCollection", "features": []}',
+    b'{"type": "Topology", "objects": {}}',
+    b'{"type": "Polygon", "coordinates": [[[0, 0], [1, 0]]], }',
+    b'{"type": "Point" "coordinates": [0, 0]}',
+    b'{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": null} {"type": "Feature"}]}',
+    b'{"type": "FeatureCollection", "features": [{"type": "Feature", "geometry": null},]}',
+    b'{"type": "Feature", "geometry": {"type": "GeometryCollection", "coordinates": []}}',
+])
+def test_malformed_geojson_raises_value_error(text):
+    with pytest.raises(ValueError):
+        ingest.load_geojson(io.BytesIO(text), chunk_size=8)
+
+
+KML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder>
+  <Placemark id="lote-1"><name>Lote 1</name>
+    <MultiGeometry>
+      <Polygon>
+        <outerBoundaryIs><LinearRing><coordinates>0,0,10 1,0,10 1,1,10 0,1,10</coordinates></LinearRing></outerBoundaryIs>
+        <innerBoundaryIs><LinearRing><coordinates>0.25,0.25 0.75,0.25 0.75,0.75 0.25,0.75 0.25,0.25</coordinates></LinearRing></innerBoundaryIs>
+      </Polygon>
+      <Polygon>
+        <outerBoundaryIs><LinearRing><coordinates>2,0 3,0 3,1 2,1 2,0</coordinates></LinearRing></outerBoundaryIs>
+      </Polygon>
+    </MultiGeometry>
+  </Placemark>
+  <Placemark><name>Pozo</name><Point><coordinates>-58.5,-34.6,0</coordinates></Point></Placemark>
+  <Placemark><description>sin geometria</description></Placemark>
+</Folder></Document></kml>'''
+
+
+def test_kml_multigeometry_with_holes_and_altitude():
+    upload = ingest.load_kml(io.BytesIO(KML))
+    assert upload.ids == ['lote-1', 'Pozo']
+    assert upload.geometry(0) == MULTIPOLYGON  # Anillo exterior cerrado y altitud descartada
+    assert upload.geometry(1) == {'type': 'Point', 'coordinates': [-58.5, -34.6]}
+
+
+def kmz_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def test_kmz_prefers_doc_kml():
+    other = KML.replace(b'lote-1', b'otro')
+    upload = ingest.load_upload(kmz_bytes({'files/otro.kml': other, 'doc.kml': KML}), 'lotes.kmz')
+    assert upload.source_format == 'kmz'
+    assert upload.ids == ['lote-1', 'Pozo']
+    assert upload.fingerprint == ingest.load_kml(io.BytesIO(KML)).fingerprint
+
+
+@pytest.mark.parametrize('loader, data', [
+    (ingest.load_kml, io.BytesIO(b'<kml><Placemark><Polygon></kml>')),
+    (ingest.load_kml, io.BytesIO(b'<kml><Document></Document></kml>')),
+    (ingest.load_kmz, io.BytesIO(b'no es un zip')),
+    (ingest.load_kmz, kmz_bytes({'leeme.txt': b'hola'})),
+])
+def test_malformed_kml_and_kmz_raise_value_error(loader, data):
+    with pytest.raises(ValueError):
+        loader(data)
@@ -0,0 +1,49 @@
+# tests/test_jobs.py
+# Deduplicación y cancelación de jobs compartidos entre sesiones.
+import threading
+
+import pytest
+
+from backend import jobs
+from utils import storage
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'WORKSPACES_DIR', str(tmp_path))
+    manager = jobs.JobManager(max_workers=1)
+    yield manager
+    manager.shutdown(wait=True)
+
+
+def blocking_job(release, progress):
+    while not release.wait(0.01):
+        progress(0.5)
+    return 'ok'
+
+
+def test_deduplicated_job_survives_one_cancel(manager):
+    release = threading.Event()
+    job_id = manager.submit(blocking_job, release, dedup_key='same')
+    assert manager.submit(blocking_job, release, dedup_key='same') == job_id
+    assert manager.status(job_id)['subscribers'] == 2
+
+    assert manager.cancel(job_id) is False  # La otra sesión sigue esperando
+    assert not manager.get(job_id).cancel_requested
+    release.set()
+    manager.get(job_id).future.result(timeout=5)
+    assert manager.status(job_id)['status'] == jobs.STATUS_DONE
+
+
+def test_last_subscriber_cancels(manager):
+    release = threading.Event()
+    job_id = manager.submit(blocking_job, release, dedup_key='same')
+    manager.submit(blocking_job, release, dedup_key='same')
+    manager.cancel(job_id)
+    assert manager.cancel(job_id) is True
+    manager.get(job_id).future.result(timeout=5)
+    assert manager.status(job_id)['status'] == jobs.STATUS_CANCELLED
+    # Un envío idéntico posterior no se une al job cancelado
+    new_id = manager.submit(blocking_job, release, dedup_key='same')
+    assert new_id != job_id
+    release.set()
@@ -0,0 +1,111 @@
+# tests/test_local_engine.py
+# Cálculo y render del motor local con bandas sintéticas (sin ee ni red).
+import io
+
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+
+from utils import local_engine
+
+
+def synthetic_bands(shape=(4, 4)):
+    """Bandas en DN (reflectancia x 10000) con valores conocidos por banda."""
+    values = {'B2': 500, 'B3': 1000, 'B4': 2000, 'B8': 6000, 'B11': 3000, 'B12': 2000}
+    return {band: np.full(shape, value, dtype=np.float32) for band, value in values.items()}
+
+
+def test_compute_indices_matches_formulas():
+    indices = local_engine.compute_indices(synthetic_bands(), ['ndvi', 'ndwi', 'nbr'])
+    assert set(indices) == {'ndvi', 'ndwi', 'nbr'}
+    np.testing.assert_allclose(indices['ndvi'], (6000 - 2000) / (6000 + 2000), rtol=1e-6)
+    np.testing.assert_allclose(indices['ndwi'], (1000 - 6000) / (1000 + 6000), rtol=1e-6)
+    np.testing.assert_allclose(indices['nbr'], (6000 - 2000) / (6000 + 2000), rtol=1e-6)
+    assert indices['ndvi'].dtype == np.float32
+
+
+def test_compute_indices_expression_index():
+    indices = local_engine.compute_indices(synthetic_bands(), ['savi'])
+    nir, red = 0.6, 0.2
+    np.testing.assert_allclose(indices['savi'], 1.5 * (nir - red) / (nir + red + 0.5), rtol=1e-6)
+
+
+def test_compute_indices_no_data_is_nan():
+    bands = synthetic_bands()
+    for band in bands.values():
+        band[0, 0] = 0  # Píxel enmascarado: computePixels lo devuelve en 0
+    bands['B4'][1, 1] = 0  # Solo una banda en 0: sigue siendo un valor válido
+    ndvi = local_engine.compute_indices(bands, ['ndvi'])['ndvi']
+    assert np.isnan(ndvi[0, 0])
+    assert ndvi[1, 1] == pytest.approx(1.0)
+    assert np.isfinite(ndvi).sum() == ndvi.size - 1
+
+
+def test_build_palette_lut_endpoints_and_interpolation():
+    lut = local_engine.build_palette_lut(['000000', 'FFFFFF'], size=3)
+    assert lut.shape == (3, 3) and lut.dtype == np.uint8
+    np.testing.assert_array_equal(lut[0], [0, 0, 0])
+    np.testing.assert_array_equal(lut[1], [128, 128, 128])
+    np.testing.assert_array_equal(lut[-1], [255, 255, 255])
+
+
+def test_build_palette_lut_single_color():
+    lut = local_engine.build_palette_lut(['#FF0000'], size=4)
+    np.testing.assert_array_equal(lut, [[255, 0, 0]] * 4)
+
+
+def test_render_index_scales_clips_and_keeps_nan_transparent():
+    vis = {'min': 0.0, 'max': 1.0, 'palette': ['000000', 'FFFFFF']}
+    values = np.array([[0.0, 1.0], [2.0, np.nan]], dtype=np.float32)
+    rgba = local_engine.render_index(values, vis)
+    assert rgba.shape == (2, 2, 4) and rgba.dtype == np.uint8
+    np.testing.assert_array_equal(rgba[0, 0], [0, 0, 0, 255])
+    np.testing.assert_array_equal(rgba[0, 1], [255, 255, 255, 255])
+    np.testing.assert_array_equal(rgba[1, 0], [255, 255, 255, 255])  # Fuera de rango: se satura al máximo
+    assert rgba[1, 1, 3] == 0
+
+
+def test_render_maps_from_bands_without_network():
+    bands = synthetic_bands()
+    for band in bands.values():
+        band[0, 0] = 0
+    renders = local_engine.render_maps(bands, {'ndvi': {'min': -1, 'max': 1, 'palette': ['000000', 'FFFFFF']}},
+                                       {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 3000})
+    assert set(renders) == {'ndvi', 'rgb'}
+    for rgba in renders.values():
+        assert rgba[0, 0, 3] == 0
+        assert (rgba[..., 3].ravel()[1:] == 255).all()
+    assert local_engine.encode_png(renders['ndvi'])[:8] == b'\x89PNG\r\n\x1a\n'
+
+
+def test_apply_mask_turns_masked_pixels_into_nan():
+    arrays = {'NDVI': np.zeros((2, 2), dtype=np.float32), 'B4': np.full((2, 2), 900, dtype=np.float32),
+              local_engine.MASK_BAND: np.array([[1, 0], [1, 1]], dtype=np.float32)}
+    masked = local_engine.apply_mask(arrays)
+    assert local_engine.MASK_BAND not in masked
+    assert np.isnan(masked['NDVI'][0, 1]) and np.isnan(masked['B4'][0, 1])
+    assert np.isfinite(masked['NDVI']).sum() == 3  # El 0 válido sigue siendo un valor
+
+
+def test_stacked_maps_leave_masked_pixels_transparent(monkeypatch):
+    # computePixels devuelve 0 en los píxeles enmascarados; solo la banda de máscara los distingue de un NDVI = 0
+    def fake_fetch(image, region, width, height, bands=None, counter=None, stage=None):
+        arrays = {band: np.zeros((height, width), dtype=np.float32) for band in bands}
+        arrays[local_engine.MASK_BAND][:, 1:] = 1
+        return arrays
+
+    monkeypatch.setattr(local_engine, 'stacked_image', lambda image, index_keys, rgb_bands=None: image)
+    monkeypatch.setattr(local_engine, 'fetch_band_arrays', fake_fetch)
+    outputs, indices = local_engine.generate_stacked_map_images(
+        None, [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]], ['ndvi'], width=3, height=2, return_indices=True)
+    assert np.isnan(indices['ndvi'][:, 0]).all() and (indices['ndvi'][:, 1:] == 0).all()
+    alpha = np.asarray(PILImage.open(io.BytesIO(outputs['ndvi'])))[..., 3]
+    np.testing.assert_array_equal(alpha, [[0, 255, 255], [0, 255, 255]])
+
+
+def test_render_rgb_nan_is_transparent():
+    bands = {band: np.full((1, 2), 1500, dtype=np.float32) for band in ('B4', 'B3', 'B2')}
+    bands['B4'][0, 0] = np.nan
+    rgba = local_engine.render_rgb(bands, {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 3000})
+    np.testing.assert_array_equal(rgba[..., 3], [[0, 255]])
+    np.testing.assert_array_equal(rgba[0, 1, :3], [128, 128, 128])
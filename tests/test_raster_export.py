@@ -0,0 +1,35 @@
+# tests/test_raster_export.py
+# Export 'npy': escritura por franjas y publicación con la georreferencia ya presente.
+import os
+
+import numpy as np
+
+from utils import raster_export
+
+
+def test_npy_export_round_trip(tmp_path):
+    path = str(tmp_path / 'indices.npy')
+    writer = raster_export.NpyExportWriter(path, ['NDVI', 'NBR'], 3, 4, [0.0, 1.0, 0.0, 4.0, 0.0, -1.0], {'scene': 's'})
+    for row in range(0, 4, 2):
+        writer.write_strip(row, np.full((2, 2, 3), row, dtype=np.float32))
+    writer.close()
+    array, metadata = raster_export.load_npy_export(path)
+    assert array.shape == (2, 4, 3) and metadata['bands'] == ['NDVI', 'NBR']
+    np.testing.assert_array_equal(array[:, :, 0], [[0, 0, 2, 2]] * 2)
+
+
+def test_npy_sidecar_is_published_before_the_array(tmp_path, monkeypatch):
+    path = str(tmp_path / 'indices.npy')
+    writer = raster_export.NpyExportWriter(path, ['NDVI'], 2, 2, [0.0, 1.0, 0.0, 2.0, 0.0, -1.0], {})
+    writer.write_strip(0, np.zeros((1, 2, 2), dtype=np.float32))
+    published = []
+    real_replace = os.replace
+
+    def recording_replace(src, dst):
+        if dst == path:
+            published.append(os.path.exists(writer.metadata_path))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', recording_replace)
+    writer.close()
+    assert published == [True]
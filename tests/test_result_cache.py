@@ -0,0 +1,81 @@
+# tests/test_result_cache.py
+# Claves normalizadas, TTL, desalojo LRU y contadores del caché de resultados.
+import json
+import os
+
+from utils import result_cache
+
+
+def key_for(geojson_string, options=None, cloud_cover_max=20):
+    spec = result_cache.normalize_aoi_params('geojson', {'geojson_string': geojson_string})
+    return result_cache.make_cache_key(spec, '2025-01-01', '2025-01-31', cloud_cover_max, {'min': 0, 'max': 1}, options)
+
+
+POLYGON = {'type': 'Polygon', 'coordinates': [[[-58.5, -34.6], [-58.4, -34.6], [-58.4, -34.5], [-58.5, -34.6]]]}
+
+
+def test_equivalent_aois_and_options_share_a_key():
+    plain = key_for(json.dumps(POLYGON), options={'baseline': None, 'export': 'npy'})
+    # Feature con propiedades, otro orden de claves, espacios y ruido por debajo de COORD_DECIMALS
+    noisy = {'coordinates': [[[-58.5000000001, -34.6], [-58.4, -34.6000000002], [-58.4, -34.5], [-58.5, -34.6]]],
+             'type': 'Polygon'}
+    feature = json.dumps({'properties': {'name': 'lote 7'}, 'type': 'Feature', 'geometry': noisy}, indent=4)
+    assert key_for(feature, options={'export': 'npy', 'baseline': None}) == plain
+
+
+def test_different_inputs_change_the_key():
+    base = key_for(json.dumps(POLYGON))
+    moved = dict(POLYGON, coordinates=[[[x + 0.001, y] for x, y in POLYGON['coordinates'][0]]])
+    assert key_for(json.dumps(moved)) != base
+    assert key_for(json.dumps(POLYGON), cloud_cover_max=30) != base
+    assert key_for(json.dumps(POLYGON), options={'export': 'cog'}) != base
+
+
+def test_coords_aoi_normalizes_radius_type():
+    as_int = result_cache.normalize_aoi_params('coords', {'lat': -34.6, 'lon': -58.4, 'radius_km': 1})
+    as_float = result_cache.normalize_aoi_params('coords', {'lat': -34.6, 'lon': -58.4, 'radius_km': 1.0})
+    assert result_cache.make_cache_key(as_int, 'a', 'b', 20, {}) == result_cache.make_cache_key(as_float, 'a', 'b', 20, {})
+
+
+def put(cache, key, size=100):
+    return cache.put(key, {'images': {'ndvi': b'x' * size}, 'image_filenames': {'ndvi': 'ndvi.png'}})
+
+
+def test_hits_misses_and_hit_rate(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path))
+    assert cache.get('a') is None
+    put(cache, 'a')
+    entry = cache.get('a')
+    assert open(entry['results']['image_paths']['ndvi'], 'rb').read() == b'x' * 100
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'hit_rate': 0.5}
+
+
+def test_expired_entries_are_misses_and_removed(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now[0])
+    cache = result_cache.ResultCache(str(tmp_path), ttl_seconds=60)
+    put(cache, 'a')
+    now[0] += 59
+    assert cache.get('a') is not None
+    now[0] += 2
+    assert cache.get('a') is None
+    assert not os.path.exists(tmp_path / 'a')
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path), max_bytes=10_000)
+    for i, key in enumerate(('a', 'b')):
+        put(cache, key, size=3000)
+        entry_json = tmp_path / key / result_cache.ENTRY_FILE
+        os.utime(entry_json, (i, i))  # 'a' es la más vieja
+    cache.get('a')  # ...hasta que se la usa
+    os.utime(tmp_path / 'b' / result_cache.ENTRY_FILE, (0, 0))
+    put(cache, 'c', size=5000)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_default_directory_is_separate_from_other_caches():
+    assert os.path.dirname(result_cache.CACHE_DIR) == result_cache.CACHE_ROOT
+    assert result_cache.CACHE_DIR != result_cache.CACHE_ROOT
@@ -0,0 +1,136 @@
+# tests/test_scene_catalog.py
+# Intervalos de cobertura, filtro fino de footprints y sincronización paginada del catálogo (GEE simulado).
+import pytest
+
+from backend import scene_catalog
+from backend.scene_catalog import DAY_MS
+
+BOX = (-58.6, -34.7, -58.4, -34.5)
+
+
+def test_merge_intervals_joins_overlapping_and_touching():
+    assert scene_catalog._merge_intervals([(5, 8), (0, 2), (2, 3), (7, 10), (12, 13)]) == [(0, 3), (5, 10), (12, 13)]
+    assert scene_catalog._merge_intervals([]) == []
+
+
+@pytest.mark.parametrize('covered, expected', [
+    ([], [(0, 10)]),
+    ([(0, 10)], []),
+    ([(-5, 3), (6, 8)], [(3, 6), (8, 10)]),
+    ([(2, 4), (12, 20)], [(0, 2), (4, 10)]),
+    ([(-10, -1), (10, 20)], [(0, 10)]),
+])
+def test_subtract_intervals(covered, expected):
+    assert scene_catalog._subtract_intervals(0, 10, covered) == expected
+
+
+def test_split_interval():
+    assert scene_catalog._split_interval(0, 10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert scene_catalog._split_interval(0, 4, 4) == [(0, 4)]
+
+
+SQUARE = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+DIAMOND = [[5, 0], [10, 5], [5, 10], [0, 5], [5, 0]]
+
+
+@pytest.mark.parametrize('ring, box, expected', [
+    (SQUARE, (2, 2, 3, 3), True),            # bbox dentro del footprint
+    (SQUARE, (-1, -1, 11, 11), True),        # footprint dentro del bbox
+    (SQUARE, (9, -5, 12, 5), True),          # solapamiento parcial
+    ([[0, 4], [10, 4], [10, 6], [0, 6], [0, 4]], (4, 0, 6, 10), True),  # cruce sin vértices adentro
+    (SQUARE, (10, 10, 12, 12), True),        # contacto en un vértice
+    (DIAMOND, (0, 0, 1, 1), False),          # dentro del bbox del footprint pero fuera del rombo
+    (SQUARE, (11, 11, 12, 12), False),
+])
+def test_ring_intersects_box(ring, box, expected):
+    assert scene_catalog.ring_intersects_box(ring, box) is expected
+
+
+class FakeGEE:
+    """Reemplaza _fetch_windows: devuelve una escena por día dentro de cada ventana."""
+
+    def __init__(self, catalog, monkeypatch):
+        self.calls = []
+        monkeypatch.setattr(catalog, '_fetch_windows', self.fetch)
+
+    def fetch(self, windows, counter=None):
+        self.calls.append(list(windows))
+        chunks = []
+        for cell, start, end in windows:
+            days = range(start, end, DAY_MS)
+            chunks.append({
+                'ids': [f'S2/{cell}/{t}' for t in days],
+                'times': list(days),
+                'clouds': [(t // DAY_MS) % 50 for t in days],
+                'footprints': [{'type': 'Polygon', 'coordinates': [[[-59, -35], [-58, -35], [-58, -34], [-59, -34], [-59, -35]]]}
+                               for _ in days],
+            })
+        return chunks
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {'t': scene_catalog.date_to_millis('2025-06-01') / 1000}
+    monkeypatch.setattr(scene_catalog.time, 'time', lambda: now['t'])
+    return now
+
+
+def make_catalog(tmp_path, **kwargs):
+    return scene_catalog.SceneCatalog(str(tmp_path / 'catalog.sqlite'), **kwargs)
+
+
+def test_sync_pages_by_date_window(tmp_path, monkeypatch, clock):
+    catalog = make_catalog(tmp_path, sync_window_days=30, sync_windows_per_call=2)
+    fake = FakeGEE(catalog, monkeypatch)
+    start, end = scene_catalog.date_to_millis('2025-01-01'), scene_catalog.date_to_millis('2025-05-01')
+    assert catalog.sync(BOX, start, end) == (end - start) // DAY_MS
+    windows = [w for call in fake.calls for w in call]
+    assert len(fake.calls) == 2 and [len(call) for call in fake.calls] == [2, 2]
+    assert all(e - s <= 30 * DAY_MS for _, s, e in windows)
+    assert windows[0][1] == start and windows[-1][2] == end
+    assert all(a[2] == b[1] for a, b in zip(windows, windows[1:]))  # Ventanas contiguas, sin huecos
+    assert catalog.missing(BOX, start, end) == []
+    assert catalog.sync(BOX, start, end) == 0 and len(fake.calls) == 2
+
+
+def test_failed_page_keeps_earlier_pages(tmp_path, monkeypatch, clock):
+    catalog = make_catalog(tmp_path, sync_window_days=10, sync_windows_per_call=1)
+    fake = FakeGEE(catalog, monkeypatch)
+    real_fetch = fake.fetch
+
+    def fail_on_second(windows, counter=None):
+        if len(fake.calls) == 1:
+            fake.calls.append(windows)
+            raise RuntimeError('GEE caído')
+        return real_fetch(windows, counter)
+
+    monkeypatch.setattr(catalog, '_fetch_windows', fail_on_second)
+    start = scene_catalog.date_to_millis('2025-01-01')
+    with pytest.raises(RuntimeError):
+        catalog.sync(BOX, start, start + 30 * DAY_MS)
+    assert catalog.missing(BOX, start, start + 30 * DAY_MS) == [((-59, -35), start + 10 * DAY_MS, start + 30 * DAY_MS)]
+
+
+def test_recent_tail_is_refreshed_after_expiry(tmp_path, monkeypatch, clock):
+    catalog = make_catalog(tmp_path, ingest_lag_days=5, tail_refresh_seconds=3600)
+    fake = FakeGEE(catalog, monkeypatch)
+    now_ms = int(clock['t'] * 1000)
+    start = now_ms - 20 * DAY_MS
+    catalog.sync(BOX, start, now_ms)
+    assert catalog.missing(BOX, start, now_ms) == []
+
+    clock['t'] += 3601
+    tail = catalog.missing(BOX, start, now_ms)
+    assert tail == [((-59, -35), now_ms - 5 * DAY_MS, now_ms)]
+    catalog.sync(BOX, start, now_ms)
+    assert fake.calls[-1] == tail  # Solo se vuelve a pedir la cola
+
+
+def test_best_scene_filters_clouds_and_dates(tmp_path, monkeypatch, clock):
+    catalog = make_catalog(tmp_path)
+    FakeGEE(catalog, monkeypatch)
+    region = [[[BOX[0], BOX[1]], [BOX[2], BOX[1]], [BOX[2], BOX[3]], [BOX[0], BOX[3]], [BOX[0], BOX[1]]]]
+    scene, candidates = catalog.best_scene(region, '2025-01-01', '2025-01-31', cloud_cover_max=10)
+    assert candidates == 10
+    assert scene['cloud_cover'] == 0
+    assert scene_catalog.date_to_millis('2025-01-01') <= scene['time_start'] < scene_catalog.date_to_millis('2025-01-31')
@@ -0,0 +1,35 @@
+# tests/test_storage.py
+# Workspace de respaldo fuera de un job.
+import os
+import shutil
+
+import pytest
+
+from utils import storage
+
+
+@pytest.fixture
+def workspaces_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'WORKSPACES_DIR', str(tmp_path))
+    monkeypatch.setattr(storage, '_fallback_workspace', None)
+    return tmp_path
+
+
+def test_fallback_workspace_is_created_once(workspaces_dir):
+    first = storage.current_workspace()
+    assert storage.current_workspace() is first
+    assert os.listdir(workspaces_dir) == [first.job_id]
+
+
+def test_job_workspace_takes_precedence(workspaces_dir):
+    fallback = storage.current_workspace()
+    with storage.JobWorkspace() as workspace:
+        assert storage.current_workspace() is workspace
+    assert storage.current_workspace() is fallback
+
+
+def test_fallback_is_recreated_after_gc(workspaces_dir):
+    first = storage.current_workspace()
+    shutil.rmtree(first.path)
+    second = storage.current_workspace()
+    assert second is not first and os.path.isdir(second.path)
@@ -0,0 +1,48 @@
+# tests/test_templates.py
+# Plantilla del PDF: mapas sin pérdida por defecto y configuración de reportlab acotada al build.
+import importlib
+import io
+
+import numpy as np
+from PIL import Image as PILImage
+from reportlab import rl_config
+
+from reports import templates
+
+
+def rgba_png(width=40, height=20):
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[..., 1] = 200
+    pixels[:, width // 2:, 3] = 255  # Mitad izquierda transparente (sin datos)
+    buffer = io.BytesIO()
+    PILImage.fromarray(pixels, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_import_leaves_reportlab_config_alone(monkeypatch):
+    monkeypatch.setattr(rl_config, 'useA85', 1)
+    importlib.reload(templates)
+    assert rl_config.useA85 == 1
+
+
+def test_stream_encoding_is_scoped_to_the_block(monkeypatch):
+    monkeypatch.setattr(rl_config, 'useA85', 1)
+    with templates.stream_encoding(ascii85=False):
+        assert rl_config.useA85 == 0
+    assert rl_config.useA85 == 1
+
+
+def test_prepare_image_defaults_to_lossless_png_with_transparency():
+    data, width, height = templates.prepare_image(rgba_png(), 20, 20)
+    assert (width, height) == (20, 10)
+    with PILImage.open(io.BytesIO(data)) as image:
+        assert image.format == 'PNG' and image.mode == 'RGBA'
+        alpha = np.asarray(image.getchannel('A'))
+    assert alpha[:, 0].max() == 0 and alpha[:, -1].min() == 255
+
+
+def test_prepare_image_jpeg_is_opt_in():
+    data, _, _ = templates.prepare_image(rgba_png(), 20, 20, image_format='jpeg')
+    with PILImage.open(io.BytesIO(data)) as image:
+        assert image.format == 'JPEG'
+        np.testing.assert_array_equal(image.getpixel((0, 0)), (255, 255, 255))  # Sin datos: blanco
@@ -0,0 +1,133 @@
+# tests/test_tile_cache.py
+# Grilla, mosaico, desalojo y deduplicación del caché de tiles (sin ee ni red).
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils import local_engine
+from utils import tile_cache
+from utils.tile_cache import TILE_PX
+
+
+def box(xmin, ymin, xmax, ymax):
+    return [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]]
+
+
+def tile_box(z, x0, y0, x1, y1):
+    return [tile_cache.block_ring(z, x0, y0, x1, y1)]
+
+
+@pytest.fixture
+def fake_gee(monkeypatch):
+    """Cada píxel descargado vale su longitud; cuenta las peticiones de bloque."""
+    calls = []
+
+    def fake_fetch(stacked, region, width, height, bands, counter=None, stage=None):
+        calls.append(region)
+        (west, _), (east, _) = region[0], region[1]
+        lon = west + (np.arange(width) + 0.5) * (east - west) / width
+        return {band: np.tile(lon.astype(np.float32), (height, 1)) for band in bands}
+
+    monkeypatch.setattr(local_engine, 'stacked_image', lambda image, index_keys, rgb_bands=None: image)
+    monkeypatch.setattr(local_engine, 'fetch_masked_arrays', fake_fetch)
+    return calls
+
+
+def test_zoom_for_matches_pixel_size_and_caps(tmp_path):
+    # Un tile completo a TILE_PX px es exactamente su zoom
+    assert tile_cache.zoom_for(tile_box(10, 5, 5, 5, 5), TILE_PX, TILE_PX) == 10
+    assert tile_cache.zoom_for(tile_box(10, 5, 5, 6, 6), TILE_PX * 2, TILE_PX * 2) == 10
+    # 0.01 grados a 512 px: ~1.95e-5 grados/px, más fino que el zoom máximo
+    region = box(-70.0, -33.0, -69.99, -32.99)
+    assert tile_cache.native_zoom(region, 512, 512) == 15
+    assert tile_cache.zoom_for(region, 512, 512, max_zoom=13) == 13
+    cache = tile_cache.TileCache(str(tmp_path / 'tiles.sqlite'), max_zoom=13)
+    assert not cache.covers(region, 512, 512)  # Se descarga directo en vez de remuestrear desde zoom 13
+    assert cache.covers(box(-70.0, -33.0, -69.9, -32.9), 512, 512)
+
+
+def test_max_zoom_is_native_sentinel2_resolution():
+    meters_per_px = tile_cache.tile_span_deg(tile_cache.MAX_ZOOM) / TILE_PX * 111320
+    assert 8 < meters_per_px < 12
+
+
+def test_tile_range_covers_bounds():
+    z = 3
+    span = tile_cache.tile_span_deg(z)
+    assert tile_cache.tile_range(tile_box(z, 2, 1, 4, 3), z) == (2, 1, 4, 3)
+    # Un bbox que toca apenas el tile vecino lo incluye
+    west, south, east, north = -180 + 2 * span, 90 - 4 * span, -180 + 5 * span + 1e-6, 90 - 1 * span
+    assert tile_cache.tile_range(box(west, south, east, north), z) == (2, 1, 5, 3)
+    # Se acota a la grilla del mundo
+    assert tile_cache.tile_range(box(-200, -100, 200, 100), 0) == (0, 0, 1, 0)
+
+
+def test_mosaic_places_tiles_and_fills_missing_with_nan():
+    z = 4
+    tiles = {(0, 0): {'a': np.full((TILE_PX, TILE_PX), 1, dtype=np.float32)},
+             (1, 1): {'a': np.full((TILE_PX, TILE_PX), 4, dtype=np.float32)}}
+    arrays = tile_cache.mosaic_layers(tiles, {'A': 'a'}, z, (0, 0, 1, 1), tile_box(z, 0, 0, 1, 1), 4, 4)
+    expected = np.array([[1, 1, np.nan, np.nan]] * 2 + [[np.nan, np.nan, 4, 4]] * 2, dtype=np.float32)
+    np.testing.assert_array_equal(arrays['A'], expected)
+
+
+def test_fetch_layers_downloads_once_then_hits(tmp_path, fake_gee):
+    cache = tile_cache.TileCache(str(tmp_path / 'tiles.sqlite'), max_zoom=13)
+    z = 9
+    region = tile_box(z, 100, 100, 101, 100)
+    first = cache.fetch_layers(None, 'scene', ['ndvi'], ['B4'], region, 2 * TILE_PX, TILE_PX)
+    second = cache.fetch_layers(None, 'scene', ['ndvi'], ['B4'], region, 2 * TILE_PX, TILE_PX)
+    assert len(fake_gee) == 1
+    for band in ('B4', 'NDVI'):
+        np.testing.assert_array_equal(first[band], second[band])
+    west, east = region[0][0][0], region[0][1][0]
+    np.testing.assert_allclose(first['NDVI'][0, [0, -1]], [west, east], atol=tile_cache.tile_span_deg(z) / TILE_PX)
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 2
+
+
+def test_evict_drops_least_recently_used(tmp_path):
+    tile_bytes = TILE_PX * TILE_PX * 4
+    cache = tile_cache.TileCache(str(tmp_path / 'tiles.sqlite'), max_bytes=2 * tile_bytes)
+    tile = np.zeros((TILE_PX, TILE_PX), dtype=np.float32)
+    cache.put_tiles('scene', 5, {(0, 0): {'a': tile}})
+    cache.put_tiles('scene', 5, {(1, 0): {'a': tile}})
+    time.sleep(0.01)
+    assert cache.get_tiles('scene', ['a'], 5, [(0, 0)])  # (0, 0) pasa a ser el más reciente
+    time.sleep(0.01)
+    cache.put_tiles('scene', 5, {(2, 0): {'a': tile}})
+    assert set(cache.get_tiles('scene', ['a'], 5, [(0, 0), (1, 0), (2, 0)])) == {(0, 0), (2, 0)}
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['bytes'] <= cache.max_bytes
+
+
+def test_concurrent_requests_download_missing_tiles_once(tmp_path, monkeypatch, fake_gee):
+    cache = tile_cache.TileCache(str(tmp_path / 'tiles.sqlite'), max_zoom=13)
+    started, release = threading.Event(), threading.Event()
+    slow_fetch = local_engine.fetch_masked_arrays
+
+    def blocking_fetch(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return slow_fetch(*args, **kwargs)
+
+    monkeypatch.setattr(local_engine, 'fetch_masked_arrays', blocking_fetch)
+    region = tile_box(9, 10, 10, 10, 10)
+    results = []
+
+    def fetch():
+        results.append(cache.fetch_layers(None, 'scene', ['ndvi'], [], region, TILE_PX, TILE_PX))
+
+    first = threading.Thread(target=fetch)
+    first.start()
+    assert started.wait(5)
+    second = threading.Thread(target=fetch)
+    second.start()
+    time.sleep(0.1)  # El segundo hilo encuentra el tile en vuelo y espera
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert len(fake_gee) == 1
+    assert len(results) == 2
+    np.testing.assert_array_equal(results[0]['NDVI'], results[1]['NDVI'])
@@ -0,0 +1,82 @@
+# tests/test_zonal_stats.py
+# Estadísticas zonales locales: solo cuentan los píxeles dentro del polígono del AOI.
+import numpy as np
+import pytest
+
+from backend import zonal_stats
+from utils import geometry
+from utils import index_registry
+
+
+def test_rasterize_even_odd_with_hole():
+    outer = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+    hole = [[3, 3], [7, 3], [7, 7], [3, 7], [3, 3]]
+    mask = geometry.rasterize({'type': 'Polygon', 'coordinates': [outer, hole]}, (0, 0, 10, 10), 10, 10)
+    assert mask.sum() == 100 - 16
+    assert not mask[5, 5] and mask[0, 0]
+
+
+def test_rasterize_rows_go_top_down():
+    triangle = {'type': 'Polygon', 'coordinates': [[[0, 0], [4, 0], [0, 4], [0, 0]]]}
+    mask = geometry.rasterize(triangle, (0, 0, 4, 4), 4, 4)
+    assert mask[-1].sum() == 4  # La fila de abajo (y mínimo) es la más ancha
+    assert mask[0].sum() == 1
+
+
+def test_circle_mask_matches_polygon_area():
+    aoi = geometry.AOIGeometry.circle(-33.45, -70.66, 5000)
+    mask = zonal_stats.aoi_mask(aoi.geometry, aoi.region, 256, 256)
+    pixel_area = zonal_stats.pixel_area_m2(aoi.region, 256, 256)
+    assert mask.mean() == pytest.approx(np.pi / 4, rel=0.01)
+    assert mask.sum() * pixel_area == pytest.approx(aoi.area_m2, rel=0.01)
+
+
+def test_local_stats_ignore_pixels_outside_the_aoi():
+    aoi = geometry.AOIGeometry.circle(-33.45, -70.66, 5000)
+    mask = zonal_stats.aoi_mask(aoi.geometry, aoi.region, 128, 128)
+    ndvi = np.where(mask, 0.8, -0.5).astype(np.float32)  # Fuera del círculo: valores que no deben contar
+    ndvi[0, 0] = np.nan
+    pixel_area = zonal_stats.pixel_area_m2(aoi.region, 128, 128)
+
+    stats = zonal_stats.compute_zonal_stats_local({'ndvi': ndvi}, pixel_area, mask=mask, aoi_area_m2=aoi.area_m2)
+    assert stats['NDVI']['mean'] == pytest.approx(0.8)
+    assert stats['NDVI']['fraction_above'] == 1.0
+    assert stats['aoi_area_ha'] == pytest.approx(aoi.area_m2 / zonal_stats.M2_PER_HA)
+
+    unclipped = zonal_stats.compute_zonal_stats_local({'ndvi': ndvi}, pixel_area)
+    assert unclipped['aoi_area_ha'] > stats['aoi_area_ha'] * 1.2  # Los bounds sobrestiman ~4/pi
+
+
+def test_local_stats_area_from_mask_when_not_given():
+    mask = np.zeros((4, 4), dtype=bool)
+    mask[:2] = True
+    stats = zonal_stats.compute_zonal_stats_local({'ndvi': np.full((4, 4), 0.6, dtype=np.float32)}, 100.0, mask=mask)
+    assert stats['aoi_area_ha'] == pytest.approx(8 * 100.0 / zonal_stats.M2_PER_HA)
+    assert stats['NDVI']['area_above_ha'] == pytest.approx(stats['aoi_area_ha'])
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Registro aislado: los índices que registra un test no quedan para los demás."""
+    monkeypatch.setattr(index_registry, 'INDEXES', dict(index_registry.INDEXES))
+    return index_registry
+
+
+def test_local_stats_use_indices_registered_after_import(registry):
+    registry.register_index('xyz', 'XYZ', {'A': 'B8'}, 'A', {'min': 0, 'max': 1, 'palette': ['000000']}, threshold=0.25)
+    stats = zonal_stats.compute_zonal_stats_local({'xyz': np.array([[0.1, 0.3], [0.4, 0.9]], dtype=np.float32)}, 1.0)
+    assert stats['XYZ']['threshold'] == 0.25 and stats['XYZ']['fraction_above'] == 0.75
+
+    # Re-registrar una clave cambia el umbral usado
+    registry.register_index('xyz', 'XYZ', {'A': 'B8'}, 'A', {'min': 0, 'max': 1, 'palette': ['000000']}, threshold=0.5)
+    stats = zonal_stats.compute_zonal_stats_local({'xyz': np.array([[0.1, 0.3], [0.4, 0.9]], dtype=np.float32)}, 1.0)
+    assert stats['XYZ']['fraction_above'] == 0.25
+
+
+def test_local_histogram_uses_the_index_range_and_keeps_outliers():
+    savi = np.array([-1.4, -0.2, 0.5, 1.4, 3.0], dtype=np.float32)  # 3.0: denominador ~0 fuera del rango
+    stats = zonal_stats.compute_zonal_stats_local({'savi': savi}, 1.0)
+    histogram = stats['SAVI']['histogram']
+    assert histogram['bins'][0] == pytest.approx(-1.5)
+    assert sum(histogram['counts']) == savi.size  # Nada se descarta en silencio
+    assert histogram['counts'][-1] == 2  # 1.4 y el 3.0 recortado al máximo
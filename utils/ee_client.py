@@ -0,0 +1,88 @@
+# utils/ee_client.py
+# Cliente de Earth Engine compartido por el proceso: ee.Initialize() se ejecuta
+# una sola vez y de forma perezosa (en la primera operación que lo necesite),
+# nunca al importar módulos. El chequeo de conectividad corre en un hilo de
+# fondo y la UI solo consulta su último estado.
+import os
+import threading
+import time
+
+import ee
+
+EE_PROJECT = os.environ.get('GEOINFORME_EE_PROJECT', 'geoinforme')
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get('GEOINFORME_EE_HEALTH_INTERVAL', 300))
+
+HEALTH_UNKNOWN = 'unknown'
+HEALTH_CHECKING = 'checking'
+HEALTH_OK = 'ok'
+HEALTH_ERROR = 'error'
+
+_init_lock = threading.Lock()
+_initialized = False
+
+_health_lock = threading.Lock()
+_health = {'state': HEALTH_UNKNOWN, 'error': None, 'checked_at': None}
+_health_thread = None
+
+
+def ensure_initialized(project=None):
+    """
+    Inicializa Earth Engine una única vez por proceso (thread-safe).
+    Lanza ee.EEException si la autenticación/inicialización falla; el
+    siguiente llamado lo vuelve a intentar.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        start = time.time()
+        ee.Initialize(project=project or EE_PROJECT)
+        from utils import gee_calls
+        gee_calls.apply_ee_deadline() # Timeout real de cada petición de ee
+        _initialized = True
+        print(f"Google Earth Engine Initialized Successfully ({time.time() - start:.2f}s).")
+
+
+def is_initialized():
+    return _initialized
+
+
+def _run_health_check():
+    try:
+        ensure_initialized()
+        # Operación mínima para validar credenciales y conectividad (un solo
+        # intento: el health check no debe quedarse reintentando)
+        from utils import gee_calls
+        gee_calls.get_info(ee.Number(1), description="health check", max_attempts=1)
+        state, error = HEALTH_OK, None
+    except Exception as e:
+        print(f"ERROR: Health check de Earth Engine falló: {e}")
+        state, error = HEALTH_ERROR, str(e)
+    with _health_lock:
+        _health.update(state=state, error=error, checked_at=time.time())
+
+
+def start_health_check(force=False):
+    """
+    Lanza el chequeo de conectividad en segundo plano si no hay uno en curso y
+    el último resultado está vencido (o force=True). No bloquea.
+    """
+    global _health_thread
+    with _health_lock:
+        if _health_thread is not None and _health_thread.is_alive():
+            return
+        checked_at = _health['checked_at']
+        if not force and checked_at is not None and time.time() - checked_at < HEALTH_CHECK_INTERVAL_SECONDS:
+            return
+        if _health['state'] == HEALTH_UNKNOWN:
+            _health['state'] = HEALTH_CHECKING
+        _health_thread = threading.Thread(target=_run_health_check, name='ee-health', daemon=True)
+        _health_thread.start()
+
+
+def health_status():
+    """Último estado conocido del chequeo: {'state', 'error', 'checked_at'}."""
+    with _health_lock:
+        return dict(_health)
@@ -0,0 +1,207 @@
+# utils/gee_calls.py
+# Capa común para llamadas remotas a GEE (getInfo, getThumbURL, computePixels)
+# y descargas HTTP de miniaturas: reintentos con backoff exponencial con
+# jitter, token bucket global del proceso ajustado a la cuota de EE y circuit
+# breaker que falla rápido cuando GEE está caído.
+# Las llamadas corren en el hilo de quien las hace y el timeout lo aplica el
+# transporte: el deadline de ee (ee.data.setDeadline, ver apply_ee_deadline)
+# y el timeout de requests en las descargas. Una llamada vencida se corta de
+# verdad en vez de quedar ocupando un hilo.
+import os
+import random
+import threading
+import time
+
+import ee
+import requests
+
+# Cuota: peticiones por segundo sostenidas y ráfaga máxima (todo el proceso)
+EE_REQUESTS_PER_SECOND = float(os.environ.get('GEOINFORME_EE_QPS', 10))
+EE_BURST = int(os.environ.get('GEOINFORME_EE_BURST', 20))
+
+DEFAULT_TIMEOUT_SECONDS = float(os.environ.get('GEOINFORME_EE_TIMEOUT', 120))
+HTTP_CONNECT_TIMEOUT_SECONDS = 10.0
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get('GEOINFORME_EE_MAX_ATTEMPTS', 5))
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('GEOINFORME_EE_BREAKER_FAILURES', 8))
+BREAKER_RESET_SECONDS = float(os.environ.get('GEOINFORME_EE_BREAKER_RESET', 60))
+
+# Fragmentos de mensajes de EEException que indican errores transitorios
+RETRYABLE_EE_MESSAGES = (
+    '429', 'too many requests', 'quota', 'rate limit', 'resource exhausted',
+    '500', '502', '503', '504', 'service unavailable', 'internal error',
+    'backend error', 'deadline', 'timed out', 'timeout', 'connection',
+)
+RETRYABLE_HTTP_STATUS = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """El circuit breaker está abierto: GEE falló repetidamente, se falla rápido."""
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe: `rate` tokens/segundo con capacidad `capacity`.
+    `clock` y `sleep` permiten inyectar un reloj falso en los tests.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Bloquea hasta obtener `tokens` tokens."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico: tras `failure_threshold` fallos transitorios
+    seguidos se abre y rechaza llamadas durante `reset_seconds`; luego deja
+    pasar una llamada de prueba (half-open) que lo cierra o lo vuelve a abrir.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_seconds:
+                    raise CircuitOpenError("GEE no disponible (circuit breaker abierto); reintenta más tarde.")
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError("GEE en recuperación (circuit breaker half-open).")
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_neutral(self):
+        """
+        La llamada terminó con un error no transitorio (p. ej. parámetros
+        inválidos): no dice nada de la salud de GEE, así que el estado y el
+        conteo de fallos no cambian; solo libera la llamada de prueba si la era.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"WARNING: Circuit breaker de GEE abierto tras {self._failures} fallos.")
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+                self._probe_in_flight = False
+
+
+# Estado compartido por todo el proceso
+rate_limiter = TokenBucket(EE_REQUESTS_PER_SECOND, EE_BURST)
+circuit_breaker = CircuitBreaker()
+
+
+def apply_ee_deadline(timeout=DEFAULT_TIMEOUT_SECONDS):
+    """Timeout de cada petición HTTP de la librería ee; se llama tras ee.Initialize()."""
+    ee.data.setDeadline(int(timeout * 1000))
+
+
+def is_retryable(error):
+    """True si el error es transitorio (cuota, 5xx, red, timeout) y vale la pena reintentar."""
+    if isinstance(error, TimeoutError): # socket.timeout del transporte de ee
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_HTTP_STATUS
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, ee.EEException):
+        message = str(error).lower()
+        return any(fragment in message for fragment in RETRYABLE_EE_MESSAGES)
+    return False
+
+
+def backoff_delay(attempt, base=BASE_BACKOFF_SECONDS, cap=MAX_BACKOFF_SECONDS):
+    """Backoff exponencial con 'full jitter': uniforme entre 0 y min(cap, base * 2^attempt)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retry(fn, *args, description='GEE call', max_attempts=DEFAULT_MAX_ATTEMPTS, **kwargs):
+    """
+    Ejecuta fn(*args, **kwargs) en el hilo actual pasando por el token bucket
+    y el circuit breaker, con reintentos con backoff para errores transitorios
+    (incluidos los timeouts del transporte). Los errores no transitorios
+    (parámetros inválidos, etc.) se propagan de inmediato y no cuentan para
+    el breaker.
+    """
+    for attempt in range(max_attempts):
+        circuit_breaker.before_call()
+        rate_limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            error = e
+        else:
+            circuit_breaker.record_success()
+            return result
+
+        if not is_retryable(error):
+            circuit_breaker.record_neutral() # No cierra un breaker abierto ni reinicia los fallos seguidos
+            raise error
+        circuit_breaker.record_failure()
+        if attempt == max_attempts - 1:
+            raise error
+        delay = backoff_delay(attempt)
+        print(f"WARNING: {description} falló ({error}); reintento {attempt + 1}/{max_attempts - 1} en {delay:.1f}s")
+        time.sleep(delay)
+
+
+def get_info(ee_object, description='getInfo', **kwargs):
+    """ee_object.getInfo() con reintentos, rate limiting y circuit breaker."""
+    return call_with_retry(ee_object.getInfo, description=description, **kwargs)
+
+
+def http_get(session, url, description='HTTP GET', timeout=DEFAULT_TIMEOUT_SECONDS, **kwargs):
+    """
+    GET con raise_for_status() bajo la misma política de reintentos (los
+    429/5xx y los timeouts se reintentan). `timeout` es el de lectura de
+    requests, por intento.
+    """
+    def _get():
+        response = session.get(url, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, timeout))
+        response.raise_for_status()
+        return response
+    return call_with_retry(_get, description=description, **kwargs)
@@ -0,0 +1,227 @@
+# utils/geometry.py
+# Motor de geometría en el cliente: círculo geodésico analítico, bounds, área
+# geodésica y simplificación Douglas-Peucker, todo con NumPy sobre arrays de
+# coordenadas. Así el AOI llega a GEE ya simplificado y su región (bounds) y
+# área se conocen sin round trips al servidor.
+import os
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8  # radio medio (IUGG)
+CIRCLE_SEGMENTS = 64
+
+# Por encima de este número de vértices el AOI se simplifica antes de enviarlo a EE
+MAX_AOI_VERTICES = int(os.environ.get('GEOINFORME_MAX_AOI_VERTICES', 2000))
+# Tolerancia inicial de Douglas-Peucker en grados (~1 m); se duplica hasta cumplir el máximo
+INITIAL_SIMPLIFY_TOLERANCE_DEG = 1e-5
+
+
+def geodesic_circle(lat, lon, radius_m, segments=CIRCLE_SEGMENTS):
+    """
+    Anillo cerrado (lista de [lon, lat]) de un círculo geodésico de radio
+    radius_m alrededor de (lat, lon), con la fórmula del punto destino sobre
+    la esfera evaluada para todos los azimuts a la vez.
+    """
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    bearings = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    delta = radius_m / EARTH_RADIUS_M
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(delta) + np.cos(lat1) * np.sin(delta) * np.cos(bearings))
+    lon2 = lon1 + np.arctan2(np.sin(bearings) * np.sin(delta) * np.cos(lat1),
+                             np.cos(delta) - np.sin(lat1) * np.sin(lat2))
+    ring = np.column_stack([np.degrees(lon2), np.degrees(lat2)])
+    ring = np.vstack([ring, ring[:1]])  # GeoJSON: el anillo se cierra repitiendo el primer vértice
+    return ring.tolist()
+
+
+def polygon_rings(geometry):
+    """Lista de polígonos (cada uno una lista de anillos como arrays (n, 2)) de una geometría GeoJSON."""
+    kind = geometry['type']
+    if kind == 'Polygon':
+        return [[np.asarray(ring, dtype=float) for ring in geometry['coordinates']]]
+    if kind == 'MultiPolygon':
+        return [[np.asarray(ring, dtype=float) for ring in polygon] for polygon in geometry['coordinates']]
+    if kind == 'GeometryCollection':
+        return [polygon for item in geometry['geometries'] for polygon in polygon_rings(item)]
+    return []
+
+
+def _all_coordinates(geometry):
+    kind = geometry['type']
+    if kind == 'Point':
+        return np.asarray([geometry['coordinates']], dtype=float)
+    if kind in ('LineString', 'MultiPoint'):
+        return np.asarray(geometry['coordinates'], dtype=float)
+    if kind == 'MultiLineString':
+        return np.concatenate([np.asarray(line, dtype=float) for line in geometry['coordinates']])
+    rings = [ring for polygon in polygon_rings(geometry) for ring in polygon]
+    if not rings:
+        raise ValueError(f"Geometría sin coordenadas: {kind}")
+    return np.concatenate(rings)
+
+
+def bounds(geometry):
+    """(xmin, ymin, xmax, ymax) de una geometría GeoJSON."""
+    coords = _all_coordinates(geometry)
+    return (float(coords[:, 0].min()), float(coords[:, 1].min()),
+            float(coords[:, 0].max()), float(coords[:, 1].max()))
+
+
+def bounds_region(geometry):
+    """Bounds en el mismo formato que aoi.bounds().coordinates() de GEE: [[[x, y], ...]]."""
+    xmin, ymin, xmax, ymax = bounds(geometry)
+    return [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]]
+
+
+def ring_area_m2(ring):
+    """Área geodésica (m², sin signo) de un anillo lon/lat sobre la esfera."""
+    ring = np.asarray(ring, dtype=float)
+    if len(ring) < 4:
+        return 0.0
+    lon = np.radians(ring[:-1, 0])
+    lat = np.radians(ring[:-1, 1])
+    # Fórmula de Chamberlain & Duquette: sum((lon[i+1] - lon[i-1]) * sin(lat[i])) * R^2 / 2
+    total = np.sum((np.roll(lon, -1) - np.roll(lon, 1)) * np.sin(lat))
+    return float(abs(total) * EARTH_RADIUS_M ** 2 / 2)
+
+
+def area_m2(geometry):
+    """Área geodésica (m²) de un Polygon/MultiPolygon, descontando los huecos."""
+    total = 0.0
+    for polygon in polygon_rings(geometry):
+        total += ring_area_m2(polygon[0]) - sum(ring_area_m2(hole) for hole in polygon[1:])
+    return total
+
+
+def rasterize(geometry, extent, width, height):
+    """
+    Máscara booleana (height, width) de los píxeles cuyo centro cae dentro del
+    Polygon/MultiPolygon, sobre el grid lineal lon/lat que cubre `extent`
+    (xmin, ymin, xmax, ymax) de arriba hacia abajo, como pixel_grid del motor
+    local. Regla par-impar por filas: los huecos quedan fuera.
+    """
+    xmin, ymin, xmax, ymax = extent
+    xs = xmin + (np.arange(width) + 0.5) * (xmax - xmin) / width
+    ys = ymax - (np.arange(height) + 0.5) * (ymax - ymin) / height
+    rings = [ring for polygon in polygon_rings(geometry) for ring in polygon if len(ring) >= 3]
+    mask = np.zeros((height, width), dtype=bool)
+    if not rings:
+        return mask
+    starts = np.concatenate([ring[:-1] for ring in rings])
+    ends = np.concatenate([ring[1:] for ring in rings])
+    # Cruces de cada arista (columnas) con la horizontal de cada fila: semiabierto en y, sin dobles conteos en vértices
+    y0, y1 = starts[:, 1], ends[:, 1]
+    crosses = (y0[None, :] <= ys[:, None]) != (y1[None, :] <= ys[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (ys[:, None] - y0[None, :]) / (y1 - y0)[None, :]
+    x_cross = np.where(crosses, starts[:, 0][None, :] + t * (ends[:, 0] - starts[:, 0])[None, :], np.inf)
+    x_cross.sort(axis=1)
+    for row in np.flatnonzero(crosses.any(axis=1)):
+        # Un centro está dentro si tiene una cantidad impar de cruces a su izquierda
+        mask[row] = np.searchsorted(x_cross[row], xs) % 2 == 1
+    return mask
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Simplifica una polilínea (n, 2) con Douglas-Peucker. Iterativo (sin
+    recursión) y con las distancias de cada tramo calculadas en bloque.
+    Devuelve el array de puntos conservados (siempre incluye los extremos).
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n < 3:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        segment = points[start + 1:end]
+        direction = b - a
+        norm = np.hypot(direction[0], direction[1])
+        if norm == 0:
+            # Tramo degenerado (p. ej. anillo cerrado): distancia al punto
+            distances = np.hypot(segment[:, 0] - a[0], segment[:, 1] - a[1])
+        else:
+            distances = np.abs(direction[0] * (segment[:, 1] - a[1]) - direction[1] * (segment[:, 0] - a[0])) / norm
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return points[keep]
+
+
+def simplify_ring(ring, tolerance):
+    """Simplifica un anillo cerrado; si colapsa (< 4 vértices) se devuelve sin cambios."""
+    simplified = douglas_peucker(ring, tolerance)
+    return simplified if len(simplified) >= 4 else np.asarray(ring, dtype=float)
+
+
+def vertex_count(geometry):
+    return sum(len(ring) for polygon in polygon_rings(geometry) for ring in polygon)
+
+
+def simplify_geometry(geometry, max_vertices=MAX_AOI_VERTICES):
+    """
+    Devuelve (geometría, tolerancia) con a lo sumo ~max_vertices vértices en
+    total. La tolerancia arranca en ~1 m y se duplica hasta cumplir el límite;
+    si la geometría ya es liviana se devuelve tal cual con tolerancia 0.
+    Solo aplica a Polygon/MultiPolygon.
+    """
+    if geometry['type'] not in ('Polygon', 'MultiPolygon') or vertex_count(geometry) <= max_vertices:
+        return geometry, 0.0
+    polygons = polygon_rings(geometry)
+    tolerance = INITIAL_SIMPLIFY_TOLERANCE_DEG
+    while True:
+        simplified = [[simplify_ring(ring, tolerance) for ring in polygon] for polygon in polygons]
+        if sum(len(ring) for polygon in simplified for ring in polygon) <= max_vertices or tolerance > 1:
+            break
+        tolerance *= 2
+    coordinates = [[ring.tolist() for ring in polygon] for polygon in simplified]
+    if geometry['type'] == 'Polygon':
+        return {'type': 'Polygon', 'coordinates': coordinates[0]}, tolerance
+    return {'type': 'MultiPolygon', 'coordinates': coordinates}, tolerance
+
+
+class AOIGeometry:
+    """
+    AOI resuelto en el cliente: geometría GeoJSON (ya simplificada), su región
+    (bounds) y su área geodésica. La ee.Geometry se construye recién cuando
+    se necesita, con la geometría simplificada.
+    """
+
+    def __init__(self, geometry, max_vertices=MAX_AOI_VERTICES):
+        original_vertices = vertex_count(geometry)
+        self.geometry, self.simplify_tolerance = simplify_geometry(geometry, max_vertices)
+        if self.simplify_tolerance:
+            print(f"AOI simplificado: {original_vertices} -> {vertex_count(self.geometry)} vértices "
+                  f"(tolerancia {self.simplify_tolerance:.2e}°)")
+        self.region = bounds_region(self.geometry)
+        self.area_m2 = area_m2(geometry)  # Área del polígono original, no del simplificado
+        self._ee_geometry = None
+
+    @classmethod
+    def circle(cls, lat, lon, radius_m, segments=CIRCLE_SEGMENTS):
+        """AOI circular geodésico calculado analíticamente (reemplaza a Point.buffer en GEE)."""
+        return cls({'type': 'Polygon', 'coordinates': [geodesic_circle(lat, lon, radius_m, segments)]})
+
+    @property
+    def bounds(self):
+        return bounds(self.geometry)
+
+    def to_ee(self):
+        """ee.Geometry equivalente (se crea una vez y se reutiliza)."""
+        if self._ee_geometry is None:
+            import ee  # El resto del módulo funciona sin ee
+            from utils import ee_client
+            ee_client.ensure_initialized()
+            self._ee_geometry = ee.Geometry(self.geometry)
+        return self._ee_geometry
+
+    def __repr__(self):
+        return f"AOIGeometry(type={self.geometry['type']}, bounds={self.bounds}, area_m2={self.area_m2:.0f})"
@@ -1,34 +1,50 @@
 # utils/helpers.py
-import ee
-import geojson
-import tempfile
-import os
-import shutil
 from datetime import datetime, timedelta
+from utils import ingest
+from utils import storage
+from utils.geometry import AOIGeometry
+
+GEOMETRY_TYPES = ['Polygon', 'MultiPolygon', 'Point', 'LineString', 'MultiPoint', 'MultiLineString']
+
+def iter_geojson_features(gj):
+    """
+    Yields (feature_id, geometry_dict, properties) for every feature in a parsed
+    GeoJSON object (FeatureCollection, Feature or bare Geometry).
+    feature_id is the feature 'id' if present, otherwise its position.
+    """
+    if gj['type'] == 'FeatureCollection':
+        for position, feature in enumerate(gj['features']):
+            feature_id = feature.get('id', position)
+            yield str(feature_id), feature['geometry'], feature.get('properties') or {}
+    elif gj['type'] == 'Feature':
+        yield str(gj.get('id', 0)), gj['geometry'], gj.get('properties') or {}
+    elif gj['type'] in GEOMETRY_TYPES:
+        yield '0', gj, {}
+    else:
+        raise ValueError(f"Unsupported GeoJSON type: {gj['type']}")
+
+def parse_upload(uploaded_file):
+    """
+    Parses an uploaded GeoJSON/KML/KMZ file in streaming mode (utils.ingest)
+    and returns a ParsedUpload handle, or None on failure.
+    """
+    try:
+        # Streamlit file uploader gives a file-like object; se lee por bloques
+        upload = ingest.load_upload(uploaded_file, uploaded_file.name)
+        print(f"Successfully parsed upload: {upload.summary()}")
+        return upload
+    except Exception as e:
+        print(f"Error parsing uploaded file: {e}")
+        return None
 
 def parse_geojson(uploaded_file):
     """Parses an uploaded GeoJSON file and returns an ee.Geometry."""
     try:
-        # Streamlit file uploader gives a file-like object
-        content = uploaded_file.read().decode("utf-8")
-        gj = geojson.loads(content)
-
-        # Extract geometry - handle FeatureCollection, Feature, or Geometry directly
-        if gj['type'] == 'FeatureCollection':
-            if not gj['features']:
-                 raise ValueError("GeoJSON FeatureCollection is empty.")
-            # Use the geometry of the first feature for simplicity in MVP
-            geometry = gj['features'][0]['geometry']
-        elif gj['type'] == 'Feature':
-            geometry = gj['geometry']
-        elif gj['type'] in ['Polygon', 'MultiPolygon', 'Point', 'LineString', 'MultiPoint', 'MultiLineString']:
-             geometry = gj
-        else:
-            raise ValueError(f"Unsupported GeoJSON type: {gj['type']}")
-
-        # Convert GeoJSON geometry to ee.Geometry
-        # GEE expects coordinates in [longitude, latitude] order
-        ee_geometry = ee.Geometry(geometry)
+        # Use the geometry of the first feature for simplicity in MVP
+        # (backend.batch processes every feature of a FeatureCollection)
+        upload = ingest.load_geojson(uploaded_file, getattr(uploaded_file, 'name', 'upload.geojson'))
+        # GEE expects coordinates in [longitude, latitude] order (simplificada en el cliente si es pesada)
+        ee_geometry = upload.to_aoi().to_ee()
         print("Successfully parsed GeoJSON to ee.Geometry.")
         return ee_geometry
     except Exception as e:
@@ -36,32 +52,50 @@ def parse_geojson(uploaded_file):
         return None
 
 def parse_kml(uploaded_file):
-    """Parses an uploaded KML file (basic implementation)."""
-    # KML parsing is more complex, often needing libraries like fastkml or pykml
-    # For MVP, we might just show a message that it's not fully supported yet
-    # Or attempt a very basic extraction if structure is known and simple (e.g., first Polygon)
-    print("KML parsing is complex. For MVP, try converting KML to GeoJSON first.")
-    # Placeholder: Read content, maybe use a basic XML parser if desperate
-    # content = uploaded_file.read().decode("utf-8")
-    # For now, return None
-    return None
+    """Parses an uploaded KML (or KMZ) file and returns an ee.Geometry of its first Placemark."""
+    try:
+        name = getattr(uploaded_file, 'name', 'upload.kml')
+        if name.lower().endswith('.kmz'):
+            upload = ingest.load_kmz(uploaded_file, name)
+        else:
+            upload = ingest.load_kml(uploaded_file, name)
+        ee_geometry = upload.to_aoi().to_ee()
+        print("Successfully parsed KML to ee.Geometry.")
+        return ee_geometry
+    except Exception as e:
+        print(f"Error parsing KML file: {e}")
+        return None
 
-def get_ee_geometry_from_coords(lat, lon, radius_km):
-    """Creates a circular ee.Geometry from center coords and radius."""
+def get_aoi_from_coords(lat, lon, radius_km):
+    """
+    Creates a circular AOI (utils.geometry.AOIGeometry) from center coords and
+    radius. The geodesic circle, its bounds and area are computed client-side.
+    """
     try:
         if not (-90 <= lat <= 90 and -180 <= lon <= 180):
             raise ValueError("Invalid latitude or longitude values.")
         if radius_km <= 0:
              raise ValueError("Radius must be positive.")
-        point = ee.Geometry.Point([lon, lat])
-        # Buffer takes radius in meters
-        buffered_aoi = point.buffer(radius_km * 1000)
+        # Radius in meters; equivalente a Point.buffer() pero sin grafo de buffer en GEE
+        aoi = AOIGeometry.circle(lat, lon, radius_km * 1000)
         print(f"Created circular AOI: Lat={lat}, Lon={lon}, Radius={radius_km}km")
-        return buffered_aoi
+        return aoi
     except Exception as e:
         print(f"Error creating geometry from coordinates: {e}")
         return None
 
+def get_aoi_from_geojson(gj):
+    """AOIGeometry of the first feature of a parsed GeoJSON object (simplified if heavy)."""
+    first = next(iter_geojson_features(gj), None)
+    if first is None:
+        raise ValueError("GeoJSON FeatureCollection is empty.")
+    return AOIGeometry(first[1])
+
+def get_ee_geometry_from_coords(lat, lon, radius_km):
+    """Creates a circular ee.Geometry from center coords and radius."""
+    aoi = get_aoi_from_coords(lat, lon, radius_km)
+    return aoi.to_ee() if aoi is not None else None
+
 def get_date_range(time_period_option):
     """Gets start and end dates based on a selected option."""
     # Simple implementation for MVP
@@ -78,19 +112,12 @@ def get_date_range(time_period_option):
     # Format as YYYY-MM-DD strings
     return start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
 
-def cleanup_temp_files(directory='data'):
-    """Removes files from the temporary data directory."""
-    print(f"Cleaning up temporary files in {directory}...")
-    for filename in os.listdir(directory):
-        # Avoid removing .gitkeep or other essential files if any
-        if filename == '.gitkeep':
-            continue
-        file_path = os.path.join(directory, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-            print(f"Removed: {file_path}")
-        except Exception as e:
-            print(f'Failed to delete {file_path}. Reason: {e}')
\ No newline at end of file
+def cleanup_temp_files(directory=storage.DATA_DIR, ttl_seconds=storage.WORKSPACE_TTL_SECONDS):
+    """
+    Removes expired artifacts: job workspaces idle for more than ttl_seconds
+    and loose files in `directory` older than that. Active workspaces (other
+    sessions' in-progress reports) are never touched; the same collection
+    runs periodically in the background (utils.storage.start_gc).
+    """
+    print(f"Cleaning up expired files in {directory}...")
+    return storage.collect_garbage(ttl_seconds, loose_files_dir=directory)
\ No newline at end of file
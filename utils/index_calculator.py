@@ -1,45 +1,38 @@
 # utils/index_calculator.py
 import ee
+from utils import index_registry
 
-# Initialize Earth Engine - Assumes authentication is done via CLI
-try:
-    ee.Initialize()
-    ee.Initialize(project='geoinforme')  # Reemplaza con tu ID real ()from utils import index_calculator
-    print("Google Earth Engine Initialized Successfully.")
-except ee.EEException as e:
-    print(f"ERROR: Failed to initialize Earth Engine: {e}")
-    print("Please ensure you have authenticated via the command line ('earthengine authenticate').")
-    # In a real app, you might exit or raise a custom exception
-    # For MVP, we print the error and continue, GEE calls will fail later.
-except Exception as e:
-    print(f"An unexpected error occurred during EE initialization: {e}")
+# Earth Engine se inicializa de forma perezosa en utils.ee_client (no al importar)
+# Las fórmulas, bandas y visualización de cada índice viven en utils.index_registry
+
+
+def calculate_index(image, key):
+    """Calculates a registered index (utils.index_registry) as a one-band ee.Image."""
+    try:
+        return index_registry.get_index(key).build_ee(image)
+    except ee.EEException as e:
+        print(f"Error calculating {key.upper()}: {e}. Ensure image has bands {index_registry.get_index(key).required_bands}.")
+        return None
+
+
+def calculate_indices(image, keys=None):
+    """Calculates every selected index; returns {key: ee.Image} (None for failures)."""
+    return {key: calculate_index(image, key) for key in index_registry.resolve_keys(keys)}
+
+
+def stack_indices(image, keys=None):
+    """All selected indices as ONE multi-band ee.Image (bands NDVI, NDWI, ...)."""
+    return index_registry.build_ee_stack(image, keys)
 
 
 def calculate_ndvi(image):
     """Calculates NDVI (Normalized Difference Vegetation Index)."""
-    try:
-        return image.normalizedDifference(['B8', 'B4']).rename('NDVI') # Sentinel-2 bands: B8=NIR, B4=Red
-    except Exception as e:
-        print(f"Error calculating NDVI: {e}. Ensure image has B8 and B4 bands.")
-        # Return a dummy band or raise an error
-        return None # Or ee.Image(0).rename('NDVI') if you need an Image object
+    return calculate_index(image, 'ndvi') # Sentinel-2 bands: B8=NIR, B4=Red
 
 def calculate_ndwi(image):
     """Calculates NDWI (Normalized Difference Water Index - McFeeters)."""
-    try:
-        # Using Green (B3) and NIR (B8) for Sentinel-2
-        return image.normalizedDifference(['B3', 'B8']).rename('NDWI')
-    except Exception as e:
-        print(f"Error calculating NDWI: {e}. Ensure image has B3 and B8 bands.")
-        return None
+    return calculate_index(image, 'ndwi') # Green (B3) and NIR (B8)
 
 def calculate_nbr(image):
     """Calculates NBR (Normalized Burn Ratio)."""
-    try:
-        # Using NIR (B8) and SWIR (B12) for Sentinel-2
-        return image.normalizedDifference(['B8', 'B12']).rename('NBR')
-    except Exception as e:
-        print(f"Error calculating NBR: {e}. Ensure image has B8 and B12 bands.")
-        return None
-
-# Add other indices here as needed (MSI, BAI, SAVI etc. for future iterations)
\ No newline at end of file
+    return calculate_index(image, 'nbr') # NIR (B8) and SWIR (B12)
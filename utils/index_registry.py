@@ -0,0 +1,264 @@
+# utils/index_registry.py
+# Registro declarativo de índices espectrales Sentinel-2. Cada índice declara
+# sus bandas, su fórmula, los parámetros de visualización, el umbral de las
+# estadísticas zonales y los textos del informe; el cálculo en GEE (una sola
+# imagen multibanda con todos los índices), el motor local NumPy, las
+# estadísticas, la serie temporal y el PDF se arman a partir de este registro.
+# Agregar un índice es una llamada a register_index(), sin tocar el pipeline.
+#
+# Este módulo no importa ee al cargarse: solo build_ee_* lo necesitan.
+import ast
+import os
+
+import numpy as np
+
+# Sentinel-2 L2A guarda la reflectancia escalada por 10000
+REFLECTANCE_SCALE = 10000.0
+
+# Bandas que usa el mapa RGB (color verdadero)
+RGB_BANDS = ['B4', 'B3', 'B2']
+
+# Lo único que puede aparecer en una fórmula (además de números y variables)
+_BINARY_OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide, ast.Pow: np.power}
+_UNARY_OPS = {ast.USub: np.negative, ast.UAdd: np.positive}
+_FUNCTIONS = {'sqrt': np.sqrt, 'abs': np.abs}
+
+
+def compile_expression(expression, variables):
+    """
+    Compila una fórmula aritmética (+ - * / **, paréntesis, números, las
+    `variables` y sqrt/abs) a una función NumPy f({variable: array}) -> array.
+    La fórmula se recorre como AST y nunca se ejecuta como código Python:
+    cualquier otra construcción lanza ValueError.
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Fórmula inválida {expression!r}: {e.msg}")
+
+    def build(node):
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            op, left, right = _BINARY_OPS[type(node.op)], build(node.left), build(node.right)
+            return lambda values: op(left(values), right(values))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+            op, operand = _UNARY_OPS[type(node.op)], build(node.operand)
+            return lambda values: op(operand(values))
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            constant = np.float32(node.value)
+            return lambda values: constant
+        if isinstance(node, ast.Name) and node.id in variables:
+            name = node.id
+            return lambda values: values[name]
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+                and len(node.args) == 1 and not node.keywords):
+            function, argument = _FUNCTIONS[node.func.id], build(node.args[0])
+            return lambda values: function(argument(values))
+        raise ValueError(f"Fórmula no soportada {expression!r}: {type(node).__name__} no permitido "
+                         f"(variables: {', '.join(sorted(variables))})")
+
+    return build(tree.body)
+
+
+class SpectralIndex:
+    """
+    Definición de un índice. `bands` es {variable: banda S2} y `expression`
+    una fórmula aritmética sobre esas variables (reflectancia 0-1), válida
+    tanto para ee.Image.expression como para NumPy (ver compile_expression;
+    se valida al registrar el índice). Si se pasa
+    `normalized_difference=(A, B)` se usa normalizedDifference en GEE (mismo
+    resultado que la fórmula, sin escalar las bandas). `value_range` es el
+    rango del histograma de las estadísticas y del gráfico de la serie
+    temporal; los valores fuera de él caen en los bins de los extremos.
+    """
+
+    def __init__(self, key, title, bands, expression, vis, threshold=0.0, description='', color='#444444',
+                 normalized_difference=None, value_range=(-1.0, 1.0)):
+        self.key = key
+        self.name = key.upper() # Nombre de la banda en GEE y clave de stats/serie temporal
+        self.title = title
+        self.bands = dict(bands)
+        self.expression = expression
+        self.vis = vis
+        self.threshold = threshold
+        self.description = description
+        self.color = color
+        self.normalized_difference = normalized_difference
+        self.value_range = tuple(float(v) for v in value_range)
+        if not self.value_range[0] < self.value_range[1]:
+            raise ValueError(f"Rango inválido para {key!r}: {value_range!r}")
+        self._compute = compile_expression(expression, self.bands)
+
+    @property
+    def required_bands(self):
+        return sorted(set(self.bands.values()))
+
+    def build_ee(self, image):
+        """ee.Image de una banda (nombre self.name) con el índice calculado en GEE."""
+        if self.normalized_difference:
+            return image.normalizedDifference(list(self.normalized_difference)).rename(self.name)
+        variables = {var: image.select(band).divide(REFLECTANCE_SCALE) for var, band in self.bands.items()}
+        return image.expression(self.expression, variables).rename(self.name)
+
+    def compute_local(self, band_arrays):
+        """Índice en NumPy a partir de {banda: array en DN}; NaN donde no hay datos."""
+        variables = {var: np.asarray(band_arrays[band], dtype=np.float32) / np.float32(REFLECTANCE_SCALE)
+                     for var, band in self.bands.items()}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.array(self._compute(variables), dtype=np.float32)
+        # Igual que GEE: sin datos (todas las bandas en 0) o división por cero quedan enmascarados
+        no_data = np.all([variables[var] == 0 for var in variables], axis=0)
+        values[no_data | ~np.isfinite(values)] = np.nan
+        return values
+
+    def __repr__(self):
+        return f"SpectralIndex({self.key!r}, {self.expression!r})"
+
+
+# Registro global, en orden de registro (es el orden de mapas, tablas y serie)
+INDEXES = {}
+
+
+def register_index(key, title, bands, expression, vis, threshold=0.0, description='', color='#444444',
+                   normalized_difference=None, value_range=(-1.0, 1.0)):
+    """Registra (o reemplaza) un índice y devuelve su definición."""
+    index = SpectralIndex(key, title, bands, expression, vis, threshold, description, color, normalized_difference,
+                          value_range)
+    INDEXES[key] = index
+    return index
+
+
+def register_normalized_difference(key, title, band_a, band_b, vis, threshold=0.0, description='', color='#444444'):
+    """Atajo para índices (A - B) / (A + B), acotados a [-1, 1]."""
+    return register_index(key, title, {'A': band_a, 'B': band_b}, '(A - B) / (A + B)', vis, threshold,
+                          description, color, normalized_difference=(band_a, band_b))
+
+
+def get_index(key):
+    try:
+        return INDEXES[key]
+    except KeyError:
+        raise ValueError(f"Índice desconocido: {key!r}. Registrados: {', '.join(INDEXES)}")
+
+
+def resolve_keys(keys=None):
+    """Lista de claves validadas; None usa DEFAULT_INDICES."""
+    keys = DEFAULT_INDICES if keys is None else keys
+    return [get_index(key).key for key in keys]
+
+
+def required_bands(keys=None, include_rgb=False):
+    """Bandas S2 necesarias para calcular `keys` (y el RGB si se pide)."""
+    bands = set(RGB_BANDS) if include_rgb else set()
+    for key in resolve_keys(keys):
+        bands.update(get_index(key).required_bands)
+    return sorted(bands, key=lambda b: (len(b), b))
+
+
+def vis_params(keys=None):
+    """{clave: vis_params} de los índices `keys`."""
+    return {key: get_index(key).vis for key in resolve_keys(keys)}
+
+
+def thresholds(keys=None):
+    """{NOMBRE: umbral} para las estadísticas zonales."""
+    return {get_index(key).name: get_index(key).threshold for key in resolve_keys(keys)}
+
+
+def value_ranges(keys=None):
+    """{NOMBRE: (mínimo, máximo)} del histograma de las estadísticas zonales."""
+    return {get_index(key).name: get_index(key).value_range for key in resolve_keys(keys)}
+
+
+def compute_local(band_arrays, keys=None):
+    """{clave: array} con todos los índices `keys` calculados en NumPy."""
+    return {key: get_index(key).compute_local(band_arrays) for key in resolve_keys(keys)}
+
+
+def build_ee_indices(image, keys=None):
+    """{clave: ee.Image de una banda} para cada índice."""
+    return {key: get_index(key).build_ee(image) for key in resolve_keys(keys)}
+
+
+def build_ee_stack(image, keys=None):
+    """Una sola ee.Image multibanda con todos los índices (bandas NDVI, NDWI, ...)."""
+    import ee
+    return ee.Image.cat([index for index in build_ee_indices(image, keys).values()])
+
+
+# --- Índices registrados --------------------------------------------------------
+# Las diferencias normalizadas están en [-1, 1]; SAVI llega a ±1.5 y EVI no está
+# acotado (su denominador puede acercarse a 0), así que declaran su value_range.
+
+_VEGETATION_PALETTE = ['FFFFFF', 'CE7E45', 'DF923D', 'F1B555', 'FCD163', '99B718',
+                       '74A901', '66A000', '529400', '3E8601', '207401', '056201',
+                       '004C00', '023B01', '012E01', '011D01', '011301']
+_WATER_PALETTE = ['#FF0000', '#FFA500', '#FFFF00', '#808080', '#00FFFF', '#0000FF']
+_BURN_PALETTE = ['#0000FF', '#00FFFF', '#FFFF00', '#FFA500', '#FF0000', '#8B0000']
+
+register_normalized_difference(
+    'ndvi', 'Índice de Vegetación (NDVI)', 'B8', 'B4',  # NIR, Red
+    {'min': -0.2, 'max': 0.9, 'palette': _VEGETATION_PALETTE},
+    threshold=0.5,  # vegetación vigorosa
+    description='Valores altos (verde) indican vegetación vigorosa. Valores bajos (marrón/blanco) indican suelo desnudo, agua o vegetación estresada.',
+    color='#008000')
+register_normalized_difference(
+    'ndwi', 'Índice de Agua (NDWI)', 'B3', 'B8',  # Green, NIR (McFeeters)
+    {'min': -0.5, 'max': 0.5, 'palette': _WATER_PALETTE},
+    threshold=0.0,  # agua / alta humedad
+    description='Valores altos (azul) indican presencia de agua o alta humedad. Valores bajos (rojo/amarillo) indican áreas secas.',
+    color='#0000FF')
+register_normalized_difference(
+    'nbr', 'Ratio de Quemado Normalizado (NBR)', 'B8', 'B12',  # NIR, SWIR2
+    {'min': -0.5, 'max': 0.8, 'palette': _BURN_PALETTE},
+    threshold=0.1,  # bajo este valor: posible área quemada o suelo desnudo
+    description='Valores bajos indican áreas quemadas recientemente (pre-incendio vs post-incendio para dNBR). Este NBR simple puede correlacionarse con estrés hídrico o áreas quemadas.',
+    color='#8B0000')
+register_index(
+    'savi', 'Índice de Vegetación Ajustado al Suelo (SAVI)', {'NIR': 'B8', 'RED': 'B4'},
+    '1.5 * (NIR - RED) / (NIR + RED + 0.5)',  # L = 0.5
+    {'min': -0.2, 'max': 0.8, 'palette': _VEGETATION_PALETTE},
+    threshold=0.3,
+    description='Como el NDVI, pero corrige el efecto del suelo visible; útil en cultivos con baja cobertura.',
+    color='#6B8E23',
+    value_range=(-1.5, 1.5))  # (1 + L) * [-1, 1]
+register_index(
+    'evi', 'Índice de Vegetación Mejorado (EVI)', {'NIR': 'B8', 'RED': 'B4', 'BLUE': 'B2'},
+    '2.5 * (NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1)',
+    {'min': -0.2, 'max': 0.8, 'palette': _VEGETATION_PALETTE},
+    threshold=0.3,
+    description='Menos saturado que el NDVI en vegetación densa y menos sensible a la atmósfera.',
+    color='#2E8B57',
+    value_range=(-1.0, 1.0))  # Rango útil; los valores espurios (denominador ~0) caen en los bins extremos
+register_normalized_difference(
+    'ndmi', 'Índice de Humedad (NDMI)', 'B8', 'B11',  # NIR, SWIR1
+    {'min': -0.5, 'max': 0.6, 'palette': _WATER_PALETTE},
+    threshold=0.2,
+    description='Contenido de agua de la vegetación: valores altos indican follaje hidratado, bajos estrés hídrico.',
+    color='#4682B4')
+register_normalized_difference(
+    'gndvi', 'Índice de Vegetación Verde (GNDVI)', 'B8', 'B3',  # NIR, Green
+    {'min': -0.2, 'max': 0.9, 'palette': _VEGETATION_PALETTE},
+    threshold=0.5,
+    description='Más sensible a la clorofila que el NDVI; útil para seguir el estado nutricional del cultivo.',
+    color='#9ACD32')
+register_normalized_difference(
+    'ndre', 'Índice de Borde Rojo (NDRE)', 'B8', 'B5',  # NIR, Red Edge 1
+    {'min': -0.2, 'max': 0.6, 'palette': _VEGETATION_PALETTE},
+    threshold=0.25,
+    description='Usa el borde rojo: detecta estrés y contenido de nitrógeno en cultivos ya densos.',
+    color='#556B2F')
+register_normalized_difference(
+    'nbr2', 'Ratio de Quemado Normalizado 2 (NBR2)', 'B11', 'B12',  # SWIR1, SWIR2
+    {'min': -0.3, 'max': 0.5, 'palette': _BURN_PALETTE},
+    threshold=0.1,
+    description='Sensible a la humedad del suelo y residuos tras un incendio; complementa al NBR.',
+    color='#CD5C5C')
+register_normalized_difference(
+    'ndbi', 'Índice de Áreas Construidas (NDBI)', 'B11', 'B8',  # SWIR1, NIR
+    {'min': -0.5, 'max': 0.5, 'palette': _BURN_PALETTE},
+    threshold=0.0,
+    description='Valores positivos indican superficies construidas o suelo desnudo.',
+    color='#696969')
+
+# Índices de cada informe si no se eligen otros (p. ej. GEOINFORME_INDICES=ndvi,savi,ndmi)
+DEFAULT_INDICES = [key.strip() for key in os.environ.get('GEOINFORME_INDICES', 'ndvi,ndwi,nbr').split(',') if key.strip()]
@@ -0,0 +1,412 @@
+# utils/ingest.py
+# Ingesta en streaming de archivos subidos (GeoJSON, KML, KMZ) con memoria
+# acotada: el GeoJSON se lee por bloques con un parser JSON incremental que
+# decodifica un feature a la vez, y el KML con iterparse liberando cada
+# Placemark apenas se procesa. Las coordenadas quedan en arrays NumPy
+# compactos y lo que se guarda en sesión es un handle (ParsedUpload), nunca el
+# texto del archivo.
+import codecs
+import hashlib
+import json
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from utils.geometry import AOIGeometry
+
+CHUNK_SIZE = int(os.environ.get('GEOINFORME_INGEST_CHUNK_BYTES', 1 << 20))  # 1 MiB por lectura
+SUPPORTED_EXTENSIONS = ('geojson', 'json', 'kml', 'kmz')
+
+_JSON_WHITESPACE = ' \t\r\n'
+
+
+class CompactGeometry:
+    """
+    Geometría con todas sus coordenadas en un único array float64 (n, 2) y
+    offsets int32 de partes (anillos/líneas) y de polígonos, al estilo GeoArrow.
+    """
+
+    __slots__ = ('type', 'coords', 'part_offsets', 'polygon_offsets')
+
+    def __init__(self, geometry_type, parts, polygon_sizes=None):
+        self.type = geometry_type
+        self.coords = np.concatenate(parts) if parts else np.empty((0, 2))
+        self.part_offsets = np.cumsum([0] + [len(p) for p in parts]).astype(np.int32)
+        self.polygon_offsets = np.cumsum([0] + list(polygon_sizes or [])).astype(np.int32)
+
+    @classmethod
+    def from_geojson(cls, geometry):
+        """Construye la versión compacta de una geometría GeoJSON (dict)."""
+        kind, coords = geometry['type'], geometry.get('coordinates')
+        if kind == 'Point':
+            return cls(kind, [_as_xy([coords])])
+        if kind in ('MultiPoint', 'LineString'):
+            return cls(kind, [_as_xy(coords)])
+        if kind == 'MultiLineString':
+            return cls(kind, [_as_xy(line) for line in coords])
+        if kind == 'Polygon':
+            return cls(kind, [_as_xy(ring) for ring in coords], [len(coords)])
+        if kind == 'MultiPolygon':
+            return cls(kind, [_as_xy(ring) for polygon in coords for ring in polygon], [len(p) for p in coords])
+        raise ValueError(f"Tipo de geometría no soportado: {kind}")
+
+    def _parts(self):
+        offsets = self.part_offsets
+        return [self.coords[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+    def to_geojson(self):
+        """Geometría GeoJSON (dict) equivalente."""
+        parts = self._parts()
+        if self.type == 'Point':
+            return {'type': 'Point', 'coordinates': parts[0][0]}
+        if self.type in ('MultiPoint', 'LineString'):
+            return {'type': self.type, 'coordinates': parts[0]}
+        if self.type == 'MultiLineString':
+            return {'type': self.type, 'coordinates': parts}
+        polygons = [parts[self.polygon_offsets[i]:self.polygon_offsets[i + 1]]
+                    for i in range(len(self.polygon_offsets) - 1)]
+        if self.type == 'Polygon':
+            return {'type': 'Polygon', 'coordinates': polygons[0]}
+        return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+    @property
+    def vertex_count(self):
+        return len(self.coords)
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + self.part_offsets.nbytes + self.polygon_offsets.nbytes
+
+    def update_hash(self, digest):
+        digest.update(self.type.encode())
+        digest.update(self.coords.tobytes())
+        digest.update(self.part_offsets.tobytes())
+        digest.update(self.polygon_offsets.tobytes())
+
+
+def _as_xy(points):
+    """Array float64 (n, 2) lon/lat; descarta altitud (también con dimensiones mezcladas)."""
+    if not points:
+        return np.empty((0, 2))
+    try:
+        array = np.asarray(points, dtype=float)
+    except ValueError:
+        array = None
+    if array is None or array.ndim != 2:
+        array = np.asarray([point[:2] for point in points], dtype=float)
+    return np.ascontiguousarray(array[:, :2])
+
+
+class ParsedUpload:
+    """
+    Handle de un archivo subido: ids y geometrías compactas de todos sus
+    features, más una huella (SHA-256 de las coordenadas) para claves de caché.
+    Es lo que se guarda en st.session_state en lugar del texto del archivo.
+    """
+
+    def __init__(self, name, source_format, features):
+        self.name = name
+        self.source_format = source_format
+        self.ids = []
+        self.geometries = []
+        digest = hashlib.sha256()
+        for feature_id, compact in features:
+            self.ids.append(feature_id)
+            self.geometries.append(compact)
+            compact.update_hash(digest)
+        if not self.geometries:
+            raise ValueError(f"No se encontraron geometrías en {name}.")
+        self.fingerprint = digest.hexdigest()
+
+    def __len__(self):
+        return len(self.geometries)
+
+    @property
+    def vertex_count(self):
+        return sum(g.vertex_count for g in self.geometries)
+
+    @property
+    def nbytes(self):
+        return sum(g.nbytes for g in self.geometries)
+
+    def geometry(self, index=0):
+        """Geometría GeoJSON (dict) del feature `index`."""
+        return self.geometries[index].to_geojson()
+
+    def iter_features(self):
+        """Itera (feature_id, geometría GeoJSON) materializando un feature a la vez."""
+        for feature_id, compact in zip(self.ids, self.geometries):
+            yield feature_id, compact.to_geojson()
+
+    def bounds(self):
+        """(xmin, ymin, xmax, ymax) de todos los features."""
+        mins = np.min([g.coords.min(axis=0) for g in self.geometries if g.vertex_count], axis=0)
+        maxs = np.max([g.coords.max(axis=0) for g in self.geometries if g.vertex_count], axis=0)
+        return float(mins[0]), float(mins[1]), float(maxs[0]), float(maxs[1])
+
+    def to_aoi(self, index=0):
+        """AOIGeometry del feature `index` (el informe usa el primero)."""
+        return AOIGeometry(self.geometry(index))
+
+    def summary(self):
+        return (f"{self.name}: {len(self)} feature(s), {self.vertex_count} vértices, "
+                f"{self.nbytes / 1e6:.1f} MB en memoria")
+
+    def __repr__(self):
+        return f"ParsedUpload({self.summary()})"
+
+
+# --- GeoJSON incremental ------------------------------------------------------
+
+class _JSONStream:
+    """
+    Lector JSON incremental sobre un archivo binario (o de texto): mantiene en
+    memoria solo la ventana no consumida y decodifica valor por valor con
+    JSONDecoder.raw_decode, leyendo más bloques cuando un valor queda cortado.
+    """
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self._file = fileobj
+        self._chunk_size = chunk_size
+        self._text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Agrega un bloque al buffer (descartando lo consumido). False si ya no hay más datos."""
+        if self.eof:
+            return False
+        # Bloques crecientes: un valor enorme se completa en O(log n) lecturas
+        size = max(self._chunk_size, len(self.buffer) - self.pos)
+        chunk = self._file.read(size)
+        if isinstance(chunk, str):
+            text = chunk
+        else:
+            text = self._text_decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Siguiente carácter que no sea espacio ('' al final del archivo)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON inválido: se esperaba '{char}' y se encontró '{found or 'EOF'}'.")
+        self.pos += 1
+
+    def elements(self, close):
+        """
+        Recorre los elementos de un objeto o arreglo ya abierto: cede una vez
+        por elemento (quien itera lo consume), exige ',' entre elementos y
+        consume el cierre `close`.
+        """
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == close:
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def value(self):
+        """Decodifica el siguiente valor JSON completo."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self.buffer, self.pos)
+                # Un valor que termina justo en el borde del buffer puede estar cortado (p. ej. un número)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                raise ValueError("JSON inválido: el archivo terminó en medio de un valor.")
+
+
+def iter_geojson_stream(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Itera (feature_id, geometría) de un GeoJSON sin cargarlo entero: el
+    arreglo 'features' de un FeatureCollection se decodifica feature por
+    feature. Un Feature o una geometría suelta también se aceptan.
+    Los features sin geometría se omiten.
+    """
+    stream = _JSONStream(fileobj, chunk_size)
+    stream.expect('{')
+    top_level = {}
+    saw_features = False
+    for _ in stream.elements('}'):
+        key = stream.value()
+        if not isinstance(key, str):
+            raise ValueError(f"JSON inválido: clave no textual {key!r}.")
+        stream.expect(':')
+        if key != 'features':
+            top_level[key] = stream.value()
+            continue
+        saw_features = True
+        stream.expect('[')
+        for position, _ in enumerate(stream.elements(']')):
+            feature = stream.value()
+            if isinstance(feature, dict) and feature.get('geometry'):
+                yield str(feature.get('id', position)), feature['geometry']
+
+    if saw_features:
+        return
+    kind = top_level.get('type')
+    if kind == 'Feature':
+        if top_level.get('geometry'):
+            yield str(top_level.get('id', 0)), top_level['geometry']
+    elif 'coordinates' in top_level:
+        yield '0', top_level
+    else:
+        raise ValueError(f"Tipo GeoJSON no soportado: {kind}")
+
+
+def load_geojson(fileobj, name='upload.geojson', chunk_size=CHUNK_SIZE):
+    features = ((feature_id, CompactGeometry.from_geojson(geometry))
+                for feature_id, geometry in iter_geojson_stream(fileobj, chunk_size))
+    return ParsedUpload(name, 'geojson', features)
+
+
+# --- KML / KMZ ----------------------------------------------------------------
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def _kml_coordinates(text):
+    """Texto 'lon,lat[,alt] lon,lat[,alt] ...' -> array (n, 2)."""
+    tuples = (text or '').split()
+    if not tuples:
+        return np.empty((0, 2))
+    dims = tuples[0].count(',') + 1
+    values = np.array((text or '').replace(',', ' ').split(), dtype=float)
+    if values.size == len(tuples) * dims:
+        return np.ascontiguousarray(values.reshape(-1, dims)[:, :2])
+    # Tuplas con dimensiones mezcladas (2D y 3D en el mismo anillo)
+    return np.array([t.split(',')[:2] for t in tuples], dtype=float)
+
+
+def _child_coordinates(elem):
+    for child in elem.iter():
+        if _local_name(child.tag) == 'coordinates':
+            return _kml_coordinates(child.text)
+    return np.empty((0, 2))
+
+
+def _closed(ring):
+    if len(ring) and not np.array_equal(ring[0], ring[-1]):
+        return np.vstack([ring, ring[:1]])
+    return ring
+
+
+def _placemark_geometry(placemark):
+    """CompactGeometry de un Placemark (Polygon, MultiGeometry, LineString o Point) o None."""
+    polygons, lines, points = [], [], []
+    for elem in placemark.iter():
+        tag = _local_name(elem.tag)
+        if tag == 'Polygon':
+            outer, inner = [], []
+            for boundary in elem:
+                boundary_tag = _local_name(boundary.tag)
+                if boundary_tag == 'outerBoundaryIs':
+                    outer.append(_closed(_child_coordinates(boundary)))
+                elif boundary_tag == 'innerBoundaryIs':
+                    inner.append(_closed(_child_coordinates(boundary)))
+            if outer and len(outer[0]) >= 4:
+                polygons.append(outer[:1] + inner)
+        elif tag == 'LineString':
+            lines.append(_child_coordinates(elem))
+        elif tag == 'Point':
+            points.append(_child_coordinates(elem)[:1])
+    if polygons:
+        kind = 'Polygon' if len(polygons) == 1 else 'MultiPolygon'
+        return CompactGeometry(kind, [ring for polygon in polygons for ring in polygon], [len(p) for p in polygons])
+    if lines:
+        return CompactGeometry('LineString' if len(lines) == 1 else 'MultiLineString', lines)
+    if points:
+        return CompactGeometry('Point' if len(points) == 1 else 'MultiPoint', [np.concatenate(points)])
+    return None
+
+
+def iter_kml_stream(fileobj):
+    """
+    Itera (feature_id, CompactGeometry) por cada Placemark de un KML usando
+    iterparse; cada Placemark se quita del árbol al terminar de procesarlo.
+    Un XML mal formado lanza ValueError.
+    """
+    stack = []
+    position = 0
+    try:
+        for event, elem in ET.iterparse(fileobj, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            if _local_name(elem.tag) != 'Placemark':
+                continue
+            compact = _placemark_geometry(elem)
+            if compact is not None:
+                name = next((c.text for c in elem if _local_name(c.tag) == 'name' and c.text), None)
+                yield elem.get('id') or name or str(position), compact
+            position += 1
+            if stack:
+                stack[-1].remove(elem)  # Libera el Placemark ya procesado
+            elem.clear()
+    except ET.ParseError as e:
+        raise ValueError(f"KML inválido: {e}") from e
+
+
+def load_kml(fileobj, name='upload.kml'):
+    return ParsedUpload(name, 'kml', iter_kml_stream(fileobj))
+
+
+def load_kmz(fileobj, name='upload.kmz'):
+    """KMZ: se lee en streaming el doc.kml (o el primer .kml) del zip."""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"El KMZ {name} no es un zip válido: {e}") from e
+    with archive:
+        members = [m for m in archive.namelist() if m.lower().endswith('.kml')]
+        if not members:
+            raise ValueError(f"El KMZ {name} no contiene ningún archivo .kml.")
+        member = 'doc.kml' if 'doc.kml' in members else members[0]
+        with archive.open(member) as kml_file:
+            return ParsedUpload(name, 'kmz', iter_kml_stream(kml_file))
+
+
+def load_upload(fileobj, name):
+    """Parsea un archivo (objeto binario) según la extensión de `name`."""
+    extension = name.rsplit('.', 1)[-1].lower()
+    if extension in ('geojson', 'json'):
+        return load_geojson(fileobj, name)
+    if extension == 'kml':
+        return load_kml(fileobj, name)
+    if extension == 'kmz':
+        return load_kmz(fileobj, name)
+    raise ValueError(f"Tipo de archivo no soportado: .{extension}")
+
+
+def load_path(path):
+    """load_upload sobre un archivo en disco."""
+    with open(path, 'rb') as f:
+        return load_upload(f, os.path.basename(path))
@@ -0,0 +1,280 @@
+# utils/local_engine.py
+# Motor local de índices: descarga una sola vez la reflectancia de las bandas
+# Sentinel-2 necesarias para el AOI y calcula/renderiza todos los índices con
+# NumPy en el cliente. Las funciones de cálculo y render trabajan sobre arrays
+# puros, así que pueden probarse sin conexión con bandas sintéticas.
+import io
+import os
+import numpy as np
+from PIL import Image as PILImage
+
+from utils import index_registry
+
+# Bandas Sentinel-2 que cubren RGB + los índices por defecto (utils.index_registry)
+BANDS = index_registry.required_bands(include_rgb=True)
+
+LUT_SIZE = 256
+
+# Banda extra de la imagen apilada: >0 donde todas las capas tienen dato.
+# computePixels devuelve 0 (no NaN) en los píxeles enmascarados (nubes, fuera
+# de la escena), así que sin ella se pintarían como valores válidos.
+MASK_BAND = 'valid'
+
+
+def region_extent(region):
+    """Devuelve (xmin, ymin, xmax, ymax) de las coordenadas de un polígono de bounds."""
+    ring = np.asarray(region[0] if np.ndim(region) == 3 else region, dtype=float)
+    return ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max()
+
+
+def pixel_grid(region, width, height):
+    """Grid (EPSG:4326) de computePixels que cubre los bounds del AOI con width x height píxeles."""
+    xmin, ymin, xmax, ymax = region_extent(region)
+    return {
+        'dimensions': {'width': width, 'height': height},
+        'affineTransform': {
+            'scaleX': (xmax - xmin) / width, 'shearX': 0, 'translateX': xmin,
+            'shearY': 0, 'scaleY': -(ymax - ymin) / height, 'translateY': ymax,
+        },
+        'crsCode': 'EPSG:4326',
+    }
+
+
+def fetch_band_arrays(image, region, width=512, height=512, bands=None, counter=None, stage='band_download'):
+    """
+    Descarga en UNA petición (ee.data.computePixels) la reflectancia de `bands`
+    para el AOI. Devuelve {banda: np.ndarray float32 (height, width)}.
+    `image` puede traer bandas calculadas en GEE (p. ej. índices apilados).
+    """
+    import ee  # Solo necesario para la descarga; el resto del módulo funciona sin ee
+    from utils import gee_calls
+    bands = bands or BANDS
+    raw = gee_calls.call_with_retry(ee.data.computePixels, {
+        'expression': image.select(bands),
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': pixel_grid(region, width, height),
+    }, description=f"computePixels [{stage}]")
+    if counter is not None:
+        counter.record(stage)
+    # computePixels devuelve un array estructurado con un campo por banda
+    return {band: np.asarray(raw[band], dtype=np.float32) for band in bands}
+
+
+def apply_mask(arrays, mask_band=MASK_BAND):
+    """Quita la banda de máscara de `arrays` y deja NaN (sin datos) en todas las bandas donde vale 0."""
+    invalid = ~(arrays.pop(mask_band) > 0)
+    for values in arrays.values():
+        values[invalid] = np.nan
+    return arrays
+
+
+def fetch_masked_arrays(stacked, region, width, height, bands, counter=None, stage='stacked_maps'):
+    """
+    fetch_band_arrays sobre una imagen de stacked_image(): pide `bands` más
+    la máscara en la misma petición y devuelve {banda: array} con NaN en los
+    píxeles enmascarados.
+    """
+    arrays = fetch_band_arrays(stacked, region, width, height, bands=list(bands) + [MASK_BAND], counter=counter,
+                               stage=stage)
+    return apply_mask(arrays)
+
+
+def normalized_difference(a, b):
+    """(a - b) / (a + b) vectorizado; NaN donde la suma es 0 (sin datos)."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    total = a + b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = (a - b) / total
+    result[total == 0] = np.nan
+    return result
+
+
+def compute_indices(bands, keys=None):
+    """Calcula los índices `keys` (por defecto los de index_registry.DEFAULT_INDICES) a partir del dict de bandas."""
+    return index_registry.compute_local(bands, keys)
+
+
+def _hex_to_rgb(color):
+    color = color.lstrip('#')
+    return [int(color[i:i + 2], 16) for i in (0, 2, 4)]
+
+
+def build_palette_lut(palette, size=LUT_SIZE):
+    """
+    Tabla (size, 3) uint8 que interpola linealmente la paleta, como hace
+    visualize() en GEE.
+    """
+    colors = np.array([_hex_to_rgb(c) for c in palette], dtype=np.float32)
+    if len(colors) == 1:
+        return np.repeat(colors.astype(np.uint8), size, axis=0)
+    stops = np.linspace(0, 1, len(colors))
+    positions = np.linspace(0, 1, size)
+    lut = np.stack([np.interp(positions, stops, colors[:, c]) for c in range(3)], axis=1)
+    return np.round(lut).astype(np.uint8)
+
+
+def render_index(values, vis_params, lut=None):
+    """
+    Aplica min/max/paleta de vis_params a un índice. Devuelve RGBA uint8;
+    los píxeles sin datos (NaN) quedan transparentes.
+    """
+    vmin = vis_params.get('min', 0)
+    vmax = vis_params.get('max', 1)
+    if lut is None:
+        lut = build_palette_lut(vis_params['palette'])
+    valid = np.isfinite(values)
+    scaled = (np.where(valid, values, vmin) - vmin) / (vmax - vmin)
+    idx = np.clip(scaled * (len(lut) - 1), 0, len(lut) - 1).astype(np.intp)
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = lut[idx]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def render_rgb(bands, vis_params):
+    """
+    Compone una imagen RGB estirando linealmente las bandas de
+    vis_params['bands']. Los píxeles sin datos (NaN, o todas las bandas en 0)
+    quedan transparentes.
+    """
+    vmin = vis_params.get('min', 0)
+    vmax = vis_params.get('max', 3000)
+    stack = np.stack([bands[b] for b in vis_params['bands']], axis=-1)
+    valid = np.isfinite(stack).all(axis=-1)
+    stack = np.where(np.isfinite(stack), stack, 0)
+    scaled = np.clip((stack - vmin) / (vmax - vmin) * 255.0, 0, 255)
+    rgba = np.empty(stack.shape[:2] + (4,), dtype=np.uint8)
+    rgba[..., :3] = np.round(scaled).astype(np.uint8)
+    rgba[..., 3] = np.where(valid & (stack.sum(axis=-1) > 0), 255, 0)
+    return rgba
+
+
+def encode_png(rgba):
+    """Codifica un array RGBA uint8 como PNG en memoria (bytes)."""
+    buffer = io.BytesIO()
+    PILImage.fromarray(rgba, mode='RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def save_png(rgba, filepath):
+    """Guarda un array RGBA uint8 como PNG (escritura atómica)."""
+    from utils import storage
+    return storage.atomic_write(filepath, encode_png(rgba))
+
+
+def render_maps(bands, vis_by_key, rgb_vis=None):
+    """
+    Calcula y renderiza todos los mapas desde las bandas ya descargadas.
+    `vis_by_key` es {índice: vis_params}; si se pasa rgb_vis se agrega 'rgb'.
+    Devuelve {clave: array RGBA}, sin tocar la red.
+    """
+    renders = {}
+    if rgb_vis is not None:
+        renders['rgb'] = render_rgb(bands, rgb_vis)
+    indices = compute_indices(bands, list(vis_by_key))
+    for key, vis in vis_by_key.items():
+        renders[key] = render_index(indices[key], vis)
+    return renders
+
+
+def generate_map_images_locally(image, region, map_files, vis_by_key, rgb_vis, data_dir, width=512, height=512, counter=None, in_memory=False, return_indices=False):
+    """
+    Equivalente local de map_generator.generate_map_images: una sola descarga
+    de bandas y render de todos los mapas en NumPy.
+    `map_files` es {clave: filename}. Devuelve {clave: ruta o None}, o
+    {clave: bytes PNG o None} si in_memory=True. Con return_indices=True
+    devuelve (salidas, {índice: array}) para reutilizar los valores calculados.
+    """
+    try:
+        bands = fetch_band_arrays(image, region, width, height, counter=counter,
+                                  bands=index_registry.required_bands(list(vis_by_key), include_rgb=rgb_vis is not None))
+        indices = compute_indices(bands, list(vis_by_key))
+        renders = {key: render_index(indices[key], vis) for key, vis in vis_by_key.items()}
+        if rgb_vis is not None:
+            renders['rgb'] = render_rgb(bands, rgb_vis)
+    except Exception as e:
+        print(f"ERROR en el motor local descargando/calculando bandas: {e}")
+        failed = {key: None for key in map_files}
+        return (failed, None) if return_indices else failed
+
+    outputs = {}
+    for key, filename in map_files.items():
+        try:
+            if in_memory:
+                outputs[key] = encode_png(renders[key])
+            else:
+                outputs[key] = save_png(renders[key], os.path.join(data_dir, filename))
+            print(f"Imagen de mapa generada localmente: {filename}")
+        except Exception as e:
+            print(f"ERROR codificando mapa local {filename}: {e}")
+            outputs[key] = None
+    return (outputs, indices) if return_indices else outputs
+
+
+def stacked_image(image, index_keys, rgb_bands=None):
+    """
+    Imagen multibanda con las bandas RGB (si se piden) + todos los índices
+    `index_keys` calculados en GEE, en float para una sola descarga, más la
+    banda MASK_BAND (ver fetch_masked_arrays).
+    """
+    import ee
+    layers = [image.select(list(rgb_bands))] if rgb_bands else []
+    layers.extend(index_registry.build_ee_indices(image, index_keys).values())
+    stacked = ee.Image.cat(layers).toFloat()
+    return stacked.addBands(stacked.mask().reduce(ee.Reducer.min()).rename(MASK_BAND))
+
+
+def _fetch_stacked_arrays(image, region, index_keys, rgb_bands, names, width, height, counter, stage, scene_id):
+    if scene_id:
+        import sqlite3
+        from utils import tile_cache # Importado acá: tile_cache depende de este módulo
+        # Un AOI chico a 512 px pide más detalle que el zoom máximo: se descarga directo
+        if tile_cache.TILE_CACHE_ENABLED and tile_cache.get_tile_cache().covers(region, width, height):
+            try:
+                return tile_cache.get_tile_cache().fetch_layers(image, scene_id, index_keys, rgb_bands, region, width,
+                                                                height, counter, stage)
+            except sqlite3.Error as e:
+                print(f"WARNING: Caché de tiles no disponible ({e}); se descarga el AOI completo.")
+    return fetch_masked_arrays(stacked_image(image, index_keys, rgb_bands), region, width, height,
+                               rgb_bands + list(names.values()), counter=counter, stage=stage)
+
+
+def generate_stacked_map_images(image, region, index_keys, rgb_vis=None, width=512, height=512, counter=None,
+                                stage='stacked_maps', return_indices=False, scene_id=None):
+    """
+    Motor 'stacked': los índices se calculan en GEE (utils.index_registry) y se
+    apilan con las bandas RGB en UNA imagen que se descarga con una sola
+    petición computePixels; el split por índice y el render con paletas se
+    hacen en el cliente. Las llamadas remotas no crecen con la cantidad de índices.
+    Los píxeles enmascarados en GEE quedan transparentes (NaN en los índices).
+    Con scene_id (id de la escena de `image`) los valores se arman desde el
+    caché de tiles (utils.tile_cache) y solo se descargan los tiles faltantes.
+    Devuelve {clave: bytes PNG o None} (incluye 'rgb' si se pasa rgb_vis); con
+    return_indices=True devuelve (salidas, {clave: array}).
+    """
+    index_keys = index_registry.resolve_keys(index_keys)
+    rgb_bands = list(rgb_vis['bands']) if rgb_vis is not None else []
+    keys = (['rgb'] if rgb_vis is not None else []) + index_keys
+    try:
+        names = {key: index_registry.get_index(key).name for key in index_keys}
+        arrays = _fetch_stacked_arrays(image, region, index_keys, rgb_bands, names, width, height, counter, stage, scene_id)
+        indices = {key: arrays[name] for key, name in names.items()}
+    except Exception as e:
+        print(f"ERROR descargando la imagen apilada de índices: {e}")
+        failed = {key: None for key in keys}
+        return (failed, None) if return_indices else failed
+
+    outputs = {}
+    for key in keys:
+        try:
+            if key == 'rgb':
+                rgba = render_rgb(arrays, rgb_vis)
+            else:
+                rgba = render_index(indices[key], index_registry.get_index(key).vis)
+            outputs[key] = encode_png(rgba)
+        except Exception as e:
+            print(f"ERROR renderizando mapa {key} desde la imagen apilada: {e}")
+            outputs[key] = None
+    print(f"Mapas renderizados desde una descarga apilada ({len(keys)} mapas, {width}x{height} px).")
+    return (outputs, indices) if return_indices else outputs
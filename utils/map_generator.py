@@ -2,42 +2,82 @@
 import ee
 import os
 import requests # Necesitamos requests para descargar la imagen desde la URL
-import shutil   # Para guardar el contenido descargado en un archivo
-
-# Asegúrate de que el directorio de datos exista
-DATA_DIR = 'data'
-os.makedirs(DATA_DIR, exist_ok=True)
-
-# Define los parámetros de visualización estándar (MANTENERlos como estaban)
-ndvi_vis = {
-    'min': -0.2, 'max': 0.9,
-    'palette': ['FFFFFF', 'CE7E45', 'DF923D', 'F1B555', 'FCD163', '99B718',
-                '74A901', '66A000', '529400', '3E8601', '207401', '056201',
-                '004C00', '023B01', '012E01', '011D01', '011301']
-}
-ndwi_vis = {
-    'min': -0.5, 'max': 0.5,
-    'palette': ['#FF0000', '#FFA500', '#FFFF00', '#808080', '#00FFFF', '#0000FF']
-}
-nbr_vis = {
-    'min': -0.5, 'max': 0.8,
-     'palette': ['#0000FF', '#00FFFF', '#FFFF00', '#FFA500', '#FF0000', '#8B0000']
-}
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from utils import gee_calls
+from utils import index_registry
+from utils import storage
+from utils import tracing
+
+DATA_DIR = storage.DATA_DIR
+
+# Número máximo de mapas generados en paralelo (getThumbURL + descarga)
+MAX_CONCURRENT_MAPS = int(os.environ.get('GEOINFORME_MAX_CONCURRENT_MAPS', 4))
+
+THUMBNAIL_SIZE_PX = 512  # lado de las miniaturas del informe
+# Lado de las vistas previas rápidas que se muestran apenas se elige la escena
+PREVIEW_SIZE_PX = int(os.environ.get('GEOINFORME_PREVIEW_PX', 128))
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Devuelve la sesión HTTP compartida (keep-alive) usada para descargar las
+    miniaturas. El pool de conexiones se dimensiona según MAX_CONCURRENT_MAPS.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_MAPS, pool_maxsize=MAX_CONCURRENT_MAPS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+# Parámetros de visualización estándar; los de cada índice viven en utils.index_registry
+ndvi_vis = index_registry.get_index('ndvi').vis
+ndwi_vis = index_registry.get_index('ndwi').vis
+nbr_vis = index_registry.get_index('nbr').vis
 rgb_vis = {
-    'bands': ['B4', 'B3', 'B2'],
+    'bands': list(index_registry.RGB_BANDS),
     'min': 0,
     'max': 3000 # Ajustar según reflectancia Sentinel-2 L2A
 }
 
 
-def generate_map_image(image, vis_params, filename, aoi, title="Map"):
+def visualize_for_map(image, vis_params):
+    """Aplica vis_params con visualize() (RGB por bandas o índice con paleta)."""
+    # Es importante asegurarse de que vis_params contenga claves válidas para visualize()
+    if 'bands' in vis_params: # Caso RGB
+        return image.visualize(
+            bands=vis_params.get('bands'),
+            min=vis_params.get('min', 0),
+            max=vis_params.get('max', 3000)
+            # Otros params como gamma, opacity podrían ir aquí
+        )
+    # Caso índices de una banda con paleta
+    return image.visualize(
+        min=vis_params.get('min', 0),
+        max=vis_params.get('max', 1),
+        palette=vis_params.get('palette')
+    )
+
+
+def fetch_map_png(image, vis_params, aoi, title="Map", region=None, counter=None, size=THUMBNAIL_SIZE_PX,
+                  stage='thumbnails'):
     """
-    Genera una imagen de mapa (PNG) obteniendo una miniatura directamente de GEE
-    usando getThumbURL y la guarda localmente.
-    Devuelve la ruta a la imagen guardada.
+    Obtiene una miniatura PNG directamente de GEE (getThumbURL) y la devuelve
+    como bytes en memoria, sin tocar el disco.
+    Si se pasa `region` (coordenadas de los bounds del AOI ya resueltas) se evita
+    el getInfo() de aoi.bounds(). `counter` (RemoteCallCounter) registra las
+    llamadas remotas hechas bajo `stage`; `size` es el lado en píxeles.
+    Devuelve None si falla (el error se informa por consola).
     """
-    filepath = os.path.join(DATA_DIR, filename)
-    print(f"Intentando generar imagen de mapa vía getThumbURL: {filepath}")
+    print(f"Intentando generar imagen de mapa vía getThumbURL: {title}")
 
     if not isinstance(image, ee.Image):
         print(f"ERROR: Objeto inválido pasado a generate_map_image. Se esperaba ee.Image, se obtuvo {type(image)}")
@@ -49,61 +89,47 @@ def generate_map_image(image, vis_params, filename, aoi, title="Map"):
     try:
         # Define parámetros para la miniatura (thumbnail)
         # Puedes ajustar las dimensiones según necesites
-        thumb_width = 512
-        thumb_height = 512
+        thumb_width = size
+        thumb_height = size
 
         # Obtén los límites del AOI para definir la región de la miniatura
-        # getInfo() es necesario aquí para obtener las coordenadas en el lado del cliente
-        region = aoi.bounds(maxError=1).getInfo()['coordinates'] # Usamos bounds() para obtener un rectángulo
+        # Solo se consulta al servidor si el llamador no trae la región precalculada
+        if region is None:
+            region = gee_calls.get_info(aoi.bounds(maxError=1), description="bounds")['coordinates'] # Usamos bounds() para obtener un rectángulo
+            if counter is not None:
+                counter.record('map_bounds')
 
         # Prepara la imagen para visualización aplicando los parámetros directamente
-        # Es importante asegurarse de que vis_params contenga claves válidas para visualize()
-        img_to_visualize = None
-        if 'bands' in vis_params: # Caso RGB
-            img_to_visualize = image.visualize(
-                bands=vis_params.get('bands'),
-                min=vis_params.get('min', 0),
-                max=vis_params.get('max', 3000)
-                # Otros params como gamma, opacity podrían ir aquí
-            )
-        else: # Caso índices de una banda con paleta
-             img_to_visualize = image.visualize(
-                min=vis_params.get('min', 0),
-                max=vis_params.get('max', 1),
-                palette=vis_params.get('palette')
-             )
-
-        if img_to_visualize is None:
-             raise ValueError("No se pudo crear la imagen visualizada desde los parámetros.")
+        img_to_visualize = visualize_for_map(image, vis_params)
 
         # Obtén la URL de la miniatura desde Earth Engine
         # Pasamos la imagen visualizada, la región, dimensiones y formato
-        thumb_url = img_to_visualize.getThumbURL({
-            'region': region,
-            'dimensions': f'{thumb_width}x{thumb_height}', # Formato "WIDTHxHEIGHT"
-            'format': 'png'
-        })
-        print(f"DEBUG: URL de Miniatura GEE generada: {thumb_url}")
-
-        # Descarga la imagen desde la URL usando la librería requests
-        response = requests.get(thumb_url, stream=True)
-        response.raise_for_status() # Lanza excepción si hay error HTTP (ej. 404, 500)
-
-        # Guarda la imagen descargada en el archivo destino
-        with open(filepath, 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
-
-        # Libera la conexión
-        del response
-
-        # Verifica si el archivo se creó y no está vacío
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            print(f"Imagen de mapa generada exitosamente vía getThumbURL: {filepath}")
-            return filepath
-        else:
-            print(f"ERROR: Archivo de imagen no encontrado o vacío después de descargar: {filepath}")
+        # (remote_calls explícito: los mapas corren en paralelo y comparten el contador)
+        with tracing.span('thumbnail.url', map=title, size=size, remote_calls=1):
+            thumb_url = gee_calls.call_with_retry(img_to_visualize.getThumbURL, {
+                'region': region,
+                'dimensions': f'{thumb_width}x{thumb_height}', # Formato "WIDTHxHEIGHT"
+                'format': 'png'
+            }, description=f"getThumbURL [{title}]")
+        if counter is not None:
+            counter.record(stage)
+
+        # Descarga la imagen desde la URL usando la sesión compartida
+        # (lanza excepción si hay error HTTP; 429/5xx se reintentan)
+        with tracing.span('thumbnail.download', map=title, size=size, remote_calls=0) as download_span:
+            response = gee_calls.http_get(get_http_session(), thumb_url, description=f"descarga [{title}]")
+            png_bytes = response.content
+            download_span.set(bytes=len(png_bytes))
+
+        if not png_bytes:
+            print(f"ERROR: Miniatura vacía después de descargar: {title}")
             return None
+        print(f"Imagen de mapa generada exitosamente vía getThumbURL: {title} ({len(png_bytes)} bytes)")
+        return png_bytes
 
+    except gee_calls.CircuitOpenError as e:
+         print(f"ERROR: GEE no disponible, se omite {title}: {e}")
+         return None
     except ee.EEException as e:
          # Errores específicos de Google Earth Engine
          print(f"ERROR durante operación GEE en generate_map_image (getThumbURL): {e}")
@@ -114,7 +140,76 @@ def generate_map_image(image, vis_params, filename, aoi, title="Map"):
          return None
     except Exception as e:
         # Cualquier otro error inesperado
-        print(f"ERROR generando imagen de mapa {filename} vía getThumbURL: {e}")
+        print(f"ERROR generando imagen de mapa {title} vía getThumbURL: {e}")
         import traceback
         traceback.print_exc() # Imprime el traceback detallado para depuración
-        return None
\ No newline at end of file
+        return None
+
+
+def save_map_png(png_bytes, filename, directory=None):
+    """
+    Sumidero opcional a disco: escribe los bytes PNG (atómicamente) en
+    directory/filename y devuelve la ruta. Sin directory se usa el workspace
+    del job en curso (utils.storage), nunca un directorio compartido.
+    """
+    directory = directory or storage.current_workspace().path
+    return storage.atomic_write(os.path.join(directory, filename), png_bytes)
+
+
+def generate_map_image(image, vis_params, filename, aoi, title="Map", region=None, counter=None):
+    """
+    Genera una imagen de mapa (PNG) obteniendo una miniatura directamente de GEE
+    usando getThumbURL y la guarda en el workspace del job en curso.
+    Devuelve la ruta a la imagen guardada.
+    """
+    png_bytes = fetch_map_png(image, vis_params, aoi, title, region, counter)
+    if png_bytes is None:
+        return None
+    return save_map_png(png_bytes, filename)
+
+
+def generate_map_images(map_tasks, aoi, region=None, counter=None, max_workers=None, in_memory=False):
+    """
+    Genera varios mapas en paralelo sobre la sesión HTTP compartida.
+    `map_tasks` es un dict {clave: (image, vis_params, filename, title)}.
+    Devuelve un dict {clave: ruta o None} en el mismo orden que `map_tasks`
+    ({clave: bytes PNG o None} si in_memory=True); None indica que ese mapa
+    falló (el error ya se informó por consola).
+    """
+    if max_workers is None:
+        max_workers = MAX_CONCURRENT_MAPS
+    max_workers = max(1, min(max_workers, len(map_tasks) or 1))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='map') as executor:
+        if in_memory:
+            futures = {
+                key: tracing.submit(executor, fetch_map_png, img, vis, aoi, title, region, counter)
+                for key, (img, vis, filename, title) in map_tasks.items()
+            }
+        else:
+            futures = {
+                key: tracing.submit(executor, generate_map_image, img, vis, filename, aoi, title, region, counter)
+                for key, (img, vis, filename, title) in map_tasks.items()
+            }
+        # Recolectamos en el orden original, no en orden de finalización
+        return {key: future.result() for key, future in futures.items()}
+
+
+def generate_map_previews(map_tasks, aoi, region=None, counter=None, max_workers=None, size=PREVIEW_SIZE_PX):
+    """
+    Primera fase del render progresivo: una miniatura chica (size x size) por
+    mapa, en paralelo y en memoria. Son baratas (pocos KB cada una) y permiten
+    mostrar la escena elegida antes de los renders a resolución completa.
+    Devuelve {clave: bytes PNG} solo con las vistas previas que se obtuvieron.
+    """
+    if max_workers is None:
+        max_workers = MAX_CONCURRENT_MAPS
+    max_workers = max(1, min(max_workers, len(map_tasks) or 1))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preview') as executor:
+        futures = {
+            key: tracing.submit(executor, fetch_map_png, img, vis, aoi, f"{title} (preview)", region, counter,
+                                size, 'previews')
+            for key, (img, vis, filename, title) in map_tasks.items()
+        }
+        previews = {key: future.result() for key, future in futures.items()}
+    return {key: png for key, png in previews.items() if png}
@@ -0,0 +1,230 @@
+# utils/raster_export.py
+# Export de los valores crudos (float32) de los índices del informe, con
+# georreferencia, para cargarlos en un GIS sin repetir el paso pesado de GEE:
+#  - 'cog': Cloud-Optimized GeoTIFF teselado, comprimido (DEFLATE + predictor
+#           de punto flotante) y con overviews internos; lecturas parciales y
+#           por HTTP range baratas. Requiere rasterio (opcional).
+#  - 'npy': array (bandas, alto, ancho) en formato .npy, abrible con
+#           np.load(..., mmap_mode='r') sin leerlo entero, más un JSON con la
+#           georreferencia. Solo NumPy.
+# La descarga reutiliza la grilla de tiles del render en alta resolución
+# (utils.tiled_renderer): cada tile trae todos los índices apilados en una
+# petición computePixels y cada franja de filas se escribe apenas está lista,
+# así la memoria queda acotada a una franja aunque el ráster no entre en RAM.
+# NaN = sin datos en ambos formatos.
+import json
+import os
+
+import numpy as np
+
+from utils import index_registry
+from utils import local_engine
+from utils import storage
+from utils import tiled_renderer
+from utils import tracing
+from utils.local_engine import region_extent
+from utils.map_generator import MAX_CONCURRENT_MAPS
+
+EXPORT_FORMATS = ('cog', 'npy')
+DEFAULT_RESOLUTION_M = float(os.environ.get('GEOINFORME_EXPORT_RESOLUTION_M', 10))
+COG_BLOCK_PX = 512
+OVERVIEW_MIN_PX = 256  # se agregan overviews (2x, 4x, ...) hasta que el lado mayor baja de esto
+EXPORT_CRS = 'EPSG:4326'  # la misma grilla lineal lon/lat de los tiles
+FILE_EXTENSIONS = {'cog': '.tif', 'npy': '.npy'}
+
+
+def _import_rasterio():
+    try:
+        import rasterio
+        import rasterio.shutil  # noqa: F401 (copy al driver COG)
+    except ImportError:
+        raise RuntimeError("El export 'cog' requiere rasterio (pip install rasterio); 'npy' funciona solo con NumPy.")
+    return rasterio
+
+
+def available_formats():
+    """Formatos de export utilizables en este entorno ('cog' solo con rasterio instalado)."""
+    try:
+        _import_rasterio()
+    except RuntimeError:
+        return ['npy']
+    return list(EXPORT_FORMATS)
+
+
+def overview_factors(width, height, min_px=OVERVIEW_MIN_PX):
+    """Factores de reducción de los overviews: 2, 4, 8... mientras el lado mayor reducido supere min_px."""
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= min_px:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def plan_geotransform(region, plan):
+    """GeoTransform GDAL (x0, ancho px, 0, y0, 0, -alto px) del mosaico de un plan de tiles."""
+    xmin, ymin, xmax, ymax = region_extent(region)
+    return [float(xmin), float(xmax - xmin) / plan['width'], 0.0, float(ymax), 0.0, -float(ymax - ymin) / plan['height']]
+
+
+class NpyExportWriter:
+    """
+    Escribe el ráster (bandas, alto, ancho) float32 en un .npy mapeado en
+    memoria, franja por franja; la georreferencia va a <archivo>.json.
+    El archivo se publica (os.replace) recién en close().
+    """
+
+    def __init__(self, path, bands, width, height, geotransform, tags):
+        self.path = path
+        self.metadata_path = path + '.json'
+        self._sidecar = dict(tags, format='npy', file=os.path.basename(path), shape=[len(bands), height, width],
+                             dtype='float32', bands=list(bands), nodata='NaN', crs=EXPORT_CRS, geotransform=geotransform,
+                             layout='band, row, column')
+        self._tmp_path = storage.temp_path_for(path)
+        self._array = np.lib.format.open_memmap(self._tmp_path, mode='w+', dtype=np.float32,
+                                                shape=(len(bands), height, width))
+
+    def write_strip(self, row_offset, strip):
+        self._array[:, row_offset:row_offset + strip.shape[1], :] = strip
+        self._array.flush() # Las páginas escritas vuelven al disco: la memoria no crece con el ráster
+
+    def close(self):
+        self._array.flush()
+        del self._array
+        # Primero la georreferencia: quien ve el .npy publicado ya tiene su .json (load_npy_export)
+        storage.atomic_write_json(self.metadata_path, self._sidecar, indent=2)
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._array = None
+        storage.remove_quietly(self._tmp_path)
+
+
+class CogExportWriter:
+    """
+    Escribe el ráster en un GeoTIFF teselado temporal (escritura por ventanas,
+    franja por franja), le construye los overviews y lo copia con el driver
+    COG de GDAL, que ordena overviews y tiles como exige el formato.
+    """
+
+    metadata_path = None
+
+    def __init__(self, path, bands, width, height, geotransform, tags):
+        rasterio = _import_rasterio()
+        from rasterio.transform import Affine
+        self._rasterio = rasterio
+        self.path = path
+        self.width, self.height = width, height
+        self._tmp_path = storage.temp_path_for(path)
+        self._dataset = rasterio.open(
+            self._tmp_path, 'w', driver='GTiff', width=width, height=height, count=len(bands), dtype='float32',
+            crs=EXPORT_CRS, transform=Affine.from_gdal(*geotransform), nodata=float('nan'),
+            tiled=True, blockxsize=COG_BLOCK_PX, blockysize=COG_BLOCK_PX, compress='deflate', predictor=3,
+            bigtiff='IF_SAFER')
+        for position, key in enumerate(bands, start=1):
+            self._dataset.set_band_description(position, key)
+        self._dataset.update_tags(**{k: str(v) for k, v in tags.items()})
+
+    def write_strip(self, row_offset, strip):
+        from rasterio.windows import Window
+        self._dataset.write(strip, window=Window(0, row_offset, strip.shape[2], strip.shape[1]))
+
+    def close(self):
+        from rasterio.enums import Resampling
+        factors = overview_factors(self.width, self.height)
+        if factors:
+            self._dataset.build_overviews(factors, Resampling.average) # average ignora el nodata (NaN)
+            self._dataset.update_tags(ns='rio_overview', resampling='average')
+        self._dataset.close()
+        cog_tmp_path = storage.temp_path_for(self.path)
+        try:
+            self._rasterio.shutil.copy(self._tmp_path, cog_tmp_path, driver='COG', compress='DEFLATE', predictor='3',
+                                       blocksize=COG_BLOCK_PX, overviews='FORCE_USE_EXISTING', bigtiff='IF_SAFER')
+            os.replace(cog_tmp_path, self.path)
+        except BaseException:
+            storage.remove_quietly(cog_tmp_path)
+            raise
+        finally:
+            storage.remove_quietly(self._tmp_path)
+
+    def abort(self):
+        try:
+            self._dataset.close()
+        finally:
+            storage.remove_quietly(self._tmp_path)
+
+
+WRITERS = {'cog': CogExportWriter, 'npy': NpyExportWriter}
+
+
+def fetch_export_tile(stacked, names, bbox, width, height, counter=None):
+    """Un tile de la imagen apilada de índices: array float32 (bandas, height, width)."""
+    xmin, ymin, xmax, ymax = bbox
+    ring = [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]
+    with tracing.span('tile', remote_calls=1, bands=len(names)) as tile_span:
+        arrays = local_engine.fetch_masked_arrays(stacked, ring, width, height, names, counter=counter, stage='export')
+        tile = np.stack([arrays[name] for name in names])
+        tile_span.set(bytes=tile.nbytes)
+    return tile
+
+
+def export_index_rasters(image, index_keys, region, path, export_format='npy', resolution_m=DEFAULT_RESOLUTION_M,
+                         max_workers=None, counter=None, tags=None, row_callback=None):
+    """
+    Exporta los índices `index_keys` de `image` (valores crudos float32, una
+    banda por índice) sobre los bounds del AOI a `path` en `export_format`.
+    Los tiles se piden con a lo sumo 2*max_workers en vuelo y cada franja se
+    escribe antes de seguir. `tags` (p. ej. id y fecha de la escena) se
+    guardan como metadata del archivo. `row_callback(filas_listas, filas)` se
+    llama tras cada franja (sus errores cancelan el export).
+    Devuelve la descripción del export (ruta, bandas, tamaño, georreferencia).
+    Lanza ValueError con un formato desconocido y RuntimeError si falta rasterio.
+    """
+    if export_format not in WRITERS:
+        raise ValueError(f"Formato de export desconocido: {export_format!r} (opciones: {', '.join(EXPORT_FORMATS)})")
+    if export_format == 'cog':
+        _import_rasterio() # Antes de cualquier descarga
+    max_workers = max_workers or MAX_CONCURRENT_MAPS
+    index_keys = index_registry.resolve_keys(index_keys)
+    names = [index_registry.get_index(key).name for key in index_keys]
+    plan = tiled_renderer.plan_tiles(region, resolution_m, tiled_renderer.stacked_tile_px(len(names)))
+    geotransform = plan_geotransform(region, plan)
+    stacked = local_engine.stacked_image(image, index_keys)
+    print(f"Export '{export_format}' de {len(index_keys)} índices: {plan['cols']}x{plan['rows']} tiles, "
+          f"{plan['width']}x{plan['height']} px a {plan['resolution_m']:.1f} m/px")
+
+    writer = WRITERS[export_format](path, index_keys, plan['width'], plan['height'], geotransform,
+                                    dict(tags or {}, resolution_m=plan['resolution_m'], units='index value (float32)'))
+    fetch = lambda bbox: fetch_export_tile(stacked, names, bbox, plan['tile_width'], plan['tile_height'], counter)
+    try:
+        for row, row_tiles in enumerate(tiled_renderer.iter_tile_rows(plan, fetch, max_workers)):
+            writer.write_strip(row * plan['tile_height'], np.concatenate(row_tiles, axis=2))
+            if row_callback is not None:
+                row_callback(row + 1, plan['rows'])
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return {
+        'format': export_format,
+        'path': path,
+        'metadata_path': writer.metadata_path,
+        'bands': index_keys,
+        'width': plan['width'],
+        'height': plan['height'],
+        'resolution_m': plan['resolution_m'],
+        'crs': EXPORT_CRS,
+        'geotransform': geotransform,
+        'bytes': os.path.getsize(path),
+    }
+
+
+def export_filename(tag, export_format):
+    return f'indices_{tag}{FILE_EXTENSIONS[export_format]}'
+
+
+def load_npy_export(path, mmap_mode='r'):
+    """Abre un export 'npy' sin leerlo entero: (array (bandas, alto, ancho), metadata del JSON)."""
+    with open(path + '.json', 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    return np.load(path, mmap_mode=mmap_mode), metadata
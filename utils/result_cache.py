@@ -0,0 +1,248 @@
+# utils/result_cache.py
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from utils import storage
+
+# Directorio y límites del caché de resultados (configurables por entorno).
+# GEOINFORME_CACHE_DIR es la raíz compartida con tiles.sqlite y
+# scene_catalog.sqlite: las entradas van en su propio subdirectorio, así el
+# listado y el desalojo solo ven entradas de este caché.
+CACHE_ROOT = os.environ.get('GEOINFORME_CACHE_DIR', 'cache')
+CACHE_DIR = os.path.join(CACHE_ROOT, 'results')
+CACHE_MAX_BYTES = int(os.environ.get('GEOINFORME_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+CACHE_TTL_SECONDS = int(os.environ.get('GEOINFORME_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+ENTRY_FILE = 'entry.json'
+COORD_DECIMALS = 6 # ~0.1 m, suficiente para que el mismo AOI genere la misma clave
+
+
+def _round_coords(value):
+    """Redondea recursivamente floats (coordenadas) para normalizar la clave."""
+    if isinstance(value, float):
+        return round(value, COORD_DECIMALS)
+    if isinstance(value, (list, tuple)):
+        return [_round_coords(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _round_coords(v) for k, v in value.items()}
+    return value
+
+
+def normalize_aoi_params(aoi_type, aoi_params):
+    """
+    Convierte los parámetros del AOI guardados en sesión a una forma canónica:
+    coordenadas redondeadas y GeoJSON re-serializado sin depender del formato
+    del archivo original (espacios, orden de claves, propiedades).
+    """
+    if aoi_type == 'coords':
+        return {'type': 'coords', 'lat': aoi_params['lat'], 'lon': aoi_params['lon'],
+                'radius_km': float(aoi_params['radius_km'])}
+    if aoi_type == 'upload':
+        # Huella de las coordenadas del archivo ya parseado (utils.ingest.ParsedUpload)
+        return {'type': 'upload', 'fingerprint': aoi_params['upload'].fingerprint}
+    if aoi_type == 'geojson':
+        gj = json.loads(aoi_params['geojson_string'])
+        # Solo la geometría influye en el resultado, no las propiedades
+        if gj.get('type') == 'FeatureCollection':
+            gj = [f.get('geometry') for f in gj.get('features', [])]
+        elif gj.get('type') == 'Feature':
+            gj = gj.get('geometry')
+        return {'type': 'geojson', 'geometry': gj}
+    raise ValueError(f"Tipo de AOI desconocido: {aoi_type}")
+
+
+def make_cache_key(aoi_spec, start_date, end_date, cloud_cover_max, vis_params, options=None):
+    """
+    Calcula la clave del caché: hash SHA-256 de las entradas normalizadas
+    (AOI, rango de fechas, umbral de nubes, parámetros de visualización y
+    opciones del informe que cambian su contenido).
+    """
+    payload = {
+        'aoi': _round_coords(aoi_spec),
+        'start_date': str(start_date),
+        'end_date': str(end_date),
+        'cloud_cover_max': cloud_cover_max,
+        'vis_params': vis_params,
+    }
+    if options:
+        payload['options'] = options
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _referenced_paths(entry):
+    """Rutas de los archivos de una entrada: mapas, PDF y export."""
+    paths = list(entry['results'].get('image_paths', {}).values())
+    if entry.get('pdf_path'):
+        paths.append(entry['pdf_path'])
+    export = entry['results'].get('export') or {}
+    paths.extend(export[k] for k in ('path', 'metadata_path') if export.get(k))
+    return paths
+
+
+class ResultCache:
+    """
+    Caché en disco, direccionado por contenido, de resultados de process_aoi:
+    metadata de la escena, miniaturas PNG, PDF final y, si se pidió, el export
+    de los rásters de índices (utils.raster_export).
+    Cada entrada vive en <directory>/<clave>/ con un entry.json. El mtime de
+    entry.json marca el último acceso y se usa para el desalojo LRU.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _read_entry(self, key):
+        entry_path = os.path.join(self._entry_dir(key), ENTRY_FILE)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_expired(self, entry):
+        return time.time() - entry.get('created_at', 0) > self.ttl_seconds
+
+    def get(self, key):
+        """
+        Devuelve la entrada cacheada ({'results': ..., 'pdf_path': ...}) o None.
+        Las rutas de imágenes/PDF apuntan dentro del directorio del caché.
+        """
+        with self._lock:
+            entry = self._read_entry(key)
+            if entry is None or self._is_expired(entry):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            # Todos los archivos referenciados deben seguir existiendo
+            if not all(os.path.exists(p) for p in _referenced_paths(entry)):
+                self._remove(key)
+                self.misses += 1
+                return None
+            # Marca el acceso para el LRU
+            os.utime(os.path.join(self._entry_dir(key), ENTRY_FILE))
+            self.hits += 1
+            return entry
+
+    def put(self, key, results, pdf_bytes=None, pdf_filename='report.pdf'):
+        """
+        Guarda un resultado en el caché. Las miniaturas (results['images'],
+        bytes PNG) y el PDF (bytes) se escriben en el directorio de la entrada;
+        el caché es el sumidero a disco del pipeline en memoria.
+        Devuelve la entrada con las rutas de los archivos cacheados.
+        Todas las escrituras son atómicas (utils.storage): otro proceso que
+        lee o escribe la misma clave nunca ve archivos a medio escribir.
+        """
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            os.makedirs(entry_dir, exist_ok=True)
+
+            # Los bytes no van al JSON: se guardan como archivos aparte
+            cached_results = {k: v for k, v in results.items() if k != 'images'}
+            filenames = results.get('image_filenames', {})
+            cached_paths = {}
+            for name, png_bytes in results.get('images', {}).items():
+                target = os.path.join(entry_dir, filenames.get(name, f'{name}.png'))
+                cached_paths[name] = storage.atomic_write(target, png_bytes)
+            cached_results['image_paths'] = cached_paths
+
+            cached_pdf = None
+            if pdf_bytes:
+                cached_pdf = storage.atomic_write(os.path.join(entry_dir, pdf_filename), pdf_bytes)
+
+            # El export vive en el workspace del job (que vence): se enlaza o copia a la entrada
+            export = results.get('export') or {}
+            if export.get('path'):
+                cached_results['export'] = dict(export, path=storage.atomic_copy(
+                    export['path'], os.path.join(entry_dir, os.path.basename(export['path']))))
+                if export.get('metadata_path'):
+                    cached_results['export']['metadata_path'] = storage.atomic_copy(
+                        export['metadata_path'], os.path.join(entry_dir, os.path.basename(export['metadata_path'])))
+
+            entry = {'key': key, 'created_at': time.time(), 'results': cached_results, 'pdf_path': cached_pdf}
+            # entry.json se publica al final: una entrada a medio escribir nunca es visible
+            storage.atomic_write_json(os.path.join(entry_dir, ENTRY_FILE), entry)
+            self._remove_unreferenced(entry_dir, entry)
+
+            self.evict()
+            return entry
+
+    def _remove_unreferenced(self, entry_dir, entry):
+        """Borra archivos de una escritura anterior de la misma clave que la entrada nueva ya no usa."""
+        referenced = {ENTRY_FILE} | {os.path.basename(p) for p in _referenced_paths(entry)}
+        for name in os.listdir(entry_dir):
+            if name not in referenced and not storage.is_temp_file(name):
+                try:
+                    os.unlink(os.path.join(entry_dir, name))
+                except OSError:
+                    pass
+
+    def _remove(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        self.evictions += 1
+
+    def _entries(self):
+        """Lista (clave, último acceso, bytes, entrada) de todas las entradas."""
+        entries = []
+        for key in os.listdir(self.directory):
+            entry_dir = self._entry_dir(key)
+            entry_path = os.path.join(entry_dir, ENTRY_FILE)
+            if not os.path.isfile(entry_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            entries.append((key, os.path.getmtime(entry_path), size, self._read_entry(key) or {}))
+        return entries
+
+    def evict(self):
+        """Elimina las entradas vencidas por TTL y luego las menos usadas hasta respetar max_bytes."""
+        with self._lock:
+            entries = []
+            for key, last_access, size, entry in self._entries():
+                if self._is_expired(entry):
+                    self._remove(key)
+                else:
+                    entries.append((last_access, size, key))
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Devuelve la instancia de ResultCache compartida por el proceso."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
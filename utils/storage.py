@@ -0,0 +1,291 @@
+# utils/storage.py
+# Capa de almacenamiento de artefactos en disco:
+#  - un único DATA_DIR (GEOINFORME_DATA_DIR) para todo el proyecto;
+#  - ids de job únicos (timestamp + aleatorio) y un workspace aislado por job
+#    en DATA_DIR/jobs/<job_id>/, así dos sesiones concurrentes nunca
+#    escriben sobre los mismos archivos;
+#  - escrituras atómicas (archivo temporal único en el mismo directorio +
+#    os.replace): un lector nunca ve un PNG/PDF a medio escribir;
+#  - un recolector en segundo plano que borra los workspaces vencidos por TTL
+#    y nunca toca los que siguen activos (reemplaza el borrado global de
+#    helpers.cleanup_temp_files al inicio de cada corrida).
+import contextvars
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+DATA_DIR = os.environ.get('GEOINFORME_DATA_DIR', 'data')
+WORKSPACES_DIR = os.path.join(DATA_DIR, 'jobs')
+WORKSPACE_TTL_SECONDS = int(os.environ.get('GEOINFORME_WORKSPACE_TTL_SECONDS', 24 * 3600))
+GC_INTERVAL_SECONDS = int(os.environ.get('GEOINFORME_GC_INTERVAL_SECONDS', 600))
+# Un workspace marcado activo sin escrituras durante este tiempo se considera abandonado (proceso caído)
+STALE_ACTIVE_SECONDS = int(os.environ.get('GEOINFORME_STALE_ACTIVE_SECONDS', 6 * 3600))
+
+ACTIVE_MARKER = '.active'
+KEEP_FILES = {'.gitkeep'}
+
+_current_workspace = contextvars.ContextVar('geoinforme_workspace', default=None)
+
+
+def new_job_id():
+    """Id único y ordenable por fecha: <YYYYmmdd-HHMMSS>-<12 hex aleatorios>."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+
+def _mkstemp_for(path):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    return tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+
+
+def temp_path_for(path):
+    """
+    Reserva un temporal único (vacío) junto a `path` para escritores que
+    necesitan una ruta (memmap, GDAL); se publica con os.replace(tmp, path).
+    El GC y el caché lo reconocen como temporal (is_temp_file).
+    """
+    fd, tmp_path = _mkstemp_for(path)
+    os.close(fd)
+    return tmp_path
+
+
+def remove_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def atomic_write(path, data):
+    """
+    Escribe `data` (bytes o str) en `path` de forma atómica: se escribe a un
+    temporal único del mismo directorio y se publica con os.replace.
+    Devuelve `path`.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    fd, tmp_path = _mkstemp_for(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    return path
+
+
+def atomic_copy(source, path):
+    """
+    Publica una copia de `source` en `path` de forma atómica. Usa un hard link
+    cuando ambos están en el mismo sistema de archivos (sin copiar los bytes
+    de rásters grandes). Devuelve `path`.
+    """
+    tmp_path = temp_path_for(path)
+    try:
+        os.unlink(tmp_path)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    return path
+
+
+def atomic_write_json(path, obj, **dump_kwargs):
+    """atomic_write de un objeto serializado como JSON."""
+    return atomic_write(path, json.dumps(obj, **dump_kwargs))
+
+
+def is_temp_file(name):
+    return name.startswith('.') and name.endswith('.tmp')
+
+
+class JobWorkspace:
+    """
+    Directorio aislado de un job (DATA_DIR/jobs/<job_id>/). Mientras existe el
+    marcador .active el recolector no lo borra; cada escritura lo renueva.
+    release() lo deja elegible para el GC una vez vencido el TTL.
+    """
+
+    def __init__(self, job_id=None, root=None):
+        self.job_id = job_id or new_job_id()
+        self.path = os.path.join(root or WORKSPACES_DIR, self.job_id)
+        os.makedirs(self.path, exist_ok=True)
+        self._touch()
+
+    def _touch(self):
+        with open(os.path.join(self.path, ACTIVE_MARKER), 'a'):
+            pass
+        os.utime(os.path.join(self.path, ACTIVE_MARKER))
+
+    def file_path(self, name):
+        """Ruta de un artefacto dentro del workspace (solo nombres simples, sin subdirectorios)."""
+        if os.path.basename(name) != name or name in ('', '.', '..'):
+            raise ValueError(f"Nombre de artefacto inválido: {name!r}")
+        return os.path.join(self.path, name)
+
+    def write_bytes(self, name, data):
+        """Escribe un artefacto de forma atómica y devuelve su ruta."""
+        path = atomic_write(self.file_path(name), data)
+        self._touch()
+        return path
+
+    def write_json(self, name, obj, **dump_kwargs):
+        path = atomic_write_json(self.file_path(name), obj, **dump_kwargs)
+        self._touch()
+        return path
+
+    @property
+    def active(self):
+        return os.path.exists(os.path.join(self.path, ACTIVE_MARKER))
+
+    def release(self):
+        """Marca el workspace como terminado; el GC lo borrará cuando venza el TTL."""
+        try:
+            os.unlink(os.path.join(self.path, ACTIVE_MARKER))
+        except FileNotFoundError:
+            pass
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        self._token = _current_workspace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_workspace.reset(self._token)
+        self.release()
+        return False
+
+    def __repr__(self):
+        return f"JobWorkspace({self.job_id!r})"
+
+
+_fallback_workspace = None  # (pid, JobWorkspace)
+_fallback_lock = threading.Lock()
+
+
+def current_workspace():
+    """
+    Workspace del job en curso (fijado con `with JobWorkspace(...)`, p. ej. por
+    backend.jobs). Fuera de un job devuelve un único workspace de respaldo por
+    proceso (creado la primera vez), así las escrituras sueltas no terminan
+    en un directorio compartido ni crean un directorio por llamada.
+    """
+    workspace = _current_workspace.get()
+    if workspace is not None:
+        return workspace
+    global _fallback_workspace
+    with _fallback_lock:
+        pid, workspace = _fallback_workspace or (None, None)
+        # Otro proceso (fork) o borrado por el GC tras STALE_ACTIVE_SECONDS sin escrituras: se crea de nuevo
+        if pid != os.getpid() or not os.path.isdir(workspace.path):
+            workspace = JobWorkspace(f"{new_job_id()}-pid{os.getpid()}")
+            _fallback_workspace = (os.getpid(), workspace)
+        return workspace
+
+
+def _last_modified(path):
+    latest = os.path.getmtime(path)
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(dirpath, name)))
+            except OSError:
+                pass # Borrado mientras recorríamos
+    return latest
+
+
+def _remove_expired_files(directory, ttl_seconds, now):
+    removed = 0
+    if not directory or not os.path.isdir(directory):
+        return removed
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name in KEEP_FILES or not os.path.isfile(path):
+            continue
+        try:
+            if now - os.path.getmtime(path) > ttl_seconds:
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def collect_garbage(ttl_seconds=WORKSPACE_TTL_SECONDS, workspaces_dir=None, loose_files_dir=None, now=None,
+                    traces_dir=None):
+    """
+    Borra los workspaces sin modificar hace más de ttl_seconds. Los que tienen
+    el marcador activo solo se borran si además pasaron STALE_ACTIVE_SECONDS
+    sin escrituras (job de un proceso caído).
+    Con loose_files_dir también borra los archivos sueltos vencidos de ese
+    directorio (artefactos de versiones anteriores escritos fuera de un workspace).
+    Las trazas JSON vencidas de traces_dir (por defecto utils.tracing.TRACE_DIR)
+    se borran igual.
+    Devuelve la cantidad de entradas borradas.
+    """
+    now = now if now is not None else time.time()
+    workspaces_dir = workspaces_dir or WORKSPACES_DIR
+    if traces_dir is None:
+        from utils import tracing # tracing importa este módulo
+        traces_dir = tracing.TRACE_DIR
+    removed = 0
+    if os.path.isdir(workspaces_dir):
+        for name in os.listdir(workspaces_dir):
+            path = os.path.join(workspaces_dir, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                idle = now - _last_modified(path)
+            except OSError:
+                continue
+            active = os.path.exists(os.path.join(path, ACTIVE_MARKER))
+            if idle > ttl_seconds and (not active or idle > max(ttl_seconds, STALE_ACTIVE_SECONDS)):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    removed += _remove_expired_files(loose_files_dir, ttl_seconds, now)
+    removed += _remove_expired_files(traces_dir, ttl_seconds, now)
+    if removed:
+        print(f"GC de almacenamiento: {removed} workspaces/archivos vencidos borrados.")
+    return removed
+
+
+_gc_thread = None
+_gc_stop = threading.Event()
+_gc_lock = threading.Lock()
+
+
+def _gc_loop(interval_seconds, ttl_seconds):
+    while not _gc_stop.is_set():
+        try:
+            collect_garbage(ttl_seconds)
+        except Exception as e:
+            print(f"WARNING: GC de almacenamiento falló: {e}")
+        _gc_stop.wait(interval_seconds)
+
+
+def start_gc(interval_seconds=GC_INTERVAL_SECONDS, ttl_seconds=WORKSPACE_TTL_SECONDS):
+    """Lanza el recolector en segundo plano (una vez por proceso). No bloquea."""
+    global _gc_thread
+    with _gc_lock:
+        if _gc_thread is not None and _gc_thread.is_alive():
+            return _gc_thread
+        _gc_stop.clear()
+        _gc_thread = threading.Thread(target=_gc_loop, args=(interval_seconds, ttl_seconds),
+                                      name='storage-gc', daemon=True)
+        _gc_thread.start()
+        return _gc_thread
+
+
+def stop_gc():
+    _gc_stop.set()
@@ -0,0 +1,358 @@
+# utils/tile_cache.py
+# Caché espacial de tiles (SQLite) para los mapas del motor 'stacked': guarda
+# los valores crudos float32 de cada capa (bandas RGB e índices) por
+# (escena, capa, zoom, x, y) y arma el AOI pedido a partir de los tiles
+# cacheados; a GEE solo se le piden los que faltan. Informes de parcelas
+# vecinas o superpuestas sobre la misma escena (el caso típico de un batch
+# por comuna) reutilizan casi todos los píxeles.
+#
+# Grilla: tile matrix XYZ en EPSG:4326 (WorldCRS84Quad: 2^(z+1) x 2^z tiles de
+# TILE_PX px, fila 0 al norte), la misma grilla lineal lon/lat de los mapas y
+# del export (utils.raster_export), así el mosaico recortado equivale al
+# render directo del bbox. Se guarda el valor crudo y no el PNG: la paleta y
+# el rango de visualización se aplican en el cliente al armar cada mapa.
+# Los faltantes se piden en bloques rectangulares de tiles (una petición
+# computePixels por bloque, con todas las capas apiladas); un informe en frío
+# hace las mismas llamadas que sin caché.
+#
+# El archivo se acota en bytes (GEOINFORME_TILE_CACHE_MAX_BYTES) desalojando
+# los tiles usados hace más tiempo. Seguro entre hilos y procesos (una
+# conexión por operación, WAL); dos hilos que necesitan el mismo tile faltante
+# lo descargan una sola vez.
+import contextlib
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import index_registry
+from utils import local_engine
+from utils import tracing
+from utils.local_engine import region_extent
+from utils.map_generator import MAX_CONCURRENT_MAPS
+from utils.tiled_renderer import MAX_STACKED_TILE_BYTES
+
+TILE_CACHE_PATH = os.environ.get('GEOINFORME_TILE_CACHE', os.path.join('cache', 'tiles.sqlite'))
+TILE_CACHE_ENABLED = os.environ.get('GEOINFORME_TILE_CACHE_ENABLED', '1') == '1'
+TILE_CACHE_MAX_BYTES = int(os.environ.get('GEOINFORME_TILE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+TILE_PX = 256
+# Zoom 13: 180 / 2^13 / 256 ~ 8.6e-5 grados por píxel, ~9.5 m/px en el ecuador, la resolución nativa
+# de Sentinel-2. Un render más fino que el zoom máximo no usa el caché (ver TileCache.covers)
+MAX_ZOOM = int(os.environ.get('GEOINFORME_TILE_CACHE_MAX_ZOOM', 13))
+IN_FLIGHT_WAIT_SECONDS = 120  # espera máxima por un tile que descarga otro hilo
+EVICT_BATCH = 256
+# Formato de los valores guardados; entra en el id de cada capa, así un cambio nunca sirve tiles viejos
+# (2: los píxeles enmascarados en GEE se guardan como NaN)
+LAYER_FORMAT = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    scene TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    data BLOB NOT NULL, -- float32 (TILE_PX, TILE_PX), NaN = sin datos
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (scene, z, x, y, layer)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used);
+"""
+
+
+def tile_span_deg(z):
+    """Lado de un tile en grados a zoom z."""
+    return 180.0 / 2 ** z
+
+
+def native_zoom(region, width, height):
+    """
+    Zoom cuyo tamaño de píxel es el más cercano (en escala log) al de un
+    render de width x height sobre los bounds del AOI, sin tope.
+    """
+    xmin, ymin, xmax, ymax = region_extent(region)
+    pixel_deg = max(min((xmax - xmin) / width, (ymax - ymin) / height), 1e-12)
+    return int(max(0, round(math.log2(tile_span_deg(0) / (TILE_PX * pixel_deg)))))
+
+
+def zoom_for(region, width, height, max_zoom=MAX_ZOOM):
+    """native_zoom acotado a max_zoom."""
+    return min(max_zoom, native_zoom(region, width, height))
+
+
+def tile_range(region, z):
+    """(x0, y0, x1, y1) inclusivo de los tiles de zoom z que cubren los bounds del AOI."""
+    xmin, ymin, xmax, ymax = region_extent(region)
+    span = tile_span_deg(z)
+    columns, rows = 2 ** (z + 1), 2 ** z
+    x0 = min(columns - 1, max(0, math.floor((xmin + 180.0) / span)))
+    x1 = min(columns - 1, max(x0, math.ceil((xmax + 180.0) / span) - 1))
+    y0 = min(rows - 1, max(0, math.floor((90.0 - ymax) / span)))
+    y1 = min(rows - 1, max(y0, math.ceil((90.0 - ymin) / span) - 1))
+    return x0, y0, x1, y1
+
+
+def block_ring(z, x0, y0, x1, y1):
+    """Anillo lon/lat del rectángulo de tiles [x0, x1] x [y0, y1]."""
+    span = tile_span_deg(z)
+    west, east = -180.0 + x0 * span, -180.0 + (x1 + 1) * span
+    north, south = 90.0 - y0 * span, 90.0 - (y1 + 1) * span
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+def layer_ids(index_keys, rgb_bands):
+    """
+    {banda de la imagen apilada: id de capa en el caché}. Las bandas RGB son
+    reflectancia cruda; cada índice lleva un hash de su fórmula, así cambiar
+    una definición del registro nunca sirve tiles viejos.
+    """
+    ids = {band: f"{band}@v{LAYER_FORMAT}" for band in rgb_bands}
+    for key in index_keys:
+        index = index_registry.get_index(key)
+        signature = repr((LAYER_FORMAT, sorted(index.bands.items()), index.expression, index.normalized_difference))
+        ids[index.name] = f"{key}@{hashlib.sha1(signature.encode('utf-8')).hexdigest()[:8]}"
+    return ids
+
+
+def mosaic_layers(tiles, ids, z, tile_block, region, width, height):
+    """
+    Arma el mosaico de `tiles` ({(x, y): {capa: array}}) sobre el rectángulo
+    de tiles `tile_block` (x0, y0, x1, y1) de zoom z y lo remuestrea (vecino
+    más cercano) a la grilla width x height del bbox. Devuelve {banda: array};
+    un tile ausente queda en NaN (sin datos), nunca con basura.
+    """
+    x0, y0, x1, y1 = tile_block
+    xmin, ymin, xmax, ymax = region_extent(region)
+    span = tile_span_deg(z)
+    pixel = span / TILE_PX
+    columns = ((xmin + (np.arange(width) + 0.5) * (xmax - xmin) / width) - (-180.0 + x0 * span)) / pixel
+    rows = ((90.0 - y0 * span) - (ymax - (np.arange(height) + 0.5) * (ymax - ymin) / height)) / pixel
+    columns = np.clip(columns.astype(np.intp), 0, (x1 - x0 + 1) * TILE_PX - 1)
+    rows = np.clip(rows.astype(np.intp), 0, (y1 - y0 + 1) * TILE_PX - 1)
+    arrays = {}
+    for band, layer in ids.items():
+        mosaic = np.full(((y1 - y0 + 1) * TILE_PX, (x1 - x0 + 1) * TILE_PX), np.nan, dtype=np.float32)
+        for (x, y), tile in tiles.items():
+            mosaic[(y - y0) * TILE_PX:(y - y0 + 1) * TILE_PX, (x - x0) * TILE_PX:(x - x0 + 1) * TILE_PX] = tile[layer]
+        arrays[band] = mosaic[rows[:, None], columns[None, :]]
+    return arrays
+
+
+def _split_blocks(tiles, max_side):
+    """Agrupa los tiles faltantes en rectángulos (x0, y0, x1, y1) de a lo sumo max_side tiles por lado."""
+    xs, ys = [x for x, _ in tiles], [y for _, y in tiles]
+    wanted = set(tiles)
+    blocks = []
+    for bx in range(min(xs), max(xs) + 1, max_side):
+        for by in range(min(ys), max(ys) + 1, max_side):
+            bx1, by1 = min(bx + max_side, max(xs) + 1) - 1, min(by + max_side, max(ys) + 1) - 1
+            inside = [(x, y) for (x, y) in wanted if bx <= x <= bx1 and by <= y <= by1]
+            if inside:
+                # Se achica al bbox de los faltantes del bloque
+                blocks.append((min(x for x, _ in inside), min(y for _, y in inside),
+                               max(x for x, _ in inside), max(y for _, y in inside)))
+    return blocks
+
+
+class TileCache:
+    """
+    Tiles de valores crudos por (escena, capa, z, x, y) en un archivo SQLite
+    acotado a max_bytes (desalojo LRU). fetch_layers() arma un AOI desde el
+    caché y descarga solo los tiles que faltan.
+    """
+
+    def __init__(self, path=TILE_CACHE_PATH, max_bytes=TILE_CACHE_MAX_BYTES, max_zoom=MAX_ZOOM):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_zoom = max_zoom
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+        self._in_flight = {}  # (escena, z, x, y) -> threading.Event del hilo que lo descarga
+        self._in_flight_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn: # commit / rollback
+                yield conn
+        finally:
+            conn.close()
+
+    def covers(self, region, width, height):
+        """
+        True si un render de width x height sobre el AOI sale del caché sin
+        perder detalle: más fino que max_zoom se descarga directo.
+        """
+        return native_zoom(region, width, height) <= self.max_zoom
+
+    def get_tiles(self, scene, layers, z, tiles):
+        """
+        {(x, y): {capa: array}} de los tiles de `tiles` que tienen TODAS las
+        capas `layers`; marca el acceso para el LRU.
+        """
+        if not tiles:
+            return {}
+        xs, ys = [x for x, _ in tiles], [y for _, y in tiles]
+        wanted, layers = set(tiles), list(layers)
+        marks = ','.join('?' * len(layers))
+        found = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT x, y, layer, data FROM tiles WHERE scene = ? AND z = ? AND x BETWEEN ? AND ? '
+                f'AND y BETWEEN ? AND ? AND layer IN ({marks})',
+                [scene, z, min(xs), max(xs), min(ys), max(ys)] + layers).fetchall()
+            for x, y, layer, data in rows:
+                if (x, y) in wanted:
+                    found.setdefault((x, y), {})[layer] = np.frombuffer(data, dtype=np.float32).reshape(TILE_PX, TILE_PX)
+            complete = {tile: arrays for tile, arrays in found.items() if len(arrays) == len(layers)}
+            if complete:
+                now = time.time()
+                conn.executemany(f'UPDATE tiles SET last_used = ? WHERE scene = ? AND z = ? AND x = ? AND y = ? '
+                                 f'AND layer IN ({marks})', [[now, scene, z, x, y] + layers for x, y in complete])
+        return complete
+
+    def put_tiles(self, scene, z, tiles):
+        """Guarda {(x, y): {capa: array (TILE_PX, TILE_PX)}} y desaloja si se pasa de max_bytes."""
+        now = time.time()
+        rows = []
+        for (x, y), arrays in tiles.items():
+            for layer, values in arrays.items():
+                data = np.ascontiguousarray(values, dtype=np.float32).tobytes()
+                rows.append((scene, layer, z, x, y, data, len(data), now))
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.evict()
+
+    def evict(self):
+        """Borra los tiles menos usados hasta que el archivo respete max_bytes. Devuelve cuántos borró."""
+        removed = 0
+        with self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM tiles').fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute('SELECT scene, layer, z, x, y, bytes FROM tiles ORDER BY last_used LIMIT ?',
+                                      (EVICT_BATCH,)).fetchall()
+                if not oldest:
+                    break
+                for scene, layer, z, x, y, size in oldest:
+                    conn.execute('DELETE FROM tiles WHERE scene = ? AND layer = ? AND z = ? AND x = ? AND y = ?',
+                                 (scene, layer, z, x, y))
+                    total -= size
+                    removed += 1
+                    if total <= self.max_bytes:
+                        break
+        if removed:
+            with self._stats_lock:
+                self.evictions += removed
+        return removed
+
+    def _fetch_block(self, stacked, bands, z, block, counter, stage):
+        """Descarga un rectángulo de tiles en una petición y lo parte en {(x, y): {banda: array}}."""
+        x0, y0, x1, y1 = block
+        width, height = (x1 - x0 + 1) * TILE_PX, (y1 - y0 + 1) * TILE_PX
+        with tracing.span('tile_block', remote_calls=1, tiles=(x1 - x0 + 1) * (y1 - y0 + 1), zoom=z) as block_span:
+            arrays = local_engine.fetch_masked_arrays(stacked, block_ring(z, x0, y0, x1, y1), width, height, bands,
+                                                      counter=counter, stage=stage)
+            block_span.set(bytes=sum(a.nbytes for a in arrays.values()))
+        return {
+            (x, y): {band: arrays[band][(y - y0) * TILE_PX:(y - y0 + 1) * TILE_PX, (x - x0) * TILE_PX:(x - x0 + 1) * TILE_PX]
+                     for band in bands}
+            for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+        }
+
+    def _download(self, image, scene, index_keys, rgb_bands, ids, z, tiles, counter, stage, max_workers):
+        """Descarga `tiles` (bloques en paralelo), los guarda y devuelve {(x, y): {capa: array}}."""
+        bands = list(ids)
+        stacked = local_engine.stacked_image(image, index_keys, rgb_bands)
+        max_side = max(1, int(math.sqrt(MAX_STACKED_TILE_BYTES / (4 * len(bands)))) // TILE_PX)
+        blocks = _split_blocks(tiles, max_side)
+        fetched = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blocks))), thread_name_prefix='tile-block') as executor:
+            futures = [tracing.submit(executor, self._fetch_block, stacked, bands, z, block, counter, stage) for block in blocks]
+            for future in futures:
+                fetched.update(future.result())
+        # Del rectángulo descargado se guardan todos los tiles: los que ya estaban se refrescan
+        by_layer = {tile: {ids[band]: values for band, values in arrays.items()} for tile, arrays in fetched.items()}
+        self.put_tiles(scene, z, by_layer)
+        return {tile: by_layer[tile] for tile in tiles}
+
+    def fetch_layers(self, image, scene, index_keys, rgb_bands, region, width, height, counter=None, stage='stacked_maps',
+                     max_workers=MAX_CONCURRENT_MAPS):
+        """
+        Equivalente cacheado de local_engine.fetch_band_arrays sobre la imagen
+        apilada (bandas `rgb_bands` + índices `index_keys` de la escena `scene`):
+        devuelve {banda: array float32 (height, width)} sobre los bounds del
+        AOI, armado desde los tiles cacheados más los que falten.
+        """
+        index_keys = index_registry.resolve_keys(index_keys)
+        ids = layer_ids(index_keys, rgb_bands)
+        z = zoom_for(region, width, height, self.max_zoom)
+        x0, y0, x1, y1 = tile_range(region, z)
+        tiles = [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+        with tracing.span('tile_cache', zoom=z, tiles=len(tiles)) as cache_span:
+            have = self.get_tiles(scene, ids.values(), z, tiles)
+            missing = [tile for tile in tiles if tile not in have]
+            # Los faltantes que ya descarga otro hilo se esperan en vez de pedirlos dos veces
+            with self._in_flight_lock:
+                waits = {tile: self._in_flight[(scene, z) + tile] for tile in missing if (scene, z) + tile in self._in_flight}
+                mine = [tile for tile in missing if tile not in waits]
+                for tile in mine:
+                    self._in_flight[(scene, z) + tile] = threading.Event()
+            try:
+                if mine:
+                    have.update(self._download(image, scene, index_keys, rgb_bands, ids, z, mine, counter, stage, max_workers))
+            finally:
+                with self._in_flight_lock:
+                    for tile in mine:
+                        self._in_flight.pop((scene, z) + tile).set()
+            if waits:
+                for event in waits.values():
+                    event.wait(IN_FLIGHT_WAIT_SECONDS)
+                have.update(self.get_tiles(scene, ids.values(), z, list(waits)))
+                # Si la descarga del otro hilo falló (o traía otras capas) se piden acá
+                leftover = [tile for tile in waits if tile not in have]
+                if leftover:
+                    have.update(self._download(image, scene, index_keys, rgb_bands, ids, z, leftover, counter, stage,
+                                               max_workers))
+            hits = len(tiles) - len(missing)
+            with self._stats_lock:
+                self.hits += hits
+                self.misses += len(missing)
+            cache_span.set(hits=hits, misses=len(missing), downloaded=len(mine))
+
+        return mosaic_layers(have, ids, z, (x0, y0, x1, y1), region, width, height)
+
+    def stats(self):
+        with self._connect() as conn:
+            tiles, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM tiles').fetchone()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {'tiles': tiles, 'bytes': total, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions}
+
+
+_default_tile_cache = None
+_default_tile_cache_lock = threading.Lock()
+
+
+def get_tile_cache():
+    """Devuelve el TileCache compartido por el proceso."""
+    global _default_tile_cache
+    with _default_tile_cache_lock:
+        if _default_tile_cache is None:
+            _default_tile_cache = TileCache()
+        return _default_tile_cache
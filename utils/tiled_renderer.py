@@ -0,0 +1,280 @@
+# utils/tiled_renderer.py
+# Render en alta resolución para AOIs grandes: divide los bounds del AOI en
+# una grilla de tiles según la resolución en terreno deseada, descarga los
+# tiles en paralelo (concurrencia acotada) y los une en un mosaico PNG que se
+# escribe por franjas de filas, así la memoria queda acotada a una franja.
+# render_tiled_stacked_maps pide cada tile una sola vez con todos los índices
+# apilados (computePixels) y arma el mosaico de todos los mapas a la vez.
+import io
+import math
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image as PILImage
+
+from utils import gee_calls
+from utils import index_registry
+from utils import local_engine
+from utils import tracing
+from utils.local_engine import region_extent
+from utils.map_generator import MAX_CONCURRENT_MAPS, get_http_session, visualize_for_map
+
+DEFAULT_TARGET_RESOLUTION_M = float(os.environ.get('GEOINFORME_TARGET_RESOLUTION_M', 10))
+MAX_TILE_PX = 1024          # lado máximo de cada getThumbURL (lejos del límite de tamaño de GEE)
+MAX_MOSAIC_PX = int(os.environ.get('GEOINFORME_MAX_MOSAIC_PX', 8192))  # lado máximo del mosaico
+# Tope de bytes por tile apilado (float32 x bandas), bajo el límite de respuesta de computePixels
+MAX_STACKED_TILE_BYTES = int(os.environ.get('GEOINFORME_MAX_STACKED_TILE_BYTES', 32 * 1024 * 1024))
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0
+
+
+class StreamingPNGWriter:
+    """
+    Escritor PNG RGBA de 8 bits que recibe las filas por franjas y las
+    comprime de inmediato, sin tener nunca la imagen completa en memoria.
+    """
+
+    def __init__(self, out, width, height):
+        self.out = out
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(6)
+        out.write(b'\x89PNG\r\n\x1a\n')
+        # IHDR: ancho, alto, 8 bits, color type 6 (RGBA), compresión, filtro, sin entrelazado
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.out.write(struct.pack('>I', len(data)))
+        self.out.write(kind)
+        self.out.write(data)
+        self.out.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write_strip(self, strip):
+        """Agrega una franja (filas, width, 4) uint8."""
+        if strip.shape[1] != self.width or strip.shape[2] != 4:
+            raise ValueError(f"Franja con forma {strip.shape}, se esperaba (n, {self.width}, 4)")
+        # Cada fila lleva un byte de filtro (0 = None) al inicio
+        raw = np.empty((strip.shape[0], self.width * 4 + 1), dtype=np.uint8)
+        raw[:, 0] = 0
+        raw[:, 1:] = strip.reshape(strip.shape[0], -1)
+        data = self._compressor.compress(raw.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows_written += strip.shape[0]
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"Se escribieron {self.rows_written} filas de {self.height}")
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+def plan_tiles(region, target_resolution_m=DEFAULT_TARGET_RESOLUTION_M, max_tile_px=MAX_TILE_PX):
+    """
+    Calcula la grilla de tiles (de a lo sumo max_tile_px por lado) para cubrir
+    los bounds del AOI a la resolución pedida (limitada a MAX_MOSAIC_PX por lado).
+    Devuelve {'width', 'height', 'cols', 'rows', 'tile_width', 'tile_height',
+    'resolution_m', 'tiles': [[(xmin, ymin, xmax, ymax), ...] por fila]}.
+    """
+    xmin, ymin, xmax, ymax = region_extent(region)
+    lat_center = math.radians((ymin + ymax) / 2)
+    width_m = (xmax - xmin) * METERS_PER_DEGREE_LON * math.cos(lat_center)
+    height_m = (ymax - ymin) * METERS_PER_DEGREE_LAT
+
+    resolution = target_resolution_m
+    if max(width_m, height_m) / resolution > MAX_MOSAIC_PX:
+        resolution = max(width_m, height_m) / MAX_MOSAIC_PX
+        print(f"WARNING: Resolución {target_resolution_m} m excede el mosaico máximo; se usa {resolution:.1f} m.")
+
+    total_w = max(1, math.ceil(width_m / resolution))
+    total_h = max(1, math.ceil(height_m / resolution))
+    cols = math.ceil(total_w / max_tile_px)
+    rows = math.ceil(total_h / max_tile_px)
+    tile_w = math.ceil(total_w / cols)
+    tile_h = math.ceil(total_h / rows)
+
+    dx = (xmax - xmin) / cols
+    dy = (ymax - ymin) / rows
+    tiles = [
+        [(xmin + c * dx, ymax - (r + 1) * dy, xmin + (c + 1) * dx, ymax - r * dy) for c in range(cols)]
+        for r in range(rows)  # Fila 0 = norte, igual que el orden de filas del PNG
+    ]
+    return {'width': tile_w * cols, 'height': tile_h * rows, 'cols': cols, 'rows': rows,
+            'tile_width': tile_w, 'tile_height': tile_h, 'resolution_m': resolution, 'tiles': tiles}
+
+
+def stacked_tile_px(band_count):
+    """Lado máximo de un tile float32 de `band_count` bandas dentro de MAX_STACKED_TILE_BYTES."""
+    return max(64, min(MAX_TILE_PX, int(math.sqrt(MAX_STACKED_TILE_BYTES / (4 * max(1, band_count))))))
+
+
+def fetch_tile(visualized, bbox, width, height, counter=None):
+    """Descarga un tile (getThumbURL + GET) y lo devuelve como array RGBA (height, width, 4)."""
+    xmin, ymin, xmax, ymax = bbox
+    with tracing.span('tile', remote_calls=1) as tile_span:
+        thumb_url = gee_calls.call_with_retry(visualized.getThumbURL, {
+            'region': [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]],
+            'dimensions': f'{width}x{height}',
+            'crs': 'EPSG:4326', # Grilla lineal en lon/lat: los tiles encajan borde a borde
+            'format': 'png',
+        }, description="getThumbURL [tile]")
+        if counter is not None:
+            counter.record('tiles')
+        response = gee_calls.http_get(get_http_session(), thumb_url, description="descarga [tile]")
+        tile_span.set(bytes=len(response.content))
+    tile = PILImage.open(io.BytesIO(response.content)).convert('RGBA')
+    if tile.size != (width, height):
+        tile = tile.resize((width, height))
+    return np.asarray(tile)
+
+
+def iter_tile_rows(plan, fetch, max_workers):
+    """
+    Descarga los tiles del plan con `fetch(bbox)` en orden fila por fila, con a
+    lo sumo 2*max_workers en vuelo, y entrega cada fila completa (lista por
+    columna) apenas está lista.
+    """
+    bboxes = [bbox for row in plan['tiles'] for bbox in row]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tile') as executor:
+        in_flight = deque()
+        next_job = 0
+        for _ in range(plan['rows']):
+            # Mantiene la ventana de descargas llena (incluye tiles de filas siguientes)
+            while next_job < len(bboxes) and len(in_flight) < 2 * max_workers:
+                in_flight.append(tracing.submit(executor, fetch, bboxes[next_job]))
+                next_job += 1
+            row_tiles = []
+            for _ in range(plan['cols']):
+                row_tiles.append(in_flight.popleft().result())
+                if next_job < len(bboxes):
+                    in_flight.append(tracing.submit(executor, fetch, bboxes[next_job]))
+                    next_job += 1
+            yield row_tiles
+
+
+def render_tiled_map(image, vis_params, region, out, target_resolution_m=DEFAULT_TARGET_RESOLUTION_M,
+                     max_workers=None, counter=None):
+    """
+    Renderiza `image` con `vis_params` sobre los bounds del AOI como un
+    mosaico PNG de alta resolución escrito en `out` (archivo binario o BytesIO).
+    Los tiles se piden en orden fila por fila con a lo sumo 2*max_workers en
+    vuelo; cada fila completa se escribe y se libera antes de seguir.
+    Devuelve el plan de tiles usado.
+    """
+    max_workers = max_workers or MAX_CONCURRENT_MAPS
+    plan = plan_tiles(region, target_resolution_m)
+    visualized = visualize_for_map(image, vis_params)
+    tile_w, tile_h = plan['tile_width'], plan['tile_height']
+    print(f"Render por tiles: {plan['cols']}x{plan['rows']} tiles, {plan['width']}x{plan['height']} px a {plan['resolution_m']:.1f} m/px")
+
+    writer = StreamingPNGWriter(out, plan['width'], plan['height'])
+    fetch = lambda bbox: fetch_tile(visualized, bbox, tile_w, tile_h, counter)
+    for row_tiles in iter_tile_rows(plan, fetch, max_workers):
+        writer.write_strip(np.concatenate(row_tiles, axis=1))
+    writer.close()
+    return plan
+
+
+def fetch_stacked_tile(stacked, bands, renderers, bbox, width, height, counter=None):
+    """
+    Descarga un tile de la imagen apilada (una petición computePixels con
+    todas las bandas) y lo renderiza con cada renderer.
+    Devuelve {clave: array RGBA (height, width, 4)}.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    ring = [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]
+    with tracing.span('tile', remote_calls=1, bands=len(bands)) as tile_span:
+        arrays = local_engine.fetch_masked_arrays(stacked, ring, width, height, bands, counter=counter, stage='tiles')
+        tile_span.set(bytes=sum(a.nbytes for a in arrays.values()))
+    # El render corre en el worker: solo viajan tiles RGBA uint8 a la franja
+    return {key: render(arrays) for key, render in renderers.items()}
+
+
+def render_tiled_stacked_maps(image, index_keys, rgb_vis, region, outs, target_resolution_m=DEFAULT_TARGET_RESOLUTION_M,
+                              max_workers=None, counter=None, row_callback=None):
+    """
+    Mosaicos de alta resolución de TODOS los mapas con una petición por tile:
+    cada tile trae las bandas RGB + los índices `index_keys` apilados y se
+    reparte en el cliente entre los PNG de `outs` ({clave: archivo binario o
+    BytesIO}; 'rgb' usa rgb_vis). El tamaño de tile se achica según la
+    cantidad de bandas para respetar MAX_STACKED_TILE_BYTES.
+    `row_callback(filas_listas, filas)` se llama tras escribir cada franja.
+    Devuelve el plan de tiles usado.
+    """
+    max_workers = max_workers or MAX_CONCURRENT_MAPS
+    index_keys = index_registry.resolve_keys(index_keys)
+    rgb_bands = list(rgb_vis['bands']) if 'rgb' in outs else []
+    names = {key: index_registry.get_index(key).name for key in index_keys}
+    bands = rgb_bands + list(names.values())
+    plan = plan_tiles(region, target_resolution_m, stacked_tile_px(len(bands)))
+    stacked = local_engine.stacked_image(image, index_keys, rgb_bands)
+    print(f"Render apilado por tiles: {len(outs)} mapas, {plan['cols']}x{plan['rows']} tiles, "
+          f"{plan['width']}x{plan['height']} px a {plan['resolution_m']:.1f} m/px")
+
+    renderers = {}
+    for key in outs:
+        if key == 'rgb':
+            renderers[key] = lambda arrays: local_engine.render_rgb(arrays, rgb_vis)
+        else:
+            vis = index_registry.get_index(key).vis
+            lut = local_engine.build_palette_lut(vis['palette'])
+            renderers[key] = lambda arrays, name=names[key], vis=vis, lut=lut: local_engine.render_index(arrays[name], vis, lut)
+
+    writers = {key: StreamingPNGWriter(out, plan['width'], plan['height']) for key, out in outs.items()}
+    fetch = lambda bbox: fetch_stacked_tile(stacked, bands, renderers, bbox, plan['tile_width'], plan['tile_height'], counter)
+    for row, row_tiles in enumerate(iter_tile_rows(plan, fetch, max_workers)):
+        for key, writer in writers.items():
+            writer.write_strip(np.concatenate([tile[key] for tile in row_tiles], axis=1))
+        if row_callback is not None:
+            row_callback(row + 1, plan['rows'])
+    for writer in writers.values():
+        writer.close()
+    return plan
+
+
+def render_tiled_map_png(image, vis_params, region, target_resolution_m=DEFAULT_TARGET_RESOLUTION_M,
+                         max_workers=None, counter=None, title="Map"):
+    """Versión en memoria de render_tiled_map: devuelve los bytes PNG o None si falla."""
+    try:
+        buffer = io.BytesIO()
+        render_tiled_map(image, vis_params, region, buffer, target_resolution_m, max_workers, counter)
+        print(f"Mapa en alta resolución generado: {title} ({buffer.tell()} bytes)")
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"ERROR generando mapa por tiles {title}: {e}")
+        return None
+
+
+def render_tiled_stacked_maps_png(image, index_keys, rgb_vis, region, target_resolution_m=DEFAULT_TARGET_RESOLUTION_M,
+                                  max_workers=None, counter=None, row_callback=None):
+    """
+    Versión en memoria de render_tiled_stacked_maps: {clave: bytes PNG}, o
+    {clave: None} si falla. Los errores de row_callback (p. ej. la cancelación
+    de un job) se propagan.
+    """
+    keys = ['rgb'] + index_registry.resolve_keys(index_keys)
+    buffers = {key: io.BytesIO() for key in keys}
+    callback_errors = []
+
+    def on_row(done, total):
+        try:
+            row_callback(done, total)
+        except Exception as e:
+            callback_errors.append(e)
+            raise
+
+    try:
+        render_tiled_stacked_maps(image, index_keys, rgb_vis, region, buffers, target_resolution_m, max_workers,
+                                  counter, on_row if row_callback is not None else None)
+    except Exception as e:
+        if callback_errors:
+            raise
+        print(f"ERROR generando mapas apilados por tiles: {e}")
+        return {key: None for key in keys}
+    print(f"Mapas en alta resolución generados: {', '.join(f'{k} ({b.tell()} bytes)' for k, b in buffers.items())}")
+    return {key: buffer.getvalue() for key, buffer in buffers.items()}
@@ -0,0 +1,246 @@
+# utils/tracing.py
+# Spans de tiempo por etapa del pipeline (búsqueda de escena, índices, cada
+# miniatura, PDF...) con duración, bytes y llamadas remotas. Las duraciones se
+# agregan en histogramas en formato Prometheus, expuestos opcionalmente por
+# HTTP (GEOINFORME_METRICS_PORT). Con GEOINFORME_WRITE_TRACES=1 cada ejecución
+# además deja su traza JSON en TRACE_DIR (el GC de utils.storage las borra).
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import storage
+
+TRACE_DIR = os.environ.get('GEOINFORME_TRACE_DIR', 'traces')
+WRITE_TRACES = os.environ.get('GEOINFORME_WRITE_TRACES', '0') == '1'
+METRICS_PORT = int(os.environ.get('GEOINFORME_METRICS_PORT', 0))  # 0 = sin servidor HTTP
+
+# Límites (segundos) de los buckets del histograma de duración
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current_trace = contextvars.ContextVar('geoinforme_trace', default=None)
+_current_span = contextvars.ContextVar('geoinforme_span', default=None)
+
+
+class Span:
+    """Un intervalo medido dentro de una traza."""
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_bytes(self, count):
+        self.attributes['bytes'] = self.attributes.get('bytes', 0) + count
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start_perf
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'parent_id': self.parent_id, 'start': self.start,
+                'duration_seconds': self.duration, 'attributes': self.attributes, 'error': self.error}
+
+
+class _NoopSpan:
+    """Span sin efecto, usado cuando no hay traza activa."""
+
+    def set(self, **attributes):
+        pass
+
+    def add_bytes(self, count):
+        pass
+
+
+class Trace:
+    """
+    Traza de una ejecución. `counter` (RemoteCallCounter) permite asignar a
+    cada span las llamadas remotas hechas mientras estuvo abierto, salvo que el
+    span declare 'remote_calls' explícitamente.
+    """
+
+    def __init__(self, name, run_id=None):
+        self.name = name
+        self.run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.spans = []
+        self.counter = None
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            return {'name': self.name, 'run_id': self.run_id, 'spans': [s.to_dict() for s in self.spans]}
+
+    def write(self, directory=TRACE_DIR):
+        """Escribe la traza (atómicamente) como <directory>/<run_id>.json y devuelve la ruta."""
+        return storage.atomic_write_json(os.path.join(directory, f"{self.run_id}.json"), self.to_dict(),
+                                         indent=2, default=str)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Mide un bloque como span de la traza activa (no hace nada si no la hay).
+    Las excepciones se registran en el span y se propagan.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NoopSpan()
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.id if parent else None, attributes)
+    calls_before = trace.counter.total if trace.counter is not None else None
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        if calls_before is not None and 'remote_calls' not in current.attributes:
+            current.attributes['remote_calls'] = trace.counter.total - calls_before
+        trace.add(current)
+
+
+@contextlib.contextmanager
+def trace_run(name, run_id=None):
+    """
+    Abre una traza para una ejecución completa (o un span anidado si ya hay
+    una activa). Al cerrar la traza raíz se escribe el JSON y se agregan sus
+    spans a las métricas del proceso.
+    """
+    if _current_trace.get() is not None:
+        with span(name):
+            yield _current_trace.get()
+        return
+    trace = Trace(name, run_id)
+    token = _current_trace.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        metrics.observe_trace(trace)
+        if WRITE_TRACES:
+            try:
+                path = trace.write()
+                print(f"Traza de ejecución escrita en {path}")
+            except OSError as e:
+                print(f"WARNING: No se pudo escribir la traza {trace.run_id}: {e}")
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit() propagando la traza/span activos al hilo worker."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class MetricsRegistry:
+    """Agregado de todas las trazas del proceso, renderizable en formato Prometheus."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}   # span -> {'counts': [...], 'sum': float, 'count': int}
+        self._bytes = {}        # span -> total
+        self._remote_calls = {} # span -> total
+        self._errors = {}       # span -> total
+
+    def observe_span(self, name, duration, byte_count=0, remote_calls=0, error=False):
+        with self._lock:
+            hist = self._histograms.setdefault(name, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    hist['counts'][i] += 1
+            hist['sum'] += duration
+            hist['count'] += 1
+            self._bytes[name] = self._bytes.get(name, 0) + byte_count
+            self._remote_calls[name] = self._remote_calls.get(name, 0) + remote_calls
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def observe_trace(self, trace):
+        for s in trace.spans:
+            if s.duration is None:
+                continue
+            self.observe_span(s.name, s.duration, s.attributes.get('bytes', 0) or 0,
+                              s.attributes.get('remote_calls', 0) or 0, s.error is not None)
+
+    def render_prometheus(self):
+        """Texto en formato de exposición de Prometheus."""
+        lines = [
+            '# HELP geoinforme_span_duration_seconds Duración de cada etapa del pipeline.',
+            '# TYPE geoinforme_span_duration_seconds histogram',
+        ]
+        with self._lock:
+            for name in sorted(self._histograms):
+                hist = self._histograms[name]
+                for bound, count in zip(self.buckets, hist['counts']):
+                    lines.append(f'geoinforme_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'geoinforme_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {hist["count"]}')
+                lines.append(f'geoinforme_span_duration_seconds_sum{{span="{name}"}} {hist["sum"]:.6f}')
+                lines.append(f'geoinforme_span_duration_seconds_count{{span="{name}"}} {hist["count"]}')
+            for metric, help_text, values in (
+                ('geoinforme_span_bytes_total', 'Bytes transferidos o producidos por etapa.', self._bytes),
+                ('geoinforme_span_remote_calls_total', 'Llamadas remotas a GEE por etapa.', self._remote_calls),
+                ('geoinforme_span_errors_total', 'Spans terminados con error por etapa.', self._errors),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for name in sorted(values):
+                    lines.append(f'{metric}{{span="{name}"}} {values[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Sin logs por cada scrape
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Expone /metrics en un hilo de fondo (una vez por proceso). No hace nada si port es 0."""
+    global _metrics_server
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, name='metrics', daemon=True).start()
+            print(f"Métricas Prometheus en http://0.0.0.0:{port}/metrics")
+        return _metrics_server